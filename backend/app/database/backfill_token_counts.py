@@ -0,0 +1,79 @@
+"""
+Заполнение token_count у сообщений и вложений, созданных до появления колонки.
+Новые строки считаются при записи (события моделей Message / FileAttachment).
+Запуск: python -m backend.app.database.backfill_token_counts [--recount-markup]
+
+--recount-markup пересчитывает и сообщения с HTML-разметкой, посчитанные до того,
+как token_count стал учитывать очищенный текст (history_sanitizer).
+"""
+import sys
+from typing import Dict
+
+from sqlalchemy.orm import Session
+
+from backend.app.models.message import Message
+from backend.app.models.file_attachment import FileAttachment
+from backend.app.utils.tokens import count_tokens
+from backend.app.utils.history_sanitizer import message_token_count
+
+
+def backfill_token_counts(db: Session, batch_size: int = 500, recount_markup: bool = False) -> Dict[str, int]:
+    """Пачками досчитывает NULL token_count; повторный запуск безопасен"""
+    updated = {"messages": 0, "file_attachments": 0}
+
+    while True:
+        rows = db.query(Message.id, Message.content).filter(
+            Message.token_count.is_(None)
+        ).order_by(Message.id).limit(batch_size).all()
+        if not rows:
+            break
+        # bulk_update_mappings не вызывает события моделей — считаем здесь
+        db.bulk_update_mappings(Message, [
+            {"id": row.id, "token_count": message_token_count(row.content)} for row in rows
+        ])
+        db.commit()
+        updated["messages"] += len(rows)
+
+    if recount_markup:
+        last_id = 0
+        while True:
+            rows = db.query(Message.id, Message.content).filter(
+                Message.id > last_id,
+                Message.content.like("%<%"),
+            ).order_by(Message.id).limit(batch_size).all()
+            if not rows:
+                break
+            db.bulk_update_mappings(Message, [
+                {"id": row.id, "token_count": message_token_count(row.content)} for row in rows
+            ])
+            db.commit()
+            last_id = rows[-1].id
+            updated["messages"] += len(rows)
+
+    while True:
+        attachments = db.query(FileAttachment).filter(
+            FileAttachment.token_count.is_(None)
+        ).order_by(FileAttachment.id).limit(batch_size).all()
+        if not attachments:
+            break
+        db.bulk_update_mappings(FileAttachment, [
+            {"id": attachment.id, "token_count": count_tokens(attachment.context_text())}
+            for attachment in attachments
+        ])
+        db.commit()
+        db.expunge_all()
+        updated["file_attachments"] += len(attachments)
+
+    return updated
+
+
+if __name__ == "__main__":
+    from backend.app.database.connection import SessionLocal
+
+    print("🚀 Подсчёт токенов для старых сообщений и вложений...")
+    session = SessionLocal()
+    try:
+        result = backfill_token_counts(session, recount_markup="--recount-markup" in sys.argv)
+    finally:
+        session.close()
+    print(f"✅ Готово: сообщений {result['messages']}, вложений {result['file_attachments']}")
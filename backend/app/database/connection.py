@@ -46,6 +46,9 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 def get_db() -> Generator[Session, None, None]:
     """
     Dependency для получения сессии БД в FastAPI эндпоинтах.
+    Сессия синхронная: обработчики с запросами к БД объявляются обычными def
+    (FastAPI выполняет их в пуле потоков), а async-обработчики выносят работу
+    с сессией в run_in_threadpool — event loop на запросах к БД не блокируется.
     Использование:
         @router.get("/items")
         def get_items(db: Session = Depends(get_db)):
@@ -116,6 +119,10 @@ def drop_db():
         conn.execute(text("DROP TABLE IF EXISTS spaces CASCADE;"))
         conn.execute(text("DROP TABLE IF EXISTS users CASCADE;"))
         conn.execute(text("DROP FUNCTION IF EXISTS update_updated_at_column() CASCADE;"))
+        conn.execute(text("DROP FUNCTION IF EXISTS update_chats_updated_at_column() CASCADE;"))
+        conn.execute(text("DROP FUNCTION IF EXISTS messages_search_vector_update() CASCADE;"))
+        conn.execute(text("DROP FUNCTION IF EXISTS notes_search_vector_update() CASCADE;"))
+        conn.execute(text("DROP FUNCTION IF EXISTS chats_search_vector_update() CASCADE;"))
     
     print("⚠️ Все таблицы удалены из БД")
 
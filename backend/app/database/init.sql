@@ -44,6 +44,13 @@ CREATE TABLE IF NOT EXISTS chats (
     space_id INTEGER NOT NULL,
     user_id INTEGER NOT NULL,
     title VARCHAR(255),
+    summary TEXT,
+    summary_message_id INTEGER,
+    summary_token_count INTEGER,
+    summary_updated_at TIMESTAMP WITH TIME ZONE,
+    last_message_preview VARCHAR(103),
+    last_message_at TIMESTAMP WITH TIME ZONE,
+    message_count INTEGER NOT NULL DEFAULT 0,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     CONSTRAINT fk_chats_space FOREIGN KEY (space_id) REFERENCES spaces(id) ON DELETE CASCADE,
@@ -61,6 +68,7 @@ CREATE TABLE IF NOT EXISTS messages (
     role VARCHAR(20) NOT NULL,
     content TEXT NOT NULL,
     image_url VARCHAR(500),
+    token_count INTEGER,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     CONSTRAINT fk_messages_chat FOREIGN KEY (chat_id) REFERENCES chats(id) ON DELETE CASCADE
 );
@@ -183,6 +191,25 @@ BEGIN
 END;
 $$ language 'plpgsql';
 
+-- updated_at чата — порядок в списке чатов. Фоновые и служебные обновления
+-- (summary*, превью и счётчик сообщений, search_vector) его не поднимают,
+-- а значение, заданное в самом UPDATE (onupdate=now() в ORM), не перезаписывается
+CREATE OR REPLACE FUNCTION update_chats_updated_at_column()
+RETURNS TRIGGER AS $$
+DECLARE
+    service_columns TEXT[] := ARRAY[
+        'updated_at', 'summary', 'summary_message_id', 'summary_token_count', 'summary_updated_at',
+        'last_message_preview', 'last_message_at', 'message_count', 'search_vector'
+    ];
+BEGIN
+    IF NEW.updated_at IS NOT DISTINCT FROM OLD.updated_at
+       AND (to_jsonb(NEW) - service_columns) IS DISTINCT FROM (to_jsonb(OLD) - service_columns) THEN
+        NEW.updated_at = CURRENT_TIMESTAMP;
+    END IF;
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
 -- Триггеры для автоматического обновления updated_at
 DROP TRIGGER IF EXISTS update_users_updated_at ON users;
 CREATE TRIGGER update_users_updated_at
@@ -200,7 +227,7 @@ DROP TRIGGER IF EXISTS update_chats_updated_at ON chats;
 CREATE TRIGGER update_chats_updated_at
     BEFORE UPDATE ON chats
     FOR EACH ROW
-    EXECUTE FUNCTION update_updated_at_column();
+    EXECUTE FUNCTION update_chats_updated_at_column();
 
 DROP TRIGGER IF EXISTS update_notes_updated_at ON notes;
 CREATE TRIGGER update_notes_updated_at
@@ -337,6 +364,7 @@ CREATE TABLE IF NOT EXISTS file_attachments (
     mime_type VARCHAR(100),
     extracted_text TEXT,
     analysis_result TEXT,
+    token_count INTEGER,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     CONSTRAINT fk_file_attachments_message FOREIGN KEY (message_id) REFERENCES messages(id) ON DELETE CASCADE,
     CONSTRAINT fk_file_attachments_chat FOREIGN KEY (chat_id) REFERENCES chats(id) ON DELETE CASCADE,
@@ -351,3 +379,164 @@ CREATE INDEX IF NOT EXISTS idx_file_attachments_space_id ON file_attachments(spa
 CREATE INDEX IF NOT EXISTS idx_file_attachments_user_id ON file_attachments(user_id);
 CREATE INDEX IF NOT EXISTS idx_file_attachments_created_at ON file_attachments(created_at);
 
+-- Миграция: число токенов сообщений и текста вложений (окно истории для LLM выбирается в SQL).
+-- Старые строки остаются с NULL до запуска: python -m backend.app.database.backfill_token_counts
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns 
+        WHERE table_name = 'messages' AND column_name = 'token_count'
+    ) THEN
+        ALTER TABLE messages ADD COLUMN token_count INTEGER;
+    END IF;
+    
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns 
+        WHERE table_name = 'file_attachments' AND column_name = 'token_count'
+    ) THEN
+        ALTER TABLE file_attachments ADD COLUMN token_count INTEGER;
+    END IF;
+END $$;
+
+-- Окно истории: последние сообщения чата по убыванию времени
+CREATE INDEX IF NOT EXISTS idx_messages_chat_created ON messages(chat_id, created_at DESC, id DESC);
+
+-- Миграция: скользящее краткое содержание чата (обновляется в фоне, см. chat_summary_service).
+-- summary_message_id — последнее сообщение, вошедшее в summary; в промпт идут только сообщения после него
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns 
+        WHERE table_name = 'chats' AND column_name = 'summary'
+    ) THEN
+        ALTER TABLE chats ADD COLUMN summary TEXT;
+        ALTER TABLE chats ADD COLUMN summary_message_id INTEGER;
+        ALTER TABLE chats ADD COLUMN summary_token_count INTEGER;
+        ALTER TABLE chats ADD COLUMN summary_updated_at TIMESTAMP WITH TIME ZONE;
+    END IF;
+END $$;
+
+-- Миграция: превью последнего сообщения и число сообщений в chats (список чатов без запроса
+-- по каждому чату). Дальше поддерживаются событиями модели Message (backend/app/models/message.py)
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns 
+        WHERE table_name = 'chats' AND column_name = 'message_count'
+    ) THEN
+        ALTER TABLE chats ADD COLUMN last_message_preview VARCHAR(103);
+        ALTER TABLE chats ADD COLUMN last_message_at TIMESTAMP WITH TIME ZONE;
+        ALTER TABLE chats ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0;
+
+        -- Заполнение существующих чатов; updated_at не меняется (триггер update_chats_updated_at отключён на время)
+        ALTER TABLE chats DISABLE TRIGGER update_chats_updated_at;
+        UPDATE chats c SET
+            message_count = m.cnt,
+            last_message_at = m.last_at,
+            last_message_preview = CASE
+                WHEN length(m.last_content) > 100 THEN substr(m.last_content, 1, 100) || '...'
+                ELSE m.last_content
+            END
+        FROM (
+            SELECT DISTINCT ON (chat_id)
+                chat_id,
+                COUNT(*) OVER (PARTITION BY chat_id) AS cnt,
+                created_at AS last_at,
+                content AS last_content
+            FROM messages
+            ORDER BY chat_id, created_at DESC, id DESC
+        ) m
+        WHERE m.chat_id = c.id;
+        ALTER TABLE chats ENABLE TRIGGER update_chats_updated_at;
+    END IF;
+END $$;
+
+-- Список чатов пользователя / пространства по времени обновления
+CREATE INDEX IF NOT EXISTS idx_chats_user_updated ON chats(user_id, updated_at DESC);
+CREATE INDEX IF NOT EXISTS idx_chats_space_updated ON chats(space_id, updated_at DESC);
+
+-- Полнотекстовый поиск (/api/search, backend/app/services/search_service.py):
+-- search_vector = русская морфология + точные словоформы (simple), GIN-индексы, заполнение триггерами
+CREATE OR REPLACE FUNCTION messages_search_vector_update()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.search_vector = to_tsvector('russian', coalesce(NEW.content, '')) || to_tsvector('simple', coalesce(NEW.content, ''));
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+CREATE OR REPLACE FUNCTION notes_search_vector_update()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.search_vector =
+        setweight(to_tsvector('russian', coalesce(NEW.title, '')) || to_tsvector('simple', coalesce(NEW.title, '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(NEW.content, '')) || to_tsvector('simple', coalesce(NEW.content, '')), 'B');
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+CREATE OR REPLACE FUNCTION chats_search_vector_update()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.search_vector = to_tsvector('russian', coalesce(NEW.title, '')) || to_tsvector('simple', coalesce(NEW.title, ''));
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns 
+        WHERE table_name = 'messages' AND column_name = 'search_vector'
+    ) THEN
+        ALTER TABLE messages ADD COLUMN search_vector TSVECTOR;
+        UPDATE messages SET search_vector =
+            to_tsvector('russian', coalesce(content, '')) || to_tsvector('simple', coalesce(content, ''));
+    END IF;
+    
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns 
+        WHERE table_name = 'notes' AND column_name = 'search_vector'
+    ) THEN
+        ALTER TABLE notes ADD COLUMN search_vector TSVECTOR;
+        -- updated_at заметок не меняется (триггер update_notes_updated_at отключён на время)
+        ALTER TABLE notes DISABLE TRIGGER update_notes_updated_at;
+        UPDATE notes SET search_vector =
+            setweight(to_tsvector('russian', coalesce(title, '')) || to_tsvector('simple', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('russian', coalesce(content, '')) || to_tsvector('simple', coalesce(content, '')), 'B');
+        ALTER TABLE notes ENABLE TRIGGER update_notes_updated_at;
+    END IF;
+    
+    IF NOT EXISTS (
+        SELECT 1 FROM information_schema.columns 
+        WHERE table_name = 'chats' AND column_name = 'search_vector'
+    ) THEN
+        ALTER TABLE chats ADD COLUMN search_vector TSVECTOR;
+        ALTER TABLE chats DISABLE TRIGGER update_chats_updated_at;
+        UPDATE chats SET search_vector =
+            to_tsvector('russian', coalesce(title, '')) || to_tsvector('simple', coalesce(title, ''));
+        ALTER TABLE chats ENABLE TRIGGER update_chats_updated_at;
+    END IF;
+END $$;
+
+DROP TRIGGER IF EXISTS messages_search_vector ON messages;
+CREATE TRIGGER messages_search_vector
+    BEFORE INSERT OR UPDATE OF content ON messages
+    FOR EACH ROW
+    EXECUTE FUNCTION messages_search_vector_update();
+
+DROP TRIGGER IF EXISTS notes_search_vector ON notes;
+CREATE TRIGGER notes_search_vector
+    BEFORE INSERT OR UPDATE OF title, content ON notes
+    FOR EACH ROW
+    EXECUTE FUNCTION notes_search_vector_update();
+
+DROP TRIGGER IF EXISTS chats_search_vector ON chats;
+CREATE TRIGGER chats_search_vector
+    BEFORE INSERT OR UPDATE OF title ON chats
+    FOR EACH ROW
+    EXECUTE FUNCTION chats_search_vector_update();
+
+CREATE INDEX IF NOT EXISTS idx_messages_search_vector ON messages USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_notes_search_vector ON notes USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_chats_search_vector ON chats USING GIN (search_vector);
@@ -11,12 +11,14 @@ security = HTTPBearer()
 optional_security = HTTPBearer(auto_error=False)
 
 
-async def get_current_user(
+def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db)
 ) -> User:
     """
     Dependency для получения текущего пользователя из JWT токена.
+    Обычная (не async) функция: FastAPI выполняет её в пуле потоков,
+    запрос к БД не блокирует event loop.
     Использование:
         @router.get("/protected")
         def protected_route(current_user: User = Depends(get_current_user)):
@@ -66,7 +68,7 @@ async def get_current_user(
     return user
 
 
-async def get_optional_user(
+def get_optional_user(
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
     db: Session = Depends(get_db)
 ) -> Optional[User]:
@@ -1,8 +1,22 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from typing import Optional
+
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from backend.app.database.base import Base
 
+# Длина превью последнего сообщения в списке чатов
+CHAT_PREVIEW_LENGTH = 100
+
+
+def message_preview(content: Optional[str]) -> Optional[str]:
+    """Превью сообщения для списка чатов"""
+    if content is None:
+        return None
+    if len(content) > CHAT_PREVIEW_LENGTH:
+        return content[:CHAT_PREVIEW_LENGTH] + "..."
+    return content
+
 
 class Chat(Base):
     """Модель чата"""
@@ -12,6 +26,16 @@ class Chat(Base):
     space_id = Column(Integer, ForeignKey("spaces.id", ondelete="CASCADE"), nullable=False, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     title = Column(String(255), nullable=True)
+    # Скользящее краткое содержание беседы (chat_summary_service): покрывает сообщения
+    # до summary_message_id включительно, в промпт после него идут только новые сообщения
+    summary = Column(Text, nullable=True)
+    summary_message_id = Column(Integer, nullable=True)
+    summary_token_count = Column(Integer, nullable=True)
+    summary_updated_at = Column(DateTime(timezone=True), nullable=True)
+    # Денормализованные данные для списка чатов (обновляются событиями Message, см. models/message.py)
+    last_message_preview = Column(String(CHAT_PREVIEW_LENGTH + 3), nullable=True)
+    last_message_at = Column(DateTime(timezone=True), nullable=True)
+    message_count = Column(Integer, nullable=False, default=0, server_default="0")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
@@ -21,6 +45,12 @@ class Chat(Base):
     messages = relationship("Message", back_populates="chat", cascade="all, delete-orphan", order_by="Message.created_at")
     file_attachments = relationship("FileAttachment", back_populates="chat", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Список чатов пользователя / пространства по времени обновления
+        Index("idx_chats_user_updated", "user_id", updated_at.desc()),
+        Index("idx_chats_space_updated", "space_id", updated_at.desc()),
+    )
+
     def __repr__(self):
         return f"<Chat(id={self.id}, title={self.title}, space_id={self.space_id})>"
 
@@ -1,7 +1,8 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, BigInteger
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, BigInteger, event, inspect
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from backend.app.database.base import Base
+from backend.app.utils.tokens import count_tokens
 
 
 class FileAttachment(Base):
@@ -24,6 +25,7 @@ class FileAttachment(Base):
     # Анализ файла
     extracted_text = Column(Text, nullable=True)  # Извлеченный текст из PDF/DOC
     analysis_result = Column(Text, nullable=True)  # Результат анализа через LLM (для изображений)
+    token_count = Column(Integer, nullable=True)  # Токены context_text(); NULL — ещё не посчитано
     
     created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
 
@@ -33,6 +35,28 @@ class FileAttachment(Base):
     space = relationship("Space", back_populates="file_attachments")
     user = relationship("User", back_populates="file_attachments")
 
+    def context_text(self) -> str:
+        """Блок, которым вложение добавляется к сообщению в истории для LLM"""
+        if self.extracted_text:
+            # Для PDF/DOC файлов — извлеченный текст
+            return f"\n\n[Содержимое файла {self.filename}]:\n{self.extracted_text}"
+        if self.analysis_result:
+            # Для изображений — результат анализа
+            return f"\n\n[Анализ изображения {self.filename}]:\n{self.analysis_result}"
+        return ""
+
     def __repr__(self):
         return f"<FileAttachment(id={self.id}, filename={self.filename}, file_type={self.file_type})>"
 
+
+@event.listens_for(FileAttachment, "before_insert")
+@event.listens_for(FileAttachment, "before_update")
+def _fill_attachment_token_count(mapper, connection, target):
+    state = inspect(target)
+    changed = any(
+        state.attrs[name].history.has_changes()
+        for name in ("extracted_text", "analysis_result", "filename")
+    )
+    if target.token_count is None or changed:
+        target.token_count = count_tokens(target.context_text())
+
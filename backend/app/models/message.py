@@ -1,8 +1,10 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, event, inspect, select, update
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from backend.app.database.base import Base
+from backend.app.models.chat import Chat, message_preview
 from backend.app.models.message_tag import message_tags
+from backend.app.utils.history_sanitizer import message_token_count
 
 
 class Message(Base):
@@ -14,6 +16,7 @@ class Message(Base):
     role = Column(String(20), nullable=False)  # 'user' или 'assistant'
     content = Column(Text, nullable=False)
     image_url = Column(String(500), nullable=True)  # Ссылка на изображение для графиков
+    token_count = Column(Integer, nullable=True)  # Токены content без HTML-разметки (как уходит в LLM); NULL — ещё не посчитано
     created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
 
     # Relationships
@@ -24,3 +27,68 @@ class Message(Base):
     def __repr__(self):
         return f"<Message(id={self.id}, role={self.role}, chat_id={self.chat_id})>"
 
+
+@event.listens_for(Message, "before_insert")
+@event.listens_for(Message, "before_update")
+def _fill_message_token_count(mapper, connection, target):
+    """token_count считается один раз при записи, а не на каждом запросе к LLM"""
+    if target.token_count is None or inspect(target).attrs.content.history.has_changes():
+        target.token_count = message_token_count(target.content)
+
+
+# --- Превью и счётчик сообщений в chats (список чатов читается без запросов по каждому чату) ---
+
+def _refresh_chat_preview(connection, chat_id: int) -> None:
+    """Пересчитать превью, время последнего сообщения и счётчик чата по таблице messages"""
+    messages = Message.__table__
+    chats = Chat.__table__
+    latest = connection.execute(
+        select(messages.c.content, messages.c.created_at)
+        .where(messages.c.chat_id == chat_id)
+        .order_by(messages.c.created_at.desc(), messages.c.id.desc())
+        .limit(1)
+    ).first()
+    count = connection.execute(
+        select(func.count()).select_from(messages).where(messages.c.chat_id == chat_id)
+    ).scalar()
+    connection.execute(update(chats).where(chats.c.id == chat_id).values(
+        message_count=count,
+        last_message_preview=message_preview(latest.content) if latest else None,
+        last_message_at=latest.created_at if latest else None,
+        # Удаление и правка сообщений не поднимают чат в списке: updated_at не меняется,
+        # поэтому и триггер update_chats_updated_at в PostgreSQL его не трогает (см. init.sql)
+        updated_at=chats.c.updated_at,
+    ))
+
+
+@event.listens_for(Message, "after_insert")
+def _chat_preview_on_insert(mapper, connection, target):
+    """
+    Новое сообщение — последнее в чате: +1 к счётчику без пересчёта.
+    updated_at поднимается через onupdate=now(): триггер update_chats_updated_at
+    сам реагирует только на пользовательские колонки, а явно заданное значение оставляет.
+    """
+    messages = Message.__table__
+    chats = Chat.__table__
+    connection.execute(update(chats).where(chats.c.id == target.chat_id).values(
+        message_count=func.coalesce(chats.c.message_count, 0) + 1,
+        last_message_preview=message_preview(target.content),
+        last_message_at=select(messages.c.created_at).where(messages.c.id == target.id).scalar_subquery(),
+    ))
+
+
+@event.listens_for(Message, "after_update")
+def _chat_preview_on_update(mapper, connection, target):
+    """Изменился текст или чат сообщения (редактирование, перенос)"""
+    state = inspect(target)
+    chat_history = state.attrs.chat_id.history
+    if chat_history.has_changes():
+        for chat_id in set(chat_history.deleted or ()) | {target.chat_id}:
+            _refresh_chat_preview(connection, chat_id)
+    elif state.attrs.content.history.has_changes():
+        _refresh_chat_preview(connection, target.chat_id)
+
+
+@event.listens_for(Message, "after_delete")
+def _chat_preview_on_delete(mapper, connection, target):
+    _refresh_chat_preview(connection, target.chat_id)
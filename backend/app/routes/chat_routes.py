@@ -1,10 +1,12 @@
 from fastapi import APIRouter, HTTPException, Depends, Query, UploadFile, File, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List
 from datetime import datetime, timezone
 from sqlalchemy.orm import Session
 from sqlalchemy import desc, or_, and_
-from typing import List, Dict
+from typing import List, Dict, Tuple, AsyncIterator, TYPE_CHECKING
 from pathlib import Path
 import uuid
 import re
@@ -17,28 +19,32 @@ from backend.app.models.chat import Chat
 from backend.app.models.message import Message
 from backend.app.models.note import Note
 from backend.app.models.file_attachment import FileAttachment
-from backend.ml.services.file_analysis_service import FileAnalysisService
-from backend.ml.models.business_classifier import EnhancedBusinessClassifier
+from backend.ml.services.file_analysis_service import FileAnalysisService, IMAGE_ANALYSIS_PROMPT
 from backend.app.models.user_activity import UserActivity
-from backend.app.services.llm_service import LLMService
-from backend.app.services.cache_service import CacheService
-from backend.app.services.formatting_service import FormattingService
+from backend.app.services.cache_service import build_cache_scope
+from backend.app.services.service_registry import services, get_llm_service
 from backend.app.services.space_context_service import build_space_context_prompt_block
-from backend.ml.services.graphic_service import GraphicService
+from backend.app.services.history_service import load_conversation_history, HistoryMessage, HISTORY_MAX_TOKENS
+from backend.app.services.chat_summary_service import chat_summarizer
+from backend.app.services.llm_telemetry import bind_context
 from backend.app.routes.spaces_routes import SpaceFileAttachmentItem, SpaceFilesListResponse
 from backend.app.utils.message_display import format_message_content_for_display
+from backend.app.utils.history_sanitizer import sanitize_message_content
+from backend.app.utils.sse import format_sse_event, SSE_RESPONSE_HEADERS
+from backend.app.services.llm_scheduler import (
+    llm_scheduler,
+    LLMQueueFullError,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_BACKGROUND,
+)
+
+# LLMService (openai SDK) создаётся реестром при прогреве или первом запросе
+if TYPE_CHECKING:
+    from backend.app.services.llm_service import LLMService
 
 router = APIRouter()
 
-# Инициализация сервисов
-classifier_service = EnhancedBusinessClassifier()
-classifier_service.load_model('backend/ml/models/business_classifier.pkl')
-llm_service = LLMService()
-cache_service = CacheService()
-formatting_service = FormattingService()
-
-# Инициализация сервиса для графиков
-graphic_service = GraphicService(llm_service)
+# Сервисы (LLM, кэши, классификатор, графики) — общие для всех роутов, см. service_registry
 
 CATEGORY_PROMPTS = {
     'marketing': "Ты — эксперт по маркетингу и продвижению бизнеса. Отвечай кратко, практично и с фокусом на измеримые результаты.",
@@ -142,7 +148,7 @@ def get_or_create_default_space(user: User, db: Session) -> Space:
 
 def get_enhanced_system_prompt(user_question: str):
     """Получение усиленного промпта на основе категории"""
-    category, probabilities = classifier_service.predict_category(user_question)
+    category, probabilities = services.classifier.predict_category(user_question)
     confidence = probabilities.get(category, 0)
 
     print(f"🎯 Категория вопроса: {category} (уверенность: {confidence:.1%})")
@@ -156,36 +162,25 @@ def get_enhanced_system_prompt(user_question: str):
     return enhanced_prompt, category, probabilities
 
 
-def get_conversation_history(chat_id: int, db: Session, max_messages: int = 10) -> List[Dict[str, str]]:
-    """Получить последние max_messages сообщений чата для контекста LLM, включая содержимое файлов."""
-    messages = db.query(Message).filter(
-        Message.chat_id == chat_id
-    ).order_by(Message.created_at.desc()).limit(max_messages).all()
-
-    # Преобразуем в список словарей (хронологически от старых к новым)
-    formatted_history = []
-    for msg in reversed(messages):
-        content = msg.content
-        
-        # Если у сообщения есть связанные файлы, добавляем их содержимое
-        file_attachments = db.query(FileAttachment).filter(
-            FileAttachment.message_id == msg.id
-        ).all()
-        
-        for file_attachment in file_attachments:
-            if file_attachment.extracted_text:
-                # Для PDF/DOC файлов добавляем извлеченный текст
-                content += f"\n\n[Содержимое файла {file_attachment.filename}]:\n{file_attachment.extracted_text}"
-            elif file_attachment.analysis_result:
-                # Для изображений добавляем результат анализа
-                content += f"\n\n[Анализ изображения {file_attachment.filename}]:\n{file_attachment.analysis_result}"
-        
-        formatted_history.append({
-            'role': msg.role,
-            'content': content
-        })
-
-    return formatted_history
+def get_conversation_history(
+    chat_id: int,
+    db: Session,
+    max_tokens: int = HISTORY_MAX_TOKENS,
+    exclude_current_turn: bool = False,
+    after_message_id: Optional[int] = None,
+    current_attachment_ids: Optional[List[int]] = None,
+) -> List[HistoryMessage]:
+    """
+    Последние сообщения чата для контекста LLM (с содержимым файлов), укладывающиеся
+    в max_tokens. Окно выбирается в SQL по сохранённым token_count (см. history_service);
+    token_count передаётся дальше, чтобы LLMService не токенизировал историю повторно.
+    after_message_id — граница краткого содержания чата (chats.summary_message_id).
+    """
+    return load_conversation_history(
+        db, chat_id, max_tokens=max_tokens,
+        exclude_current_turn=exclude_current_turn, after_message_id=after_message_id,
+        current_attachment_ids=current_attachment_ids,
+    )
 
 
 def _guess_file_meta_from_asset_path(asset_rel_path: str) -> Dict[str, str]:
@@ -300,6 +295,45 @@ def _register_assistant_assets_as_attachments(
         print(f"⚠️ Не удалось зарегистрировать ассистентские assets в FileAttachment: {e}")
 
 
+def llm_busy_http_error(error: LLMQueueFullError) -> HTTPException:
+    """429 для переполненной очереди llm_scheduler"""
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=str(error),
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
+
+def _save_graphic_note(db: Session, current_user: User, space_id: int, user_query: str, saved_image_path: str) -> None:
+    """Заметка со ссылкой на сгенерированный график"""
+    try:
+        # Получаем пространство
+        space = db.query(Space).filter(
+            Space.id == space_id,
+            Space.user_id == current_user.id
+        ).first()
+
+        if space:
+            # Создаем заметку
+            new_note = Note(
+                space_id=space.id,
+                user_id=current_user.id,
+                title=f"График: {user_query[:50]}",
+                content=f"График создан по запросу: {user_query}",
+                image_url=saved_image_path
+            )
+            db.add(new_note)
+            db.commit()
+            db.refresh(new_note)
+            print(f"✅ Заметка создана с ID {new_note.id}, image_url: {saved_image_path}")
+        else:
+            print(f"⚠️ Пространство {space_id} не найдено, заметка не создана")
+    except Exception as e:
+        print(f"❌ Ошибка при создании заметки: {e}")
+        import traceback
+        traceback.print_exc()
+
+
 async def process_graphic_request(user_query: str, current_user: User, db: Session, space_id: int) -> dict:
     """
     Обработка запроса на график.
@@ -308,40 +342,16 @@ async def process_graphic_request(user_query: str, current_user: User, db: Sessi
     try:
         print(f"📊 Обработка графического запроса: {user_query}")
 
-        # Обрабатываем запрос через GraphicService
-        result = graphic_service.process_graphic_request(user_query)
+        # Обрабатываем запрос через GraphicService (генерация кода + выполнение) вне event loop
+        async with llm_scheduler.slot(f"user:{current_user.id}", PRIORITY_BACKGROUND):
+            result = await run_in_threadpool(services.graphic_service.process_graphic_request, user_query)
 
         if result["success"]:
             saved_image_path = result.get('saved_image_path')
 
-            # Создаем заметку с ссылкой на картинку
+            # Создаем заметку с ссылкой на картинку (запросы к БД — вне event loop)
             if saved_image_path:
-                try:
-                    # Получаем пространство
-                    space = db.query(Space).filter(
-                        Space.id == space_id,
-                        Space.user_id == current_user.id
-                    ).first()
-
-                    if space:
-                        # Создаем заметку
-                        new_note = Note(
-                            space_id=space.id,
-                            user_id=current_user.id,
-                            title=f"График: {user_query[:50]}",
-                            content=f"График создан по запросу: {user_query}",
-                            image_url=saved_image_path
-                        )
-                        db.add(new_note)
-                        db.commit()
-                        db.refresh(new_note)
-                        print(f"✅ Заметка создана с ID {new_note.id}, image_url: {saved_image_path}")
-                    else:
-                        print(f"⚠️ Пространство {space_id} не найдено, заметка не создана")
-                except Exception as e:
-                    print(f"❌ Ошибка при создании заметки: {e}")
-                    import traceback
-                    traceback.print_exc()
+                await run_in_threadpool(_save_graphic_note, db, current_user, space_id, user_query, saved_image_path)
 
             # Формируем HTML с изображением из assets
             # Используем сохраненный путь, если есть, иначе fallback на base64
@@ -535,40 +545,40 @@ async def create_chat(
     )
 
 
-async def _assistant_reply_pipeline(
-    db: Session,
-    chat: Chat,
-    space: Space,
-    current_user: User,
+def _quick_assistant_reply(db: Session, chat: Chat, user_message: str) -> Optional[ChatSendResponse]:
+    """Быстрый ответ без LLM (приветствия и т.п.), сохранённый в БД, или None"""
+    quick_response = services.llm_service.get_quick_response(user_message)
+    if not quick_response:
+        return None
+
+    assistant_msg = Message(
+        chat_id=chat.id,
+        role="assistant",
+        content=quick_response
+    )
+    db.add(assistant_msg)
+    db.commit()
+    db.refresh(assistant_msg)
+
+    return ChatSendResponse(
+        success=True,
+        chat_id=chat.id,
+        message_id=assistant_msg.id,
+        response={
+            'raw_text': quick_response,
+            'formatted_html': f'<p class="response-text">{quick_response}</p>',
+            'timestamp': datetime.now().isoformat(),
+            'category': 'quick_response'
+        }
+    )
+
+
+def _classify_user_message(
     user_message: str,
     user_message_with_file: str,
     file_content_context: str,
-) -> ChatSendResponse:
-    """Общая генерация ответа ассистента после сохранения сообщения пользователя в БД."""
-    if not file_content_context:
-        quick_response = llm_service.get_quick_response(user_message)
-        if quick_response:
-            assistant_msg = Message(
-                chat_id=chat.id,
-                role="assistant",
-                content=quick_response
-            )
-            db.add(assistant_msg)
-            db.commit()
-            db.refresh(assistant_msg)
-
-            return ChatSendResponse(
-                success=True,
-                chat_id=chat.id,
-                message_id=assistant_msg.id,
-                response={
-                    'raw_text': quick_response,
-                    'formatted_html': f'<p class="response-text">{quick_response}</p>',
-                    'timestamp': datetime.now().isoformat(),
-                    'category': 'quick_response'
-                }
-            )
-
+) -> Tuple[str, str, str, Dict]:
+    """Классификация вопроса: (текст для классификации, enhanced_prompt, category, probabilities)"""
     text_for_classification = user_message_with_file
     text_for_classification = re.sub(r'<[^>]+>', ' ', text_for_classification)
     text_for_classification = ' '.join(text_for_classification.split())
@@ -583,6 +593,72 @@ async def _assistant_reply_pipeline(
     print(f"🔍 Текст для классификации ({len(text_for_classification)} символов): {text_for_classification[:200]}...")
 
     enhanced_prompt, category, probabilities = get_enhanced_system_prompt(text_for_classification)
+    return text_for_classification, enhanced_prompt, category, probabilities
+
+
+def _save_graphic_reply(
+    db: Session,
+    chat: Chat,
+    space: Space,
+    current_user: User,
+    response_data: dict,
+) -> ChatSendResponse:
+    """Сохранение ответа с графиком и регистрация картинки как вложения"""
+    saved_image_path = response_data.get('graphic_data', {}).get('saved_image_path')
+    assistant_msg = Message(
+        chat_id=chat.id,
+        role="assistant",
+        content=response_data['raw_text'],
+        image_url=saved_image_path
+    )
+    db.add(assistant_msg)
+    chat.updated_at = datetime.now(timezone.utc)
+    db.commit()
+    db.refresh(assistant_msg)
+
+    _register_assistant_assets_as_attachments(
+        db=db,
+        current_user=current_user,
+        chat=chat,
+        space=space,
+        assistant_message=assistant_msg,
+        formatted_html=response_data.get("formatted_html") if isinstance(response_data, dict) else None,
+        extra_asset_paths=[saved_image_path] if saved_image_path else None,
+    )
+
+    return ChatSendResponse(
+        success=True,
+        chat_id=chat.id,
+        message_id=assistant_msg.id,
+        response=response_data
+    )
+
+
+async def _assistant_shortcut_reply(
+    db: Session,
+    chat: Chat,
+    space: Space,
+    current_user: User,
+    user_message: str,
+    user_message_with_file: str,
+    file_content_context: str,
+) -> Tuple[Optional[ChatSendResponse], str, str, Dict]:
+    """
+    Первая часть пайплайна ответа: классификация, быстрые ответы и графики.
+    Классификатор и запросы к БД (sync-сессия) выполняются в пуле потоков.
+
+    Returns:
+        (готовый ответ или None, enhanced_prompt, category, probabilities).
+        Если ответ None — нужно идти в LLM с полученным промптом.
+    """
+    if not file_content_context:
+        quick_reply = await run_in_threadpool(_quick_assistant_reply, db, chat, user_message)
+        if quick_reply is not None:
+            return quick_reply, "", "quick_response", {}
+
+    text_for_classification, enhanced_prompt, category, probabilities = await run_in_threadpool(
+        _classify_user_message, user_message, user_message_with_file, file_content_context
+    )
 
     if category == 'graphic':
         graphic_keywords = ['график', 'диаграмма', 'chart', 'plot', 'график по', 'построй', 'создай график', 'визуализ']
@@ -590,35 +666,10 @@ async def _assistant_reply_pipeline(
 
         if has_graphic_request:
             response_data = await process_graphic_request(user_message, current_user, db, space.id)
-
-            saved_image_path = response_data.get('graphic_data', {}).get('saved_image_path')
-            assistant_msg = Message(
-                chat_id=chat.id,
-                role="assistant",
-                content=response_data['raw_text'],
-                image_url=saved_image_path
-            )
-            db.add(assistant_msg)
-            chat.updated_at = datetime.now(timezone.utc)
-            db.commit()
-            db.refresh(assistant_msg)
-
-            _register_assistant_assets_as_attachments(
-                db=db,
-                current_user=current_user,
-                chat=chat,
-                space=space,
-                assistant_message=assistant_msg,
-                formatted_html=response_data.get("formatted_html") if isinstance(response_data, dict) else None,
-                extra_asset_paths=[saved_image_path] if saved_image_path else None,
-            )
-
-            return ChatSendResponse(
-                success=True,
-                chat_id=chat.id,
-                message_id=assistant_msg.id,
-                response=response_data
+            graphic_reply = await run_in_threadpool(
+                _save_graphic_reply, db, chat, space, current_user, response_data
             )
+            return graphic_reply, enhanced_prompt, category, probabilities
         else:
             print(f"⚠️ Категория 'graphic' определена, но нет явного запроса на график. Переопределяем на 'general'")
             category = 'general'
@@ -627,9 +678,47 @@ async def _assistant_reply_pipeline(
             enhanced_prompt += f"\n\n[Категория вопроса: general]"
             probabilities = {'general': 1.0}
 
-    cached_response = cache_service.get(user_message)
+    return None, enhanced_prompt, category, probabilities
+
+
+def _load_llm_context(
+    db: Session,
+    chat: Chat,
+    space: Space,
+    attachment_ids: Optional[List[int]] = None,
+) -> Tuple[List[HistoryMessage], Optional[str]]:
+    """
+    История чата и контекст пространства для запроса к LLM.
+    Если у чата есть краткое содержание (chat.summary), история берётся только после него.
+    """
+    conversation_history = get_conversation_history(
+        chat.id, db, exclude_current_turn=True,
+        after_message_id=chat.summary_message_id if chat.summary else None,
+        current_attachment_ids=attachment_ids,
+    )
+
+    space_context_block = build_space_context_prompt_block(db, space.id, limit=30)
+
+    print(f"📚 Используем историю из {len(conversation_history)} сообщений для контекста")
+    if space_context_block:
+        print(f"🗂️ Добавлен контекст пространства (последние сообщения по всем чатам space)")
+
+    return conversation_history, space_context_block
+
+
+def _cached_assistant_reply(
+    db: Session,
+    chat: Chat,
+    space: Space,
+    current_user: User,
+    user_message: str,
+    cache_scope: str,
+    category: str,
+) -> Optional[ChatSendResponse]:
+    """Ответ из кэша (с учётом области — истории, пространства, вложений) или None."""
+    cached_response = services.semantic_cache.get_cached_response(services.cache_service, user_message, cache_scope, category)
     if cached_response:
-        print(f"✅ Используем кэшированный ответ для: {user_message[:50]}...")
+        print(f"✅ Используем кэшированный ответ ({cache_scope.split(':', 1)[0]}) для: {user_message[:50]}...")
         assistant_content = cached_response.get('raw_text', '')
 
         assistant_msg = Message(
@@ -657,47 +746,23 @@ async def _assistant_reply_pipeline(
             response=cached_response
         )
 
-    print(f"📨 Отправляем запрос в LLM: {user_message[:200]}...")
-    if file_content_context:
-        print(f"📎 Включено содержимое файла в контекст")
-
-    conversation_history = get_conversation_history(chat.id, db, max_messages=15)
-
-    space_context_block = build_space_context_prompt_block(db, space.id, limit=30)
-
-    print(f"📚 Используем историю из {len(conversation_history)} сообщений для контекста")
-    if space_context_block:
-        print(f"🗂️ Добавлен контекст пространства (последние сообщения по всем чатам space)")
+    return None
 
-    try:
-        ai_response = llm_service.generate_response(
-            system_prompt=enhanced_prompt,
-            user_question=user_message_with_file,
-            conversation_history=conversation_history,
-            space_context=space_context_block,
-        )
-    except ValueError as e:
-        error_msg = str(e)
-        print(f"❌ Ошибка генерации ответа: {error_msg}")
-        return ChatSendResponse(
-            success=False,
-            chat_id=chat.id if chat else 0,
-            message_id=0,
-            error=error_msg
-        )
-    except Exception as e:
-        error_msg = f"Ошибка при генерации ответа: {str(e)}"
-        print(f"❌ Неожиданная ошибка LLM: {e}")
-        import traceback
-        traceback.print_exc()
-        return ChatSendResponse(
-            success=False,
-            chat_id=chat.id if chat else 0,
-            message_id=0,
-            error="Не удалось получить ответ от AI. Попробуйте ещё раз."
-        )
 
-    formatted_response = formatting_service.format_response(ai_response)
+def _save_llm_reply(
+    db: Session,
+    chat: Chat,
+    space: Space,
+    current_user: User,
+    user_message: str,
+    ai_response: str,
+    category: str,
+    probabilities: Dict,
+    conversation_history: List[HistoryMessage],
+    cache_scope: str,
+) -> ChatSendResponse:
+    """Форматирование, сохранение ответа LLM в БД и кэш."""
+    formatted_response = services.formatting_service.format_response(ai_response)
 
     assistant_msg = Message(
         chat_id=chat.id,
@@ -718,7 +783,8 @@ async def _assistant_reply_pipeline(
         'history_count': len(conversation_history) + 1
     }
 
-    cache_service.set(user_message, response_data)
+    services.cache_service.set(user_message, response_data, scope=cache_scope)
+    services.semantic_cache.add(user_message, cache_scope, category)
 
     _register_assistant_assets_as_attachments(
         db=db,
@@ -739,195 +805,403 @@ async def _assistant_reply_pipeline(
     )
 
 
-@router.post("/chat/send", response_model=ChatSendResponse)
-async def send_message(
-        request: ChatSendRequest,
-        current_user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
-):
-    """Отправка сообщения в чат и получение ответа от LLM с учетом всей истории"""
+def _bind_llm_telemetry(chat: Chat, space: Space, current_user: User, llm_tenant: Optional[str]) -> None:
+    """Пространство и чат для телеметрии вызовов LLM (публичный tenant — без токена ссылки)"""
+    is_public = (llm_tenant or "").startswith("public:")
+    bind_context(
+        space_id=space.id if space else None,
+        chat_id=chat.id,
+        tenant="public" if is_public else f"user:{current_user.id}",
+    )
+
+
+async def _assistant_reply_pipeline(
+    db: Session,
+    chat: Chat,
+    space: Space,
+    current_user: User,
+    user_message: str,
+    user_message_with_file: str,
+    file_content_context: str,
+    attachment_ids: Optional[List[int]] = None,
+    llm_tenant: Optional[str] = None,
+    llm_priority: int = PRIORITY_INTERACTIVE,
+) -> ChatSendResponse:
+    """
+    Общая генерация ответа ассистента после сохранения сообщения пользователя в БД.
+
+    llm_tenant/llm_priority — для llm_scheduler (по умолчанию "user:<id>", интерактивный приоритет).
+    """
+    _bind_llm_telemetry(chat, space, current_user, llm_tenant)
+    ready_response, enhanced_prompt, category, probabilities = await _assistant_shortcut_reply(
+        db, chat, space, current_user,
+        user_message, user_message_with_file, file_content_context,
+    )
+    if ready_response is not None:
+        return ready_response
+
+    # Запросы к БД (sync-сессия) и кэшу — в пуле потоков, чтобы не блокировать event loop
+    conversation_history, space_context_block = await run_in_threadpool(
+        _load_llm_context, db, chat, space, attachment_ids
+    )
+    cache_scope = build_cache_scope(
+        category, conversation_history, space_context_block, attachment_ids, chat.summary
+    )
+
+    cached_reply = await run_in_threadpool(
+        _cached_assistant_reply, db, chat, space, current_user, user_message, cache_scope, category
+    )
+    if cached_reply is not None:
+        return cached_reply
+
+    print(f"📨 Отправляем запрос в LLM: {user_message[:200]}...")
+    if file_content_context:
+        print(f"📎 Включено содержимое файла в контекст")
+
     try:
-        user_message = request.message.strip()
-        
-        print(f"📨 Получено сообщение пользователя:")
-        print(f"   - Длина: {len(user_message)} символов")
-        print(f"   - Первые 200 символов: {user_message[:200]}...")
-        print(f"   - Содержит HTML: {'<div' in user_message or '<img' in user_message or '<a href' in user_message}")
-
-        if not user_message:
-            raise HTTPException(status_code=400, detail="Сообщение не может быть пустым")
-
-        # Определяем чат и пространство.
-        # Важно: если chat_id передан, пространство берем из самого чата,
-        # иначе после перемещения чата в другое пространство поиск ломается.
-        if request.chat_id:
-            chat = db.query(Chat).filter(
-                Chat.id == request.chat_id,
-                Chat.user_id == current_user.id
-            ).first()
-            if not chat:
-                raise HTTPException(status_code=404, detail="Чат не найден")
-            if request.space_id and chat.space_id != request.space_id:
-                raise HTTPException(status_code=404, detail="Чат не найден")
-            space = chat.space
-
-            # Если это первое сообщение в чате, обновляем заголовок
-            # на основе запроса пользователя.
-            has_messages = db.query(Message.id).filter(
-                Message.chat_id == chat.id
-            ).first() is not None
-            if not has_messages:
-                new_title = user_message[:50] + "..." if len(user_message) > 50 else user_message
-                chat.title = new_title
-        else:
-            # Для нового чата пространство определяем явно или через дефолтное.
-            if request.space_id:
-                space = db.query(Space).filter(
-                    Space.id == request.space_id,
-                    Space.user_id == current_user.id,
-                    Space.is_archived == False
-                ).first()
-                if not space:
-                    raise HTTPException(status_code=404, detail="Пространство не найдено")
-            else:
-                space = get_or_create_default_space(current_user, db)
+        ai_response = await services.llm_service.generate_response_async(
+            system_prompt=enhanced_prompt,
+            user_question=sanitize_message_content(user_message),
+            conversation_history=conversation_history,
+            space_context=space_context_block,
+            file_context=file_content_context or None,
+            conversation_summary=chat.summary,
+            tenant=llm_tenant or f"user:{current_user.id}",
+            priority=llm_priority,
+            category=category,
+            confidence=probabilities.get(category),
+        )
+    except LLMQueueFullError as e:
+        print(f"⏳ Очередь к LLM переполнена: {e}")
+        raise llm_busy_http_error(e)
+    except ValueError as e:
+        error_msg = str(e)
+        print(f"❌ Ошибка генерации ответа: {error_msg}")
+        return ChatSendResponse(
+            success=False,
+            chat_id=chat.id if chat else 0,
+            message_id=0,
+            error=error_msg
+        )
+    except Exception as e:
+        error_msg = f"Ошибка при генерации ответа: {str(e)}"
+        print(f"❌ Неожиданная ошибка LLM: {e}")
+        import traceback
+        traceback.print_exc()
+        return ChatSendResponse(
+            success=False,
+            chat_id=chat.id if chat else 0,
+            message_id=0,
+            error="Не удалось получить ответ от AI. Попробуйте ещё раз."
+        )
 
-            # Создаем новый чат
-            chat = Chat(
-                space_id=space.id,
-                user_id=current_user.id,
-                title=user_message[:50] + "..." if len(user_message) > 50 else user_message
-            )
-            db.add(chat)
-            db.commit()
-            db.refresh(chat)
+    result = await run_in_threadpool(
+        _save_llm_reply,
+        db, chat, space, current_user,
+        user_message, ai_response, category, probabilities, conversation_history, cache_scope,
+    )
+    # Краткое содержание длинного чата обновляется в фоне, ответ не ждёт
+    chat_summarizer.schedule(chat.id, services.llm_service)
+    return result
 
-        # Извлекаем file_url из HTML, если есть файл (изображение или документ)
-        image_url = None
-        file_urls = []  # Список всех найденных файлов
-        import re
-        from datetime import timedelta
-        
-        # Ищем изображения: src="/assets/..." или src="assets/..."
-        if '<img' in user_message and 'src=' in user_message:
-            img_matches = re.findall(r'src=["\']([^"\']*assets/[^"\']+)["\']', user_message)
-            if img_matches:
-                image_url = img_matches[0].lstrip('/')  # Первое изображение для image_url
-                file_urls = [url.lstrip('/') for url in img_matches]
-                print(f"📷 Извлечены image_url из сообщения: {file_urls}")
-        
-        # Ищем ссылки на файлы: href="/assets/..." или href="assets/..."
-        if not file_urls and '<a href=' in user_message:
-            href_matches = re.findall(r'href=["\']([^"\']*assets/[^"\']+)["\']', user_message)
-            if href_matches:
-                file_urls = [url.lstrip('/') for url in href_matches]
-                if not image_url:
-                    image_url = file_urls[0]
-                print(f"📎 Извлечены file_url из сообщения: {file_urls}")
-        
-        # Также ищем упоминания файлов в тексте (для случаев, когда файл уже загружен)
-        # Ищем паттерны типа "assets/file_xxx.pdf" в тексте
-        text_file_matches = re.findall(r'assets/[a-zA-Z0-9_\-\.]+', user_message)
-        for match in text_file_matches:
-            if match not in file_urls:
-                file_urls.append(match)
-        
-        # Сохраняем сообщение пользователя
-        user_msg = Message(
-            chat_id=chat.id,
-            role="user",
-            content=user_message,
-            image_url=image_url
+
+async def _assistant_reply_stream(
+    db: Session,
+    chat: Chat,
+    space: Space,
+    current_user: User,
+    user_message: str,
+    user_message_with_file: str,
+    file_content_context: str,
+    attachment_ids: Optional[List[int]] = None,
+    llm_tenant: Optional[str] = None,
+    llm_priority: int = PRIORITY_INTERACTIVE,
+) -> AsyncIterator[str]:
+    """
+    Потоковый вариант _assistant_reply_pipeline (Server-Sent Events).
+
+    События:
+        token — очередной фрагмент текста ответа: {"text": "..."}
+        done  — итог в формате ChatSendResponse (formatted_html, category, message_id)
+        error — ChatSendResponse с success=false
+    Ответ ассистента сохраняется в БД один раз, после завершения генерации.
+    Быстрые ответы, графики и кэш отдаются сразу одним событием done.
+    """
+    _bind_llm_telemetry(chat, space, current_user, llm_tenant)
+    ready_response, enhanced_prompt, category, probabilities = await _assistant_shortcut_reply(
+        db, chat, space, current_user,
+        user_message, user_message_with_file, file_content_context,
+    )
+    if ready_response is None:
+        conversation_history, space_context_block = await run_in_threadpool(
+            _load_llm_context, db, chat, space, attachment_ids
         )
-        db.add(user_msg)
-        db.flush()  # Получаем ID сообщения для связи с FileAttachment
-        
-        # Ищем FileAttachment по нескольким критериям
-        file_attachments = []
-        
-        # 1. Ищем по file_path из сообщения
-        if file_urls:
-            for file_url in file_urls:
-                attachment = db.query(FileAttachment).filter(
-                    FileAttachment.file_path == file_url,
-                    FileAttachment.user_id == current_user.id
-                ).order_by(FileAttachment.created_at.desc()).first()
-                if attachment and attachment not in file_attachments:
-                    file_attachments.append(attachment)
-        
-        # 2. Ищем файлы, загруженные в этом чате (если chat_id был указан при загрузке)
-        chat_attachments = db.query(FileAttachment).filter(
-            FileAttachment.chat_id == chat.id,
-            FileAttachment.user_id == current_user.id,
-            FileAttachment.message_id.is_(None)  # Еще не связанные с сообщением
-        ).order_by(FileAttachment.created_at.desc()).limit(5).all()
-        
-        for attachment in chat_attachments:
-            if attachment not in file_attachments:
-                file_attachments.append(attachment)
-        
-        # 3. Ищем недавно загруженные файлы пользователя (за последние 10 минут)
-        recent_time = datetime.now(timezone.utc) - timedelta(minutes=10)
-        recent_attachments = db.query(FileAttachment).filter(
-            FileAttachment.user_id == current_user.id,
-            FileAttachment.message_id.is_(None),
-            FileAttachment.created_at >= recent_time
-        ).order_by(FileAttachment.created_at.desc()).limit(5).all()
-        
-        for attachment in recent_attachments:
-            if attachment not in file_attachments:
-                file_attachments.append(attachment)
-        
-        # Связываем найденные файлы с сообщением
-        for file_attachment in file_attachments:
-            if not file_attachment.message_id:
-                file_attachment.message_id = user_msg.id
-                print(f"✅ Связан FileAttachment {file_attachment.id} ({file_attachment.filename}) с сообщением {user_msg.id}")
-        
-        db.flush()  # Сохраняем связи в БД
-        
-        # Собираем содержимое всех файлов для контекста
-        file_content_context = ""
-        for file_attachment in file_attachments:
-            if file_attachment.extracted_text:
-                # Для PDF/DOC файлов добавляем извлеченный текст
-                file_content_context += f"\n\n[Содержимое файла {file_attachment.filename}]:\n{file_attachment.extracted_text}"
-                print(f"📄 Добавлен текст из файла {file_attachment.filename}: {len(file_attachment.extracted_text)} символов")
-            elif file_attachment.analysis_result:
-                # Для изображений добавляем результат анализа
-                file_content_context += f"\n\n[Анализ изображения {file_attachment.filename}]:\n{file_attachment.analysis_result}"
-                print(f"🖼️ Добавлен анализ изображения {file_attachment.filename}: {len(file_attachment.analysis_result)} символов")
-        
-        # Добавляем содержимое файла к сообщению пользователя для LLM
-        if file_content_context:
-            user_message_with_file = user_message + file_content_context
-        else:
-            user_message_with_file = user_message
+        cache_scope = build_cache_scope(
+            category, conversation_history, space_context_block, attachment_ids, chat.summary
+        )
+        ready_response = await run_in_threadpool(
+            _cached_assistant_reply, db, chat, space, current_user, user_message, cache_scope, category
+        )
+    if ready_response is not None:
+        yield format_sse_event("done", ready_response.model_dump())
+        return
 
-        # Сохраняем активность пользователя для аналитики эффективности
-        today = datetime.now(timezone.utc).date()
-        activity = db.query(UserActivity).filter(
-            UserActivity.user_id == current_user.id,
-            UserActivity.activity_date == today
-        ).first()
+    print(f"📨 Отправляем потоковый запрос в LLM: {user_message[:200]}...")
+
+    chunks: List[str] = []
+    try:
+        async for delta in services.llm_service.stream_response_async(
+            system_prompt=enhanced_prompt,
+            user_question=sanitize_message_content(user_message),
+            conversation_history=conversation_history,
+            space_context=space_context_block,
+            file_context=file_content_context or None,
+            conversation_summary=chat.summary,
+            tenant=llm_tenant or f"user:{current_user.id}",
+            priority=llm_priority,
+            category=category,
+            confidence=probabilities.get(category),
+        ):
+            chunks.append(delta)
+            yield format_sse_event("token", {"text": delta})
+    except (ValueError, LLMQueueFullError) as e:
+        print(f"❌ Ошибка потоковой генерации ответа: {e}")
+        yield format_sse_event("error", ChatSendResponse(
+            success=False,
+            chat_id=chat.id,
+            message_id=0,
+            error=str(e)
+        ).model_dump())
+        return
+    except Exception as e:
+        print(f"❌ Неожиданная ошибка LLM (stream): {e}")
+        import traceback
+        traceback.print_exc()
+        yield format_sse_event("error", ChatSendResponse(
+            success=False,
+            chat_id=chat.id,
+            message_id=0,
+            error="Не удалось получить ответ от AI. Попробуйте ещё раз."
+        ).model_dump())
+        return
+
+    result = await run_in_threadpool(
+        _save_llm_reply,
+        db, chat, space, current_user,
+        user_message, "".join(chunks), category, probabilities, conversation_history, cache_scope,
+    )
+    chat_summarizer.schedule(chat.id, services.llm_service)
+    yield format_sse_event("done", result.model_dump())
+
+
+def _save_user_turn(
+        request: ChatSendRequest,
+        current_user: User,
+        db: Session,
+) -> Tuple[Chat, Space, str, str, str, List[int]]:
+    """
+    Сохраняет сообщение пользователя (создаёт чат при необходимости, связывает вложения).
 
-        if activity:
-            activity.message_count += 1
-            activity.updated_at = datetime.now(timezone.utc)
+    Returns:
+        (chat, space, user_message, user_message_with_file, file_content_context, attachment_ids)
+    """
+    user_message = request.message.strip()
+
+    print(f"📨 Получено сообщение пользователя:")
+    print(f"   - Длина: {len(user_message)} символов")
+    print(f"   - Первые 200 символов: {user_message[:200]}...")
+    print(f"   - Содержит HTML: {'<div' in user_message or '<img' in user_message or '<a href' in user_message}")
+
+    if not user_message:
+        raise HTTPException(status_code=400, detail="Сообщение не может быть пустым")
+
+    # Определяем чат и пространство.
+    # Важно: если chat_id передан, пространство берем из самого чата,
+    # иначе после перемещения чата в другое пространство поиск ломается.
+    if request.chat_id:
+        chat = db.query(Chat).filter(
+            Chat.id == request.chat_id,
+            Chat.user_id == current_user.id
+        ).first()
+        if not chat:
+            raise HTTPException(status_code=404, detail="Чат не найден")
+        if request.space_id and chat.space_id != request.space_id:
+            raise HTTPException(status_code=404, detail="Чат не найден")
+        space = chat.space
+
+        # Если это первое сообщение в чате, обновляем заголовок
+        # на основе запроса пользователя.
+        has_messages = db.query(Message.id).filter(
+            Message.chat_id == chat.id
+        ).first() is not None
+        if not has_messages:
+            new_title = user_message[:50] + "..." if len(user_message) > 50 else user_message
+            chat.title = new_title
+    else:
+        # Для нового чата пространство определяем явно или через дефолтное.
+        if request.space_id:
+            space = db.query(Space).filter(
+                Space.id == request.space_id,
+                Space.user_id == current_user.id,
+                Space.is_archived == False
+            ).first()
+            if not space:
+                raise HTTPException(status_code=404, detail="Пространство не найдено")
         else:
-            activity = UserActivity(
-                user_id=current_user.id,
-                activity_date=today,
-                message_count=1
-            )
-            db.add(activity)
+            space = get_or_create_default_space(current_user, db)
 
+        # Создаем новый чат
+        chat = Chat(
+            space_id=space.id,
+            user_id=current_user.id,
+            title=user_message[:50] + "..." if len(user_message) > 50 else user_message
+        )
+        db.add(chat)
         db.commit()
-        db.refresh(user_msg)
+        db.refresh(chat)
+
+    # Извлекаем file_url из HTML, если есть файл (изображение или документ)
+    image_url = None
+    file_urls = []  # Список всех найденных файлов
+    from datetime import timedelta
+
+    # Ищем изображения: src="/assets/..." или src="assets/..."
+    if '<img' in user_message and 'src=' in user_message:
+        img_matches = re.findall(r'src=["\']([^"\']*assets/[^"\']+)["\']', user_message)
+        if img_matches:
+            image_url = img_matches[0].lstrip('/')  # Первое изображение для image_url
+            file_urls = [url.lstrip('/') for url in img_matches]
+            print(f"📷 Извлечены image_url из сообщения: {file_urls}")
+
+    # Ищем ссылки на файлы: href="/assets/..." или href="assets/..."
+    if not file_urls and '<a href=' in user_message:
+        href_matches = re.findall(r'href=["\']([^"\']*assets/[^"\']+)["\']', user_message)
+        if href_matches:
+            file_urls = [url.lstrip('/') for url in href_matches]
+            if not image_url:
+                image_url = file_urls[0]
+            print(f"📎 Извлечены file_url из сообщения: {file_urls}")
+
+    # Также ищем упоминания файлов в тексте (для случаев, когда файл уже загружен)
+    # Ищем паттерны типа "assets/file_xxx.pdf" в тексте
+    text_file_matches = re.findall(r'assets/[a-zA-Z0-9_\-\.]+', user_message)
+    for match in text_file_matches:
+        if match not in file_urls:
+            file_urls.append(match)
+
+    # Сохраняем сообщение пользователя
+    user_msg = Message(
+        chat_id=chat.id,
+        role="user",
+        content=user_message,
+        image_url=image_url
+    )
+    db.add(user_msg)
+    db.flush()  # Получаем ID сообщения для связи с FileAttachment
+
+    # Ищем FileAttachment по нескольким критериям
+    file_attachments = []
+
+    # 1. Ищем по file_path из сообщения
+    if file_urls:
+        for file_url in file_urls:
+            attachment = db.query(FileAttachment).filter(
+                FileAttachment.file_path == file_url,
+                FileAttachment.user_id == current_user.id
+            ).order_by(FileAttachment.created_at.desc()).first()
+            if attachment and attachment not in file_attachments:
+                file_attachments.append(attachment)
+
+    # 2. Ищем файлы, загруженные в этом чате (если chat_id был указан при загрузке)
+    chat_attachments = db.query(FileAttachment).filter(
+        FileAttachment.chat_id == chat.id,
+        FileAttachment.user_id == current_user.id,
+        FileAttachment.message_id.is_(None)  # Еще не связанные с сообщением
+    ).order_by(FileAttachment.created_at.desc()).limit(5).all()
+
+    for attachment in chat_attachments:
+        if attachment not in file_attachments:
+            file_attachments.append(attachment)
+
+    # 3. Ищем недавно загруженные файлы пользователя (за последние 10 минут)
+    recent_time = datetime.now(timezone.utc) - timedelta(minutes=10)
+    recent_attachments = db.query(FileAttachment).filter(
+        FileAttachment.user_id == current_user.id,
+        FileAttachment.message_id.is_(None),
+        FileAttachment.created_at >= recent_time
+    ).order_by(FileAttachment.created_at.desc()).limit(5).all()
+
+    for attachment in recent_attachments:
+        if attachment not in file_attachments:
+            file_attachments.append(attachment)
+
+    # Связываем найденные файлы с сообщением
+    for file_attachment in file_attachments:
+        if not file_attachment.message_id:
+            file_attachment.message_id = user_msg.id
+            print(f"✅ Связан FileAttachment {file_attachment.id} ({file_attachment.filename}) с сообщением {user_msg.id}")
+
+    db.flush()  # Сохраняем связи в БД
+
+    # Собираем содержимое всех файлов для контекста
+    file_content_context = ""
+    for file_attachment in file_attachments:
+        if file_attachment.extracted_text:
+            # Для PDF/DOC файлов добавляем извлеченный текст
+            file_content_context += f"\n\n[Содержимое файла {file_attachment.filename}]:\n{file_attachment.extracted_text}"
+            print(f"📄 Добавлен текст из файла {file_attachment.filename}: {len(file_attachment.extracted_text)} символов")
+        elif file_attachment.analysis_result:
+            # Для изображений добавляем результат анализа
+            file_content_context += f"\n\n[Анализ изображения {file_attachment.filename}]:\n{file_attachment.analysis_result}"
+            print(f"🖼️ Добавлен анализ изображения {file_attachment.filename}: {len(file_attachment.analysis_result)} символов")
+
+    # Добавляем содержимое файла к сообщению пользователя для LLM
+    if file_content_context:
+        user_message_with_file = user_message + file_content_context
+    else:
+        user_message_with_file = user_message
+
+    # Сохраняем активность пользователя для аналитики эффективности
+    today = datetime.now(timezone.utc).date()
+    activity = db.query(UserActivity).filter(
+        UserActivity.user_id == current_user.id,
+        UserActivity.activity_date == today
+    ).first()
+
+    if activity:
+        activity.message_count += 1
+        activity.updated_at = datetime.now(timezone.utc)
+    else:
+        activity = UserActivity(
+            user_id=current_user.id,
+            activity_date=today,
+            message_count=1
+        )
+        db.add(activity)
+
+    db.commit()
+    db.refresh(user_msg)
+
+    attachment_ids = [file_attachment.id for file_attachment in file_attachments]
+    return chat, space, user_message, user_message_with_file, file_content_context, attachment_ids
+
+
+@router.post("/chat/send", response_model=ChatSendResponse)
+async def send_message(
+        request: ChatSendRequest,
+        current_user: User = Depends(get_current_user),
+        db: Session = Depends(get_db)
+):
+    """Отправка сообщения в чат и получение ответа от LLM с учетом всей истории"""
+    try:
+        chat, space, user_message, user_message_with_file, file_content_context, attachment_ids = await run_in_threadpool(
+            _save_user_turn, request, current_user, db
+        )
 
         return await _assistant_reply_pipeline(
             db, chat, space, current_user,
             user_message, user_message_with_file, file_content_context,
+            attachment_ids=attachment_ids,
         )
 
     except HTTPException:
@@ -944,6 +1218,49 @@ async def send_message(
         )
 
 
+@router.post("/chat/send/stream")
+async def send_message_stream(
+        request: ChatSendRequest,
+        current_user: User = Depends(get_current_user),
+        db: Session = Depends(get_db)
+):
+    """
+    Потоковая отправка сообщения: ответ LLM приходит по токенам (text/event-stream).
+    Завершающее событие done содержит тот же объект, что и /chat/send.
+    """
+    try:
+        llm_scheduler.check_capacity(f"user:{current_user.id}")
+    except LLMQueueFullError as e:
+        raise llm_busy_http_error(e)
+
+    try:
+        chat, space, user_message, user_message_with_file, file_content_context, attachment_ids = await run_in_threadpool(
+            _save_user_turn, request, current_user, db
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Ошибка: {e}")
+        import traceback
+        traceback.print_exc()
+        return ChatSendResponse(
+            success=False,
+            chat_id=0,
+            message_id=0,
+            error="Временная ошибка сервера. Пожалуйста, попробуйте ещё раз."
+        )
+
+    return StreamingResponse(
+        _assistant_reply_stream(
+            db, chat, space, current_user,
+            user_message, user_message_with_file, file_content_context,
+            attachment_ids=attachment_ids,
+        ),
+        media_type="text/event-stream",
+        headers=SSE_RESPONSE_HEADERS,
+    )
+
+
 @router.patch("/chat/messages/{message_id}/regenerate", response_model=ChatSendResponse)
 async def edit_user_message_and_regenerate(
     message_id: int,
@@ -1087,6 +1404,7 @@ async def edit_user_message_and_regenerate(
         user_message,
         user_message_with_file,
         file_content_context,
+        attachment_ids=[file_attachment.id for file_attachment in final_attachments],
     )
 
 
@@ -1119,7 +1437,7 @@ plt.close()
     return {"success": False, "error": result.get("error")}
 
 @router.get("/chat/history", response_model=ChatHistoryResponse)
-async def get_chat_history(
+def get_chat_history(
         space_id: Optional[int] = Query(None, description="Фильтр по пространству"),
         limit: int = Query(50, ge=1, le=100),
         offset: int = Query(0, ge=0),
@@ -1135,26 +1453,24 @@ async def get_chat_history(
 
         total = query.count()
 
-        chats = query.order_by(desc(Chat.updated_at)).offset(offset).limit(limit).all()
-
-        chat_items = []
-        for chat in chats:
-            # Получаем последнее сообщение
-            last_message = db.query(Message).filter(
-                Message.chat_id == chat.id
-            ).order_by(desc(Message.created_at)).first()
+        # Превью последнего сообщения хранится в chats — один запрос на страницу списка
+        rows = query.outerjoin(Space, Space.id == Chat.space_id).add_columns(Space.name).order_by(
+            desc(Chat.updated_at)
+        ).offset(offset).limit(limit).all()
 
-            chat_items.append(ChatHistoryItem(
+        chat_items = [
+            ChatHistoryItem(
                 id=chat.id,
                 title=chat.title,
                 space_id=chat.space_id,
-                space_name=chat.space.name if chat.space else "",
-                last_message=last_message.content[:100] + "..." if last_message and len(
-                    last_message.content) > 100 else last_message.content if last_message else None,
-                last_message_at=last_message.created_at.isoformat() if last_message else None,
+                space_name=space_name or "",
+                last_message=chat.last_message_preview,
+                last_message_at=chat.last_message_at.isoformat() if chat.last_message_at else None,
                 created_at=chat.created_at.isoformat(),
                 updated_at=chat.updated_at.isoformat()
-            ))
+            )
+            for chat, space_name in rows
+        ]
 
         return ChatHistoryResponse(chats=chat_items, total=total)
     except Exception as e:
@@ -1163,7 +1479,7 @@ async def get_chat_history(
 
 
 @router.get("/chat/{chat_id}/messages", response_model=ChatMessagesResponse)
-async def get_chat_messages(
+def get_chat_messages(
         chat_id: int,
         limit: int = Query(100, ge=1, le=500),
         offset: int = Query(0, ge=0),
@@ -1225,7 +1541,7 @@ async def get_chat_context(
         raise HTTPException(status_code=404, detail="Чат не найден")
 
     # Получаем историю для контекста
-    conversation_history = get_conversation_history(chat_id, db, max_messages=15)
+    conversation_history = get_conversation_history(chat_id, db)
     space_context_preview = build_space_context_prompt_block(db, chat.space_id, limit=30)
 
     return {
@@ -1236,10 +1552,8 @@ async def get_chat_context(
         "space_context_included": bool(space_context_preview),
         "context_messages": [
             {
-                "role": m["role"],
-                "content_preview": (m["content"][:100] + "...")
-                if len(m.get("content", "")) > 100
-                else m.get("content", ""),
+                "role": m.role,
+                "content_preview": m.content[:100] + "..." if len(m.content) > 100 else m.content,
             }
             for m in conversation_history
         ],
@@ -1393,18 +1707,13 @@ async def update_chat(
         db.commit()
         db.refresh(chat)
 
-    # Получаем последнее сообщение для ответа
-    last_message = db.query(Message).filter(
-        Message.chat_id == chat.id
-    ).order_by(desc(Message.created_at)).first()
-
     return ChatHistoryItem(
         id=chat.id,
         title=chat.title,
         space_id=chat.space_id,
         space_name=chat.space.name if chat.space else "",
-        last_message=last_message.content[:100] if last_message else None,
-        last_message_at=last_message.created_at.isoformat() if last_message else None,
+        last_message=chat.last_message_preview,
+        last_message_at=chat.last_message_at.isoformat() if chat.last_message_at else None,
         created_at=chat.created_at.isoformat(),
         updated_at=chat.updated_at.isoformat()
     )
@@ -1576,7 +1885,8 @@ class TranscribeResponse(BaseModel):
 @router.post("/chat/transcribe", response_model=TranscribeResponse)
 async def transcribe_audio(
     audio: UploadFile = File(...),
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_user),
+    llm_service: "LLMService" = Depends(get_llm_service),
 ):
     """Транскрибация аудио в текст через Whisper API"""
     try:
@@ -1639,7 +1949,7 @@ async def transcribe_audio(
         text = None
         error_message = None
         try:
-            text = llm_service.transcribe_audio(audio_bytes, filename, language)
+            text = await run_in_threadpool(llm_service.transcribe_audio, audio_bytes, filename, language)
             if text:
                 print(f"✅ Транскрибация завершена, распознано: '{text}'")
             else:
@@ -1701,7 +2011,8 @@ async def upload_file(
     chat_id: Optional[int] = Query(None),
     space_id: Optional[int] = Query(None),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    llm_service: "LLMService" = Depends(get_llm_service),
 ):
     """
     Загрузка файла (PDF, DOC/DOCX, изображения) с анализом содержимого
@@ -1771,16 +2082,31 @@ async def upload_file(
         file_type = file_ext[1:] if file_ext else "unknown"
         
         try:
-            file_analysis = FileAnalysisService.analyze_file(
-                file_bytes=file_bytes,
-                filename=file.filename or unique_filename,
-                mime_type=mime_type,
-                llm_service=llm_service
-            )
-            
-            extracted_text = file_analysis.get("extracted_text")
-            analysis_result = file_analysis.get("analysis_result")
-            file_type = file_analysis.get("file_type", file_type)
+            if FileAnalysisService.is_image(mime_type):
+                # Подготовка изображения (PIL) — в threadpool, vision-запрос — async-клиентом.
+                # Слот очереди LLM занимается только на время vision-запроса
+                image_base64, image_mime_type = await run_in_threadpool(
+                    FileAnalysisService.prepare_image,
+                    file_bytes,
+                    file.filename or unique_filename,
+                    mime_type,
+                )
+                async with llm_scheduler.slot(f"user:{current_user.id}", PRIORITY_BACKGROUND):
+                    analysis_result = await llm_service.analyze_image_async(
+                        image_base64, IMAGE_ANALYSIS_PROMPT, image_mime_type
+                    )
+                file_type = "image"
+            else:
+                # Извлечение текста из PDF/DOC(X) не обращается к LLM и очередь не занимает
+                file_analysis = await run_in_threadpool(
+                    FileAnalysisService.analyze_file,
+                    file_bytes=file_bytes,
+                    filename=file.filename or unique_filename,
+                    mime_type=mime_type,
+                )
+                extracted_text = file_analysis.get("extracted_text")
+                analysis_result = file_analysis.get("analysis_result")
+                file_type = file_analysis.get("file_type", file_type)
             
             if extracted_text:
                 print(f"✅ Извлечен текст из {file.filename}: {len(extracted_text)} символов")
@@ -1794,6 +2120,10 @@ async def upload_file(
             if analysis_result:
                 print(f"✅ Результат анализа изображения {file.filename}: {len(analysis_result)} символов")
                 
+        except LLMQueueFullError as e:
+            # Без анализа файл бесполезен для контекста — не сохраняем его молча, а просим повторить
+            saved_file_path.unlink(missing_ok=True)
+            raise llm_busy_http_error(e)
         except Exception as e:
             print(f"⚠️ Ошибка анализа файла: {e}")
             import traceback
@@ -0,0 +1,75 @@
+"""
+Метрики процесса в формате Prometheus: GET /api/metrics.
+
+Телеметрия вызовов LLM (llm_telemetry) плюс текущие счётчики компонентов (их
+stats()): очередь LLM, single-flight, хеджирование, здоровье endpoint'ов, уровни
+моделей, кэши, фоновые summary. Сервисы, которые ещё не созданы, пропускаются —
+сбор метрик не должен их инициализировать.
+
+Если задан METRICS_TOKEN, нужен заголовок Authorization: Bearer <METRICS_TOKEN>.
+"""
+
+import os
+import secrets
+from typing import List, Optional
+
+from fastapi import APIRouter, Header, HTTPException, status
+from fastapi.responses import PlainTextResponse
+
+from backend.app.services.chat_summary_service import chat_summarizer
+from backend.app.services.llm_scheduler import llm_scheduler
+from backend.app.services.llm_telemetry import llm_telemetry, render_stats_gauges
+from backend.app.services.service_registry import services
+from backend.app.utils.history_sanitizer import sanitized_history
+
+router = APIRouter()
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def collect_component_metrics() -> List[str]:
+    lines: List[str] = []
+    lines += render_stats_gauges("app_llm_scheduler", [({}, llm_scheduler.stats())])
+    lines += render_stats_gauges("app_chat_summary", [({}, chat_summarizer.stats())])
+    lines += render_stats_gauges("app_history_sanitizer", [({}, sanitized_history.stats())])
+
+    if services.is_initialized("cache_service"):
+        lines += render_stats_gauges("app_response_cache", [({}, services.cache_service.stats())])
+    if services.is_initialized("semantic_cache"):
+        lines += render_stats_gauges("app_semantic_cache", [({}, services.semantic_cache.stats())])
+
+    if services.is_initialized("llm_service"):
+        llm_service = services.llm_service
+        lines += render_stats_gauges("app_llm_single_flight", [({}, llm_service.single_flight.stats())])
+        lines += render_stats_gauges("app_llm_hedge", [({}, llm_service.hedger.stats())])
+        lines += render_stats_gauges("app_llm_model_catalog", [({}, llm_service.model_catalog.stats())])
+
+        router_stats = llm_service.llm_router.stats()
+        lines += render_stats_gauges("app_llm_router", [({}, {
+            'failovers': router_stats['failovers'],
+            'unavailable': router_stats['unavailable'],
+        })])
+        lines += render_stats_gauges("app_llm_endpoint", [
+            ({'endpoint': endpoint['name'], 'model': endpoint['model']}, {
+                'circuit_open': endpoint['state'] == 'open',
+                **{key: value for key, value in endpoint.items() if key not in ('name', 'model', 'state')},
+            })
+            for endpoint in router_stats['endpoints']
+        ])
+        lines += render_stats_gauges("app_llm_tier", [
+            ({'tier': name}, tier.stats()) for name, tier in llm_service.llm_tiers.items()
+        ])
+    return lines
+
+
+@router.get("", response_class=PlainTextResponse)
+async def metrics(authorization: Optional[str] = Header(None)):
+    """Метрики в формате Prometheus (text exposition 0.0.4)"""
+    token = os.getenv("METRICS_TOKEN")
+    if token:
+        provided = (authorization or "").removeprefix("Bearer ").strip()
+        if not secrets.compare_digest(provided, token):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Неверный токен метрик")
+
+    body = llm_telemetry.render() + "\n".join(collect_component_metrics()) + "\n"
+    return PlainTextResponse(body, media_type=PROMETHEUS_CONTENT_TYPE)
@@ -1,7 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple, AsyncIterator
 from sqlalchemy import desc, or_, and_
 from datetime import datetime, timezone
 import re
@@ -14,22 +16,21 @@ from backend.app.models.note import Note
 from backend.app.models.tag import Tag
 from backend.app.models.user import User
 from backend.app.models.file_attachment import FileAttachment
-from backend.app.routes.chat_routes import _assistant_reply_pipeline
+from backend.app.routes.chat_routes import _assistant_reply_pipeline, llm_busy_http_error
+from backend.app.services.llm_scheduler import llm_scheduler, LLMQueueFullError, PRIORITY_PUBLIC
 from backend.app.utils.message_display import format_message_content_for_display
+from backend.app.utils.sse import format_sse_event, SSE_RESPONSE_HEADERS
 from backend.app.routes.spaces_routes import SpaceFileAttachmentItem, SpaceFilesListResponse
-from backend.ml.services.classifier_service import BusinessClassifierService
-from backend.app.services.llm_service import LLMService
-from backend.app.services.cache_service import CacheService
-from backend.app.services.formatting_service import FormattingService
+from backend.app.services.cache_service import build_cache_scope
+from backend.app.services.service_registry import services
 from backend.app.services.space_context_service import build_space_context_prompt_block
+from backend.app.services.history_service import load_conversation_history, HistoryMessage, HISTORY_MAX_TOKENS
+from backend.app.services.chat_summary_service import chat_summarizer
+from backend.app.services.llm_telemetry import bind_context
 
 router = APIRouter()
 
-# Инициализация сервисов
-classifier_service = BusinessClassifierService()
-llm_service = LLMService()
-cache_service = CacheService()
-formatting_service = FormattingService()
+# Сервисы общие с chat_routes (один LLMService и кэш на процесс), см. service_registry
 
 CATEGORY_PROMPTS = {
     'marketing': "Ты — эксперт по маркетингу и продвижению бизнеса. Отвечай кратко, практично и с фокусом на измеримые результаты.",
@@ -43,7 +44,7 @@ CATEGORY_PROMPTS = {
 
 def get_enhanced_system_prompt(user_question: str):
     """Получение усиленного промпта на основе категории"""
-    category, probabilities = classifier_service.predict_category(user_question)
+    category, probabilities = services.public_classifier.predict_category(user_question)
     confidence = probabilities.get(category, 0)
 
     print(f"🎯 Категория вопроса: {category} (уверенность: {confidence:.1%})")
@@ -57,21 +58,18 @@ def get_enhanced_system_prompt(user_question: str):
     return enhanced_prompt, category, probabilities
 
 
-def get_conversation_history(chat_id: int, db: Session, max_messages: int = 10) -> List[Dict[str, str]]:
-    """Получить историю сообщений для контекста LLM"""
-    messages = db.query(Message).filter(
-        Message.chat_id == chat_id
-    ).order_by(Message.created_at.desc()).limit(max_messages).all()
-
-    # Преобразуем в формат для LLM
-    history = []
-    for msg in reversed(messages):
-        history.append({
-            "role": msg.role,
-            "content": msg.content
-        })
-    
-    return history
+def get_conversation_history(
+    chat_id: int,
+    db: Session,
+    max_tokens: int = HISTORY_MAX_TOKENS,
+    exclude_current_turn: bool = False,
+    after_message_id: Optional[int] = None,
+) -> List[HistoryMessage]:
+    """Получить историю сообщений для контекста LLM (окно по токенам выбирается в SQL)"""
+    return load_conversation_history(
+        db, chat_id, max_tokens=max_tokens, include_attachments=False,
+        exclude_current_turn=exclude_current_turn, after_message_id=after_message_id,
+    )
 
 
 # Pydantic модели
@@ -165,7 +163,7 @@ def get_public_space(public_token: str, db: Session) -> Space:
 
 
 @router.get("/spaces/{public_token}", response_model=PublicSpaceResponse)
-async def get_public_space_info(
+def get_public_space_info(
     public_token: str,
     db: Session = Depends(get_db)
 ):
@@ -202,7 +200,7 @@ async def get_public_space_info(
 
 
 @router.get("/spaces/{public_token}/chats", response_model=PublicChatsResponse)
-async def get_public_space_chats(
+def get_public_space_chats(
     public_token: str,
     limit: int = Query(50, ge=1, le=100),
     offset: int = Query(0, ge=0),
@@ -216,22 +214,23 @@ async def get_public_space_chats(
     
     chats = query.order_by(desc(Chat.updated_at)).offset(offset).limit(limit).all()
     
-    chat_items = []
-    for chat in chats:
-        messages_count = db.query(Message).filter(Message.chat_id == chat.id).count()
-        chat_items.append(PublicChatItem(
+    # Число сообщений хранится в chats (message_count), без запроса на каждый чат
+    chat_items = [
+        PublicChatItem(
             id=chat.id,
             title=chat.title,
             created_at=chat.created_at.isoformat(),
             updated_at=chat.updated_at.isoformat(),
-            messages_count=messages_count
-        ))
+            messages_count=chat.message_count or 0
+        )
+        for chat in chats
+    ]
     
     return PublicChatsResponse(chats=chat_items, total=total)
 
 
 @router.get("/spaces/{public_token}/chats/{chat_id}/messages", response_model=PublicMessagesResponse)
-async def get_public_chat_messages(
+def get_public_chat_messages(
     public_token: str,
     chat_id: int,
     limit: int = Query(100, ge=1, le=200),
@@ -275,6 +274,189 @@ async def get_public_chat_messages(
     )
 
 
+def _save_public_user_turn(
+    public_token: str,
+    request: PublicChatSendRequest,
+    db: Session,
+) -> Tuple[Space, Chat, str]:
+    """Проверяет доступ к публичному чату и сохраняет сообщение пользователя."""
+    user_message = request.message.strip()
+
+    if not user_message:
+        raise HTTPException(status_code=400, detail="Сообщение не может быть пустым")
+
+    space = get_public_space(public_token, db)
+
+    # Определяем чат
+    if not request.chat_id:
+        # Публичные пользователи могут пользоваться существующими чатами,
+        # но не создавать новые.
+        raise HTTPException(
+            status_code=403,
+            detail="Создание нового чата в публичном пространстве запрещено. Выберите существующий чат."
+        )
+
+    chat = db.query(Chat).filter(
+        Chat.id == request.chat_id,
+        Chat.space_id == space.id
+    ).first()
+    if not chat:
+        raise HTTPException(status_code=404, detail="Чат не найден")
+
+    # Сохраняем сообщение пользователя
+    user_msg = Message(
+        chat_id=chat.id,
+        role="user",
+        content=user_message
+    )
+    db.add(user_msg)
+    db.commit()
+    db.refresh(user_msg)
+
+    return space, chat, user_message
+
+
+def _public_quick_reply(
+    db: Session,
+    chat: Chat,
+    user_message: str,
+) -> Optional[PublicChatSendResponse]:
+    """Быстрый ответ без обращения к LLM или None."""
+    quick_response = services.llm_service.get_quick_response(user_message)
+    if quick_response:
+        assistant_msg = Message(
+            chat_id=chat.id,
+            role="assistant",
+            content=quick_response
+        )
+        db.add(assistant_msg)
+        db.commit()
+        db.refresh(assistant_msg)
+
+        return PublicChatSendResponse(
+            success=True,
+            chat_id=chat.id,
+            message_id=assistant_msg.id,
+            response={
+                'raw_text': quick_response,
+                'formatted_html': f'<p class="response-text">{quick_response}</p>',
+                'timestamp': datetime.now().isoformat(),
+                'category': 'quick_response'
+            }
+        )
+
+    return None
+
+
+def _load_public_llm_context(
+    db: Session,
+    space: Space,
+    chat: Chat,
+    user_message: str,
+) -> Tuple[List[HistoryMessage], Optional[str], str, str, Dict, str]:
+    """
+    Контекст запроса к LLM в публичном чате.
+
+    Returns:
+        (conversation_history, space_context_block, enhanced_prompt, category, probabilities, cache_scope)
+    """
+    # Получаем ВСЮ историю сообщений для контекста
+    conversation_history = get_conversation_history(
+        chat.id, db, exclude_current_turn=True,
+        after_message_id=chat.summary_message_id if chat.summary else None,
+    )
+    space_context_block = build_space_context_prompt_block(db, space.id, limit=30)
+
+    print(f"📚 Используем историю из {len(conversation_history)} сообщений для контекста")
+
+    # Получаем усиленный промпт
+    enhanced_prompt, category, probabilities = get_enhanced_system_prompt(user_message)
+
+    cache_scope = build_cache_scope(category, conversation_history, space_context_block, conversation_summary=chat.summary)
+    return conversation_history, space_context_block, enhanced_prompt, category, probabilities, cache_scope
+
+
+def _public_cached_reply(
+    db: Session,
+    chat: Chat,
+    user_message: str,
+    cache_scope: str,
+    category: str,
+) -> Optional[PublicChatSendResponse]:
+    """Ответ из кэша (с учётом истории и контекста пространства) или None."""
+    cached_response = services.semantic_cache.get_cached_response(services.cache_service, user_message, cache_scope, category)
+    if cached_response:
+        print(f"✅ Используем кэшированный ответ ({cache_scope.split(':', 1)[0]}) для: {user_message[:50]}...")
+        assistant_content = cached_response.get('raw_text', '')
+
+        assistant_msg = Message(
+            chat_id=chat.id,
+            role="assistant",
+            content=assistant_content
+        )
+        db.add(assistant_msg)
+        db.commit()
+        db.refresh(assistant_msg)
+
+        return PublicChatSendResponse(
+            success=True,
+            chat_id=chat.id,
+            message_id=assistant_msg.id,
+            response=cached_response
+        )
+
+    return None
+
+
+def _save_public_llm_reply(
+    db: Session,
+    chat: Chat,
+    user_message: str,
+    ai_response: str,
+    category: str,
+    probabilities: Dict,
+    conversation_history: List[HistoryMessage],
+    cache_scope: str,
+) -> PublicChatSendResponse:
+    """Форматирование и сохранение ответа LLM в публичном чате."""
+    # Форматируем ответ
+    formatted_response = services.formatting_service.format_response(ai_response)
+
+    # Сохраняем ответ ассистента
+    assistant_msg = Message(
+        chat_id=chat.id,
+        role="assistant",
+        content=ai_response
+    )
+    db.add(assistant_msg)
+    chat.updated_at = datetime.now(timezone.utc)
+    db.commit()
+    db.refresh(assistant_msg)
+
+    # Подготавливаем данные для ответа
+    response_data = {
+        'raw_text': ai_response,
+        'formatted_html': formatted_response,
+        'timestamp': datetime.now().isoformat(),
+        'category': category,
+        'probabilities': probabilities,
+        'history_count': len(conversation_history) + 1
+    }
+
+    # Сохраняем в кэш
+    services.cache_service.set(user_message, response_data, scope=cache_scope)
+    services.semantic_cache.add(user_message, cache_scope, category)
+
+    print(f"✅ Успешно обработан публичный запрос. История: {len(conversation_history) + 1} сообщений")
+
+    return PublicChatSendResponse(
+        success=True,
+        chat_id=chat.id,
+        message_id=assistant_msg.id,
+        response=response_data
+    )
+
+
 @router.post("/spaces/{public_token}/chat/send", response_model=PublicChatSendResponse)
 async def send_public_message(
     public_token: str,
@@ -283,104 +465,41 @@ async def send_public_message(
 ):
     """Отправка сообщения в чат публичного пространства (без авторизации)"""
     try:
-        user_message = request.message.strip()
-        
-        if not user_message:
-            raise HTTPException(status_code=400, detail="Сообщение не может быть пустым")
-        
-        space = get_public_space(public_token, db)
-        
-        # Определяем чат
-        if not request.chat_id:
-            # Публичные пользователи могут пользоваться существующими чатами,
-            # но не создавать новые.
-            raise HTTPException(
-                status_code=403,
-                detail="Создание нового чата в публичном пространстве запрещено. Выберите существующий чат."
-            )
-        
-        chat = db.query(Chat).filter(
-            Chat.id == request.chat_id,
-            Chat.space_id == space.id
-        ).first()
-        if not chat:
-            raise HTTPException(status_code=404, detail="Чат не найден")
-        
-        # Сохраняем сообщение пользователя
-        user_msg = Message(
-            chat_id=chat.id,
-            role="user",
-            content=user_message
-        )
-        db.add(user_msg)
-        db.commit()
-        db.refresh(user_msg)
-        
-        # Проверяем быстрые ответы
-        quick_response = llm_service.get_quick_response(user_message)
-        if quick_response:
-            assistant_msg = Message(
-                chat_id=chat.id,
-                role="assistant",
-                content=quick_response
-            )
-            db.add(assistant_msg)
-            db.commit()
-            db.refresh(assistant_msg)
-            
-            return PublicChatSendResponse(
-                success=True,
-                chat_id=chat.id,
-                message_id=assistant_msg.id,
-                response={
-                    'raw_text': quick_response,
-                    'formatted_html': f'<p class="response-text">{quick_response}</p>',
-                    'timestamp': datetime.now().isoformat(),
-                    'category': 'quick_response'
-                }
-            )
-        
-        # Проверяем кэш
-        cached_response = cache_service.get(user_message)
-        if cached_response:
-            print(f"✅ Используем кэшированный ответ для: {user_message[:50]}...")
-            assistant_content = cached_response.get('raw_text', '')
-            
-            assistant_msg = Message(
-                chat_id=chat.id,
-                role="assistant",
-                content=assistant_content
-            )
-            db.add(assistant_msg)
-            db.commit()
-            db.refresh(assistant_msg)
-            
-            return PublicChatSendResponse(
-                success=True,
-                chat_id=chat.id,
-                message_id=assistant_msg.id,
-                response=cached_response
-            )
-        
-        print(f"📨 Публичное сообщение в пространстве {space.id}, чат {chat.id}: {user_message}")
-        
-        # Получаем ВСЮ историю сообщений для контекста
-        conversation_history = get_conversation_history(chat.id, db, max_messages=15)
-        space_context_block = build_space_context_prompt_block(db, space.id, limit=30)
+        # Запросы к БД (sync-сессия) и кэшу — в пуле потоков, чтобы не блокировать event loop
+        space, chat, user_message = await run_in_threadpool(_save_public_user_turn, public_token, request, db)
+        bind_context(space_id=space.id, chat_id=chat.id, tenant="public")
+
+        ready_response = await run_in_threadpool(_public_quick_reply, db, chat, user_message)
+        if ready_response is not None:
+            return ready_response
 
-        print(f"📚 Используем историю из {len(conversation_history)} сообщений для контекста")
+        (
+            conversation_history, space_context_block,
+            enhanced_prompt, category, probabilities, cache_scope,
+        ) = await run_in_threadpool(_load_public_llm_context, db, space, chat, user_message)
 
-        # Получаем усиленный промпт
-        enhanced_prompt, category, probabilities = get_enhanced_system_prompt(user_message)
+        ready_response = await run_in_threadpool(_public_cached_reply, db, chat, user_message, cache_scope, category)
+        if ready_response is not None:
+            return ready_response
+
+        print(f"📨 Публичное сообщение в пространстве {space.id}, чат {chat.id}: {user_message}")
 
         # Генерируем ответ с учетом всей истории чата и контекста пространства
         try:
-            ai_response = llm_service.generate_response(
+            ai_response = await services.llm_service.generate_response_async(
                 system_prompt=enhanced_prompt,
                 user_question=user_message,
                 conversation_history=conversation_history,
                 space_context=space_context_block,
+                conversation_summary=chat.summary,
+                tenant=f"public:{public_token}",
+                priority=PRIORITY_PUBLIC,
+                category=category,
+                confidence=probabilities.get(category),
             )
+        except LLMQueueFullError as e:
+            print(f"⏳ Очередь к LLM переполнена (публичное пространство {space.id}): {e}")
+            raise llm_busy_http_error(e)
         except ValueError as e:
             error_msg = str(e)
             print(f"❌ Ошибка генерации ответа: {error_msg}")
@@ -401,43 +520,15 @@ async def send_public_message(
                 message_id=0,
                 error="Не удалось получить ответ от AI. Попробуйте ещё раз."
             )
-        
-        # Форматируем ответ
-        formatted_response = formatting_service.format_response(ai_response)
-        
-        # Сохраняем ответ ассистента
-        assistant_msg = Message(
-            chat_id=chat.id,
-            role="assistant",
-            content=ai_response
-        )
-        db.add(assistant_msg)
-        chat.updated_at = datetime.now(timezone.utc)
-        db.commit()
-        db.refresh(assistant_msg)
-        
-        # Подготавливаем данные для ответа
-        response_data = {
-            'raw_text': ai_response,
-            'formatted_html': formatted_response,
-            'timestamp': datetime.now().isoformat(),
-            'category': category,
-            'probabilities': probabilities,
-            'history_count': len(conversation_history) + 1
-        }
-        
-        # Сохраняем в кэш
-        cache_service.set(user_message, response_data)
-        
-        print(f"✅ Успешно обработан публичный запрос. История: {len(conversation_history) + 1} сообщений")
-        
-        return PublicChatSendResponse(
-            success=True,
-            chat_id=chat.id,
-            message_id=assistant_msg.id,
-            response=response_data
+
+        result = await run_in_threadpool(
+            _save_public_llm_reply,
+            db, chat, user_message, ai_response, category, probabilities, conversation_history, cache_scope,
         )
-        
+        # Краткое содержание длинного чата обновляется в фоне, ответ не ждёт
+        chat_summarizer.schedule(chat.id, services.llm_service)
+        return result
+
     except HTTPException:
         raise
     except Exception as e:
@@ -452,6 +543,92 @@ async def send_public_message(
         )
 
 
+async def _public_reply_stream(
+    db: Session,
+    space: Space,
+    chat: Chat,
+    user_message: str,
+) -> AsyncIterator[str]:
+    """SSE-поток ответа в публичном чате (события token / done / error, как в /chat/send/stream)."""
+    bind_context(space_id=space.id, chat_id=chat.id, tenant="public")
+    ready_response = await run_in_threadpool(_public_quick_reply, db, chat, user_message)
+    if ready_response is None:
+        (
+            conversation_history, space_context_block,
+            enhanced_prompt, category, probabilities, cache_scope,
+        ) = await run_in_threadpool(_load_public_llm_context, db, space, chat, user_message)
+        ready_response = await run_in_threadpool(_public_cached_reply, db, chat, user_message, cache_scope, category)
+    if ready_response is not None:
+        yield format_sse_event("done", ready_response.model_dump())
+        return
+
+    print(f"📨 Публичное потоковое сообщение в пространстве {space.id}, чат {chat.id}: {user_message}")
+
+    chunks: List[str] = []
+    try:
+        async for delta in services.llm_service.stream_response_async(
+            system_prompt=enhanced_prompt,
+            user_question=user_message,
+            conversation_history=conversation_history,
+            space_context=space_context_block,
+            conversation_summary=chat.summary,
+            tenant=f"public:{space.public_token}",
+            priority=PRIORITY_PUBLIC,
+            category=category,
+            confidence=probabilities.get(category),
+        ):
+            chunks.append(delta)
+            yield format_sse_event("token", {"text": delta})
+    except (ValueError, LLMQueueFullError) as e:
+        print(f"❌ Ошибка потоковой генерации ответа: {e}")
+        yield format_sse_event("error", PublicChatSendResponse(
+            success=False,
+            chat_id=chat.id,
+            message_id=0,
+            error=str(e)
+        ).model_dump())
+        return
+    except Exception as e:
+        print(f"❌ Неожиданная ошибка LLM (stream): {e}")
+        import traceback
+        traceback.print_exc()
+        yield format_sse_event("error", PublicChatSendResponse(
+            success=False,
+            chat_id=chat.id,
+            message_id=0,
+            error="Не удалось получить ответ от AI. Попробуйте ещё раз."
+        ).model_dump())
+        return
+
+    result = await run_in_threadpool(
+        _save_public_llm_reply,
+        db, chat, user_message, "".join(chunks), category, probabilities, conversation_history, cache_scope,
+    )
+    chat_summarizer.schedule(chat.id, services.llm_service)
+    yield format_sse_event("done", result.model_dump())
+
+
+@router.post("/spaces/{public_token}/chat/send/stream")
+async def send_public_message_stream(
+    public_token: str,
+    request: PublicChatSendRequest,
+    db: Session = Depends(get_db)
+):
+    """Потоковая отправка сообщения в публичный чат (text/event-stream)"""
+    try:
+        llm_scheduler.check_capacity(f"public:{public_token}")
+    except LLMQueueFullError as e:
+        raise llm_busy_http_error(e)
+
+    space, chat, user_message = await run_in_threadpool(_save_public_user_turn, public_token, request, db)
+
+    return StreamingResponse(
+        _public_reply_stream(db, space, chat, user_message),
+        media_type="text/event-stream",
+        headers=SSE_RESPONSE_HEADERS,
+    )
+
+
 @router.patch(
     "/spaces/{public_token}/chats/{chat_id}/messages/{message_id}/regenerate",
     response_model=PublicChatSendResponse,
@@ -581,6 +758,9 @@ async def public_edit_user_message_and_regenerate(
         user_message,
         user_message_with_file,
         file_content_context,
+        attachment_ids=[file_attachment.id for file_attachment in final_attachments],
+        llm_tenant=f"public:{public_token}",
+        llm_priority=PRIORITY_PUBLIC,
     )
 
     return PublicChatSendResponse(
@@ -593,7 +773,7 @@ async def public_edit_user_message_and_regenerate(
 
 
 @router.get("/spaces/{public_token}/notes", response_model=PublicNotesResponse)
-async def get_public_space_notes(
+def get_public_space_notes(
     public_token: str,
     limit: int = Query(50, ge=1, le=100),
     offset: int = Query(0, ge=0),
@@ -622,7 +802,7 @@ async def get_public_space_notes(
 
 
 @router.get("/spaces/{public_token}/tags", response_model=PublicTagsResponse)
-async def get_public_space_tags(
+def get_public_space_tags(
     public_token: str,
     db: Session = Depends(get_db)
 ):
@@ -665,7 +845,7 @@ def _public_space_files_query(db: Session, space: Space):
 
 
 @router.get("/spaces/{public_token}/files", response_model=SpaceFilesListResponse)
-async def get_public_space_files(
+def get_public_space_files(
     public_token: str,
     limit: int = Query(50, ge=1, le=200),
     offset: int = Query(0, ge=0),
@@ -1,7 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
-from sqlalchemy import or_, and_, func
 from typing import Optional, List, Literal
 from datetime import datetime
 
@@ -9,9 +8,11 @@ from backend.app.database.connection import get_db
 from backend.app.dependencies import get_current_user
 from backend.app.models.user import User
 from backend.app.models.space import Space
-from backend.app.models.chat import Chat
-from backend.app.models.message import Message
-from backend.app.models.note import Note
+from backend.app.services.search_service import (
+    search_chats,
+    search_messages,
+    search_notes,
+)
 
 router = APIRouter()
 
@@ -71,58 +72,10 @@ class SearchResults(BaseModel):
         from_attributes = True
 
 
-# ========== Вспомогательные функции ==========
-
-def highlight_match(text: str, query: str, max_length: int = 200) -> Optional[str]:
-    """Выделяет совпадение в тексте и возвращает фрагмент"""
-    if not text or not query:
-        return None
-    
-    text_lower = text.lower()
-    query_lower = query.lower()
-    
-    # Ищем первое вхождение
-    index = text_lower.find(query_lower)
-    if index == -1:
-        return None
-    
-    # Вычисляем начало и конец фрагмента (с учетом max_length)
-    context_size = min(50, (max_length - len(query)) // 2)
-    start = max(0, index - context_size)
-    end = min(len(text), index + len(query) + context_size)
-    
-    # Ограничиваем длину фрагмента
-    if end - start > max_length:
-        if index - start < max_length // 2:
-            start = 0
-            end = max_length
-        else:
-            end = start + max_length
-    
-    snippet = text[start:end]
-    
-    # Выделяем совпадение
-    snippet_lower = snippet.lower()
-    match_index = snippet_lower.find(query_lower)
-    if match_index != -1:
-        before = snippet[:match_index]
-        match = snippet[match_index:match_index + len(query)]
-        after = snippet[match_index + len(query):]
-        snippet = f"{before}<mark>{match}</mark>{after}"
-    
-    # Добавляем многоточие если нужно
-    if start > 0:
-        snippet = "..." + snippet
-    if end < len(text):
-        snippet = snippet + "..."
-    
-    return snippet
-
-
 # ========== Эндпоинт поиска ==========
 
 @router.get("", response_model=SearchResults)
-async def search(
+def search(
     q: str = Query(..., description="Поисковый запрос", min_length=1),
     type: Optional[Literal["all", "chats", "notes", "messages"]] = Query("all", description="Тип поиска"),
     space_id: Optional[int] = Query(None, description="Фильтр по пространству"),
@@ -137,6 +90,9 @@ async def search(
     - **type**: Тип поиска (all, chats, notes, messages)
     - **space_id**: Фильтр по пространству (опционально)
     - **limit**: Количество результатов на каждый тип
+    
+    В PostgreSQL результаты упорядочены по релевантности (полнотекстовый поиск),
+    в остальных СУБД — по дате (поиск по подстроке)
     """
     if not q or not q.strip():
         raise HTTPException(
@@ -145,7 +101,6 @@ async def search(
         )
     
     query = q.strip()
-    search_pattern = f"%{query}%"
     
     results = {
         "chats": [],
@@ -156,9 +111,8 @@ async def search(
     total = 0
     
     # Проверяем доступ к пространству, если указано
-    space = None
     if space_id:
-        space = db.query(Space).filter(
+        space = db.query(Space.id).filter(
             Space.id == space_id,
             Space.user_id == current_user.id
         ).first()
@@ -170,27 +124,12 @@ async def search(
     
     # ========== Поиск по чатам ==========
     if type in ["all", "chats"]:
-        chat_query = db.query(Chat).join(Space).filter(
-            Chat.user_id == current_user.id,
-            or_(
-                Chat.title.ilike(search_pattern)
-            )
-        )
-        
-        if space_id:
-            chat_query = chat_query.filter(Chat.space_id == space_id)
-        
-        chats = chat_query.order_by(Chat.updated_at.desc()).limit(limit).all()
-        
-        for chat in chats:
-            space = db.query(Space).filter(Space.id == chat.space_id).first()
-            snippet = highlight_match(chat.title or "", query) if chat.title else None
-            
+        for chat, space_name, snippet in search_chats(db, current_user.id, query, space_id, limit):
             results["chats"].append(SearchChatItem(
                 id=chat.id,
                 title=chat.title,
                 space_id=chat.space_id,
-                space_name=space.name if space else "",
+                space_name=space_name,
                 created_at=chat.created_at.isoformat(),
                 updated_at=chat.updated_at.isoformat(),
                 snippet=snippet
@@ -200,29 +139,12 @@ async def search(
     
     # ========== Поиск по заметкам ==========
     if type in ["all", "notes"]:
-        note_query = db.query(Note).join(Space).filter(
-            Note.user_id == current_user.id,
-            or_(
-                Note.title.ilike(search_pattern),
-                Note.content.ilike(search_pattern)
-            )
-        )
-        
-        if space_id:
-            note_query = note_query.filter(Note.space_id == space_id)
-        
-        notes = note_query.order_by(Note.updated_at.desc()).limit(limit).all()
-        
-        for note in notes:
-            space = db.query(Space).filter(Space.id == note.space_id).first()
-            # Ищем совпадение в title или content
-            snippet = highlight_match(note.title, query) or highlight_match(note.content or "", query)
-            
+        for note, space_name, snippet in search_notes(db, current_user.id, query, space_id, limit):
             results["notes"].append(SearchNoteItem(
                 id=note.id,
                 title=note.title,
                 space_id=note.space_id,
-                space_name=space.name if space else "",
+                space_name=space_name,
                 created_at=note.created_at.isoformat(),
                 updated_at=note.updated_at.isoformat(),
                 snippet=snippet
@@ -232,36 +154,20 @@ async def search(
     
     # ========== Поиск по сообщениям ==========
     if type in ["all", "messages"]:
-        # Сначала находим чаты пользователя
-        user_chats_query = db.query(Chat.id).filter(Chat.user_id == current_user.id)
-        if space_id:
-            user_chats_query = user_chats_query.filter(Chat.space_id == space_id)
-        user_chat_ids = [chat_id[0] for chat_id in user_chats_query.all()]
-        
-        if user_chat_ids:
-            message_query = db.query(Message).join(Chat).join(Space).filter(
-                Message.chat_id.in_(user_chat_ids),
-                Message.content.ilike(search_pattern)
-            )
-            
-            messages = message_query.order_by(Message.created_at.desc()).limit(limit).all()
-            
-            for msg in messages:
-                chat = db.query(Chat).filter(Chat.id == msg.chat_id).first()
-                space = db.query(Space).filter(Space.id == chat.space_id).first() if chat else None
-                snippet = highlight_match(msg.content, query)
-                
-                results["messages"].append(SearchMessageItem(
-                    id=msg.id,
-                    chat_id=msg.chat_id,
-                    chat_title=chat.title if chat else None,
-                    space_id=chat.space_id if chat else 0,
-                    space_name=space.name if space else "",
-                    role=msg.role,
-                    content=msg.content,
-                    created_at=msg.created_at.isoformat(),
-                    snippet=snippet
-                ))
+        for msg, chat_title, chat_space_id, space_name, snippet in search_messages(
+            db, current_user.id, query, space_id, limit
+        ):
+            results["messages"].append(SearchMessageItem(
+                id=msg.id,
+                chat_id=msg.chat_id,
+                chat_title=chat_title,
+                space_id=chat_space_id,
+                space_name=space_name,
+                role=msg.role,
+                content=msg.content,
+                created_at=msg.created_at.isoformat(),
+                snippet=snippet
+            ))
         
         total += len(results["messages"])
     
@@ -1,8 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query, UploadFile, File
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, Query as SQLQuery
 from typing import Optional, List, Dict, Any
-from sqlalchemy import desc, or_, and_
+from sqlalchemy import desc, or_, and_, func, select
 import json
 import zipfile
 import io
@@ -120,10 +120,53 @@ class SpaceFileRenameRequest(BaseModel):
     filename: str
 
 
+# ========== Счётчики пространств ==========
+
+def _count_in_space(model):
+    """Число строк model в пространстве — коррелированный подзапрос по индексу space_id"""
+    return select(func.count()).select_from(model).where(
+        model.space_id == Space.id
+    ).correlate(Space).scalar_subquery()
+
+
+def with_space_counts(query: SQLQuery) -> SQLQuery:
+    """
+    Добавить к запросу Space число чатов, заметок и тегов: строки (Space, chats, notes, tags).
+    Счётчики считаются в том же запросе, а не тремя count() на каждое пространство.
+    """
+    return query.add_columns(
+        _count_in_space(Chat).label("chats_count"),
+        _count_in_space(Note).label("notes_count"),
+        _count_in_space(Tag).label("tags_count"),
+    )
+
+
+def get_space_with_counts(db: Session, space_id: int, user_id: Optional[int] = None) -> Optional[tuple]:
+    """(Space, chats, notes, tags) пространства (при user_id — только пространства этого пользователя) или None"""
+    query = db.query(Space).filter(Space.id == space_id)
+    if user_id is not None:
+        query = query.filter(Space.user_id == user_id)
+    return with_space_counts(query).first()
+
+
+def space_response(space: Space, chats_count: int = 0, notes_count: int = 0, tags_count: int = 0) -> SpaceResponse:
+    return SpaceResponse(
+        id=space.id,
+        name=space.name,
+        description=space.description,
+        is_archived=space.is_archived,
+        created_at=space.created_at.isoformat(),
+        updated_at=space.updated_at.isoformat(),
+        chats_count=chats_count,
+        notes_count=notes_count,
+        tags_count=tags_count
+    )
+
+
 # ========== Базовый CRUD для пространств ==========
 
 @router.get("", response_model=SpaceListResponse)
-async def list_spaces(
+def list_spaces(
     include_archived: bool = Query(False, description="Включить архивированные пространства"),
     limit: int = Query(50, ge=1, le=100),
     offset: int = Query(0, ge=0),
@@ -138,26 +181,9 @@ async def list_spaces(
     
     total = query.count()
     
-    spaces = query.order_by(desc(Space.updated_at)).offset(offset).limit(limit).all()
+    rows = with_space_counts(query).order_by(desc(Space.updated_at)).offset(offset).limit(limit).all()
     
-    space_items = []
-    for space in spaces:
-        # Подсчитываем количество связанных объектов
-        chats_count = db.query(Chat).filter(Chat.space_id == space.id).count()
-        notes_count = db.query(Note).filter(Note.space_id == space.id).count()
-        tags_count = db.query(Tag).filter(Tag.space_id == space.id).count()
-        
-        space_items.append(SpaceResponse(
-            id=space.id,
-            name=space.name,
-            description=space.description,
-            is_archived=space.is_archived,
-            created_at=space.created_at.isoformat(),
-            updated_at=space.updated_at.isoformat(),
-            chats_count=chats_count,
-            notes_count=notes_count,
-            tags_count=tags_count
-        ))
+    space_items = [space_response(*row) for row in rows]
     
     return SpaceListResponse(spaces=space_items, total=total)
 
@@ -205,32 +231,15 @@ async def get_space(
     db: Session = Depends(get_db)
 ):
     """Получить пространство по ID"""
-    space = db.query(Space).filter(
-        Space.id == space_id,
-        Space.user_id == current_user.id
-    ).first()
+    row = get_space_with_counts(db, space_id, current_user.id)
     
-    if not space:
+    if not row:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Пространство не найдено"
         )
     
-    chats_count = db.query(Chat).filter(Chat.space_id == space.id).count()
-    notes_count = db.query(Note).filter(Note.space_id == space.id).count()
-    tags_count = db.query(Tag).filter(Tag.space_id == space.id).count()
-    
-    return SpaceResponse(
-        id=space.id,
-        name=space.name,
-        description=space.description,
-        is_archived=space.is_archived,
-        created_at=space.created_at.isoformat(),
-        updated_at=space.updated_at.isoformat(),
-        chats_count=chats_count,
-        notes_count=notes_count,
-        tags_count=tags_count
-    )
+    return space_response(*row)
 
 
 @router.get("/{space_id}/files", response_model=SpaceFilesListResponse)
@@ -452,23 +461,9 @@ async def update_space(
         space.description = space_data.description.strip() if space_data.description else None
     
     db.commit()
-    db.refresh(space)
-    
-    chats_count = db.query(Chat).filter(Chat.space_id == space.id).count()
-    notes_count = db.query(Note).filter(Note.space_id == space.id).count()
-    tags_count = db.query(Tag).filter(Tag.space_id == space.id).count()
     
-    return SpaceResponse(
-        id=space.id,
-        name=space.name,
-        description=space.description,
-        is_archived=space.is_archived,
-        created_at=space.created_at.isoformat(),
-        updated_at=space.updated_at.isoformat(),
-        chats_count=chats_count,
-        notes_count=notes_count,
-        tags_count=tags_count
-    )
+    # Перечитываем пространство вместе со счётчиками одним запросом (владелец уже проверен)
+    return space_response(*get_space_with_counts(db, space_id))
 
 
 @router.delete("/{space_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -524,23 +519,9 @@ async def archive_space(
     
     space.is_archived = True
     db.commit()
-    db.refresh(space)
     
-    chats_count = db.query(Chat).filter(Chat.space_id == space.id).count()
-    notes_count = db.query(Note).filter(Note.space_id == space.id).count()
-    tags_count = db.query(Tag).filter(Tag.space_id == space.id).count()
-    
-    return SpaceResponse(
-        id=space.id,
-        name=space.name,
-        description=space.description,
-        is_archived=space.is_archived,
-        created_at=space.created_at.isoformat(),
-        updated_at=space.updated_at.isoformat(),
-        chats_count=chats_count,
-        notes_count=notes_count,
-        tags_count=tags_count
-    )
+    # Перечитываем пространство вместе со счётчиками одним запросом (владелец уже проверен)
+    return space_response(*get_space_with_counts(db, space_id))
 
 
 @router.post("/{space_id}/unarchive", response_model=SpaceResponse)
@@ -563,23 +544,9 @@ async def unarchive_space(
     
     space.is_archived = False
     db.commit()
-    db.refresh(space)
     
-    chats_count = db.query(Chat).filter(Chat.space_id == space.id).count()
-    notes_count = db.query(Note).filter(Note.space_id == space.id).count()
-    tags_count = db.query(Tag).filter(Tag.space_id == space.id).count()
-    
-    return SpaceResponse(
-        id=space.id,
-        name=space.name,
-        description=space.description,
-        is_archived=space.is_archived,
-        created_at=space.created_at.isoformat(),
-        updated_at=space.updated_at.isoformat(),
-        chats_count=chats_count,
-        notes_count=notes_count,
-        tags_count=tags_count
-    )
+    # Перечитываем пространство вместе со счётчиками одним запросом (владелец уже проверен)
+    return space_response(*get_space_with_counts(db, space_id))
 
 
 # ========== Настройки уведомлений ==========
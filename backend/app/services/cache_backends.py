@@ -0,0 +1,248 @@
+"""
+Второй уровень (L2) кэша ответов LLM, общий для воркеров uvicorn.
+
+In-process кэш (CacheService) у каждого процесса свой, поэтому при нескольких
+воркерах и после рестарта он холодный. L2 хранит записи вне процесса:
+- RedisCacheBackend — Redis (или совместимый сервер), для нескольких хостов
+- SQLiteCacheBackend — файл SQLite, для одного хоста
+
+Инвалидация рассылается всем процессам: Redis — через pub/sub,
+SQLite — через таблицу событий, которую процессы опрашивают.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, List, Optional, Tuple
+
+# Ключ, означающий «очистить всё»
+INVALIDATE_ALL = "*"
+
+
+def serialize_cache_entry(data: Any, expires_at: float) -> bytes:
+    """Компактная сериализация записи: JSON без пробелов + zlib"""
+    raw = json.dumps({"e": expires_at, "d": data}, ensure_ascii=False, separators=(",", ":"), default=str)
+    return zlib.compress(raw.encode("utf-8"), 6)
+
+
+def deserialize_cache_entry(blob: bytes) -> Tuple[Any, float]:
+    """Обратная операция к serialize_cache_entry: (data, expires_at)"""
+    payload = json.loads(zlib.decompress(blob).decode("utf-8"))
+    return payload["d"], float(payload["e"])
+
+
+class SharedCacheBackend:
+    """Интерфейс L2-хранилища. Значения — готовые байты (см. serialize_cache_entry)."""
+
+    name = "none"
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl_seconds: float) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def clear(self) -> None:
+        raise NotImplementedError
+
+    def publish_invalidation(self, key: str) -> None:
+        """Сообщить остальным процессам, что ключ (или INVALIDATE_ALL) устарел"""
+        raise NotImplementedError
+
+    def poll_invalidations(self) -> List[str]:
+        """Забрать накопившиеся события инвалидации (не блокирует)"""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class RedisCacheBackend(SharedCacheBackend):
+    """L2 на Redis: SET с PX (TTL) для записей, канал pub/sub для инвалидации."""
+
+    name = "redis"
+
+    def __init__(self, url: Optional[str] = None, prefix: str = "copilot:llm-cache:", client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError as e:
+                raise RuntimeError("Для RESPONSE_CACHE_L2=redis нужен пакет redis (pip install redis)") from e
+            client = redis.Redis.from_url(url or os.getenv("RESPONSE_CACHE_REDIS_URL", "redis://localhost:6379/0"))
+
+        self.client = client
+        self.prefix = prefix
+        self.channel = f"{prefix}invalidate"
+        self.pubsub = client.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(self.channel)
+        # PubSub redis-py не потокобезопасен, а кэш опрашивается из потоков threadpool
+        self._pubsub_lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(self.prefix + key)
+
+    def set(self, key: str, value: bytes, ttl_seconds: float) -> None:
+        self.client.set(self.prefix + key, value, px=max(1, int(ttl_seconds * 1000)))
+
+    def delete(self, key: str) -> None:
+        self.client.delete(self.prefix + key)
+
+    def clear(self) -> None:
+        keys = list(self.client.scan_iter(match=f"{self.prefix}*"))
+        if keys:
+            self.client.delete(*keys)
+
+    def publish_invalidation(self, key: str) -> None:
+        self.client.publish(self.channel, key)
+
+    def poll_invalidations(self) -> List[str]:
+        keys = []
+        with self._pubsub_lock:
+            while True:
+                message = self.pubsub.get_message(timeout=0)
+                if message is None:
+                    break
+                if message.get("type") != "message":
+                    continue
+                data = message.get("data")
+                keys.append(data.decode() if isinstance(data, bytes) else str(data))
+        return keys
+
+    def close(self) -> None:
+        try:
+            with self._pubsub_lock:
+                self.pubsub.close()
+        finally:
+            self.client.close()
+
+
+class SQLiteCacheBackend(SharedCacheBackend):
+    """
+    L2 в файле SQLite (WAL) для развёртывания на одном хосте.
+    Инвалидация — журнал событий в отдельной таблице, каждый процесс помнит последний прочитанный id.
+    """
+
+    name = "sqlite"
+
+    # Сколько хранить события инвалидации (процессы опрашивают журнал раз в секунду)
+    INVALIDATION_RETENTION_SECONDS = 3600
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv("RESPONSE_CACHE_SQLITE_PATH", "llm_response_cache.sqlite3")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache_invalidations ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        row = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM response_cache_invalidations").fetchone()
+        self._last_invalidation_id = row[0]
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] <= time.time():
+                self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                return None
+            return row[0]
+
+    def set(self, key: str, value: bytes, ttl_seconds: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, sqlite3.Binary(value), time.time() + ttl_seconds),
+            )
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM response_cache")
+
+    def publish_invalidation(self, key: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO response_cache_invalidations (key, created_at) VALUES (?, ?)", (key, now)
+            )
+            self._conn.execute(
+                "DELETE FROM response_cache_invalidations WHERE created_at < ?",
+                (now - self.INVALIDATION_RETENTION_SECONDS,),
+            )
+
+    def poll_invalidations(self) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, key FROM response_cache_invalidations WHERE id > ? ORDER BY id",
+                (self._last_invalidation_id,),
+            ).fetchall()
+            if rows:
+                self._last_invalidation_id = rows[-1][0]
+        return [row[1] for row in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def create_shared_cache_backend() -> Optional[SharedCacheBackend]:
+    """
+    L2 по переменной окружения RESPONSE_CACHE_L2: redis | sqlite | none (по умолчанию).
+    Если хранилище недоступно — работаем только с in-process кэшем.
+    """
+    kind = os.getenv("RESPONSE_CACHE_L2", "none").strip().lower()
+    if kind in ("", "none", "off", "false"):
+        return None
+    try:
+        if kind == "redis":
+            backend = RedisCacheBackend()
+        elif kind == "sqlite":
+            backend = SQLiteCacheBackend()
+        else:
+            print(f"⚠️ Неизвестный RESPONSE_CACHE_L2={kind}, общий кэш отключен")
+            return None
+    except Exception as e:
+        print(f"⚠️ Не удалось подключить общий кэш ответов ({kind}): {e}")
+        return None
+
+    print(f"✅ Общий кэш ответов (L2): {backend.name}")
+    return backend
+
+
+_shared_backend: Optional[SharedCacheBackend] = None
+_shared_backend_initialized = False
+
+
+def get_shared_cache_backend() -> Optional[SharedCacheBackend]:
+    """Один L2-клиент на процесс (его используют кэши chat_routes и public_routes)"""
+    global _shared_backend, _shared_backend_initialized
+    if not _shared_backend_initialized:
+        _shared_backend = create_shared_cache_backend()
+        _shared_backend_initialized = True
+    return _shared_backend
+
+
+def close_shared_cache_backend() -> None:
+    """Закрыть L2-клиент процесса (остановка приложения); следующий get_shared_cache_backend создаст новый"""
+    global _shared_backend, _shared_backend_initialized
+    backend, _shared_backend, _shared_backend_initialized = _shared_backend, None, False
+    if backend is not None:
+        backend.close()
@@ -1,41 +1,273 @@
 import hashlib
-from datetime import datetime, timedelta
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+from backend.app.services.cache_backends import (
+    INVALIDATE_ALL,
+    SharedCacheBackend,
+    deserialize_cache_entry,
+    serialize_cache_entry,
+)
+
+
+def _short_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def _role_and_content(message) -> List[Optional[str]]:
+    """Роль и текст сообщения истории (словарь или HistoryMessage)"""
+    if isinstance(message, dict):
+        return [message.get('role'), message.get('content')]
+    return [getattr(message, 'role', None), getattr(message, 'content', None)]
+
+
+def build_cache_scope(
+        category: str,
+        conversation_history: Optional[List[Any]] = None,
+        space_context: Optional[str] = None,
+        attachment_ids: Optional[Iterable[int]] = None,
+        conversation_summary: Optional[str] = None,
+) -> str:
+    """
+    Область действия закэшированного ответа (добавляется к ключу вопроса).
+
+    Ответ LLM зависит не только от текста вопроса, но и от окна истории чата,
+    контекста пространства и вложений. Поэтому в ключ входят:
+    - категория классификатора (от неё зависит системный промпт)
+    - хэш окна истории (без текущего хода пользователя — он уже в вопросе)
+      вместе с кратким содержанием ранней части беседы
+    - версия контекста пространства (хэш блока space_context)
+    - id вложений
+
+    Если контекста нет вовсе (новый чат, пустое пространство, без файлов),
+    вопрос самостоятельный — используется общий уровень "free:<category>",
+    и ответ переиспользуется между любыми чатами.
+    """
+    history = [_role_and_content(m) for m in conversation_history or []]
+    # Текущий ход пользователя уже сохранён в БД и попадает в историю
+    while history and history[-1][0] == 'user':
+        history.pop()
+    ids = sorted({int(i) for i in (attachment_ids or [])})
+
+    if not history and not space_context and not ids and not conversation_summary:
+        return f"free:{category}"
+
+    history_parts = list(history)
+    if conversation_summary:
+        history_parts.insert(0, ['summary', conversation_summary])
+    history_hash = _short_hash(json.dumps(history_parts, ensure_ascii=False)) if history_parts else "-"
+    space_version = _short_hash(space_context) if space_context else "-"
+    attachments_part = ",".join(str(i) for i in ids) or "-"
+    return f"ctx:{category}:h={history_hash}:s={space_version}:a={attachments_part}"
 
 
 class CacheService:
-    def __init__(self, max_size: int = 100, ttl_hours: int = 24):
-        self.cache = {}
+    """
+    Кэш ответов LLM: in-process LRU + TTL с ограничением по объёму (L1)
+    и необязательный общий для воркеров второй уровень (L2, см. cache_backends).
+
+    - get/set/удаление в L1 — O(1) (OrderedDict, последний элемент — самый свежий по использованию)
+    - TTL проверяется лениво при обращении к записи
+    - кроме числа записей ограничен суммарный размер сохранённых данных (байты JSON),
+      т.к. ответы содержат formatted_html и могут весить десятки КБ
+    - потокобезопасен (обработчики могут работать в threadpool)
+    - промах в L1 проверяется в L2, найденная запись поднимается в L1
+    - clear/invalidate рассылаются остальным процессам через L2
+    """
+
+    # Как часто (сек) забирать события инвалидации от других процессов
+    INVALIDATION_POLL_INTERVAL = 1.0
+
+    def __init__(
+            self,
+            max_size: int = 1000,
+            ttl_hours: float = 24,
+            max_bytes: Optional[int] = None,
+            shared_backend: Optional[SharedCacheBackend] = None,
+    ):
+        self.cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
         self.max_size = max_size
-        self.ttl = timedelta(hours=ttl_hours)
+        self.ttl_seconds = ttl_hours * 3600
+        if max_bytes is None:
+            max_bytes = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(20 * 1024 * 1024)))
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._lock = threading.Lock()
 
-    def get_cache_key(self, question: str):
-        """Генерация ключа кэша"""
-        return hashlib.md5(question.lower().encode()).hexdigest()
+        self.shared_backend = shared_backend
+        self._next_invalidation_poll = 0.0
+        # Опрос L2 ведёт один поток за раз; остальные в это время его пропускают
+        self._poll_lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.shared_hits = 0
+        self.shared_errors = 0
+
+    def get_cache_key(self, question: str, scope: Optional[str] = None):
+        """Генерация ключа кэша (вопрос + область, см. build_cache_scope)"""
+        raw = question.lower() if scope is None else f"{scope}\n{question.lower()}"
+        return hashlib.md5(raw.encode()).hexdigest()
+
+    @staticmethod
+    def _payload_size(data) -> int:
+        """Размер сохраняемых данных в байтах (по JSON-представлению)"""
+        try:
+            return len(json.dumps(data, ensure_ascii=False, default=str).encode("utf-8"))
+        except (TypeError, ValueError):
+            return len(str(data).encode("utf-8"))
+
+    def _remove(self, key: str) -> None:
+        entry = self.cache.pop(key)
+        self.current_bytes -= entry['size']
+
+    def _store_local(self, key: str, data, ttl_seconds: float) -> None:
+        """Запись в L1 с вытеснением по LRU и бюджету байт (вызывать под self._lock)"""
+        size = self._payload_size(data)
 
-    def get(self, question: str):
-        """Получение из кэша"""
-        key = self.get_cache_key(question)
         if key in self.cache:
-            cached_data = self.cache[key]
-            if datetime.now() - cached_data['timestamp'] < self.ttl:
-                return cached_data['data']
-            else:
-                del self.cache[key]
-        return None
+            self._remove(key)
 
-    def set(self, question: str, data):
-        """Сохранение в кэш"""
-        key = self.get_cache_key(question)
+        # Запись больше всего бюджета не кэшируем — она вытеснила бы всё остальное
+        if size > self.max_bytes:
+            return
 
-        if len(self.cache) >= self.max_size:
+        while self.cache and (
+                len(self.cache) >= self.max_size
+                or self.current_bytes + size > self.max_bytes
+        ):
             oldest_key = next(iter(self.cache))
-            del self.cache[oldest_key]
+            self._remove(oldest_key)
+            self.evictions += 1
 
         self.cache[key] = {
             'data': data,
-            'timestamp': datetime.now()
+            'size': size,
+            'expires_at': time.monotonic() + ttl_seconds,
         }
+        self.current_bytes += size
+
+    def _shared_call(self, method: str, *args):
+        """Обращение к L2; ошибки хранилища не должны ломать ответ пользователю"""
+        try:
+            return getattr(self.shared_backend, method)(*args)
+        except Exception as e:
+            self.shared_errors += 1
+            print(f"⚠️ Ошибка общего кэша ({self.shared_backend.name}.{method}): {e}")
+            return None
+
+    def _apply_remote_invalidations(self) -> None:
+        if time.monotonic() < self._next_invalidation_poll:
+            return
+        if not self._poll_lock.acquire(blocking=False):
+            return
+        try:
+            now = time.monotonic()
+            if now < self._next_invalidation_poll:
+                return
+            self._next_invalidation_poll = now + self.INVALIDATION_POLL_INTERVAL
+            keys = self._shared_call("poll_invalidations") or []
+        finally:
+            self._poll_lock.release()
+        if not keys:
+            return
+        with self._lock:
+            for key in keys:
+                if key == INVALIDATE_ALL:
+                    self.cache.clear()
+                    self.current_bytes = 0
+                elif key in self.cache:
+                    self._remove(key)
+
+    def get(self, question: str, scope: Optional[str] = None):
+        """Получение из кэша"""
+        key = self.get_cache_key(question, scope)
+        if self.shared_backend is not None:
+            self._apply_remote_invalidations()
+
+        with self._lock:
+            entry = self.cache.get(key)
+            if entry is not None:
+                if time.monotonic() < entry['expires_at']:
+                    self.cache.move_to_end(key)
+                    self.hits += 1
+                    return entry['data']
+                self._remove(key)
+                self.expirations += 1
+
+        if self.shared_backend is not None:
+            blob = self._shared_call("get", key)
+            if blob is not None:
+                try:
+                    data, expires_at = deserialize_cache_entry(blob)
+                except Exception as e:
+                    print(f"⚠️ Повреждённая запись общего кэша {key}: {e}")
+                    data, expires_at = None, 0.0
+                remaining = expires_at - time.time()
+                if data is not None and remaining > 0:
+                    with self._lock:
+                        self._store_local(key, data, remaining)
+                        self.hits += 1
+                        self.shared_hits += 1
+                    return data
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, question: str, data, scope: Optional[str] = None):
+        """Сохранение в кэш"""
+        key = self.get_cache_key(question, scope)
+
+        with self._lock:
+            self._store_local(key, data, self.ttl_seconds)
+
+        if self.shared_backend is not None:
+            blob = serialize_cache_entry(data, time.time() + self.ttl_seconds)
+            self._shared_call("set", key, blob, self.ttl_seconds)
+
+    def invalidate(self, question: str, scope: Optional[str] = None):
+        """Удаление записи во всех процессах"""
+        key = self.get_cache_key(question, scope)
+        with self._lock:
+            if key in self.cache:
+                self._remove(key)
+
+        if self.shared_backend is not None:
+            self._shared_call("delete", key)
+            self._shared_call("publish_invalidation", key)
 
     def clear(self):
         """Очистка кэша"""
-        self.cache.clear()
\ No newline at end of file
+        with self._lock:
+            self.cache.clear()
+            self.current_bytes = 0
+
+        if self.shared_backend is not None:
+            self._shared_call("clear")
+            self._shared_call("publish_invalidation", INVALIDATE_ALL)
+
+    def stats(self) -> Dict[str, Any]:
+        """Счётчики попаданий/промахов/вытеснений и текущий объём"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self.cache),
+                'bytes': self.current_bytes,
+                'max_entries': self.max_size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': self.hits / total if total else 0.0,
+                'shared_backend': self.shared_backend.name if self.shared_backend else None,
+                'shared_hits': self.shared_hits,
+                'shared_errors': self.shared_errors,
+            }
@@ -0,0 +1,237 @@
+"""
+Скользящее краткое содержание чата (rolling summary).
+
+Раньше в промпт шло до 3000 токенов истории на каждом ходе, а ранние сообщения
+длинного чата просто отрезались по бюджету. Теперь у чата хранится краткое
+содержание (chats.summary), покрывающее сообщения до summary_message_id, и в
+промпт идут summary + только сообщения после него — стоимость хода не растёт с
+длиной чата.
+
+Summary обновляется в фоне после ответа ассистента (не на пути запроса): когда
+за границей summary накопилось CHAT_SUMMARY_EVERY_MESSAGES сообщений (не считая
+последних CHAT_SUMMARY_KEEP_RECENT, они остаются в промпте дословно) или их
+текст превысил CHAT_SUMMARY_TRIGGER_TOKENS. Новое содержание строится из
+прежнего и новых сообщений (инкрементально). За один запуск берётся не больше
+CHAT_SUMMARY_BATCH_MESSAGES самых старых сообщений и CHAT_SUMMARY_BATCH_TOKENS
+токенов: длинный чат без summary (созданный до его появления) догоняется за
+несколько обновлений, а не одним запросом, который не помещается в контекст модели.
+
+Обновление идемпотентно: запись идёт условным UPDATE по прежнему
+summary_message_id (compare-and-set), поэтому повторный или параллельный запуск
+для того же чата (другой воркер) ничего не испортит, а в пределах процесса
+одновременно идёт не больше одного обновления на чат.
+"""
+
+import asyncio
+import os
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Set
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from backend.app.models.chat import Chat
+from backend.app.models.message import Message
+from backend.app.services.llm_scheduler import llm_scheduler, LLMQueueFullError, PRIORITY_BACKGROUND
+from backend.app.utils.history_sanitizer import sanitized_history
+from backend.app.utils.tokens import count_tokens, truncate_to_tokens
+
+
+class ChatSummarizer:
+    """Фоновое обновление chats.summary"""
+
+    def __init__(
+            self,
+            session_factory: Optional[Callable[[], Session]] = None,
+            enabled: Optional[bool] = None,
+            keep_recent: Optional[int] = None,
+            every_messages: Optional[int] = None,
+            trigger_tokens: Optional[int] = None,
+            message_max_tokens: Optional[int] = None,
+            batch_messages: Optional[int] = None,
+            batch_tokens: Optional[int] = None,
+    ):
+        self._session_factory = session_factory
+        if enabled is None:
+            enabled = os.getenv("CHAT_SUMMARY_ENABLED", "true").lower() == "true"
+        self.enabled = enabled
+        self.keep_recent = keep_recent if keep_recent is not None else int(os.getenv("CHAT_SUMMARY_KEEP_RECENT", "6"))
+        self.every_messages = every_messages or int(os.getenv("CHAT_SUMMARY_EVERY_MESSAGES", "8"))
+        self.trigger_tokens = trigger_tokens or int(os.getenv("CHAT_SUMMARY_TRIGGER_TOKENS", "1500"))
+        # Одно огромное сообщение не должно занять весь запрос на суммаризацию
+        self.message_max_tokens = message_max_tokens or int(os.getenv("CHAT_SUMMARY_MESSAGE_MAX_TOKENS", "800"))
+        # Размер одного запроса на суммаризацию (остальное — в следующих обновлениях)
+        self.batch_messages = batch_messages or int(os.getenv("CHAT_SUMMARY_BATCH_MESSAGES", "40"))
+        self.batch_tokens = batch_tokens or int(os.getenv("CHAT_SUMMARY_BATCH_TOKENS", "6000"))
+
+        self._in_flight: Set[int] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self.scheduled = 0
+        self.refreshed = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def _new_session(self) -> Session:
+        if self._session_factory is None:
+            from backend.app.database.connection import SessionLocal
+            self._session_factory = SessionLocal
+        return self._session_factory()
+
+    def pending_messages(self, db: Session, chat: Chat) -> List[Message]:
+        """Сообщения после границы summary, кроме последних keep_recent (хронологически)"""
+        query = db.query(Message).filter(Message.chat_id == chat.id)
+        if chat.summary_message_id is not None:
+            query = query.filter(Message.id > chat.summary_message_id)
+        messages = query.order_by(Message.created_at.asc(), Message.id.asc()).all()
+        if self.keep_recent:
+            messages = messages[:-self.keep_recent]
+        return messages
+
+    def needs_refresh(self, messages: List[Message]) -> bool:
+        if not messages:
+            return False
+        if len(messages) >= self.every_messages:
+            return True
+        tokens = sum(m.token_count if m.token_count is not None else count_tokens(m.content) for m in messages)
+        return tokens >= self.trigger_tokens
+
+    def schedule(self, chat_id: int, llm_service) -> bool:
+        """
+        Запланировать обновление summary чата (вызывается после ответа ассистента).
+        Возвращает False, если обновление выключено, уже идёт или нет event loop.
+        """
+        if not self.enabled or chat_id in self._in_flight:
+            return False
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+
+        self._in_flight.add(chat_id)
+        self.scheduled += 1
+        task = loop.create_task(self._run(chat_id, llm_service))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _run(self, chat_id: int, llm_service) -> None:
+        try:
+            await self.refresh(chat_id, llm_service)
+        except Exception as e:
+            self.failed += 1
+            print(f"❌ Ошибка обновления краткого содержания чата {chat_id}: {e}")
+        finally:
+            self._in_flight.discard(chat_id)
+
+    def _load_pending(self, chat_id: int) -> Optional[tuple]:
+        """
+        (tenant, прежнее summary, прежняя граница, новая граница, история для LLM) или None.
+        Короткая сессия: соединение не держится на время запроса к LLM.
+        """
+        db = self._new_session()
+        try:
+            chat = db.query(Chat).filter(Chat.id == chat_id).first()
+            if chat is None:
+                return None
+            messages = self.pending_messages(db, chat)
+            if not self.needs_refresh(messages):
+                self.skipped += 1
+                return None
+            # Самые старые сообщения в пределах батча; граница summary сдвигается до последнего из них.
+            # Текст без HTML-разметки, как в истории для промпта (history_service)
+            history = []
+            batch_tokens = 0
+            boundary = None
+            for m in messages[:self.batch_messages]:
+                text, tokens = sanitized_history.get(m.id, m.content, m.token_count)
+                tokens = min(tokens, self.message_max_tokens)
+                if history and batch_tokens + tokens > self.batch_tokens:
+                    break
+                history.append({"role": m.role, "content": truncate_to_tokens(text, self.message_max_tokens)})
+                batch_tokens += tokens
+                boundary = m.id
+            return f"user:{chat.user_id}", chat.summary, chat.summary_message_id, boundary, history
+        finally:
+            db.close()
+
+    def _store_summary(
+            self,
+            chat_id: int,
+            previous_boundary: Optional[int],
+            new_boundary: int,
+            summary: str,
+    ) -> bool:
+        """Compare-and-set по прежнему summary_message_id; False — summary уже обновил другой процесс"""
+        db = self._new_session()
+        try:
+            updated = db.query(Chat).filter(
+                Chat.id == chat_id,
+                func.coalesce(Chat.summary_message_id, 0) == (previous_boundary or 0),
+            ).update({
+                Chat.summary: summary,
+                Chat.summary_message_id: new_boundary,
+                Chat.summary_token_count: count_tokens(summary),
+                Chat.summary_updated_at: datetime.now(timezone.utc),
+                # Фоновое обновление не поднимает чат в списке: onupdate=now() здесь отключён,
+                # а в PostgreSQL триггер update_chats_updated_at не трогает updated_at,
+                # если изменились только служебные колонки (summary*, превью, счётчики)
+                Chat.updated_at: Chat.updated_at,
+            }, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+        return bool(updated)
+
+    async def refresh(self, chat_id: int, llm_service) -> bool:
+        """
+        Обновить summary чата, если накопилось достаточно новых сообщений.
+        Возвращает True, если summary записано.
+        Запросы к БД (sync Session) идут в threadpool, чтобы не блокировать event loop.
+        """
+        pending = await asyncio.to_thread(self._load_pending, chat_id)
+        if pending is None:
+            return False
+        tenant, previous_summary, previous_boundary, new_boundary, history = pending
+
+        try:
+            async with llm_scheduler.slot(tenant, PRIORITY_BACKGROUND):
+                summary = await llm_service.summarize_conversation_async(
+                    history, previous_summary=previous_summary, min_messages=1, max_messages=None,
+                )
+        except LLMQueueFullError:
+            # LLM занят интерактивными запросами — попробуем после следующего ответа
+            self.skipped += 1
+            return False
+
+        summary = (summary or "").strip()
+        if not summary:
+            self.failed += 1
+            return False
+
+        if not await asyncio.to_thread(self._store_summary, chat_id, previous_boundary, new_boundary, summary):
+            # Summary уже обновил другой процесс — результат отбрасываем
+            self.skipped += 1
+            return False
+
+        self.refreshed += 1
+        print(f"📝 Обновлено краткое содержание чата {chat_id}: +{len(history)} сообщений")
+        return True
+
+    async def wait_idle(self) -> None:
+        """Дождаться запущенных обновлений (завершение работы, тесты)"""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def stats(self) -> Dict:
+        return {
+            'enabled': self.enabled,
+            'in_flight': len(self._in_flight),
+            'scheduled': self.scheduled,
+            'refreshed': self.refreshed,
+            'skipped': self.skipped,
+            'failed': self.failed,
+        }
+
+
+# Глобальный экземпляр
+chat_summarizer = ChatSummarizer()
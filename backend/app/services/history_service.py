@@ -0,0 +1,193 @@
+"""
+Окно истории чата для LLM, выбранное на стороне БД.
+
+Раньше бралось фиксированное число последних сообщений (15) независимо от размера,
+а LLMService заново токенизировал каждое на каждом запросе и отбрасывал лишние.
+Теперь у сообщений и вложений хранится token_count, и окно выбирается одним
+запросом: накопительная сумма токенов (оконная функция SUM() OVER) от новых
+сообщений к старым, пока она не превышает бюджет.
+
+load_conversation_history собирает из окна историю для LLM (текст без разметки,
+блоки вложений без повторов). Вложения всех сообщений окна и текущего хода
+загружаются одним запросом (IN по message_id / id), а не по запросу на сообщение.
+"""
+
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+
+from backend.app.models.message import Message
+from backend.app.models.file_attachment import FileAttachment
+from backend.app.utils.history_sanitizer import sanitized_history, attachment_key, attachment_reference
+from backend.app.utils.tokens import count_tokens
+
+# Совпадает с max_history_tokens по умолчанию в LLMService.generate_response*
+HISTORY_MAX_TOKENS = 3000
+# Страховка от чатов из множества очень коротких сообщений
+HISTORY_MAX_MESSAGES = 50
+
+
+class HistoryMessage(NamedTuple):
+    """Сообщение истории для промпта: текст без разметки вместе с блоками вложений"""
+    role: str
+    content: str
+    token_count: int
+
+
+def _estimated_tokens(stored, text_column):
+    """token_count, а для ещё не посчитанных строк (до backfill) — оценка по длине текста"""
+    return func.coalesce(stored, func.length(func.coalesce(text_column, "")) / 2 + 1)
+
+
+def select_history_window(
+        db: Session,
+        chat_id: int,
+        max_tokens: int = HISTORY_MAX_TOKENS,
+        max_messages: int = HISTORY_MAX_MESSAGES,
+        include_attachments: bool = True,
+        exclude_current_turn: bool = False,
+        after_message_id: Optional[int] = None,
+) -> List[Tuple[Message, int]]:
+    """
+    Последние сообщения чата, суммарно укладывающиеся в max_tokens.
+
+    Args:
+        include_attachments: учитывать токены текста вложений (он добавляется к сообщению)
+        exclude_current_turn: не включать последнее сообщение, если это вопрос пользователя —
+            текущий ход уже сохранён в БД, но передаётся в LLM отдельно
+        after_message_id: только сообщения новее этого id (более ранние покрыты summary чата)
+
+    Returns:
+        [(Message, токены сообщения вместе с вложениями)] в хронологическом порядке
+    """
+    newest_first = (Message.created_at.desc(), Message.id.desc())
+
+    query = db.query(Message.id).filter(Message.chat_id == chat_id)
+    if after_message_id is not None:
+        query = query.filter(Message.id > after_message_id)
+    if exclude_current_turn:
+        latest = db.query(Message.id, Message.role).filter(
+            Message.chat_id == chat_id
+        ).order_by(*newest_first).first()
+        if latest and latest.role == "user":
+            query = query.filter(Message.id != latest.id)
+
+    message_tokens = _estimated_tokens(Message.token_count, Message.content)
+    if include_attachments:
+        attachment_tokens = db.query(
+            FileAttachment.message_id.label("message_id"),
+            func.sum(_estimated_tokens(
+                FileAttachment.token_count,
+                func.coalesce(FileAttachment.extracted_text, FileAttachment.analysis_result),
+            )).label("tokens"),
+        ).join(
+            Message, Message.id == FileAttachment.message_id
+        ).filter(
+            Message.chat_id == chat_id,
+        ).group_by(FileAttachment.message_id).subquery()
+        query = query.outerjoin(attachment_tokens, attachment_tokens.c.message_id == Message.id)
+        total_tokens = message_tokens + func.coalesce(attachment_tokens.c.tokens, 0)
+    else:
+        total_tokens = message_tokens
+
+    window = query.add_columns(
+        total_tokens.label("tokens"),
+        func.sum(total_tokens).over(order_by=newest_first).label("running_tokens"),
+        func.row_number().over(order_by=newest_first).label("position"),
+    ).subquery()
+
+    rows = db.query(Message, window.c.tokens).join(
+        window, window.c.id == Message.id
+    ).filter(
+        window.c.running_tokens <= max_tokens,
+        window.c.position <= max_messages,
+    ).order_by(Message.created_at.asc(), Message.id.asc()).all()
+
+    return [(message, int(tokens)) for message, tokens in rows]
+
+
+def _load_attachments(
+        db: Session,
+        message_ids: List[int],
+        current_attachment_ids: Optional[List[int]] = None,
+) -> Tuple[Dict[int, List[FileAttachment]], List[FileAttachment]]:
+    """
+    Вложения сообщений окна и вложения текущего хода — одним запросом.
+
+    Returns:
+        ({message_id: [вложения]}, вложения текущего хода)
+    """
+    conditions = []
+    if message_ids:
+        conditions.append(FileAttachment.message_id.in_(message_ids))
+    if current_attachment_ids:
+        conditions.append(FileAttachment.id.in_(current_attachment_ids))
+    if not conditions:
+        return {}, []
+
+    window_ids = set(message_ids)
+    current_ids = set(current_attachment_ids or [])
+    by_message: Dict[int, List[FileAttachment]] = {}
+    current: List[FileAttachment] = []
+    for attachment in db.query(FileAttachment).filter(or_(*conditions)).order_by(FileAttachment.id).all():
+        if attachment.message_id in window_ids:
+            by_message.setdefault(attachment.message_id, []).append(attachment)
+        if attachment.id in current_ids:
+            current.append(attachment)
+    return by_message, current
+
+
+def load_conversation_history(
+        db: Session,
+        chat_id: int,
+        max_tokens: int = HISTORY_MAX_TOKENS,
+        include_attachments: bool = True,
+        exclude_current_turn: bool = False,
+        after_message_id: Optional[int] = None,
+        current_attachment_ids: Optional[List[int]] = None,
+) -> List[HistoryMessage]:
+    """
+    История чата для LLM: [HistoryMessage(role, content, token_count)] в хронологическом порядке.
+
+    Текст сообщений очищается от HTML-разметки (history_sanitizer). Содержимое файла
+    целиком идёт только в самом новом месте, где файл встречается (current_attachment_ids —
+    вложения текущего хода, они уходят в промпт отдельно), в более ранних сообщениях —
+    ссылка на него.
+    """
+    window = select_history_window(
+        db, chat_id, max_tokens=max_tokens, include_attachments=include_attachments,
+        exclude_current_turn=exclude_current_turn, after_message_id=after_message_id,
+    )
+
+    attachments: Dict[int, List[FileAttachment]] = {}
+    seen_attachments = set()
+    if include_attachments:
+        attachments, current = _load_attachments(
+            db, [msg.id for msg, _ in window], current_attachment_ids
+        )
+        seen_attachments = {attachment_key(attachment) for attachment in current}
+
+    # От новых к старым, чтобы полный текст файла достался самому новому упоминанию
+    history = []
+    for msg, _ in reversed(window):
+        content, token_count = sanitized_history.get(msg.id, msg.content, msg.token_count)
+
+        for file_attachment in attachments.get(msg.id, ()):
+            block = file_attachment.context_text()
+            if not block:
+                continue
+            key = attachment_key(file_attachment)
+            if key in seen_attachments:
+                block = attachment_reference(file_attachment.filename)
+                token_count += count_tokens(block)
+            else:
+                seen_attachments.add(key)
+                stored = file_attachment.token_count
+                token_count += stored if stored is not None else count_tokens(block)
+            content += block
+
+        history.append(HistoryMessage(msg.role, content, token_count))
+
+    history.reverse()
+    return history
@@ -0,0 +1,141 @@
+"""
+Хеджирование запросов к LLM: срезаем хвост латентности.
+
+p99 /chat/send определяют редкие очень медленные ответы бесплатных моделей
+OpenRouter. Если основной запрос не ответил за «обычное» время (перцентиль
+недавних латентностей, LLM_HEDGE_PERCENTILE), отправляется второй запрос на
+альтернативный endpoint; берётся ответ, пришедший первым, проигравший отменяется.
+
+Включается LLM_HEDGE_ENABLED=true. Доля дополнительных запросов ограничена
+бюджетом (LLM_HEDGE_BUDGET, по умолчанию 10%): каждый запрос пополняет бюджет
+на LLM_HEDGE_BUDGET, каждый хедж расходует единицу.
+
+Перцентиль считается по латентностям основного запроса, а не победителя:
+если основной проиграл хеджу, известно лишь, что он шёл дольше — такой замер
+(цензурированный) при сортировке ставится выше всех полных, иначе ответы
+хеджей занижали бы порог и хеджей становилось бы всё больше.
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+
+class RequestHedger:
+    def __init__(
+            self,
+            enabled: Optional[bool] = None,
+            percentile: Optional[float] = None,
+            budget: Optional[float] = None,
+            min_delay: Optional[float] = None,
+            initial_delay: Optional[float] = None,
+            min_samples: int = 20,
+            max_samples: int = 500,
+            max_budget_tokens: float = 10.0,
+    ):
+        self.enabled = (
+            enabled if enabled is not None
+            else os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+        )
+        self.percentile = percentile if percentile is not None else float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+        self.budget = budget if budget is not None else float(os.getenv("LLM_HEDGE_BUDGET", "0.1"))
+        self.min_delay = min_delay if min_delay is not None else float(os.getenv("LLM_HEDGE_MIN_DELAY", "1.0"))
+        # Пока замеров мало, ждём заведомо «долгое» время
+        self.initial_delay = (
+            initial_delay if initial_delay is not None
+            else float(os.getenv("LLM_HEDGE_INITIAL_DELAY", "10.0"))
+        )
+        self.min_samples = min_samples
+        self.max_budget_tokens = max_budget_tokens
+        # (цензурирован ли замер, латентность основного запроса)
+        self._latencies: Deque[Tuple[bool, float]] = deque(maxlen=max_samples)
+        self._budget_tokens = 0.0
+
+        self.requests = 0
+        self.hedges_sent = 0
+        self.hedges_won = 0
+        self.hedges_skipped_budget = 0
+
+    def current_delay(self) -> float:
+        """Через сколько секунд без ответа отправлять хедж"""
+        if len(self._latencies) < self.min_samples:
+            return self.initial_delay
+        ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        # Цензурированный замер — нижняя граница: не меньше полных замеров, стоящих ниже него
+        return max(self.min_delay, max(latency for _, latency in ordered[:index + 1]))
+
+    def record_primary_latency(self, latency: float, censored: bool = False) -> None:
+        """censored=True — основной запрос отменён, его латентность не меньше latency"""
+        self._latencies.append((censored, latency))
+
+    def _take_budget(self) -> bool:
+        if self._budget_tokens >= 1.0:
+            self._budget_tokens -= 1.0
+            return True
+        return False
+
+    async def run(
+            self,
+            primary: Callable[[], Awaitable[Any]],
+            hedge: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        """
+        Выполнить primary(); если он не уложился в current_delay() и бюджет позволяет —
+        параллельно запустить hedge() и вернуть первый успешный результат.
+        Если упали оба — поднимается ошибка основного запроса.
+        """
+        if not self.enabled:
+            return await primary()
+
+        self.requests += 1
+        self._budget_tokens = min(self.max_budget_tokens, self._budget_tokens + self.budget)
+
+        started = time.monotonic()
+        primary_task = asyncio.ensure_future(primary())
+        tasks = [primary_task]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.current_delay())
+            if not done:
+                if self._take_budget():
+                    self.hedges_sent += 1
+                    print(f"🪝 LLM не ответил за {time.monotonic() - started:.1f} с, отправлен хедж-запрос")
+                    tasks.append(asyncio.ensure_future(hedge()))
+                else:
+                    self.hedges_skipped_budget += 1
+
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # При одновременном завершении предпочитаем основной запрос
+                for task in sorted(done, key=tasks.index):
+                    if task.exception() is not None:
+                        continue
+                    # Основной запрос либо ответил сейчас, либо будет отменён после победы хеджа
+                    self.record_primary_latency(time.monotonic() - started, censored=task is not primary_task)
+                    if task is not primary_task:
+                        self.hedges_won += 1
+                    return task.result()
+            # Успешных нет — наружу ошибка основного запроса
+            return primary_task.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    # Ошибку проигравшего не логируем как «never retrieved»
+                    task.exception()
+
+    def stats(self) -> Dict:
+        return {
+            'enabled': self.enabled,
+            'requests': self.requests,
+            'hedges_sent': self.hedges_sent,
+            'hedges_won': self.hedges_won,
+            'hedges_skipped_budget': self.hedges_skipped_budget,
+            'hedge_rate': self.hedges_sent / self.requests if self.requests else 0.0,
+            'hedge_win_rate': self.hedges_won / self.hedges_sent if self.hedges_sent else 0.0,
+            'current_delay_ms': self.current_delay() * 1000,
+        }
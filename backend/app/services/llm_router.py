@@ -0,0 +1,360 @@
+"""
+Маршрутизация запросов к LLM между несколькими OpenAI-совместимыми провайдерами.
+
+Раньше LLMService работал ровно с одним бэкендом (Ollama или одна модель
+OpenRouter): когда провайдер тормозил или отвечал 5xx, каждый чат ждал полный
+таймаут. Здесь для каждого endpoint'а (провайдер + модель) ведётся здоровье:
+
+- скользящая латентность (EWMA) и доля ошибок за последние LLM_HEALTH_WINDOW_SECONDS
+  секунд: старые ошибки «забываются», и восстановившийся провайдер снова получает запросы
+- circuit breaker: после LLM_CIRCUIT_FAILURES ошибок подряд (или доли ошибок
+  >= 50% в окне) endpoint исключается на LLM_CIRCUIT_OPEN_SECONDS секунд,
+  затем пропускается один пробный запрос (half-open)
+- запрос идёт в самый здоровый endpoint (score = латентность + штраф за ошибки;
+  endpoint без замеров пробуется первым), при ошибке — в следующий
+
+Ошибки самого запроса (400/413/422: слишком длинный контекст и т.п.) на здоровье
+не влияют и на другой endpoint не переключают — там они повторились бы.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from backend.app.services.llm_telemetry import llm_telemetry
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+# Коды, при которых виноват запрос, а не провайдер
+REQUEST_ERROR_STATUS_CODES = (400, 413, 422)
+
+
+class LLMUnavailableError(ValueError):
+    """Все endpoint'ы LLM временно исключены circuit breaker'ом"""
+
+    def __init__(self, message: str = "Все провайдеры AI временно недоступны. Попробуйте позже."):
+        super().__init__(message)
+
+
+class LLMEndpoint:
+    """
+    Провайдер + модель.
+
+    kind: "ollama" (запрос с отключённым thinking) или "openai" (OpenRouter и любые
+    OpenAI-совместимые API). base_url=None — endpoint использует основные клиенты
+    LLMService (self.client / self.async_client).
+    """
+
+    def __init__(
+            self,
+            name: str,
+            model: str,
+            kind: str = "openai",
+            base_url: Optional[str] = None,
+            api_key: Optional[str] = None,
+    ):
+        self.name = name
+        self.model = model
+        self.kind = kind
+        self.base_url = base_url
+        self.api_key = api_key
+
+    def __repr__(self) -> str:
+        return f"LLMEndpoint({self.name!r}, model={self.model!r})"
+
+
+class _EndpointHealth:
+    def __init__(self, window: int):
+        self.latency_ewma: Optional[float] = None
+        # (monotonic-время, успех)
+        self.outcomes: Deque[Tuple[float, bool]] = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.state = CIRCUIT_CLOSED
+        self.open_until = 0.0
+        self.trial_in_flight = False
+        self.requests = 0
+        self.failures = 0
+        self.circuit_opens = 0
+
+    def recent(self, now: float, horizon: float) -> List[bool]:
+        return [ok for at, ok in self.outcomes if now - at <= horizon]
+
+    def error_rate(self, now: float, horizon: float) -> float:
+        recent = self.recent(now, horizon)
+        if not recent:
+            return 0.0
+        return recent.count(False) / len(recent)
+
+
+def is_request_error(exc: Exception) -> bool:
+    """Ошибка в самом запросе — повтор на другом endpoint'е не поможет"""
+    return getattr(exc, "status_code", None) in REQUEST_ERROR_STATUS_CODES
+
+
+class LLMRouter:
+    def __init__(
+            self,
+            endpoints: List[LLMEndpoint],
+            failure_threshold: Optional[int] = None,
+            open_seconds: Optional[float] = None,
+            window: int = 20,
+            health_window_seconds: Optional[float] = None,
+            min_samples_for_rate: int = 10,
+            max_error_rate: float = 0.5,
+            error_penalty_seconds: float = 10.0,
+            latency_alpha: float = 0.2,
+    ):
+        if not endpoints:
+            raise ValueError("LLMRouter: нужен хотя бы один endpoint")
+        self.endpoints = list(endpoints)
+        self.failure_threshold = failure_threshold or int(os.getenv("LLM_CIRCUIT_FAILURES", "3"))
+        self.open_seconds = open_seconds if open_seconds is not None else float(os.getenv("LLM_CIRCUIT_OPEN_SECONDS", "30"))
+        self.health_window_seconds = (
+            health_window_seconds if health_window_seconds is not None
+            else float(os.getenv("LLM_HEALTH_WINDOW_SECONDS", "60"))
+        )
+        self.min_samples_for_rate = min_samples_for_rate
+        self.max_error_rate = max_error_rate
+        self.error_penalty_seconds = error_penalty_seconds
+        self.latency_alpha = latency_alpha
+        self._health: Dict[str, _EndpointHealth] = {ep.name: _EndpointHealth(window) for ep in self.endpoints}
+        self._lock = threading.Lock()
+        self.failovers = 0
+        self.unavailable = 0
+
+    # ----- здоровье -----
+
+    def _score(self, endpoint: LLMEndpoint, now: float) -> float:
+        """Чем меньше, тем лучше: латентность (сек) + штраф за долю недавних ошибок"""
+        health = self._health[endpoint.name]
+        latency = health.latency_ewma or 0.0
+        return latency + self.error_penalty_seconds * health.error_rate(now, self.health_window_seconds)
+
+    def ordered_endpoints(self) -> List[LLMEndpoint]:
+        """
+        Endpoint'ы в порядке попыток: по score, при равенстве — в порядке конфигурации.
+        Открытые circuit'ы пропускаются.
+        """
+        now = time.monotonic()
+        available = []
+        with self._lock:
+            for endpoint in self.endpoints:
+                health = self._health[endpoint.name]
+                if health.state == CIRCUIT_OPEN:
+                    if now < health.open_until:
+                        continue
+                    health.state = CIRCUIT_HALF_OPEN
+                available.append(endpoint)
+            # sort стабильный: равные score остаются в порядке конфигурации
+            available.sort(key=lambda endpoint: self._score(endpoint, now))
+        return available
+
+    def acquire(self, endpoint: LLMEndpoint) -> bool:
+        """Можно ли отправить запрос: в half-open пропускается только один пробный"""
+        with self._lock:
+            health = self._health[endpoint.name]
+            if health.state == CIRCUIT_OPEN:
+                return False
+            if health.state == CIRCUIT_HALF_OPEN:
+                if health.trial_in_flight:
+                    return False
+                health.trial_in_flight = True
+            health.requests += 1
+            return True
+
+    def release(self, endpoint: LLMEndpoint) -> None:
+        """Запрос завершился без вердикта о здоровье (отмена, ошибка запроса)"""
+        with self._lock:
+            self._health[endpoint.name].trial_in_flight = False
+
+    def record_success(self, endpoint: LLMEndpoint, latency: float) -> None:
+        with self._lock:
+            health = self._health[endpoint.name]
+            health.trial_in_flight = False
+            health.outcomes.append((time.monotonic(), True))
+            health.consecutive_failures = 0
+            if health.latency_ewma is None:
+                health.latency_ewma = latency
+            else:
+                health.latency_ewma += self.latency_alpha * (latency - health.latency_ewma)
+            if health.state != CIRCUIT_CLOSED:
+                print(f"✅ LLM endpoint {endpoint.name} снова доступен")
+            health.state = CIRCUIT_CLOSED
+
+    def record_failure(self, endpoint: LLMEndpoint, latency: Optional[float] = None) -> None:
+        with self._lock:
+            health = self._health[endpoint.name]
+            now = time.monotonic()
+            health.trial_in_flight = False
+            health.outcomes.append((now, False))
+            health.consecutive_failures += 1
+            health.failures += 1
+            # Медленный отказ (таймаут) тоже ухудшает латентность
+            if latency is not None and health.latency_ewma is not None:
+                health.latency_ewma += self.latency_alpha * (latency - health.latency_ewma)
+            recent = health.recent(now, self.health_window_seconds)
+            too_many_failures = (
+                health.consecutive_failures >= self.failure_threshold
+                or (
+                    len(recent) >= self.min_samples_for_rate
+                    and recent.count(False) / len(recent) >= self.max_error_rate
+                )
+            )
+            if health.state == CIRCUIT_HALF_OPEN or too_many_failures:
+                if health.state != CIRCUIT_OPEN:
+                    health.circuit_opens += 1
+                    print(f"⛔ LLM endpoint {endpoint.name} исключён на {self.open_seconds:.0f} с "
+                          f"(ошибок подряд: {health.consecutive_failures})")
+                health.state = CIRCUIT_OPEN
+                health.open_until = time.monotonic() + self.open_seconds
+
+    # ----- выполнение -----
+
+    def no_endpoint_error(self, last_error: Optional[Exception]) -> Exception:
+        """Что поднять, когда попытки кончились: последнюю ошибку или LLMUnavailableError"""
+        if last_error is not None:
+            return last_error
+        self.unavailable += 1
+        return LLMUnavailableError()
+
+    def note_failover(self, endpoint: LLMEndpoint, exc: Exception) -> None:
+        self.failovers += 1
+        llm_telemetry.record_fallback("endpoint")
+        print(f"🔀 LLM endpoint {endpoint.name} ответил ошибкой ({exc}), пробуем следующий")
+
+    def call(self, request: Callable[[LLMEndpoint], Any]) -> Any:
+        """Выполнить request(endpoint) на самом здоровом endpoint'е с переключением при ошибках"""
+        last_error: Optional[Exception] = None
+        for endpoint in self.ordered_endpoints():
+            if not self.acquire(endpoint):
+                continue
+            started = time.monotonic()
+            try:
+                result = request(endpoint)
+            except Exception as e:
+                if is_request_error(e):
+                    self.release(endpoint)
+                    raise
+                self.record_failure(endpoint, time.monotonic() - started)
+                self.note_failover(endpoint, e)
+                last_error = e
+                continue
+            except BaseException:
+                self.release(endpoint)
+                raise
+            self.record_success(endpoint, time.monotonic() - started)
+            return result
+        raise self.no_endpoint_error(last_error)
+
+    async def call_async(
+            self,
+            request: Callable[[LLMEndpoint], Awaitable[Any]],
+            exclude: Optional[Set[str]] = None,
+    ) -> Any:
+        """
+        Async-версия call.
+        exclude — имена endpoint'ов, которые пропускаются (хедж-запрос не идёт туда же, куда основной)
+        """
+        last_error: Optional[Exception] = None
+        for endpoint in self.ordered_endpoints():
+            if exclude and endpoint.name in exclude:
+                continue
+            if not self.acquire(endpoint):
+                continue
+            started = time.monotonic()
+            try:
+                result = await request(endpoint)
+            except Exception as e:
+                if is_request_error(e):
+                    self.release(endpoint)
+                    raise
+                self.record_failure(endpoint, time.monotonic() - started)
+                self.note_failover(endpoint, e)
+                last_error = e
+                continue
+            except BaseException:
+                # Отмена клиентом — не вердикт о здоровье провайдера
+                self.release(endpoint)
+                raise
+            self.record_success(endpoint, time.monotonic() - started)
+            return result
+        raise self.no_endpoint_error(last_error)
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        endpoints = []
+        with self._lock:
+            for endpoint in self.endpoints:
+                health = self._health[endpoint.name]
+                endpoints.append({
+                    'name': endpoint.name,
+                    'model': endpoint.model,
+                    'state': health.state,
+                    'open_for_seconds': max(0.0, health.open_until - now) if health.state == CIRCUIT_OPEN else 0.0,
+                    'latency_ms': health.latency_ewma * 1000 if health.latency_ewma is not None else None,
+                    'error_rate': health.error_rate(now, self.health_window_seconds),
+                    'requests': health.requests,
+                    'failures': health.failures,
+                    'circuit_opens': health.circuit_opens,
+                })
+        return {
+            'endpoints': endpoints,
+            'failovers': self.failovers,
+            'unavailable': self.unavailable,
+        }
+
+
+def build_llm_endpoints(
+        primary_name: str,
+        primary_model: str,
+        primary_kind: str,
+) -> List[LLMEndpoint]:
+    """
+    Список endpoint'ов из окружения. Первый — основной (USE_OLLAMA / OPENROUTER_MODEL),
+    дальше:
+
+    - OPENROUTER_FALLBACK_MODELS — модели через тот же клиент OpenRouter, через запятую
+    - LLM_ENDPOINTS — JSON-список дополнительных OpenAI-совместимых API:
+      [{"name": "...", "base_url": "http://host/v1", "model": "...",
+        "api_key_env": "ИМЯ_ПЕРЕМЕННОЙ" | "api_key": "...", "kind": "openai" | "ollama"}]
+    """
+    endpoints = [LLMEndpoint(primary_name, primary_model, kind=primary_kind)]
+
+    fallback_models = os.getenv("OPENROUTER_FALLBACK_MODELS", "")
+    if primary_kind == "openai":
+        for model in fallback_models.split(","):
+            model = model.strip()
+            if model and model != primary_model:
+                endpoints.append(LLMEndpoint(f"openrouter:{model}", model))
+
+    raw = os.getenv("LLM_ENDPOINTS", "").strip()
+    if raw:
+        try:
+            configured = json.loads(raw)
+        except json.JSONDecodeError as e:
+            print(f"⚠️ LLM_ENDPOINTS: некорректный JSON ({e}), дополнительные endpoint'ы не подключены")
+            configured = []
+        for item in configured:
+            if not item.get("base_url") or not item.get("model"):
+                print(f"⚠️ LLM_ENDPOINTS: пропущен endpoint без base_url/model: {item}")
+                continue
+            api_key = item.get("api_key") or os.getenv(item.get("api_key_env", ""), "") or "not-needed"
+            endpoints.append(LLMEndpoint(
+                name=item.get("name") or f"{item['base_url']}:{item['model']}",
+                model=item["model"],
+                kind=item.get("kind", "openai"),
+                base_url=item["base_url"],
+                api_key=api_key,
+            ))
+
+    names = set()
+    for endpoint in endpoints:
+        if endpoint.name in names:
+            endpoint.name = f"{endpoint.name}#{len(names)}"
+        names.add(endpoint.name)
+    return endpoints
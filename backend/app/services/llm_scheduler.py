@@ -0,0 +1,229 @@
+"""
+Планировщик запросов к LLM: ограничивает число одновременных генераций.
+
+Без него всплеск /chat/send, перегенераций, графиков и анализа изображений
+уходит к провайдеру разом и упирается в rate limit OpenRouter для всех.
+
+- глобальный лимит одновременных вызовов (LLM_MAX_CONCURRENCY)
+- лимит на одного «арендатора» (LLM_MAX_PER_TENANT): пользователь user:<id>
+  или публичная ссылка public:<token> — один клиент не занимает все слоты
+- классы приоритета: чат владельцев > публичные пространства > фоновый анализ
+  (графики, анализ файлов); внутри класса — очередь по кругу между арендаторами
+- ограниченная очередь (LLM_MAX_QUEUE, LLM_MAX_QUEUE_PER_TENANT) и таймаут ожидания:
+  при переполнении сразу LLMQueueFullError (в роутах — HTTP 429)
+- метрики времени ожидания в очереди
+"""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_PUBLIC = 1
+PRIORITY_BACKGROUND = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_PUBLIC: "public",
+    PRIORITY_BACKGROUND: "background",
+}
+
+
+class LLMQueueFullError(Exception):
+    """Очередь к LLM переполнена или ожидание слота превысило таймаут"""
+
+    def __init__(self, message: str = "Сервис перегружен запросами к AI. Попробуйте через минуту.",
+                 retry_after: int = 10):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("tenant", "priority", "future", "enqueued_at")
+
+    def __init__(self, tenant: str, priority: int, future: asyncio.Future):
+        self.tenant = tenant
+        self.priority = priority
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class LLMScheduler:
+    def __init__(
+            self,
+            max_concurrency: Optional[int] = None,
+            max_per_tenant: Optional[int] = None,
+            max_queue: Optional[int] = None,
+            max_queue_per_tenant: Optional[int] = None,
+            queue_timeout: Optional[float] = None,
+    ):
+        self.max_concurrency = max_concurrency or int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+        self.max_per_tenant = max_per_tenant or int(os.getenv("LLM_MAX_PER_TENANT", "2"))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv("LLM_MAX_QUEUE", "100"))
+        self.max_queue_per_tenant = (
+            max_queue_per_tenant if max_queue_per_tenant is not None
+            else int(os.getenv("LLM_MAX_QUEUE_PER_TENANT", "10"))
+        )
+        self.queue_timeout = queue_timeout if queue_timeout is not None else float(os.getenv("LLM_QUEUE_TIMEOUT", "60"))
+
+        self.running = 0
+        self._running_by_tenant: Dict[str, int] = {}
+        # priority -> (tenant -> очередь ожидающих); порядок tenant'ов — круговая очередь
+        self._queues: Dict[int, "OrderedDict[str, Deque[_Waiter]]"] = {
+            priority: OrderedDict() for priority in PRIORITY_NAMES
+        }
+        self._waiting = 0
+        self._waiting_by_tenant: Dict[str, int] = {}
+
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.admitted_by_priority: Dict[str, int] = {name: 0 for name in PRIORITY_NAMES.values()}
+
+    # ----- внутреннее состояние -----
+
+    def _can_run(self, tenant: str) -> bool:
+        return (
+            self.running < self.max_concurrency
+            and self._running_by_tenant.get(tenant, 0) < self.max_per_tenant
+        )
+
+    def _start(self, tenant: str, priority: int, waited: float) -> None:
+        self.running += 1
+        self._running_by_tenant[tenant] = self._running_by_tenant.get(tenant, 0) + 1
+        self.admitted += 1
+        self.admitted_by_priority[PRIORITY_NAMES[priority]] += 1
+        self.wait_time_total += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+
+    def _finish(self, tenant: str) -> None:
+        self.running -= 1
+        left = self._running_by_tenant.get(tenant, 1) - 1
+        if left > 0:
+            self._running_by_tenant[tenant] = left
+        else:
+            self._running_by_tenant.pop(tenant, None)
+        self._dispatch()
+
+    def _dequeue(self, waiter: _Waiter) -> None:
+        tenants = self._queues[waiter.priority]
+        queue = tenants.get(waiter.tenant)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        if not queue:
+            del tenants[waiter.tenant]
+        self._waiting -= 1
+        left = self._waiting_by_tenant.get(waiter.tenant, 1) - 1
+        if left > 0:
+            self._waiting_by_tenant[waiter.tenant] = left
+        else:
+            self._waiting_by_tenant.pop(waiter.tenant, None)
+
+    def _dispatch(self) -> None:
+        """Раздать свободные слоты: сначала старшие классы, внутри класса — по кругу"""
+        while self.running < self.max_concurrency:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            self._dequeue(waiter)
+            self._start(waiter.tenant, waiter.priority, time.monotonic() - waiter.enqueued_at)
+            waiter.future.set_result(True)
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        for priority in sorted(self._queues):
+            tenants = self._queues[priority]
+            for tenant in list(tenants.keys()):
+                queue = tenants[tenant]
+                # Отменённые ожидания (клиент ушёл) просто выбрасываем
+                while queue and queue[0].future.done():
+                    self._dequeue(queue[0])
+                if tenant not in tenants:
+                    continue
+                if self._running_by_tenant.get(tenant, 0) >= self.max_per_tenant:
+                    continue
+                # Арендатор обслужен — в конец круга, чтобы следующим был другой
+                tenants.move_to_end(tenant)
+                return queue[0]
+        return None
+
+    # ----- API -----
+
+    def check_capacity(self, tenant: str) -> None:
+        """Быстрая проверка до начала работы (например, до открытия SSE-потока)"""
+        if self._can_run(tenant):
+            return
+        if self._waiting >= self.max_queue or self._waiting_by_tenant.get(tenant, 0) >= self.max_queue_per_tenant:
+            self.rejected += 1
+            raise LLMQueueFullError()
+
+    @asynccontextmanager
+    async def slot(self, tenant: str, priority: int = PRIORITY_INTERACTIVE):
+        """
+        Занять слот для вызова LLM:
+
+            async with llm_scheduler.slot("user:42", PRIORITY_INTERACTIVE):
+                ...
+        """
+        if self._can_run(tenant) and not self._has_waiters_ahead(priority):
+            self._start(tenant, priority, 0.0)
+        else:
+            self.check_capacity(tenant)
+            waiter = _Waiter(tenant, priority, asyncio.get_running_loop().create_future())
+            self._queues[priority].setdefault(tenant, deque()).append(waiter)
+            self._waiting += 1
+            self._waiting_by_tenant[tenant] = self._waiting_by_tenant.get(tenant, 0) + 1
+            # Ожидающие впереди могут быть заблокированы своим per-tenant лимитом —
+            # тогда свободный слот достанется этому запросу сразу
+            self._dispatch()
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._dequeue(waiter)
+                if waiter.future.done():
+                    # Слот выдан в момент истечения таймаута — возвращаем его
+                    self._finish(tenant)
+                else:
+                    waiter.future.cancel()
+                self.timeouts += 1
+                raise LLMQueueFullError("Превышено время ожидания очереди к AI. Попробуйте ещё раз.")
+            except asyncio.CancelledError:
+                self._dequeue(waiter)
+                if waiter.future.done() and not waiter.future.cancelled():
+                    self._finish(tenant)
+                else:
+                    waiter.future.cancel()
+                raise
+
+        try:
+            yield
+        finally:
+            self._finish(tenant)
+
+    def _has_waiters_ahead(self, priority: int) -> bool:
+        """Есть ли ожидающие того же или более высокого приоритета (не обгоняем очередь)"""
+        return any(self._queues[p] for p in self._queues if p <= priority)
+
+    def stats(self) -> Dict:
+        return {
+            'running': self.running,
+            'waiting': self._waiting,
+            'max_concurrency': self.max_concurrency,
+            'max_per_tenant': self.max_per_tenant,
+            'max_queue': self.max_queue,
+            'admitted': self.admitted,
+            'admitted_by_priority': dict(self.admitted_by_priority),
+            'rejected': self.rejected,
+            'timeouts': self.timeouts,
+            'avg_queue_wait_ms': (self.wait_time_total / self.admitted * 1000) if self.admitted else 0.0,
+            'max_queue_wait_ms': self.wait_time_max * 1000,
+        }
+
+
+# Общий на процесс, как и LLMService из service_registry: лимиты действуют на все роуты сразу
+llm_scheduler = LLMScheduler()
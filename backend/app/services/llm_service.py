@@ -1,13 +1,59 @@
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 import os
 from dotenv import load_dotenv
-from typing import List, Dict, Optional
-import tiktoken
+from typing import List, Dict, NamedTuple, Optional, AsyncIterator, Tuple
 import httpx
 import io
+import time
+
+from backend.app.services.single_flight import SingleFlight, make_flight_key
+from backend.app.services.llm_scheduler import llm_scheduler, PRIORITY_INTERACTIVE
+from backend.app.services.llm_hedging import RequestHedger
+from backend.app.services.model_catalog import ModelCatalog
+from backend.app.services.llm_telemetry import llm_telemetry
+from backend.app.services.model_tiering import (
+    LLMTier,
+    RoutingSignals,
+    TieringPolicy,
+    TIER_DEFAULT,
+    TIER_FAST,
+)
+from backend.app.utils.tokens import get_encoding
+from backend.app.services.prompt_budget import (
+    PromptBudget,
+    PromptSection,
+    PRIORITY_FILES,
+    PRIORITY_HISTORY,
+    PRIORITY_SPACE_CONTEXT,
+    KEEP_EXTERNAL,
+    KEEP_TAIL_LINES,
+)
+from backend.app.services.llm_router import (
+    LLMRouter,
+    LLMEndpoint,
+    build_llm_endpoints,
+    is_request_error,
+)
 
 load_dotenv()
 
+# Параметры запросов суммаризации и vision (общие для sync- и async-версий)
+SUMMARY_PARAMS = {"temperature": 0.3, "max_tokens": 300}
+VISION_PARAMS = {"temperature": 0.7, "max_tokens": 1000}
+VISION_OPENAI_MODEL = "gpt-4o-mini"  # GPT-4o-mini поддерживает vision
+VISION_OPENAI_TIMEOUT = httpx.Timeout(60.0, connect=30.0)
+VISION_UNAVAILABLE_MESSAGE = (
+    "Не удалось проанализировать изображение. "
+    "Убедитесь, что настроен OPENAI_API_KEY или используется модель с поддержкой vision."
+)
+
+
+class GenerationPrompt(NamedTuple):
+    """Готовый промпт и его размер по подсчётам бюджета (для выбора уровня и статистики)"""
+    messages: List[Dict]
+    prompt_tokens: int
+    question_tokens: int
+
 
 class LLMService:
     def __init__(self):
@@ -20,11 +66,17 @@ class LLMService:
         timeout = httpx.Timeout(request_timeout, connect=connect_timeout)
         http_client = httpx.Client(timeout=timeout)
         self.http_client = http_client
+        # Асинхронный клиент для async-роутов: ожидание LLM не блокирует event loop
+        async_http_client = httpx.AsyncClient(timeout=timeout)
+        self.async_http_client = async_http_client
+        # Повторы внутри SDK; при нескольких endpoint'ах быстрее переключаться, чем повторять (0)
+        self.llm_max_retries = int(os.getenv("LLM_MAX_RETRIES", "2"))
         
         # Проверяем, использовать ли Ollama
         use_ollama = os.getenv("USE_OLLAMA", "true").lower() == "true"
         ollama_api_url = os.getenv("OLLAMA_API_URL", "http://ollama:11434")
         ollama_model = os.getenv("OLLAMA_MODEL", "deepseek-r1:8b")
+        openrouter_base_url = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1").rstrip("/")
         
         if use_ollama:
             # Использование Ollama (OpenAI-совместимый API)
@@ -33,24 +85,76 @@ class LLMService:
             self.client = OpenAI(
                 base_url=ollama_base_url,
                 api_key="ollama",  # Ollama требует любой API ключ, но не проверяет его
-                http_client=http_client
+                http_client=http_client,
+                max_retries=self.llm_max_retries
+            )
+            self.async_client = AsyncOpenAI(
+                base_url=ollama_base_url,
+                api_key="ollama",
+                http_client=async_http_client,
+                max_retries=self.llm_max_retries
             )
             self.ollama_model = ollama_model
             print(f"✅ Используется Ollama (URL: {ollama_base_url}, модель: {ollama_model})")
         else:
-            # Использование OpenRouter API
+            # Использование OpenRouter API (OPENROUTER_BASE_URL — например, локальный стенд fake_llm_server)
             self.client = OpenAI(
-                base_url="https://openrouter.ai/api/v1",
+                base_url=openrouter_base_url,
+                api_key=os.getenv("OPENROUTER_API_KEY"),
+                http_client=http_client,
+                max_retries=self.llm_max_retries
+            )
+            self.async_client = AsyncOpenAI(
+                base_url=openrouter_base_url,
                 api_key=os.getenv("OPENROUTER_API_KEY"),
-                http_client=http_client
+                http_client=async_http_client,
+                max_retries=self.llm_max_retries
             )
             self.ollama_model = None
             print("✅ Используется OpenRouter API")
 
         # OpenRouter endpoints (used for eligibility fallback on guardrails/data policy errors)
-        self.openrouter_base_url = "https://openrouter.ai/api/v1"
+        self.openrouter_base_url = openrouter_base_url
         self.openrouter_models_url = f"{self.openrouter_base_url}/models/user"
         self.openrouter_api_key = os.getenv("OPENROUTER_API_KEY")
+        # Каталог eligible-моделей с TTL и фоновым обновлением (см. model_catalog);
+        # lambda — чтобы подмена методов в тестах тоже попадала в каталог
+        self.model_catalog = ModelCatalog(
+            fetch=lambda: self._get_openrouter_eligible_models(),
+            fetch_async=lambda: self._get_openrouter_eligible_models_async(),
+        )
+
+        # Объединение одинаковых одновременных запросов генерации (см. generate_response_async)
+        self.single_flight = SingleFlight()
+
+        # Несколько провайдеров с учётом здоровья и circuit breaker (см. llm_router)
+        if use_ollama:
+            primary = ("ollama", ollama_model, "ollama")
+        else:
+            primary = ("openrouter", os.getenv("OPENROUTER_MODEL", "openai/gpt-oss-120b:free"), "openai")
+        self.llm_router = LLMRouter(build_llm_endpoints(*primary))
+        # Уровни моделей: простые вопросы — в LLM_FAST_MODEL (см. model_tiering)
+        self.llm_tiers: Dict[str, LLMTier] = {
+            TIER_DEFAULT: LLMTier(TIER_DEFAULT, self.llm_router, int(os.getenv("LLM_MAX_TOKENS", "1000"))),
+        }
+        fast_model = os.getenv("LLM_FAST_MODEL", "").strip()
+        if fast_model:
+            self.llm_tiers[TIER_FAST] = LLMTier(
+                TIER_FAST,
+                LLMRouter([LLMEndpoint(f"fast:{fast_model}", fast_model, kind=primary[2])]),
+                int(os.getenv("LLM_FAST_MAX_TOKENS", "500")),
+            )
+            print(f"✅ Быстрая модель для простых вопросов: {fast_model}")
+        self.tiering = TieringPolicy()
+        self._endpoint_clients: Dict[str, tuple] = {}
+        # Хедж-запросы при медленном ответе (LLM_HEDGE_ENABLED, см. llm_hedging)
+        self.hedger = RequestHedger()
+        # Бюджет токенов промпта и квоты секций (см. prompt_budget)
+        self.prompt_budget = PromptBudget()
+        self.prompt_files_max_tokens = int(os.getenv("PROMPT_FILES_MAX_TOKENS", "2500"))
+        self.prompt_space_max_tokens = int(os.getenv("PROMPT_SPACE_CONTEXT_MAX_TOKENS", "800"))
+        if len(self.llm_router.endpoints) > 1:
+            print(f"✅ LLM endpoints: {', '.join(ep.name for ep in self.llm_router.endpoints)}")
         
         # Настройка Whisper: контейнер, API или локальный
         # Приоритет: контейнер > API > локальный
@@ -143,11 +247,8 @@ class LLMService:
             'спасибо': 'Пожалуйста! Обращайтесь, если понадобится ещё помощь.',
             'помощь': 'Я консультирую по вопросам бизнеса: маркетинг, финансы, юридические аспекты, управление. Задайте конкретный вопрос!',
         }
-        # Инициализация токенизатора для подсчета токенов
-        try:
-            self.encoding = tiktoken.get_encoding("cl100k_base")
-        except:
-            self.encoding = None
+        # Токенизатор общий с utils.tokens (одна кодировка cl100k_base на процесс)
+        self.encoding = get_encoding()
 
     def _is_openrouter_guardrail_data_policy_404(self, exc: Exception) -> bool:
         """
@@ -163,53 +264,238 @@ class LLMService:
 
     def _get_openrouter_eligible_models(self) -> List[Dict]:
         """
-        Возвращает список моделей, которые реально доступны под текущие guardrails/privacy
-        для вашего ключа.
+        Загружает список моделей, которые реально доступны под текущие guardrails/privacy
+        для вашего ключа. Ошибки пробрасываются: кэшем и повторами управляет model_catalog.
         """
         if not self.openrouter_api_key:
             return []
 
-        try:
-            resp = self.http_client.get(
-                self.openrouter_models_url,
-                headers={"Authorization": f"Bearer {self.openrouter_api_key}"},
-            )
-            resp.raise_for_status()
-            payload = resp.json()
-            return payload.get("data") or []
-        except Exception as e:
-            print(f"⚠️ Не удалось получить eligible models OpenRouter: {e}")
+        resp = self.http_client.get(
+            self.openrouter_models_url,
+            headers={"Authorization": f"Bearer {self.openrouter_api_key}"},
+        )
+        resp.raise_for_status()
+        payload = resp.json()
+        return payload.get("data") or []
+
+    async def _get_openrouter_eligible_models_async(self) -> List[Dict]:
+        """Async-версия _get_openrouter_eligible_models."""
+        if not self.openrouter_api_key:
             return []
 
+        resp = await self.async_http_client.get(
+            self.openrouter_models_url,
+            headers={"Authorization": f"Bearer {self.openrouter_api_key}"},
+        )
+        resp.raise_for_status()
+        payload = resp.json()
+        return payload.get("data") or []
+
     def _pick_openrouter_model(
         self,
         preferred_model: str,
         input_modality: Optional[str] = None,  # "text" | "image" | "file" | "audio" | ...
     ) -> str:
         """
-        Выбирает модель из eligible моделей, учитывая input_modality.
+        Выбирает модель из eligible моделей (кэш model_catalog), учитывая input_modality.
         Если подходящей модели нет — вернёт preferred_model.
         """
-        eligible_models = self._get_openrouter_eligible_models()
-        if not eligible_models:
-            return preferred_model
+        return self.model_catalog.pick(preferred_model, input_modality)
 
-        # 1) Сначала пытаемся использовать preferred_model, если он есть среди eligible
-        for m in eligible_models:
-            if m.get("id") == preferred_model or m.get("canonical_slug") == preferred_model:
-                return m.get("id") or preferred_model
+    async def _pick_openrouter_model_async(
+        self,
+        preferred_model: str,
+        input_modality: Optional[str] = None,
+    ) -> str:
+        """Async-версия _pick_openrouter_model."""
+        return await self.model_catalog.pick_async(preferred_model, input_modality)
 
-        # 2) Если указали modality — выбираем первую подходящую
-        if input_modality:
-            for m in eligible_models:
-                arch = m.get("architecture") or {}
-                input_modalities = arch.get("input_modalities") or []
-                if input_modality in input_modalities:
-                    return m.get("id") or preferred_model
+    def _openrouter_headers(self) -> Dict[str, str]:
+        return {
+            "HTTP-Referer": self.app_url,
+            "X-OpenRouter-Title": "Business Assistant",
+        }
 
-        # 3) Иначе — первая eligible
-        first = eligible_models[0].get("id") or preferred_model
-        return first
+    def _chat_completion(
+        self,
+        *,
+        preferred_model: str,
+        messages: List[Dict],
+        temperature: float,
+        max_tokens: int,
+        input_modality: str = "text",
+        fallback_label: str = "",
+        client: Optional[OpenAI] = None,
+    ):
+        """
+        Запрос chat completion к OpenRouter с fallback на eligible модель
+        при guardrail/data policy 404.
+        client — клиент endpoint'а (по умолчанию основной self.client).
+        """
+        client = client or self.client
+        try:
+            return client.chat.completions.create(
+                extra_headers=self._openrouter_headers(),
+                model=preferred_model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens
+            )
+        except Exception as e:
+            # Если guardrails/privacy отфильтровали все endpoints под выбранную модель,
+            # пробуем выбрать модель, которая реально eligible для вашего ключа.
+            if not self._is_openrouter_guardrail_data_policy_404(e):
+                raise
+            alt_model_name = self._pick_openrouter_model(
+                preferred_model,
+                input_modality=input_modality,
+            )
+            if alt_model_name == preferred_model:
+                raise
+            print(f"🔁 OpenRouter {fallback_label}model fallback: {preferred_model} -> {alt_model_name}")
+            llm_telemetry.record_fallback("model")
+            try:
+                return client.chat.completions.create(
+                    extra_headers=self._openrouter_headers(),
+                    model=alt_model_name,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens
+                )
+            except Exception:
+                self.model_catalog.forget_fallback(preferred_model, input_modality)
+                raise
+
+    async def _chat_completion_async(
+        self,
+        *,
+        preferred_model: str,
+        messages: List[Dict],
+        temperature: float,
+        max_tokens: int,
+        input_modality: str = "text",
+        fallback_label: str = "",
+        client: Optional[AsyncOpenAI] = None,
+        **extra,
+    ):
+        """
+        Async-версия _chat_completion (AsyncOpenAI + httpx.AsyncClient).
+        extra пробрасывается в create (например, stream=True).
+        """
+        client = client or self.async_client
+        try:
+            return await client.chat.completions.create(
+                extra_headers=self._openrouter_headers(),
+                model=preferred_model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                **extra
+            )
+        except Exception as e:
+            if not self._is_openrouter_guardrail_data_policy_404(e):
+                raise
+            alt_model_name = await self._pick_openrouter_model_async(
+                preferred_model,
+                input_modality=input_modality,
+            )
+            if alt_model_name == preferred_model:
+                raise
+            print(f"🔁 OpenRouter {fallback_label}model fallback: {preferred_model} -> {alt_model_name}")
+            llm_telemetry.record_fallback("model")
+            try:
+                return await client.chat.completions.create(
+                    extra_headers=self._openrouter_headers(),
+                    model=alt_model_name,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    **extra
+                )
+            except Exception:
+                self.model_catalog.forget_fallback(preferred_model, input_modality)
+                raise
+
+    def _clients_for(self, endpoint: LLMEndpoint) -> tuple:
+        """(OpenAI, AsyncOpenAI) клиенты endpoint'а; у основного — self.client / self.async_client"""
+        if endpoint.base_url is None:
+            return self.client, self.async_client
+        clients = self._endpoint_clients.get(endpoint.name)
+        if clients is None:
+            clients = (
+                OpenAI(base_url=endpoint.base_url, api_key=endpoint.api_key,
+                       http_client=self.http_client, max_retries=self.llm_max_retries),
+                AsyncOpenAI(base_url=endpoint.base_url, api_key=endpoint.api_key,
+                            http_client=self.async_http_client, max_retries=self.llm_max_retries),
+            )
+            self._endpoint_clients[endpoint.name] = clients
+        return clients
+
+    def _endpoint_completion(self, endpoint: LLMEndpoint, messages: List[Dict], temperature: float, max_tokens: int):
+        """Chat completion через конкретный endpoint (для LLMRouter.call)"""
+        client, _ = self._clients_for(endpoint)
+        with llm_telemetry.track("chat", endpoint.model, endpoint.name, messages) as call:
+            if endpoint.kind == "ollama":
+                completion = client.chat.completions.create(
+                    **self._ollama_completion_kwargs(messages, temperature, max_tokens, model=endpoint.model)
+                )
+            else:
+                completion = self._chat_completion(
+                    preferred_model=endpoint.model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    client=client,
+                )
+            call.set_usage(completion)
+            return completion
+
+    async def _endpoint_completion_async(
+            self,
+            endpoint: LLMEndpoint,
+            messages: List[Dict],
+            temperature: float,
+            max_tokens: int,
+            **extra,
+    ):
+        """
+        Async-версия _endpoint_completion; extra пробрасывается в create (stream=True).
+        Потоковые вызовы телеметрия отслеживает в stream_response_async (до конца потока).
+        """
+        _, async_client = self._clients_for(endpoint)
+        if extra.get("stream"):
+            return await self._create_endpoint_completion_async(
+                endpoint, async_client, messages, temperature, max_tokens, **extra
+            )
+        with llm_telemetry.track("chat", endpoint.model, endpoint.name, messages) as call:
+            completion = await self._create_endpoint_completion_async(
+                endpoint, async_client, messages, temperature, max_tokens, **extra
+            )
+            call.set_usage(completion)
+            return completion
+
+    async def _create_endpoint_completion_async(
+            self,
+            endpoint: LLMEndpoint,
+            async_client: AsyncOpenAI,
+            messages: List[Dict],
+            temperature: float,
+            max_tokens: int,
+            **extra,
+    ):
+        if endpoint.kind == "ollama":
+            return await async_client.chat.completions.create(
+                **self._ollama_completion_kwargs(messages, temperature, max_tokens, model=endpoint.model),
+                **extra
+            )
+        return await self._chat_completion_async(
+            preferred_model=endpoint.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            client=async_client,
+            **extra
+        )
 
     def get_quick_response(self, question: str) -> Optional[str]:
         """Проверка быстрых ответов"""
@@ -246,13 +532,32 @@ class LLMService:
             system_prompt: str,
             user_question: str,
             conversation_history: List[Dict] = None,
-            max_tokens: int = 3000
+            max_tokens: int = 3000,
+            system_tokens: Optional[int] = None,
+            question_tokens: Optional[int] = None,
     ) -> List[Dict]:
         """
-        Подготовка сообщений для LLM с учетом истории и ограничения по токенам
+        Подготовка сообщений для LLM с учетом истории и ограничения по токенам.
+        system_tokens / question_tokens — уже посчитанные значения (чтобы не токенизировать повторно)
         """
+        return self._build_conversation_messages(
+            system_prompt, user_question, conversation_history, max_tokens, system_tokens, question_tokens,
+        )[0]
+
+    def _build_conversation_messages(
+            self,
+            system_prompt: str,
+            user_question: str,
+            conversation_history: Optional[List[Dict]],
+            max_tokens: int,
+            system_tokens: Optional[int],
+            question_tokens: Optional[int],
+    ) -> Tuple[List[Dict], int]:
+        """prepare_conversation_messages + число токенов собранного промпта"""
         messages = [{"role": "system", "content": system_prompt}]
-        current_tokens = self.count_tokens(system_prompt)
+        if system_tokens is None:
+            system_tokens = self.count_tokens(system_prompt)
+        current_tokens = system_tokens
 
         # Добавляем историю сообщений (если есть)
         if conversation_history:
@@ -265,14 +570,18 @@ class LLMService:
                     # Если это SQLAlchemy объект
                     role = msg.role
                     content = msg.content
+                    message_tokens = getattr(msg, 'token_count', None)
                 elif isinstance(msg, dict) and 'role' in msg and 'content' in msg:
                     # Если это словарь
                     role = msg['role']
                     content = msg['content']
+                    message_tokens = msg.get('token_count')
                 else:
                     continue
 
-                message_tokens = self.count_tokens(content)
+                # token_count сохраняется в БД при записи сообщения — повторно не токенизируем
+                if message_tokens is None:
+                    message_tokens = self.count_tokens(content)
 
                 # Проверяем, не превысим ли лимит
                 if current_tokens + history_tokens + message_tokens > max_tokens:
@@ -295,7 +604,7 @@ class LLMService:
             current_tokens += history_tokens
 
         # Добавляем текущий вопрос пользователя
-        user_tokens = self.count_tokens(user_question)
+        user_tokens = question_tokens if question_tokens is not None else self.count_tokens(user_question)
         messages.append({"role": "user", "content": user_question})
         current_tokens += user_tokens
 
@@ -304,9 +613,187 @@ class LLMService:
             messages = [messages[0]] + self._collapse_adjacent_same_role(messages[1:])
 
         print(
-            f"📊 Токены: система={self.count_tokens(system_prompt)}, история={current_tokens - self.count_tokens(system_prompt) - user_tokens}, вопрос={user_tokens}, всего={current_tokens}")
+            f"📊 Токены: система={system_tokens}, история={current_tokens - system_tokens - user_tokens}, вопрос={user_tokens}, всего={current_tokens}")
 
-        return messages
+        return messages, current_tokens
+
+    def _prepare_generation_messages(
+            self,
+            system_prompt: str,
+            user_question: str,
+            conversation_history: List[Dict] = None,
+            max_history_tokens: int = 3000,
+            space_context: Optional[str] = None,
+            file_context: Optional[str] = None,
+            conversation_summary: Optional[str] = None,
+    ) -> List[Dict]:
+        """Сообщения для генерации (см. _build_generation_prompt)"""
+        return self._build_generation_prompt(
+            system_prompt, user_question, conversation_history, max_history_tokens,
+            space_context, file_context, conversation_summary,
+        ).messages
+
+    def _build_generation_prompt(
+            self,
+            system_prompt: str,
+            user_question: str,
+            conversation_history: Optional[List[Dict]],
+            max_history_tokens: int,
+            space_context: Optional[str],
+            file_context: Optional[str],
+            conversation_summary: Optional[str],
+    ) -> GenerationPrompt:
+        """
+        Сборка промпта в пределах бюджета токенов (PromptBudget): system prompt и вопрос
+        целиком, затем текст файлов, краткое содержание беседы и история (квота
+        max_history_tokens), контекст пространства — что не помещается, обрезается или
+        отбрасывается, начиная с конца списка.
+        Вместе с сообщениями возвращаются уже посчитанные размеры промпта и вопроса,
+        чтобы выбор уровня модели и статистика не токенизировали промпт повторно.
+        """
+        # История: token_count из БД, для записей без него считаем один раз здесь
+        history: List[Dict] = []
+        for msg in conversation_history or []:
+            if isinstance(msg, dict):
+                role, content, tokens = msg.get('role'), msg.get('content'), msg.get('token_count')
+            else:
+                role, content, tokens = getattr(msg, 'role', None), getattr(msg, 'content', None), getattr(msg, 'token_count', None)
+            if role is None or content is None:
+                continue
+            if tokens is None:
+                tokens = self.count_tokens(content)
+            history.append({'role': role, 'content': content, 'token_count': tokens})
+
+        system = PromptSection("system", system_prompt, tokens=self.count_tokens(system_prompt))
+        question = PromptSection("question", user_question, tokens=self.count_tokens(user_question))
+        files = PromptSection(
+            "files", file_context, PRIORITY_FILES,
+            max_tokens=self.prompt_files_max_tokens, min_tokens=200,
+        )
+        summary = PromptSection(
+            "summary",
+            f"Краткое содержание предыдущей части беседы:\n{conversation_summary.strip()}" if conversation_summary else None,
+            PRIORITY_HISTORY, min_tokens=30,
+        )
+        history_section = PromptSection(
+            "history", priority=PRIORITY_HISTORY, max_tokens=max_history_tokens, keep=KEEP_EXTERNAL,
+            tokens=sum(m['token_count'] for m in history),
+        )
+        space = PromptSection(
+            "space", space_context.strip() if space_context else None, PRIORITY_SPACE_CONTEXT,
+            max_tokens=self.prompt_space_max_tokens, min_tokens=150, keep=KEEP_TAIL_LINES,
+        )
+        sections = [system, question, files, summary, history_section, space]
+        self.prompt_budget.allocate(sections)
+        print(f"🧮 Бюджет промпта: {PromptBudget.format_report(sections)}")
+
+        full_system = system_prompt
+        system_tokens = system.allocated
+        for extra in (summary, space):
+            if extra.text.strip():
+                full_system = f"{full_system.rstrip()}\n\n{extra.text}"
+                system_tokens += extra.allocated
+
+        # Подготавливаем сообщения с учетом ограничений по токенам
+        messages, prompt_tokens = self._build_conversation_messages(
+            full_system,
+            user_question + files.text,
+            history,
+            system_tokens + history_section.allocated,
+            system_tokens=system_tokens,
+            question_tokens=question.allocated + files.allocated,
+        )
+        return GenerationPrompt(messages, prompt_tokens, question.tokens)
+
+    def _ollama_completion_kwargs(
+            self,
+            messages: List[Dict],
+            temperature: float,
+            max_tokens: int,
+            model: Optional[str] = None,
+    ) -> Dict:
+        # Отключаем режим thinking для ускорения ответов
+        # Пользователь использует точные промпты, поэтому thinking не нужен
+        return {
+            "model": model or self.ollama_model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "extra_body": {
+                "options": {
+                    "thinking": False  # Отключаем режим thinking
+                }
+            },
+        }
+
+    @staticmethod
+    def _extract_response_text(completion) -> str:
+        if not completion.choices or len(completion.choices) == 0:
+            raise ValueError("LLM вернул пустой ответ")
+
+        response = completion.choices[0].message.content
+
+        if not response:
+            raise ValueError("LLM вернул пустое содержимое")
+
+        return response
+
+    @staticmethod
+    def _to_llm_error(exc: Exception) -> ValueError:
+        """Приведение ошибки провайдера к ValueError с понятным пользователю текстом."""
+        error_message = str(exc)
+
+        # Обработка ошибки 401 - неверный API ключ
+        if "401" in error_message or "User not found" in error_message or "authentication" in error_message.lower():
+            return ValueError("Неверный API ключ OpenRouter. Проверьте переменную OPENROUTER_API_KEY.")
+        elif "rate limit" in error_message.lower() or "quota" in error_message.lower() or "429" in error_message:
+            return ValueError("Превышен лимит запросов. Попробуйте позже.")
+        elif "timeout" in error_message.lower():
+            return ValueError("Превышено время ожидания. Попробуйте ещё раз.")
+        else:
+            return ValueError(f"Ошибка LLM: {error_message}")
+
+    def _select_tier(
+            self,
+            prompt: GenerationPrompt,
+            file_context: Optional[str],
+            conversation_summary: Optional[str],
+            category: Optional[str],
+            confidence: Optional[float],
+    ) -> LLMTier:
+        """Уровень модели для запроса (без LLM_FAST_MODEL — всегда основной)"""
+        default = self.llm_tiers[TIER_DEFAULT]
+        if TIER_FAST not in self.llm_tiers:
+            return default
+        signals = RoutingSignals(
+            category=category,
+            confidence=confidence,
+            question_tokens=prompt.question_tokens,
+            prompt_tokens=prompt.prompt_tokens,
+            history_messages=sum(1 for m in prompt.messages[:-1] if m['role'] != 'system'),
+            has_files=bool(file_context and file_context.strip()),
+            has_summary=bool(conversation_summary),
+        )
+        tier_name, reason = self.tiering.choose(signals)
+        print(f"🎚️ Уровень модели: {tier_name} ({reason})")
+        return self.llm_tiers[tier_name]
+
+    def _fallback_tier(self, tier: LLMTier, exc: Exception) -> Optional[LLMTier]:
+        """Основной уровень, если быстрый не справился (кроме ошибок самого запроса)"""
+        default = self.llm_tiers[TIER_DEFAULT]
+        if tier is default or is_request_error(exc):
+            tier.record_failure()
+            return None
+        tier.record_failure(fell_back=True)
+        llm_telemetry.record_fallback("tier")
+        print(f"🎚️ Уровень {tier.name} недоступен ({exc}), запрос идёт в {default.name}")
+        return default
+
+    def _record_tier_success(self, tier: LLMTier, started: float, prompt: GenerationPrompt, response: str) -> None:
+        # Размер промпта уже посчитан бюджетом; ответ токенизируем, только когда
+        # есть с чем сравнивать (LLM_FAST_MODEL), иначе completion_tokens не ведётся
+        completion_tokens = self.count_tokens(response) if TIER_FAST in self.llm_tiers else 0
+        tier.record_success(time.monotonic() - started, prompt.prompt_tokens, completion_tokens)
 
     def generate_response(
             self,
@@ -315,6 +802,10 @@ class LLMService:
             conversation_history: List[Dict] = None,
             max_history_tokens: int = 3000,
             space_context: Optional[str] = None,
+            file_context: Optional[str] = None,
+            conversation_summary: Optional[str] = None,
+            category: Optional[str] = None,
+            confidence: Optional[float] = None,
     ) -> str:
         """
         Генерация ответа через LLM с учетом истории сообщений
@@ -325,106 +816,217 @@ class LLMService:
             conversation_history: История сообщений (из БД)
             max_history_tokens: Максимальное количество токенов для истории
             space_context: Доп. блок (контекст пространства), добавляется к system prompt
+            file_context: Текст прикреплённых файлов, добавляется к вопросу (в пределах бюджета промпта)
+            conversation_summary: Краткое содержание ранней части беседы (chats.summary)
+            category, confidence: Категория вопроса и уверенность классификатора (выбор уровня модели)
 
         Returns:
             Ответ от LLM или None в случае ошибки
         """
         try:
-            full_system = system_prompt
-            if space_context and space_context.strip():
-                full_system = f"{system_prompt.rstrip()}\n\n{space_context.strip()}"
-
-            # Подготавливаем сообщения с учетом ограничений по токенам
-            messages = self.prepare_conversation_messages(
-                full_system,
-                user_question,
-                conversation_history,
-                max_history_tokens
+            prompt = self._build_generation_prompt(
+                system_prompt, user_question, conversation_history, max_history_tokens,
+                space_context, file_context, conversation_summary,
             )
+            messages = prompt.messages
+            tier = self._select_tier(prompt, file_context, conversation_summary, category, confidence)
 
-            # Определяем модель в зависимости от используемого API
-            use_ollama = os.getenv("USE_OLLAMA", "false").lower() == "true"
-            
-            if use_ollama:
-                # Использование Ollama
-                model_name = self.ollama_model
-                # Отключаем режим thinking для ускорения ответов
-                # Пользователь использует точные промпты, поэтому thinking не нужен
-                completion = self.client.chat.completions.create(
-                    model=model_name,
-                    messages=messages,
-                    temperature=0.5,
-                    max_tokens=1000,
-                    extra_body={
-                        "options": {
-                            "thinking": False  # Отключаем режим thinking
-                        }
-                    }
-                )
-            else:
-                # Использование OpenRouter API
-                preferred_model_name = os.getenv("OPENROUTER_MODEL", "openai/gpt-oss-120b:free")
-                model_name = preferred_model_name
+            while True:
+                started = time.monotonic()
                 try:
-                    completion = self.client.chat.completions.create(
-                        extra_headers={
-                            "HTTP-Referer": self.app_url,
-                            "X-OpenRouter-Title": "Business Assistant",
-                        },
-                        model=model_name,
-                        messages=messages,
-                        temperature=0.5,
-                        max_tokens=1000
+                    # Endpoint выбирает LLMRouter уровня; пустой ответ — тоже повод переключиться
+                    response = tier.router.call(
+                        lambda endpoint: self._extract_response_text(
+                            self._endpoint_completion(endpoint, messages, temperature=0.5, max_tokens=tier.max_tokens)
+                        )
                     )
                 except Exception as e:
-                    # Если guardrails/privacy отфильтровали все endpoints под выбранную модель,
-                    # пробуем выбрать модель, которая реально eligible для вашего ключа.
-                    if self._is_openrouter_guardrail_data_policy_404(e):
-                        alt_model_name = self._pick_openrouter_model(
-                            preferred_model_name,
-                            input_modality="text",
-                        )
-                        if alt_model_name != model_name:
-                            print(f"🔁 OpenRouter model fallback: {model_name} -> {alt_model_name}")
-                            completion = self.client.chat.completions.create(
-                                extra_headers={
-                                    "HTTP-Referer": self.app_url,
-                                    "X-OpenRouter-Title": "Business Assistant",
-                                },
-                                model=alt_model_name,
-                                messages=messages,
-                                temperature=0.5,
-                                max_tokens=1000
-                            )
-                        else:
-                            raise
-                    else:
+                    tier = self._fallback_tier(tier, e)
+                    if tier is None:
                         raise
-
-            if not completion.choices or len(completion.choices) == 0:
-                raise ValueError("LLM вернул пустой ответ")
-
-            response = completion.choices[0].message.content
-            
-            if not response:
-                raise ValueError("LLM вернул пустое содержимое")
-
-            return response
+                    continue
+                self._record_tier_success(tier, started, prompt, response)
+                return response
 
         except ValueError as e:
             raise
         except Exception as e:
-            error_message = str(e)
-            
-            # Обработка ошибки 401 - неверный API ключ
-            if "401" in error_message or "User not found" in error_message or "authentication" in error_message.lower():
-                raise ValueError("Неверный API ключ OpenRouter. Проверьте переменную OPENROUTER_API_KEY.")
-            elif "rate limit" in error_message.lower() or "quota" in error_message.lower() or "429" in error_message:
-                raise ValueError("Превышен лимит запросов. Попробуйте позже.")
-            elif "timeout" in error_message.lower():
-                raise ValueError("Превышено время ожидания. Попробуйте ещё раз.")
-            else:
-                raise ValueError(f"Ошибка LLM: {error_message}")
+            raise self._to_llm_error(e)
+
+    async def generate_response_async(
+            self,
+            system_prompt: str,
+            user_question: str,
+            conversation_history: List[Dict] = None,
+            max_history_tokens: int = 3000,
+            space_context: Optional[str] = None,
+            file_context: Optional[str] = None,
+            conversation_summary: Optional[str] = None,
+            tenant: Optional[str] = None,
+            priority: int = PRIORITY_INTERACTIVE,
+            category: Optional[str] = None,
+            confidence: Optional[float] = None,
+    ) -> str:
+        """
+        Async-версия generate_response: запрос к провайдеру идёт через AsyncOpenAI,
+        поэтому event loop не блокируется на время генерации.
+
+        Одновременные запросы с одинаковым итоговым промптом объединяются (single-flight):
+        к провайдеру уходит один запрос, ответ получают все ожидающие.
+        Сам вызов провайдера проходит через llm_scheduler (tenant — "user:<id>" или
+        "public:<token>", priority — класс приоритета).
+        При LLM_HEDGE_ENABLED=true медленный запрос дублируется на другой endpoint
+        (см. RequestHedger), берётся первый ответ.
+        category/confidence — сигналы для выбора уровня модели (см. model_tiering).
+
+        Raises:
+            LLMQueueFullError: очередь к LLM переполнена
+        """
+        prompt = self._build_generation_prompt(
+            system_prompt, user_question, conversation_history, max_history_tokens,
+            space_context, file_context, conversation_summary,
+        )
+        messages = prompt.messages
+        selected_tier = self._select_tier(prompt, file_context, conversation_summary, category, confidence)
+
+        async def generate() -> str:
+            async with llm_scheduler.slot(tenant or "system", priority):
+                tier = selected_tier
+                while True:
+                    started = time.monotonic()
+                    try:
+                        response = await call_provider(tier)
+                    except Exception as e:
+                        tier = self._fallback_tier(tier, e)
+                        if tier is None:
+                            if isinstance(e, ValueError):
+                                raise
+                            raise self._to_llm_error(e)
+                        continue
+                    self._record_tier_success(tier, started, prompt, response)
+                    return response
+
+        async def call_provider(tier: LLMTier) -> str:
+            async def call_endpoint(endpoint: LLMEndpoint) -> str:
+                completion = await self._endpoint_completion_async(
+                    endpoint, messages, temperature=0.5, max_tokens=tier.max_tokens
+                )
+                return self._extract_response_text(completion)
+
+            router = tier.router
+            ordered = router.ordered_endpoints()
+            if len(ordered) < 2:
+                # Хедж на тот же endpoint и модель только удвоил бы нагрузку
+                return await router.call_async(call_endpoint)
+
+            # Хедж идёт на другой endpoint, чем выберет основной запрос, и занимает
+            # свой слот llm_scheduler: общий лимит одновременных вызовов не превышается
+            hedge_exclude = {ordered[0].name}
+
+            async def hedge() -> str:
+                async with llm_scheduler.slot(tenant or "system", priority):
+                    return await router.call_async(call_endpoint, exclude=hedge_exclude)
+
+            return await self.hedger.run(lambda: router.call_async(call_endpoint), hedge)
+
+        endpoint_names = [endpoint.name for endpoint in selected_tier.router.endpoints]
+        flight_key = make_flight_key(endpoint_names, messages, 0.5, selected_tier.max_tokens)
+        return await self.single_flight.do(flight_key, generate)
+
+    async def stream_response_async(
+            self,
+            system_prompt: str,
+            user_question: str,
+            conversation_history: List[Dict] = None,
+            max_history_tokens: int = 3000,
+            space_context: Optional[str] = None,
+            file_context: Optional[str] = None,
+            conversation_summary: Optional[str] = None,
+            tenant: Optional[str] = None,
+            priority: int = PRIORITY_INTERACTIVE,
+            category: Optional[str] = None,
+            confidence: Optional[float] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Потоковая генерация ответа (stream=True): отдаёт текстовые фрагменты
+        по мере их получения от провайдера. Слот llm_scheduler занят до конца потока.
+
+        Raises:
+            ValueError: ошибка провайдера (тот же текст, что и в generate_response)
+                или пустой ответ
+            LLMQueueFullError: очередь к LLM переполнена
+        """
+        prompt = self._build_generation_prompt(
+            system_prompt, user_question, conversation_history, max_history_tokens,
+            space_context, file_context, conversation_summary,
+        )
+        messages = prompt.messages
+        tier = self._select_tier(prompt, file_context, conversation_summary, category, confidence)
+        received: List[str] = []
+        async with llm_scheduler.slot(tenant or "system", priority):
+            while True:
+                router = tier.router
+                last_error: Optional[Exception] = None
+                tier_started = time.monotonic()
+                # Переключение на следующий endpoint (и уровень) возможно только до первого
+                # фрагмента: отданный клиенту текст уже не отозвать
+                for endpoint in router.ordered_endpoints():
+                    if not router.acquire(endpoint):
+                        continue
+                    started = time.monotonic()
+                    call = llm_telemetry.start("chat_stream", endpoint.model, endpoint.name, messages)
+                    try:
+                        stream = await self._endpoint_completion_async(
+                            endpoint, messages, temperature=0.5, max_tokens=tier.max_tokens, stream=True
+                        )
+                        async for chunk in stream:
+                            if getattr(chunk, "usage", None) is not None:
+                                call.set_usage(chunk)
+                            if not chunk.choices:
+                                continue
+                            delta_text = getattr(chunk.choices[0].delta, "content", None)
+                            if delta_text:
+                                call.mark_first_token()
+                                received.append(delta_text)
+                                yield delta_text
+                    except Exception as e:
+                        call.set_completion_text("".join(received))
+                        llm_telemetry.finish(call, e)
+                        if received or is_request_error(e):
+                            if is_request_error(e):
+                                router.release(endpoint)
+                            else:
+                                # Обрыв посреди потока — отказ endpoint'а (здоровье, circuit breaker),
+                                # но переключаться уже поздно: часть ответа отдана клиенту
+                                router.record_failure(endpoint, time.monotonic() - started)
+                            tier.record_failure()
+                            raise self._to_llm_error(e)
+                        router.record_failure(endpoint, time.monotonic() - started)
+                        router.note_failover(endpoint, e)
+                        last_error = e
+                        continue
+                    except BaseException as e:
+                        # Клиент отключился посреди потока
+                        call.set_completion_text("".join(received))
+                        llm_telemetry.finish(call, e)
+                        router.release(endpoint)
+                        raise
+                    if received:
+                        call.set_completion_text("".join(received))
+                        llm_telemetry.finish(call)
+                        router.record_success(endpoint, time.monotonic() - started)
+                        self._record_tier_success(tier, tier_started, prompt, "".join(received))
+                        return
+                    last_error = ValueError("LLM вернул пустое содержимое")
+                    llm_telemetry.finish(call, last_error)
+                    router.record_failure(endpoint, time.monotonic() - started)
+
+                error = router.no_endpoint_error(last_error)
+                tier = self._fallback_tier(tier, error)
+                if tier is None:
+                    break
+
+        raise error if isinstance(error, ValueError) else self._to_llm_error(error)
 
     def generate_response_with_context(
             self,
@@ -437,105 +1039,140 @@ class LLMService:
         """
         return self.generate_response(system_prompt, user_question, context_messages)
 
-    def summarize_conversation(self, conversation_history: List[Dict]) -> str:
+    @staticmethod
+    def _build_summary_messages(
+            conversation_history: List[Dict],
+            previous_summary: Optional[str] = None,
+            max_messages: Optional[int] = 10,
+    ) -> List[Dict]:
+        if previous_summary:
+            # Инкрементальное обновление: прежнее краткое содержание + новые сообщения
+            summary_prompt = f"""
+            Обнови краткое содержание беседы с учётом новых сообщений. Сохрани важные факты,
+            темы и решения из прежнего содержания, добавь новые. Не больше 5-6 предложений.
+
+            Прежнее краткое содержание:
+            {previous_summary}
+
+            Новые сообщения:
+            """
+        else:
+            summary_prompt = """
+            Суммаризуй следующую беседу в 2-3 предложениях, выделив основные темы и решения.
+            Сохрани контекст для будущих вопросов.
+
+            Беседа:
+            """
+
+        # Берем только часть истории для суммаризации (max_messages=None — всю переданную)
+        recent_history = conversation_history[-max_messages:] if max_messages else conversation_history
+
+        conversation_text = ""
+        for msg in recent_history:
+            if hasattr(msg, 'role') and hasattr(msg, 'content'):
+                role = "Пользователь" if msg.role == "user" else "Ассистент"
+                conversation_text += f"{role}: {msg.content}\n"
+            elif isinstance(msg, dict):
+                role = "Пользователь" if msg.get('role') == "user" else "Ассистент"
+                conversation_text += f"{role}: {msg.get('content', '')}\n"
+
+        summary_prompt += conversation_text
+
+        return [
+            {"role": "system", "content": "Ты помогаешь суммаризировать беседы."},
+            {"role": "user", "content": summary_prompt}
+        ]
+
+    def _summary_request(
+            self,
+            conversation_history: List[Dict],
+            previous_summary: Optional[str],
+            min_messages: int,
+            max_messages: Optional[int],
+    ) -> Optional[tuple]:
+        """(use_ollama, model, messages) запроса суммаризации; None — суммаризация не нужна"""
+        if not conversation_history or len(conversation_history) < min_messages:
+            return None
+
+        messages = self._build_summary_messages(conversation_history, previous_summary, max_messages)
+
+        # Провайдер тот же, что у self.client (выбран в __init__), а не повторное чтение USE_OLLAMA
+        use_ollama = self.ollama_model is not None
+        model = self.ollama_model if use_ollama else os.getenv("OPENROUTER_MODEL", "openai/gpt-oss-120b:free")
+        return use_ollama, model, messages
+
+    def summarize_conversation(
+            self,
+            conversation_history: List[Dict],
+            previous_summary: Optional[str] = None,
+            min_messages: int = 5,
+            max_messages: Optional[int] = 10,
+    ) -> str:
         """
         Суммаризация длинной беседы для сохранения контекста
 
         Args:
-            conversation_history: Полная история беседы
+            conversation_history: Полная история беседы (или новые сообщения при previous_summary)
+            previous_summary: Прежнее краткое содержание — оно дополняется новыми сообщениями
+            min_messages: Меньше сообщений — суммаризация не нужна
+            max_messages: Сколько последних сообщений учитывать (None — все)
 
         Returns:
             Краткое содержание беседы
         """
-        if not conversation_history or len(conversation_history) < 5:
-            return ""
-
         try:
-            summary_prompt = """
-            Суммаризуй следующую беседу в 2-3 предложениях, выделив основные темы и решения.
-            Сохрани контекст для будущих вопросов.
+            request = self._summary_request(conversation_history, previous_summary, min_messages, max_messages)
+            if request is None:
+                return ""
+            use_ollama, model, messages = request
 
-            Беседа:
-            """
+            with llm_telemetry.track("summary", model, messages=messages) as call:
+                if use_ollama:
+                    completion = self.client.chat.completions.create(
+                        **self._ollama_completion_kwargs(messages, **SUMMARY_PARAMS)
+                    )
+                else:
+                    completion = self._chat_completion(
+                        preferred_model=model,
+                        messages=messages,
+                        fallback_label="summarization ",
+                        **SUMMARY_PARAMS,
+                    )
+                call.set_usage(completion)
 
-            # Берем только часть истории для суммаризации
-            recent_history = conversation_history[-10:]  # последние 10 сообщений
+            return completion.choices[0].message.content
 
-            conversation_text = ""
-            for msg in recent_history:
-                if hasattr(msg, 'role') and hasattr(msg, 'content'):
-                    role = "Пользователь" if msg.role == "user" else "Ассистент"
-                    conversation_text += f"{role}: {msg.content}\n"
-                elif isinstance(msg, dict):
-                    role = "Пользователь" if msg.get('role') == "user" else "Ассистент"
-                    conversation_text += f"{role}: {msg.get('content', '')}\n"
+        except Exception as e:
+            print(f"❌ Ошибка суммаризации: {e}")
+            return ""
 
-            summary_prompt += conversation_text
+    async def summarize_conversation_async(
+            self,
+            conversation_history: List[Dict],
+            previous_summary: Optional[str] = None,
+            min_messages: int = 5,
+            max_messages: Optional[int] = 10,
+    ) -> str:
+        """Async-версия summarize_conversation."""
+        try:
+            request = self._summary_request(conversation_history, previous_summary, min_messages, max_messages)
+            if request is None:
+                return ""
+            use_ollama, model, messages = request
 
-            # Определяем модель в зависимости от используемого API
-            use_ollama = os.getenv("USE_OLLAMA", "false").lower() == "true"
-            
-            if use_ollama:
-                # Использование Ollama
-                model_name = self.ollama_model
-                # Отключаем режим thinking для ускорения ответов
-                completion = self.client.chat.completions.create(
-                    model=model_name,
-                    messages=[
-                        {"role": "system", "content": "Ты помогаешь суммаризировать беседы."},
-                        {"role": "user", "content": summary_prompt}
-                    ],
-                    temperature=0.3,
-                    max_tokens=300,
-                    extra_body={
-                        "options": {
-                            "thinking": False  # Отключаем режим thinking
-                        }
-                    }
-                )
-            else:
-                # Использование OpenRouter API
-                preferred_model_name = os.getenv("OPENROUTER_MODEL", "openai/gpt-oss-120b:free")
-                model_name = preferred_model_name
-                try:
-                    completion = self.client.chat.completions.create(
-                        extra_headers={
-                            "HTTP-Referer": self.app_url,
-                            "X-OpenRouter-Title": "Business Assistant",
-                        },
-                        model=model_name,
-                        messages=[
-                            {"role": "system", "content": "Ты помогаешь суммаризировать беседы."},
-                            {"role": "user", "content": summary_prompt}
-                        ],
-                        temperature=0.3,
-                        max_tokens=300
+            with llm_telemetry.track("summary", model, messages=messages) as call:
+                if use_ollama:
+                    completion = await self.async_client.chat.completions.create(
+                        **self._ollama_completion_kwargs(messages, **SUMMARY_PARAMS)
                     )
-                except Exception as e:
-                    if self._is_openrouter_guardrail_data_policy_404(e):
-                        alt_model_name = self._pick_openrouter_model(
-                            preferred_model_name,
-                            input_modality="text",
-                        )
-                        if alt_model_name != model_name:
-                            print(f"🔁 OpenRouter summarization model fallback: {model_name} -> {alt_model_name}")
-                            completion = self.client.chat.completions.create(
-                                extra_headers={
-                                    "HTTP-Referer": self.app_url,
-                                    "X-OpenRouter-Title": "Business Assistant",
-                                },
-                                model=alt_model_name,
-                                messages=[
-                                    {"role": "system", "content": "Ты помогаешь суммаризировать беседы."},
-                                    {"role": "user", "content": summary_prompt}
-                                ],
-                                temperature=0.3,
-                                max_tokens=300
-                            )
-                        else:
-                            raise
-                    else:
-                        raise
+                else:
+                    completion = await self._chat_completion_async(
+                        preferred_model=model,
+                        messages=messages,
+                        fallback_label="summarization ",
+                        **SUMMARY_PARAMS,
+                    )
+                call.set_usage(completion)
 
             return completion.choices[0].message.content
 
@@ -612,21 +1249,23 @@ class LLMService:
                     except Exception as e:
                         error[0] = e
                 
-                thread = threading.Thread(target=transcribe_with_timeout, daemon=True)
-                thread.start()
-                # Увеличиваем таймаут до 300 секунд (5 минут) чтобы учесть время загрузки модели
-                thread.join(timeout=300)
-                
-                if thread.is_alive():
-                    print("⏱️ Транскрибация превысила таймаут (300 сек), переключаемся на API...")
-                    raise TimeoutError("Транскрибация превысила таймаут")
-                
-                if error[0]:
-                    raise error[0]
-                
-                if result[0] is None:
-                    raise ValueError("Транскрибация не вернула результат")
-                
+                with llm_telemetry.track("transcription", "whisper-local", "local") as call:
+                    call.extra["audio_bytes"] = len(audio_bytes)
+                    thread = threading.Thread(target=transcribe_with_timeout, daemon=True)
+                    thread.start()
+                    # Увеличиваем таймаут до 300 секунд (5 минут) чтобы учесть время загрузки модели
+                    thread.join(timeout=300)
+
+                    if thread.is_alive():
+                        print("⏱️ Транскрибация превысила таймаут (300 сек), переключаемся на API...")
+                        raise TimeoutError("Транскрибация превысила таймаут")
+
+                    if error[0]:
+                        raise error[0]
+
+                    if result[0] is None:
+                        raise ValueError("Транскрибация не вернула результат")
+
                 return result[0]
                 
             except (TimeoutError, ValueError, Exception) as e:
@@ -639,11 +1278,13 @@ class LLMService:
                     try:
                         audio_file = io.BytesIO(audio_bytes)
                         audio_file.name = filename
-                        transcript = self.whisper_client.audio.transcriptions.create(
-                            model="whisper-1",
-                            file=audio_file,
-                            language=language
-                        )
+                        with llm_telemetry.track("transcription", "whisper-1", "api") as call:
+                            call.extra["audio_bytes"] = len(audio_bytes)
+                            transcript = self.whisper_client.audio.transcriptions.create(
+                                model="whisper-1",
+                                file=audio_file,
+                                language=language
+                            )
                         print("✅ Транскрибация через Whisper API успешна")
                         return transcript.text
                     except Exception as api_error:
@@ -660,11 +1301,13 @@ class LLMService:
             
             try:
                 # Отправляем в Whisper API
-                transcript = self.whisper_client.audio.transcriptions.create(
-                    model="whisper-1",
-                    file=audio_file,
-                    language=language
-                )
+                with llm_telemetry.track("transcription", "whisper-1", "api") as call:
+                    call.extra["audio_bytes"] = len(audio_bytes)
+                    transcript = self.whisper_client.audio.transcriptions.create(
+                        model="whisper-1",
+                        file=audio_file,
+                        language=language
+                    )
                 
                 return transcript.text
             except Exception as e:
@@ -678,6 +1321,46 @@ class LLMService:
                 "или установите OPENAI_API_KEY для использования API"
             )
 
+    @staticmethod
+    def _build_vision_messages(image_base64: str, prompt: str, mime_type: str) -> List[Dict]:
+        # Формируем data URL для изображения
+        image_data_url = f"data:{mime_type};base64,{image_base64}"
+
+        system_prompt = "Ты — эксперт по анализу изображений. Описывай содержимое изображений подробно и точно. Если на изображении есть текст, извлеки его полностью. Если это график или диаграмма, опиши данные."
+
+        # Используем формат для vision API: content как массив объектов
+        return [
+            {
+                "role": "system",
+                "content": system_prompt
+            },
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": prompt
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": image_data_url
+                        }
+                    }
+                ]
+            }
+        ]
+
+    @staticmethod
+    def _vision_result(completion, provider_label: str) -> Optional[str]:
+        """Текст ответа vision-модели; None — пустой ответ (пробуем следующий провайдер)"""
+        if completion.choices and len(completion.choices) > 0:
+            result = completion.choices[0].message.content
+            if result:
+                print(f"✅ Изображение проанализировано через {provider_label}")
+                return result
+        return None
+
     def analyze_image(self, image_base64: str, prompt: str, mime_type: str = "image/jpeg") -> str:
         """
         Анализирует изображение через LLM с поддержкой vision
@@ -691,120 +1374,108 @@ class LLMService:
             Результат анализа изображения
         """
         try:
-            # Формируем data URL для изображения
-            image_data_url = f"data:{mime_type};base64,{image_base64}"
-            
-            system_prompt = "Ты — эксперт по анализу изображений. Описывай содержимое изображений подробно и точно. Если на изображении есть текст, извлеки его полностью. Если это график или диаграмма, опиши данные."
-            
-            # Используем формат для vision API: content как массив объектов
-            messages = [
-                {
-                    "role": "system",
-                    "content": system_prompt
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": prompt
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": image_data_url
-                            }
-                        }
-                    ]
-                }
-            ]
-            
-            # Пробуем использовать vision-модель через OpenRouter
-            # Многие модели на OpenRouter поддерживают vision, например:
-            # - openai/gpt-4-vision-preview
-            # - google/gemini-pro-vision
-            # - anthropic/claude-3-opus
-            # - qwen/qwen-vl-plus
+            messages = self._build_vision_messages(image_base64, prompt, mime_type)
             
             # Сначала пробуем через OpenRouter с vision-моделью
+            # (модель должна поддерживать input_modality="image")
             try:
-                preferred_vision_model = os.getenv("OPENROUTER_VISION_MODEL", "openai/gpt-4o-mini")
-                try:
-                    completion = self.client.chat.completions.create(
-                        extra_headers={
-                            "HTTP-Referer": self.app_url,
-                            "X-OpenRouter-Title": "Business Assistant",
-                        },
-                        # Модель должна поддерживать vision (input_modality="image")
-                        model=preferred_vision_model,
+                vision_model = os.getenv("OPENROUTER_VISION_MODEL", VISION_OPENAI_MODEL)
+                with llm_telemetry.track("vision", vision_model, "openrouter", messages) as call:
+                    completion = self._chat_completion(
+                        preferred_model=vision_model,
                         messages=messages,
-                        temperature=0.7,
-                        max_tokens=1000
+                        input_modality="image",
+                        fallback_label="vision ",
+                        **VISION_PARAMS,
                     )
-                except Exception as e:
-                    if self._is_openrouter_guardrail_data_policy_404(e):
-                        alt_model_name = self._pick_openrouter_model(
-                            preferred_vision_model,
-                            input_modality="image",
-                        )
-                        if alt_model_name != preferred_vision_model:
-                            print(f"🔁 OpenRouter vision model fallback: {preferred_vision_model} -> {alt_model_name}")
-                            completion = self.client.chat.completions.create(
-                                extra_headers={
-                                    "HTTP-Referer": self.app_url,
-                                    "X-OpenRouter-Title": "Business Assistant",
-                                },
-                                model=alt_model_name,
-                                messages=messages,
-                                temperature=0.7,
-                                max_tokens=1000
-                            )
-                        else:
-                            raise
-                    else:
-                        raise
+                    call.set_usage(completion)
                 
-                if completion.choices and len(completion.choices) > 0:
-                    result = completion.choices[0].message.content
-                    if result:
-                        print(f"✅ Изображение проанализировано через OpenRouter")
-                        return result
+                result = self._vision_result(completion, "OpenRouter")
+                if result:
+                    return result
             except Exception as e:
                 print(f"⚠️ Ошибка анализа через OpenRouter vision: {e}")
-                # Fallback на OpenAI API если доступен
-                pass
             
             # Fallback: используем OpenAI API напрямую, если доступен
             openai_api_key = os.getenv("OPENAI_API_KEY")
             if openai_api_key:
                 try:
-                    openai_timeout = httpx.Timeout(60.0, connect=30.0)
-                    openai_http_client = httpx.Client(timeout=openai_timeout)
-                    openai_client = OpenAI(
-                        api_key=openai_api_key,
-                        http_client=openai_http_client
-                    )
-                    
-                    completion = openai_client.chat.completions.create(
-                        model="gpt-4o-mini",  # GPT-4o-mini поддерживает vision
-                        messages=messages,
-                        temperature=0.7,
-                        max_tokens=1000
-                    )
+                    with httpx.Client(timeout=VISION_OPENAI_TIMEOUT) as openai_http_client:
+                        openai_client = OpenAI(api_key=openai_api_key, http_client=openai_http_client)
+                        with llm_telemetry.track("vision", VISION_OPENAI_MODEL, "openai", messages) as call:
+                            completion = openai_client.chat.completions.create(
+                                model=VISION_OPENAI_MODEL,
+                                messages=messages,
+                                **VISION_PARAMS,
+                            )
+                            call.set_usage(completion)
                     
-                    if completion.choices and len(completion.choices) > 0:
-                        result = completion.choices[0].message.content
-                        if result:
-                            print(f"✅ Изображение проанализировано через OpenAI API")
-                            return result
+                    result = self._vision_result(completion, "OpenAI API")
+                    if result:
+                        return result
                 except Exception as e:
                     print(f"⚠️ Ошибка анализа через OpenAI API: {e}")
             
             # Если ничего не сработало, возвращаем сообщение об ошибке
-            return "Не удалось проанализировать изображение. Убедитесь, что настроен OPENAI_API_KEY или используется модель с поддержкой vision."
+            return VISION_UNAVAILABLE_MESSAGE
             
         except Exception as e:
             print(f"❌ Ошибка анализа изображения: {e}")
             import traceback
             traceback.print_exc()
-            return f"Ошибка анализа изображения: {str(e)}"
\ No newline at end of file
+            return f"Ошибка анализа изображения: {str(e)}"
+
+    async def analyze_image_async(self, image_base64: str, prompt: str, mime_type: str = "image/jpeg") -> str:
+        """Async-версия analyze_image (OpenRouter vision + fallback на OpenAI API)."""
+        try:
+            messages = self._build_vision_messages(image_base64, prompt, mime_type)
+
+            try:
+                vision_model = os.getenv("OPENROUTER_VISION_MODEL", VISION_OPENAI_MODEL)
+                with llm_telemetry.track("vision", vision_model, "openrouter", messages) as call:
+                    completion = await self._chat_completion_async(
+                        preferred_model=vision_model,
+                        messages=messages,
+                        input_modality="image",
+                        fallback_label="vision ",
+                        **VISION_PARAMS,
+                    )
+                    call.set_usage(completion)
+
+                result = self._vision_result(completion, "OpenRouter")
+                if result:
+                    return result
+            except Exception as e:
+                print(f"⚠️ Ошибка анализа через OpenRouter vision: {e}")
+
+            openai_api_key = os.getenv("OPENAI_API_KEY")
+            if openai_api_key:
+                try:
+                    async with httpx.AsyncClient(timeout=VISION_OPENAI_TIMEOUT) as openai_http_client:
+                        openai_client = AsyncOpenAI(api_key=openai_api_key, http_client=openai_http_client)
+                        with llm_telemetry.track("vision", VISION_OPENAI_MODEL, "openai", messages) as call:
+                            completion = await openai_client.chat.completions.create(
+                                model=VISION_OPENAI_MODEL,
+                                messages=messages,
+                                **VISION_PARAMS,
+                            )
+                            call.set_usage(completion)
+
+                    result = self._vision_result(completion, "OpenAI API")
+                    if result:
+                        return result
+                except Exception as e:
+                    print(f"⚠️ Ошибка анализа через OpenAI API: {e}")
+
+            return VISION_UNAVAILABLE_MESSAGE
+
+        except Exception as e:
+            print(f"❌ Ошибка анализа изображения: {e}")
+            import traceback
+            traceback.print_exc()
+            return f"Ошибка анализа изображения: {str(e)}"
+
+    async def aclose(self):
+        """Закрывает HTTP-клиенты (вызывается при остановке приложения, см. service_registry)."""
+        await self.async_http_client.aclose()
+        self.http_client.close()
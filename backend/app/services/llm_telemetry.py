@@ -0,0 +1,400 @@
+"""
+Телеметрия вызовов LLM: латентность, TTFT, скорость генерации, токены, ошибки.
+
+Раньше о работе LLMService можно было судить только по print («📊 Токены: …»):
+ни p95 латентности по моделям, ни расхода токенов по пространствам. Теперь каждый
+запрос к провайдеру (генерация, потоковая генерация, summary, анализ изображений,
+транскрибация) оборачивается в llm_telemetry.track(...):
+
+    with llm_telemetry.track("chat", model=endpoint.model, endpoint=endpoint.name) as call:
+        completion = client.chat.completions.create(...)
+        call.set_usage(completion)
+
+По завершении обновляются метрики (экспорт в формате Prometheus — /api/metrics) и
+пишется одна строка структурированного лога (JSON, LLM_TELEMETRY_LOG):
+
+- llm_requests_total{operation, model, outcome}
+- llm_request_duration_seconds{operation, model} — гистограмма полной длительности
+- llm_time_to_first_token_seconds{operation, model} — для потоковых ответов
+- llm_generation_tokens_per_second{operation, model}
+- llm_tokens_total{operation, model, kind=prompt|completion} — из поля usage ответа,
+  если провайдер его не вернул — оценка по тексту
+- llm_space_tokens_total{space_id, kind} — расход по пространствам (не больше
+  LLM_METRICS_MAX_SPACES разных значений, остальные — "other")
+- llm_errors_total{operation, model, error_class} — таксономия ошибок (classify_error)
+- llm_fallbacks_total{kind} — переключения: endpoint (LLMRouter), tier (model_tiering),
+  model (guardrail-fallback OpenRouter)
+
+Пространство, чат и tenant запроса берутся из контекста (bind_context): роуты
+задают их один раз, и они доходят до вызовов LLM, в том числе фоновых (summary).
+Метрики хранятся в процессе: при нескольких воркерах каждый отдаёт свои.
+"""
+
+import json
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from backend.app.utils.tokens import count_tokens
+
+DURATION_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+TTFT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+TOKENS_PER_SECOND_BUCKETS = (1, 5, 10, 20, 40, 80, 160, 320)
+
+_request_context: ContextVar[Dict[str, Any]] = ContextVar("llm_request_context", default={})
+
+
+def bind_context(**fields) -> None:
+    """Добавить поля (space_id, chat_id, tenant, …) к телеметрии вызовов LLM текущего запроса"""
+    context = dict(_request_context.get())
+    context.update({key: value for key, value in fields.items() if value is not None})
+    _request_context.set(context)
+
+
+def current_context() -> Dict[str, Any]:
+    return _request_context.get()
+
+
+def classify_error(exc: BaseException) -> str:
+    """Класс ошибки для метрик (без импорта openai: SDK грузится лениво)"""
+    name = type(exc).__name__
+    status = getattr(exc, "status_code", None)
+    text = str(exc).lower()
+    if name in ("CancelledError", "GeneratorExit"):
+        return "cancelled"
+    if name == "LLMUnavailableError":
+        return "unavailable"
+    if "timeout" in name.lower() or "timeout" in text or "timed out" in text:
+        return "timeout"
+    if status == 429 or "rate limit" in text or "429" in text:
+        return "rate_limit"
+    if status in (401, 403) or "authentication" in text:
+        return "auth"
+    if "guardrail restrictions" in text:
+        return "guardrail"
+    if "пустое содержимое" in text or "пустой ответ" in text:
+        return "empty_response"
+    if status in (400, 413, 422):
+        return "bad_request"
+    if isinstance(status, int) and status >= 500:
+        return "server"
+    if "connection" in name.lower() or "connect" in text:
+        return "connection"
+    return "other"
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[Any, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values) -> float:
+        return self._values.get(label_values, 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {_format_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (), buckets: Iterable[float] = DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # label_values -> (счётчики по корзинам, сумма, количество)
+        self._series: Dict[Tuple, List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values) -> None:
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = [[0] * len(self.buckets), 0.0, 0]
+                self._series[label_values] = series
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *label_values) -> int:
+        series = self._series.get(label_values)
+        return series[2] if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labels, label_values, f'le="{_format_number(bound)}"')
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labels, label_values)
+                lines.append(f"{self.name}_sum{labels} {_format_number(total)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class LLMCall:
+    """Один запрос к провайдеру; заполняется внутри llm_telemetry.track(...)"""
+
+    def __init__(
+            self,
+            operation: str,
+            model: str,
+            endpoint: Optional[str] = None,
+            messages: Optional[List[Dict]] = None,
+    ):
+        self.operation = operation
+        self.model = model
+        self.endpoint = endpoint
+        self.started = time.monotonic()
+        self.first_token_at: Optional[float] = None
+        # Промпт считается по тексту, только если провайдер не вернул usage
+        self.messages = messages
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+        self.usage_reported = False
+        self.extra: Dict[str, Any] = {}
+
+    def set_usage(self, completion) -> None:
+        """Токены из поля usage ответа (или фрагмента потока); без usage — оценка по тексту"""
+        usage = getattr(completion, "usage", None)
+        prompt = getattr(usage, "prompt_tokens", None)
+        completion_tokens = getattr(usage, "completion_tokens", None)
+        if isinstance(prompt, int) and isinstance(completion_tokens, int):
+            self.prompt_tokens = prompt
+            self.completion_tokens = completion_tokens
+            self.usage_reported = True
+            return
+        if self.completion_tokens is None:
+            try:
+                text = completion.choices[0].message.content
+            except (AttributeError, IndexError, TypeError):
+                text = None
+            if isinstance(text, str):
+                self.completion_tokens = count_tokens(text)
+
+    def set_completion_text(self, text: str) -> None:
+        """Потоковый ответ без usage: оценка по собранному тексту"""
+        if not self.usage_reported:
+            self.completion_tokens = count_tokens(text)
+
+    def mark_first_token(self) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+
+    def estimate_prompt_tokens(self) -> None:
+        if self.prompt_tokens is not None or not self.messages:
+            return
+        total = 0
+        for message in self.messages:
+            content = message.get("content")
+            if isinstance(content, str):
+                total += count_tokens(content)
+            elif isinstance(content, list):
+                # vision: считаем только текстовые части
+                total += sum(count_tokens(part.get("text") or "") for part in content if isinstance(part, dict))
+        self.prompt_tokens = total
+
+
+class _Track:
+    def __init__(self, telemetry: "LLMTelemetry", call: LLMCall):
+        self._telemetry = telemetry
+        self._call = call
+
+    def __enter__(self) -> LLMCall:
+        return self._call
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self._telemetry.finish(self._call, exc)
+        return False
+
+
+class LLMTelemetry:
+    def __init__(self, log_enabled: Optional[bool] = None, max_spaces: Optional[int] = None):
+        if log_enabled is None:
+            log_enabled = os.getenv("LLM_TELEMETRY_LOG", "true").lower() == "true"
+        self.log_enabled = log_enabled
+        self.max_spaces = max_spaces or int(os.getenv("LLM_METRICS_MAX_SPACES", "500"))
+        self._spaces: set = set()
+        self._spaces_lock = threading.Lock()
+
+        self.requests = Counter("llm_requests_total", "Запросы к провайдерам LLM", ("operation", "model", "outcome"))
+        self.duration = Histogram(
+            "llm_request_duration_seconds", "Длительность запроса к LLM", ("operation", "model"), DURATION_BUCKETS
+        )
+        self.ttft = Histogram(
+            "llm_time_to_first_token_seconds", "Время до первого фрагмента потокового ответа",
+            ("operation", "model"), TTFT_BUCKETS,
+        )
+        self.tokens_per_second = Histogram(
+            "llm_generation_tokens_per_second", "Скорость генерации (токены ответа в секунду)",
+            ("operation", "model"), TOKENS_PER_SECOND_BUCKETS,
+        )
+        self.tokens = Counter("llm_tokens_total", "Токены промпта и ответа", ("operation", "model", "kind"))
+        self.space_tokens = Counter("llm_space_tokens_total", "Токены по пространствам", ("space_id", "kind"))
+        self.errors = Counter("llm_errors_total", "Ошибки запросов к LLM", ("operation", "model", "error_class"))
+        self.fallbacks = Counter("llm_fallbacks_total", "Переключения на другой endpoint, уровень или модель", ("kind",))
+
+    def track(
+            self,
+            operation: str,
+            model: Optional[str],
+            endpoint: Optional[str] = None,
+            messages: Optional[List[Dict]] = None,
+    ) -> _Track:
+        return _Track(self, self.start(operation, model, endpoint, messages))
+
+    def start(
+            self,
+            operation: str,
+            model: Optional[str],
+            endpoint: Optional[str] = None,
+            messages: Optional[List[Dict]] = None,
+    ) -> LLMCall:
+        """Начать вызов вручную (когда успех и ошибка разбираются в разных ветках); завершить — finish()"""
+        return LLMCall(operation, model or "unknown", endpoint, messages)
+
+    def record_fallback(self, kind: str) -> None:
+        self.fallbacks.inc(kind)
+
+    def _space_label(self, space_id: Any) -> str:
+        space = str(space_id)
+        with self._spaces_lock:
+            if space in self._spaces:
+                return space
+            if len(self._spaces) < self.max_spaces:
+                self._spaces.add(space)
+                return space
+        return "other"
+
+    def finish(self, call: LLMCall, exc: Optional[BaseException] = None) -> Dict[str, Any]:
+        """Записать метрики и лог завершённого вызова; возвращает запись лога"""
+        now = time.monotonic()
+        duration = now - call.started
+        labels = (call.operation, call.model)
+        error_class = classify_error(exc) if exc is not None else None
+        outcome = "ok" if exc is None else ("cancelled" if error_class == "cancelled" else "error")
+
+        self.requests.inc(*labels, outcome)
+        self.duration.observe(duration, *labels)
+        if error_class is not None and outcome == "error":
+            self.errors.inc(*labels, error_class)
+
+        ttft = call.first_token_at - call.started if call.first_token_at is not None else None
+        if ttft is not None:
+            self.ttft.observe(ttft, *labels)
+
+        tokens_per_second = None
+        if exc is None and call.completion_tokens:
+            generation_time = now - call.first_token_at if call.first_token_at is not None else duration
+            if generation_time > 0:
+                tokens_per_second = call.completion_tokens / generation_time
+                self.tokens_per_second.observe(tokens_per_second, *labels)
+
+        call.estimate_prompt_tokens()
+        context = current_context()
+        space_id = context.get("space_id")
+        for kind, value in (("prompt", call.prompt_tokens), ("completion", call.completion_tokens)):
+            if value:
+                self.tokens.inc(*labels, kind, amount=value)
+                if space_id is not None:
+                    self.space_tokens.inc(self._space_label(space_id), kind, amount=value)
+
+        record = {
+            "event": "llm_call",
+            "operation": call.operation,
+            "model": call.model,
+            "endpoint": call.endpoint,
+            "outcome": outcome,
+            "duration_ms": round(duration * 1000, 1),
+            "ttft_ms": round(ttft * 1000, 1) if ttft is not None else None,
+            "prompt_tokens": call.prompt_tokens,
+            "completion_tokens": call.completion_tokens,
+            "usage_reported": call.usage_reported,
+            "tokens_per_second": round(tokens_per_second, 1) if tokens_per_second is not None else None,
+            "error_class": error_class,
+            **call.extra,
+            **context,
+        }
+        if self.log_enabled:
+            print(json.dumps({k: v for k, v in record.items() if v is not None}, ensure_ascii=False, default=str))
+        return record
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in (
+                self.requests, self.duration, self.ttft, self.tokens_per_second,
+                self.tokens, self.space_tokens, self.errors, self.fallbacks,
+        ):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def _flatten_stats(prefix: str, stats: Dict[str, Any], into: Dict[str, float]) -> None:
+    for key, value in stats.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, dict):
+            _flatten_stats(name, value, into)
+        elif isinstance(value, bool):
+            into[name] = int(value)
+        elif isinstance(value, (int, float)):
+            into[name] = value
+
+
+def render_stats_gauges(prefix: str, series: List[Tuple[Dict[str, Any], Dict[str, Any]]]) -> List[str]:
+    """
+    Числовые поля stats() компонентов → gauge-метрики Prometheus.
+    series — [(метки, stats)]; вложенные словари разворачиваются через "_".
+    """
+    families: Dict[str, List[str]] = {}
+    for labels, stats in series:
+        flat: Dict[str, float] = {}
+        _flatten_stats(prefix, stats, flat)
+        label_part = _format_labels(tuple(labels.keys()), tuple(labels.values()))
+        for name, value in flat.items():
+            families.setdefault(name, []).append(f"{name}{label_part} {_format_number(value)}")
+    lines: List[str] = []
+    for name, samples in families.items():
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(samples)
+    return lines
+
+
+# Глобальный экземпляр
+llm_telemetry = LLMTelemetry()
@@ -0,0 +1,226 @@
+"""
+Кэш каталога моделей OpenRouter, доступных ключу (GET /models/user).
+
+Каталог нужен при fallback после guardrail/data policy 404 (см.
+LLMService._chat_completion). Раньше каждый такой fallback синхронно запрашивал
+полный список моделей прямо на пути запроса — во время инцидента у провайдера
+каждый чат платил за лишний запрос.
+
+Теперь список хранится OPENROUTER_MODELS_TTL секунд и проиндексирован по id,
+canonical_slug и входной модальности. Устаревший список отдаётся сразу, а
+обновляется в фоне (stale-while-revalidate); ждать загрузки приходится только
+если списка ещё нет. После неудачной загрузки следующая попытка — не раньше чем
+через OPENROUTER_MODELS_RETRY секунд.
+
+Выбранная замена запоминается (preferred → alt для модальности): повторный
+fallback обходится поиском в словаре. Запомненная замена забывается, если модель
+пропала из каталога или запрос к ней не удался.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+class ModelCatalog:
+    """Список eligible-моделей с TTL, фоновым обновлением и индексами"""
+
+    def __init__(
+            self,
+            fetch: Callable[[], List[Dict]],
+            fetch_async: Optional[Callable[[], Awaitable[List[Dict]]]] = None,
+            ttl: Optional[float] = None,
+            retry_after: Optional[float] = None,
+    ):
+        # fetch должен бросать исключение при ошибке: пустой список — валидный ответ
+        self._fetch = fetch
+        self._fetch_async = fetch_async
+        self.ttl = ttl if ttl is not None else float(os.getenv("OPENROUTER_MODELS_TTL", "600"))
+        self.retry_after = retry_after if retry_after is not None else float(os.getenv("OPENROUTER_MODELS_RETRY", "30"))
+
+        self._lock = threading.Lock()
+        self._models: List[Dict] = []
+        self._by_id: Dict[str, Dict] = {}
+        self._by_modality: Dict[str, List[str]] = {}
+        self._fallbacks: Dict[Tuple[str, Optional[str]], str] = {}
+        self._loaded = False
+        self._fetched_at = 0.0
+        self._next_attempt_at = 0.0
+        self._refreshing = False
+        self._refresh_task: Optional[asyncio.Task] = None
+
+        self.hits = 0
+        self.fallback_hits = 0
+        self.refreshes = 0
+        self.failures = 0
+
+    # --- Загрузка ---
+
+    def _store(self, models: List[Dict]) -> None:
+        by_id: Dict[str, Dict] = {}
+        by_modality: Dict[str, List[str]] = {}
+        for model in models:
+            model_id = model.get("id")
+            if not model_id:
+                continue
+            by_id.setdefault(model_id, model)
+            slug = model.get("canonical_slug")
+            if slug:
+                by_id.setdefault(slug, model)
+            arch = model.get("architecture") or {}
+            for modality in arch.get("input_modalities") or []:
+                by_modality.setdefault(modality, []).append(model_id)
+
+        now = time.monotonic()
+        with self._lock:
+            self._models = [m for m in models if m.get("id")]
+            self._by_id = by_id
+            self._by_modality = by_modality
+            # Замены на модели, которых больше нет в каталоге, забываем
+            self._fallbacks = {key: alt for key, alt in self._fallbacks.items() if alt in by_id}
+            self._loaded = True
+            self._fetched_at = now
+            self._next_attempt_at = now + self.ttl
+            self.refreshes += 1
+
+    def _failed(self, error: Exception) -> None:
+        with self._lock:
+            self._next_attempt_at = time.monotonic() + self.retry_after
+            self.failures += 1
+        print(f"⚠️ Не удалось обновить каталог моделей OpenRouter: {error}")
+
+    def refresh(self) -> bool:
+        """Синхронно загрузить каталог; False при ошибке (прежний список сохраняется)"""
+        try:
+            models = self._fetch()
+        except Exception as e:
+            self._failed(e)
+            return False
+        self._store(models)
+        return True
+
+    async def refresh_async(self) -> bool:
+        if self._fetch_async is None:
+            return await asyncio.to_thread(self.refresh)
+        try:
+            models = await self._fetch_async()
+        except Exception as e:
+            self._failed(e)
+            return False
+        self._store(models)
+        return True
+
+    def _claim_refresh(self) -> bool:
+        """Пора обновлять и обновление ещё не идёт (одно на процесс)"""
+        with self._lock:
+            if self._refreshing or time.monotonic() < self._next_attempt_at:
+                return False
+            self._refreshing = True
+            return True
+
+    def _release_refresh(self) -> None:
+        with self._lock:
+            self._refreshing = False
+
+    def refresh_in_background(self) -> bool:
+        """Обновить каталог в фоновом потоке, если он устарел (sync-код и прогрев)"""
+        if not self._claim_refresh():
+            return False
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                self._release_refresh()
+
+        threading.Thread(target=run, name="model-catalog-refresh", daemon=True).start()
+        return True
+
+    async def _refresh_task_body(self) -> None:
+        try:
+            await self.refresh_async()
+        finally:
+            self._release_refresh()
+
+    def _schedule_async_refresh(self) -> Optional[asyncio.Task]:
+        if not self._claim_refresh():
+            return self._refresh_task
+        self._refresh_task = asyncio.get_running_loop().create_task(self._refresh_task_body())
+        return self._refresh_task
+
+    # --- Чтение ---
+
+    def get_models(self) -> List[Dict]:
+        """Каталог для sync-кода: первая загрузка блокирует, дальше — фоновое обновление"""
+        if not self._loaded:
+            if self._claim_refresh():
+                try:
+                    self.refresh()
+                finally:
+                    self._release_refresh()
+        else:
+            self.refresh_in_background()
+        self.hits += 1
+        return self._models
+
+    async def get_models_async(self) -> List[Dict]:
+        """Async-версия get_models: одновременные первые обращения ждут одну загрузку"""
+        task = self._schedule_async_refresh()
+        if not self._loaded and task is not None:
+            await asyncio.shield(task)
+        self.hits += 1
+        return self._models
+
+    def select(self, preferred_model: str, input_modality: Optional[str] = None) -> str:
+        """
+        Замена для preferred_model по загруженному каталогу:
+        сама модель, если она eligible; иначе первая с нужной модальностью; иначе первая.
+        Если каталог пуст — preferred_model.
+        """
+        key = (preferred_model, input_modality)
+        with self._lock:
+            remembered = self._fallbacks.get(key)
+            if remembered is not None:
+                self.fallback_hits += 1
+                return remembered
+            models, by_id, by_modality = self._models, self._by_id, self._by_modality
+
+        if not models:
+            return preferred_model
+        model = by_id.get(preferred_model)
+        if model is not None:
+            return model.get("id") or preferred_model
+        candidates = by_modality.get(input_modality) if input_modality else None
+        alt = candidates[0] if candidates else models[0].get("id") or preferred_model
+
+        if alt != preferred_model:
+            with self._lock:
+                self._fallbacks[key] = alt
+        return alt
+
+    def pick(self, preferred_model: str, input_modality: Optional[str] = None) -> str:
+        self.get_models()
+        return self.select(preferred_model, input_modality)
+
+    async def pick_async(self, preferred_model: str, input_modality: Optional[str] = None) -> str:
+        await self.get_models_async()
+        return self.select(preferred_model, input_modality)
+
+    def forget_fallback(self, preferred_model: str, input_modality: Optional[str] = None) -> None:
+        """Запрос к запомненной замене не удался — в следующий раз выбрать заново"""
+        with self._lock:
+            self._fallbacks.pop((preferred_model, input_modality), None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'models': len(self._models),
+                'age_seconds': round(time.monotonic() - self._fetched_at, 1) if self._loaded else None,
+                'fallbacks': dict((f"{preferred}|{modality or ''}", alt) for (preferred, modality), alt in self._fallbacks.items()),
+                'hits': self.hits,
+                'fallback_hits': self.fallback_hits,
+                'refreshes': self.refreshes,
+                'failures': self.failures,
+            }
@@ -0,0 +1,147 @@
+"""
+Выбор уровня модели (tier) под сложность запроса.
+
+Раньше любой вопрос — от «привет, что такое ИП?» до разбора договора на 20 страниц —
+шёл в одну и ту же модель (OPENROUTER_MODEL / OLLAMA_MODEL) с max_tokens=1000.
+Если задан LLM_FAST_MODEL, простые запросы отправляются в небольшую быструю
+модель, а основная остаётся для сложных и «тяжёлых» по контексту.
+
+Решение принимается по уже посчитанным сигналам (RoutingSignals):
+
+- категория и уверенность классификатора: категории из LLM_COMPLEX_CATEGORIES
+  (юридические и финансовые вопросы) и неуверенная классификация — в основную модель
+- размер вопроса и итогового промпта (после бюджета, см. prompt_budget)
+- прикреплённые файлы
+- глубина истории: число сообщений в промпте и наличие краткого содержания чата
+
+Быстрый уровень — отдельный LLMRouter со своим здоровьем; если он недоступен,
+запрос уходит в основной уровень. По каждому уровню считаются запросы, латентность
+и токены (оценка по тексту промпта и ответа).
+"""
+
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from backend.app.services.llm_router import LLMRouter
+
+TIER_DEFAULT = "default"
+TIER_FAST = "fast"
+
+
+class RoutingSignals:
+    """Признаки запроса, по которым выбирается уровень модели"""
+
+    def __init__(
+            self,
+            category: Optional[str] = None,
+            confidence: Optional[float] = None,
+            question_tokens: int = 0,
+            prompt_tokens: int = 0,
+            history_messages: int = 0,
+            has_files: bool = False,
+            has_summary: bool = False,
+    ):
+        self.category = category
+        self.confidence = confidence
+        self.question_tokens = question_tokens
+        self.prompt_tokens = prompt_tokens
+        self.history_messages = history_messages
+        self.has_files = has_files
+        self.has_summary = has_summary
+
+
+class LLMTier:
+    """Уровень модели: свой LLMRouter, свой max_tokens и статистика"""
+
+    def __init__(self, name: str, router: LLMRouter, max_tokens: int, latency_alpha: float = 0.2):
+        self.name = name
+        self.router = router
+        self.max_tokens = max_tokens
+        self.latency_alpha = latency_alpha
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.fallbacks = 0
+        self.latency_ewma: Optional[float] = None
+        self.latency_total = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def record_success(self, latency: float, prompt_tokens: int, completion_tokens: int) -> None:
+        with self._lock:
+            self.requests += 1
+            self.latency_total += latency
+            if self.latency_ewma is None:
+                self.latency_ewma = latency
+            else:
+                self.latency_ewma += self.latency_alpha * (latency - self.latency_ewma)
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+    def record_failure(self, fell_back: bool = False) -> None:
+        with self._lock:
+            self.failures += 1
+            if fell_back:
+                self.fallbacks += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'models': [endpoint.model for endpoint in self.router.endpoints],
+                'max_tokens': self.max_tokens,
+                'requests': self.requests,
+                'failures': self.failures,
+                'fallbacks': self.fallbacks,
+                'latency_ms': self.latency_ewma * 1000 if self.latency_ewma is not None else None,
+                'avg_latency_ms': self.latency_total / self.requests * 1000 if self.requests else None,
+                'prompt_tokens': self.prompt_tokens,
+                'completion_tokens': self.completion_tokens,
+            }
+
+
+def _env_list(name: str, default: str) -> List[str]:
+    return [item.strip() for item in os.getenv(name, default).split(",") if item.strip()]
+
+
+class TieringPolicy:
+    """Правила выбора уровня; все пороги настраиваются через окружение"""
+
+    def __init__(
+            self,
+            max_question_tokens: Optional[int] = None,
+            max_prompt_tokens: Optional[int] = None,
+            max_history_messages: Optional[int] = None,
+            min_confidence: Optional[float] = None,
+            complex_categories: Optional[List[str]] = None,
+    ):
+        self.max_question_tokens = max_question_tokens or int(os.getenv("LLM_FAST_MAX_QUESTION_TOKENS", "60"))
+        self.max_prompt_tokens = max_prompt_tokens or int(os.getenv("LLM_FAST_MAX_PROMPT_TOKENS", "1500"))
+        self.max_history_messages = (
+            max_history_messages if max_history_messages is not None
+            else int(os.getenv("LLM_FAST_MAX_HISTORY_MESSAGES", "6"))
+        )
+        self.min_confidence = (
+            min_confidence if min_confidence is not None
+            else float(os.getenv("LLM_FAST_MIN_CONFIDENCE", "0.5"))
+        )
+        self.complex_categories = set(
+            complex_categories if complex_categories is not None
+            else _env_list("LLM_COMPLEX_CATEGORIES", "legal,finance")
+        )
+
+    def choose(self, signals: RoutingSignals) -> Tuple[str, str]:
+        """(уровень, причина) — причина идёт в лог"""
+        if signals.has_files:
+            return TIER_DEFAULT, "файлы"
+        if signals.category in self.complex_categories:
+            return TIER_DEFAULT, f"категория {signals.category}"
+        if signals.confidence is not None and signals.confidence < self.min_confidence:
+            return TIER_DEFAULT, f"уверенность {signals.confidence:.0%}"
+        if signals.question_tokens > self.max_question_tokens:
+            return TIER_DEFAULT, f"вопрос {signals.question_tokens} токенов"
+        if signals.prompt_tokens > self.max_prompt_tokens:
+            return TIER_DEFAULT, f"промпт {signals.prompt_tokens} токенов"
+        if signals.has_summary or signals.history_messages > self.max_history_messages:
+            return TIER_DEFAULT, "длинная беседа"
+        return TIER_FAST, "простой вопрос"
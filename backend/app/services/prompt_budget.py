@@ -0,0 +1,144 @@
+"""
+Бюджет токенов промпта: system prompt, текущий вопрос, файлы, история, контекст пространства.
+
+Раньше размер промпта рос без согласования: контекст пространства (до 30 × 1500
+символов) дописывался к system prompt, полный текст вложений — к вопросу, а
+обрезалась только история. Большой PDF выводил запрос за контекст модели и сильно
+замедлял генерацию.
+
+Каждая секция получает приоритет и квоту (max_tokens). Бюджет раздаётся по
+приоритетам: обязательные секции (system prompt, вопрос) целиком, остальные —
+сколько осталось в пределах квоты. Если секции досталось меньше нужного, она
+обрезается, а если меньше min_tokens — отбрасывается целиком. Первыми страдают
+секции с низким приоритетом.
+"""
+
+import os
+from typing import Dict, List, Optional
+
+from backend.app.utils.tokens import count_tokens, truncate_to_tokens
+
+# Приоритеты (меньше — важнее)
+PRIORITY_REQUIRED = 0
+PRIORITY_FILES = 1
+PRIORITY_HISTORY = 2
+PRIORITY_SPACE_CONTEXT = 3
+
+# Способы обрезки секции
+KEEP_HEAD = "head"  # начало текста (документы: начало обычно важнее)
+KEEP_TAIL_LINES = "tail_lines"  # последние строки, заголовок сохраняется (лента сообщений)
+KEEP_EXTERNAL = "external"  # обрезает вызывающий код по выданному бюджету (история)
+
+TRUNCATED_MARKER = "\n[…текст сокращён, чтобы уложиться в контекст модели]"
+
+
+class PromptSection:
+    def __init__(
+            self,
+            name: str,
+            text: Optional[str] = None,
+            priority: int = PRIORITY_REQUIRED,
+            max_tokens: Optional[int] = None,
+            min_tokens: int = 0,
+            keep: str = KEEP_HEAD,
+            tokens: Optional[int] = None,
+    ):
+        self.name = name
+        self.text = text or ""
+        self.priority = priority
+        self.max_tokens = max_tokens
+        self.min_tokens = min_tokens
+        self.keep = keep
+        self.tokens = tokens if tokens is not None else count_tokens(self.text)
+        self.allocated = 0
+        self.action = "kept"
+
+    @property
+    def required(self) -> bool:
+        return self.priority == PRIORITY_REQUIRED
+
+
+class PromptBudget:
+    """Распределение max_prompt_tokens между секциями промпта"""
+
+    def __init__(self, max_prompt_tokens: Optional[int] = None):
+        self.max_prompt_tokens = max_prompt_tokens or int(os.getenv("PROMPT_MAX_TOKENS", "6000"))
+
+    def allocate(self, sections: List[PromptSection]) -> List[PromptSection]:
+        """Выставляет allocated/action и обрезает текст секций; порядок списка не меняется"""
+        remaining = self.max_prompt_tokens
+        # sorted стабильный: при равном приоритете — порядок переданных секций
+        for section in sorted(sections, key=lambda s: s.priority):
+            if section.required:
+                granted = section.tokens
+            else:
+                quota = section.tokens if section.max_tokens is None else min(section.tokens, section.max_tokens)
+                granted = max(0, min(quota, remaining))
+                if granted < section.tokens and granted < section.min_tokens:
+                    granted = 0
+            section.allocated = granted
+            remaining -= granted
+
+            if granted >= section.tokens:
+                section.action = "kept"
+            elif granted == 0:
+                section.action = "dropped"
+                if section.keep != KEEP_EXTERNAL:
+                    section.text = ""
+            else:
+                section.action = "truncated"
+                if section.keep != KEEP_EXTERNAL:
+                    section.text = self._truncate(section, granted)
+                    section.allocated = count_tokens(section.text)
+                    if not section.text:
+                        section.action = "dropped"
+                    remaining += granted - section.allocated
+        return sections
+
+    @staticmethod
+    def _truncate(section: PromptSection, max_tokens: int) -> str:
+        budget = max(0, max_tokens - count_tokens(TRUNCATED_MARKER))
+        if section.keep == KEEP_TAIL_LINES:
+            lines = section.text.split("\n")
+            header, body = [], lines
+            # Заголовок блока (строки до первого пункта списка) сохраняем
+            while body and not body[0].startswith("•"):
+                header.append(body.pop(0))
+            used = count_tokens("\n".join(header))
+            kept: List[str] = []
+            for line in reversed(body):
+                line_tokens = count_tokens(line) + 1
+                if used + line_tokens > budget:
+                    break
+                kept.insert(0, line)
+                used += line_tokens
+            if not kept:
+                return ""
+            return "\n".join(header + kept) + TRUNCATED_MARKER
+        head = truncate_to_tokens(section.text, budget)
+        return head + TRUNCATED_MARKER if head else ""
+
+    @staticmethod
+    def report(sections: List[PromptSection]) -> Dict[str, Dict]:
+        """Итоговая раскладка токенов по секциям (для логов и метрик)"""
+        return {
+            section.name: {
+                'requested': section.tokens,
+                'allocated': section.allocated,
+                'action': section.action,
+            }
+            for section in sections
+        }
+
+    @staticmethod
+    def format_report(sections: List[PromptSection]) -> str:
+        parts = []
+        for section in sections:
+            if section.tokens == 0:
+                continue
+            part = f"{section.name}={section.allocated}"
+            if section.action != "kept":
+                part += f" ({section.action}, было {section.tokens})"
+            parts.append(part)
+        total = sum(section.allocated for section in sections)
+        return f"{', '.join(parts)}; всего={total}"
@@ -0,0 +1,220 @@
+"""
+Поиск по чатам, заметкам и сообщениям пользователя (/api/search).
+
+PostgreSQL — полнотекстовый поиск: колонки search_vector (tsvector, конфигурации
+russian + simple) с GIN-индексами поддерживаются триггерами (см. init.sql),
+результаты ранжируются ts_rank, фрагменты строит ts_headline.
+Другие СУБД (SQLite в тестах) и SEARCH_FULL_TEXT=false — ILIKE по подстроке.
+
+В обоих случаях названия пространства и чата приходят в том же запросе (JOIN),
+а не отдельными запросами на каждую найденную строку.
+"""
+
+import os
+import re
+from typing import List, NamedTuple, Optional
+
+from sqlalchemy import case, func, literal_column, or_
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import Session
+
+from backend.app.models.chat import Chat
+from backend.app.models.message import Message
+from backend.app.models.note import Note
+from backend.app.models.space import Space
+
+# Фрагмент с совпадением: как highlight_match — <mark> и около 200 символов
+HEADLINE_OPTIONS = (
+    "StartSel=<mark>, StopSel=</mark>, MinWords=10, MaxWords=30, "
+    "MaxFragments=2, FragmentDelimiter=\" ... \""
+)
+HEADLINE_CONFIG = "russian"
+
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class ChatHit(NamedTuple):
+    chat: Chat
+    space_name: str
+    snippet: Optional[str]
+
+
+class NoteHit(NamedTuple):
+    note: Note
+    space_name: str
+    snippet: Optional[str]
+
+
+class MessageHit(NamedTuple):
+    message: Message
+    chat_title: Optional[str]
+    space_id: int
+    space_name: str
+    snippet: Optional[str]
+
+
+def highlight_match(text: str, query: str, max_length: int = 200) -> Optional[str]:
+    """Выделяет совпадение в тексте и возвращает фрагмент"""
+    if not text or not query:
+        return None
+
+    text_lower = text.lower()
+    query_lower = query.lower()
+
+    # Ищем первое вхождение
+    index = text_lower.find(query_lower)
+    if index == -1:
+        return None
+
+    # Вычисляем начало и конец фрагмента (с учетом max_length)
+    context_size = min(50, (max_length - len(query)) // 2)
+    start = max(0, index - context_size)
+    end = min(len(text), index + len(query) + context_size)
+
+    # Ограничиваем длину фрагмента
+    if end - start > max_length:
+        if index - start < max_length // 2:
+            start = 0
+            end = max_length
+        else:
+            end = start + max_length
+
+    snippet = text[start:end]
+
+    # Выделяем совпадение
+    snippet_lower = snippet.lower()
+    match_index = snippet_lower.find(query_lower)
+    if match_index != -1:
+        before = snippet[:match_index]
+        match = snippet[match_index:match_index + len(query)]
+        after = snippet[match_index + len(query):]
+        snippet = f"{before}<mark>{match}</mark>{after}"
+
+    # Добавляем многоточие если нужно
+    if start > 0:
+        snippet = "..." + snippet
+    if end < len(text):
+        snippet = snippet + "..."
+
+    return snippet
+
+
+def prefix_tsquery_text(query: str) -> Optional[str]:
+    """
+    Текст для to_tsquery: все слова запроса, каждое как префикс ("догов отч" -> "догов:* & отч:*").
+    Берутся только буквы/цифры, поэтому синтаксис tsquery из пользовательского ввода не проходит.
+    None — в запросе нет ни одного слова (только знаки), тогда ищем по подстроке.
+    """
+    terms = _TERM_RE.findall(query.lower())
+    if not terms:
+        return None
+    return " & ".join(f"{term}:*" for term in terms)
+
+
+def full_text_enabled(db: Session) -> bool:
+    """Полнотекстовый поиск доступен только в PostgreSQL (колонки search_vector из init.sql)"""
+    if os.getenv("SEARCH_FULL_TEXT", "true").lower() != "true":
+        return False
+    return db.get_bind().dialect.name == "postgresql"
+
+
+def _search_vector(model):
+    """Колонка search_vector: заполняется триггером в БД, в ORM-модели не отображается"""
+    return literal_column(f"{model.__tablename__}.search_vector", TSVECTOR)
+
+
+def _ts_query(tsquery_text: str):
+    """Совпадение по русской морфологии или по точной словоформе (имена, латиница, коды)"""
+    return func.to_tsquery("russian", tsquery_text).op("||")(func.to_tsquery("simple", tsquery_text))
+
+
+def _text_vector(column):
+    return func.to_tsvector("russian", column).op("||")(func.to_tsvector("simple", column))
+
+
+def _headline(column, ts_query):
+    # ts_headline дорогая; PostgreSQL считает её после ORDER BY ... LIMIT, т.е. только для выданных строк
+    return func.ts_headline(HEADLINE_CONFIG, column, ts_query, HEADLINE_OPTIONS)
+
+
+def search_chats(db: Session, user_id: int, query: str, space_id: Optional[int], limit: int) -> List[ChatHit]:
+    rows = db.query(Chat, Space.name).join(Space, Space.id == Chat.space_id).filter(Chat.user_id == user_id)
+    if space_id:
+        rows = rows.filter(Chat.space_id == space_id)
+
+    tsquery_text = prefix_tsquery_text(query) if full_text_enabled(db) else None
+    if tsquery_text:
+        ts_query = _ts_query(tsquery_text)
+        vector = _search_vector(Chat)
+        rows = rows.add_columns(_headline(func.coalesce(Chat.title, ""), ts_query)).filter(
+            vector.op("@@")(ts_query)
+        ).order_by(func.ts_rank(vector, ts_query).desc(), Chat.updated_at.desc())
+    else:
+        rows = rows.filter(Chat.title.ilike(f"%{query}%")).order_by(Chat.updated_at.desc())
+
+    hits = []
+    for row in rows.limit(limit).all():
+        chat, space_name = row[0], row[1]
+        snippet = row[2] if tsquery_text else highlight_match(chat.title or "", query)
+        hits.append(ChatHit(chat, space_name or "", snippet))
+    return hits
+
+
+def search_notes(db: Session, user_id: int, query: str, space_id: Optional[int], limit: int) -> List[NoteHit]:
+    rows = db.query(Note, Space.name).join(Space, Space.id == Note.space_id).filter(Note.user_id == user_id)
+    if space_id:
+        rows = rows.filter(Note.space_id == space_id)
+
+    tsquery_text = prefix_tsquery_text(query) if full_text_enabled(db) else None
+    if tsquery_text:
+        ts_query = _ts_query(tsquery_text)
+        vector = _search_vector(Note)
+        # Совпало в заголовке — фрагмент из заголовка, иначе из текста (как раньше с highlight_match)
+        snippet = case(
+            (_text_vector(Note.title).op("@@")(ts_query), _headline(Note.title, ts_query)),
+            else_=_headline(func.coalesce(Note.content, ""), ts_query),
+        )
+        rows = rows.add_columns(snippet).filter(
+            vector.op("@@")(ts_query)
+        ).order_by(func.ts_rank(vector, ts_query).desc(), Note.updated_at.desc())
+    else:
+        pattern = f"%{query}%"
+        rows = rows.filter(
+            or_(Note.title.ilike(pattern), Note.content.ilike(pattern))
+        ).order_by(Note.updated_at.desc())
+
+    hits = []
+    for row in rows.limit(limit).all():
+        note, space_name = row[0], row[1]
+        if tsquery_text:
+            snippet = row[2]
+        else:
+            snippet = highlight_match(note.title, query) or highlight_match(note.content or "", query)
+        hits.append(NoteHit(note, space_name or "", snippet))
+    return hits
+
+
+def search_messages(db: Session, user_id: int, query: str, space_id: Optional[int], limit: int) -> List[MessageHit]:
+    # Чаты пользователя ограничиваются JOIN, а не списком id в IN (...)
+    rows = db.query(Message, Chat.title, Chat.space_id, Space.name).select_from(Message).join(
+        Chat, Chat.id == Message.chat_id
+    ).join(Space, Space.id == Chat.space_id).filter(Chat.user_id == user_id)
+    if space_id:
+        rows = rows.filter(Chat.space_id == space_id)
+
+    tsquery_text = prefix_tsquery_text(query) if full_text_enabled(db) else None
+    if tsquery_text:
+        ts_query = _ts_query(tsquery_text)
+        vector = _search_vector(Message)
+        rows = rows.add_columns(_headline(Message.content, ts_query)).filter(
+            vector.op("@@")(ts_query)
+        ).order_by(func.ts_rank(vector, ts_query).desc(), Message.created_at.desc())
+    else:
+        rows = rows.filter(Message.content.ilike(f"%{query}%")).order_by(Message.created_at.desc())
+
+    hits = []
+    for row in rows.limit(limit).all():
+        message, chat_title, chat_space_id, space_name = row[0], row[1], row[2], row[3]
+        snippet = row[4] if tsquery_text else highlight_match(message.content, query)
+        hits.append(MessageHit(message, chat_title, chat_space_id, space_name or "", snippet))
+    return hits
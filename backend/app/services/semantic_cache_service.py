@@ -0,0 +1,252 @@
+"""
+Семантический кэш: находит ранее заданный вопрос, сформулированный иначе
+("как продвигать бизнес в соцсетях" ~ "продвижение бизнеса в соцсетях").
+
+Работает локально, без сети и моделей эмбеддингов:
+- вопрос превращается в вектор хэшированием признаков (hashing trick):
+  «основы» слов (первые 5 символов, без стоп-слов) + символьные 3-граммы
+- векторы нормированы, поэтому косинусная близость — это скалярное произведение
+- векторы хранятся в матрице float32 отдельно для каждой области кэша
+  (build_cache_scope: категория + контекст), поиск — одно умножение матрицы на вектор
+- число областей ограничено (LRU): области ctx: содержат хэш истории и почти
+  не повторяются, без ограничения индекс рос бы всё время жизни процесса
+
+Сам ответ хранится в CacheService: семантический слой лишь сопоставляет
+новый вопрос с уже закэшированным и возвращает его текст.
+"""
+
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+# Служебные слова не несут смысла вопроса, но сильно влияют на короткие формулировки
+_STOP_WORDS = frozenset(
+    "как что такое для в во на и или по с со о об а к ко у из от до ли же то это "
+    "мне нам мой наш чем где когда какие какой какая каким можно нужно ли".split()
+)
+_NON_WORD_RE = re.compile(r"[^\w\s]+")
+
+# Пороговые значения косинусной близости по категориям: для юридических и финансовых
+# вопросов ошибка дороже, поэтому порог строже. Графики не кэшируются семантически.
+DEFAULT_CATEGORY_THRESHOLDS = {
+    'legal': 0.94,
+    'finance': 0.93,
+    'graphic': 1.01,
+}
+
+# Начальное число строк матрицы области: большинство областей так и остаются с 1-2 вопросами
+_INITIAL_ROWS = 4
+
+
+class _ScopeIndex:
+    """Векторы вопросов одной области кэша (кольцевой буфер фиксированной ёмкости)"""
+
+    def __init__(self, dim: int, capacity: int):
+        self.capacity = capacity
+        self.vectors = np.zeros((min(capacity, _INITIAL_ROWS), dim), dtype=np.float32)
+        self.questions: List[Optional[str]] = []
+        self.next_slot = 0
+
+    def add(self, vector: np.ndarray, question: str) -> None:
+        if len(self.questions) < self.capacity:
+            slot = len(self.questions)
+            if slot >= self.vectors.shape[0]:
+                grown = np.zeros((min(self.capacity, self.vectors.shape[0] * 2), self.vectors.shape[1]), dtype=np.float32)
+                grown[:slot] = self.vectors[:slot]
+                self.vectors = grown
+            self.questions.append(question)
+        else:
+            # Ёмкость исчерпана — перезаписываем самую старую запись
+            slot = self.next_slot
+            self.next_slot = (self.next_slot + 1) % self.capacity
+            self.questions[slot] = question
+        self.vectors[slot] = vector
+
+    def remove(self, slot: int) -> None:
+        self.vectors[slot] = 0.0
+        self.questions[slot] = None
+
+
+class SemanticCacheService:
+    """Поиск закэшированного вопроса по смысловой близости формулировки"""
+
+    def __init__(
+            self,
+            dim: int = 256,
+            threshold: Optional[float] = None,
+            category_thresholds: Optional[Dict[str, float]] = None,
+            max_entries_per_scope: int = 20000,
+            max_scopes: Optional[int] = None,
+            enabled: Optional[bool] = None,
+    ):
+        if enabled is None:
+            enabled = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+        if threshold is None:
+            threshold = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+        if max_scopes is None:
+            max_scopes = int(os.getenv("SEMANTIC_CACHE_MAX_SCOPES", "1000"))
+
+        self.enabled = enabled
+        # Половина измерений — основы слов, половина — символьные 3-граммы
+        self.dim = dim
+        self.half_dim = dim // 2
+        self.threshold = threshold
+        self.category_thresholds = dict(DEFAULT_CATEGORY_THRESHOLDS)
+        if category_thresholds:
+            self.category_thresholds.update(category_thresholds)
+        self.max_entries_per_scope = max_entries_per_scope
+        self.max_scopes = max(1, max_scopes)
+
+        # Области в порядке последнего использования: вытесняется самая давняя целиком
+        self._indexes: "OrderedDict[str, _ScopeIndex]" = OrderedDict()
+        self.evicted_scopes = 0
+        self._lock = threading.Lock()
+
+        self.lookups = 0
+        self.hits = 0
+        self.lookup_time_total = 0.0
+
+    # ----- векторизация -----
+
+    @staticmethod
+    def _content_words(text: str) -> List[str]:
+        text = _NON_WORD_RE.sub(" ", text.lower().replace("ё", "е"))
+        return [word for word in text.split() if word not in _STOP_WORDS]
+
+    def _add_feature(self, vector: np.ndarray, offset: int, feature: str) -> None:
+        # Знаковый hashing trick: коллизии взаимно гасятся, а не только складываются
+        h = zlib.crc32(feature.encode("utf-8"))
+        vector[offset + h % self.half_dim] += 1.0 if h & 0x80000000 == 0 else -1.0
+
+    def vectorize(self, text: str) -> np.ndarray:
+        """Нормированный вектор вопроса (нулевой, если значимых слов нет)"""
+        stems = np.zeros(self.dim, dtype=np.float32)
+        grams = np.zeros(self.dim, dtype=np.float32)
+        for word in self._content_words(text):
+            self._add_feature(stems, 0, word[:5])
+            padded = f" {word} "
+            for i in range(len(padded) - 2):
+                self._add_feature(grams, self.half_dim, padded[i:i + 3])
+
+        # Основы слов весят больше 3-грамм: иначе "нанять сотрудника" ~ "уволить сотрудника"
+        stems_norm = np.linalg.norm(stems)
+        grams_norm = np.linalg.norm(grams)
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if stems_norm:
+            vector += stems * (1.5 / stems_norm)
+        if grams_norm:
+            vector += grams / grams_norm
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    # ----- API -----
+
+    def threshold_for(self, category: str) -> float:
+        return self.category_thresholds.get(category, self.threshold)
+
+    def find(self, question: str, scope: str, category: str) -> Optional[str]:
+        """
+        Ближайший ранее закэшированный вопрос той же области, если близость выше порога.
+
+        Returns:
+            текст найденного вопроса (ключ для CacheService.get) или None
+        """
+        if not self.enabled:
+            return None
+        threshold = self.threshold_for(category)
+        if threshold > 1.0:
+            return None
+
+        started = time.perf_counter()
+        vector = self.vectorize(question)
+        match = None
+        with self._lock:
+            self.lookups += 1
+            index = self._indexes.get(scope)
+            if index is not None:
+                self._indexes.move_to_end(scope)
+            if index is not None and index.questions and vector.any():
+                scores = index.vectors[:len(index.questions)] @ vector
+                best = int(np.argmax(scores))
+                if scores[best] >= threshold:
+                    match = index.questions[best]
+            self.lookup_time_total += time.perf_counter() - started
+        return match
+
+    def add(self, question: str, scope: str, category: str) -> None:
+        """Запоминает вопрос, ответ на который только что сохранён в CacheService"""
+        if not self.enabled or self.threshold_for(category) > 1.0:
+            return
+        vector = self.vectorize(question)
+        if not vector.any():
+            return
+        with self._lock:
+            index = self._indexes.get(scope)
+            if index is None:
+                index = self._indexes[scope] = _ScopeIndex(self.dim, self.max_entries_per_scope)
+                while len(self._indexes) > self.max_scopes:
+                    self._indexes.popitem(last=False)
+                    self.evicted_scopes += 1
+            else:
+                self._indexes.move_to_end(scope)
+            index.add(vector, question)
+
+    def forget(self, question: str, scope: str) -> None:
+        """Убирает вопрос из индекса (ответ вытеснен из CacheService)"""
+        with self._lock:
+            index = self._indexes.get(scope)
+            if index is None:
+                return
+            for slot, stored in enumerate(index.questions):
+                if stored == question:
+                    index.remove(slot)
+
+    def get_cached_response(self, cache_service, question: str, scope: str, category: str):
+        """
+        Ответ из CacheService: сначала точное совпадение вопроса, затем семантическое.
+        """
+        cached_response = cache_service.get(question, scope=scope)
+        if cached_response:
+            return cached_response
+
+        similar_question = self.find(question, scope, category)
+        if similar_question is None or similar_question.lower() == question.lower():
+            return None
+
+        cached_response = cache_service.get(similar_question, scope=scope)
+        if not cached_response:
+            # Ответ уже вытеснен из кэша (LRU/TTL) — вопрос больше не нужен в индексе
+            self.forget(similar_question, scope)
+            return None
+
+        with self._lock:
+            self.hits += 1
+            saved = self.hits
+        print(f"🧠 Семантический кэш: «{question[:50]}» ≈ «{similar_question[:50]}» (сэкономлено вызовов LLM: {saved})")
+        return cached_response
+
+    def clear(self) -> None:
+        with self._lock:
+            self._indexes.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'scopes': len(self._indexes),
+                'max_scopes': self.max_scopes,
+                'evicted_scopes': self.evicted_scopes,
+                'entries': sum(
+                    sum(1 for q in index.questions if q is not None) for index in self._indexes.values()
+                ),
+                'lookups': self.lookups,
+                'saved_llm_calls': self.hits,
+                'avg_lookup_ms': (self.lookup_time_total / self.lookups * 1000) if self.lookups else 0.0,
+            }
@@ -0,0 +1,218 @@
+"""
+Реестр тяжёлых сервисов: по одному экземпляру на процесс.
+
+Раньше chat_routes и public_routes при импорте создавали свои LLMService (два
+пула httpx, два локальных Whisper), классификаторы (модель из PKL загружалась
+дважды), CacheService и SemanticCacheService (два L1-кэша с разным содержимым).
+Теперь сервисы создаются лениво при первом обращении к services.<имя> и
+разделяются всеми роутами. LLMService в обработчиках доступен и как зависимость
+FastAPI (её подменяют тесты через app.dependency_overrides):
+
+    @router.post("/transcribe")
+    async def transcribe(llm_service: LLMService = Depends(get_llm_service)):
+        ...
+
+Модули сервисов импортируются внутри фабрик: импорт backend.main не тянет
+openai, numpy, pandas/scikit-learn, faster-whisper и библиотеки документов.
+
+startup() (lifespan приложения) заранее создаёт сервисы из SERVICES_WARMUP, чтобы
+первый запрос не платил за инициализацию; shutdown() закрывает HTTP-клиенты и
+дожидается фоновых задач.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from backend.app.services.cache_service import CacheService
+    from backend.app.services.formatting_service import FormattingService
+    from backend.app.services.llm_service import LLMService
+    from backend.app.services.semantic_cache_service import SemanticCacheService
+    from backend.ml.models.business_classifier import EnhancedBusinessClassifier
+    from backend.ml.services.classifier_service import BusinessClassifierService
+    from backend.ml.services.graphic_service import GraphicService
+
+CLASSIFIER_MODEL_PATH = Path(__file__).resolve().parents[2] / "ml" / "models" / "business_classifier.pkl"
+
+DEFAULT_WARMUP = "llm_service,cache_service,semantic_cache,formatting_service,classifier,public_classifier"
+
+
+class ServiceRegistry:
+    """Ленивые синглтоны сервисов (потокобезопасно: обработчики работают и в threadpool)"""
+
+    def __init__(self):
+        self._instances: Dict[str, Any] = {}
+        self._lock = threading.RLock()
+        self._warmup_task: Optional[asyncio.Task] = None
+        self.warmed_up = False
+
+    def _get(self, name: str, factory: Callable[[], Any]) -> Any:
+        instance = self._instances.get(name)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(name)
+                if instance is None:
+                    started = time.monotonic()
+                    instance = factory()
+                    self._instances[name] = instance
+                    print(f"🧩 Сервис {name} инициализирован за {time.monotonic() - started:.2f} с")
+        return instance
+
+    def override(self, name: str, instance: Any) -> None:
+        """Подменить сервис (тесты)"""
+        with self._lock:
+            self._instances[name] = instance
+
+    def is_initialized(self, name: str) -> bool:
+        return name in self._instances
+
+    def reset(self) -> None:
+        with self._lock:
+            self._instances.clear()
+
+    # --- Сервисы ---
+
+    @property
+    def llm_service(self) -> "LLMService":
+        def create():
+            from backend.app.services.llm_service import LLMService
+            return LLMService()
+        return self._get("llm_service", create)
+
+    @property
+    def cache_service(self) -> "CacheService":
+        def create():
+            from backend.app.services.cache_backends import get_shared_cache_backend
+            from backend.app.services.cache_service import CacheService
+            return CacheService(shared_backend=get_shared_cache_backend())
+        return self._get("cache_service", create)
+
+    @property
+    def semantic_cache(self) -> "SemanticCacheService":
+        def create():
+            from backend.app.services.semantic_cache_service import SemanticCacheService
+            return SemanticCacheService()
+        return self._get("semantic_cache", create)
+
+    @property
+    def formatting_service(self) -> "FormattingService":
+        def create():
+            from backend.app.services.formatting_service import FormattingService
+            return FormattingService()
+        return self._get("formatting_service", create)
+
+    @property
+    def classifier(self) -> "EnhancedBusinessClassifier":
+        """Классификатор вопросов для чатов пользователя"""
+        def create():
+            from backend.ml.models.business_classifier import EnhancedBusinessClassifier
+            classifier = EnhancedBusinessClassifier()
+            classifier.load_model(str(CLASSIFIER_MODEL_PATH))
+            return classifier
+        return self._get("classifier", create)
+
+    @property
+    def public_classifier(self) -> "BusinessClassifierService":
+        """Классификатор публичных чатов: та же обученная модель, без повторной загрузки PKL"""
+        def create():
+            from backend.ml.services.classifier_service import BusinessClassifierService
+            classifier = self.classifier
+            return BusinessClassifierService(model_data={
+                'classifier': classifier.classifier,
+                'labels': classifier.labels,
+                'category_keywords': classifier.category_keywords,
+            })
+        return self._get("public_classifier", create)
+
+    @property
+    def graphic_service(self) -> "GraphicService":
+        def create():
+            from backend.ml.services.graphic_service import GraphicService
+            return GraphicService(self.llm_service)
+        return self._get("graphic_service", create)
+
+    # --- Жизненный цикл ---
+
+    def warmup(self, names: Optional[List[str]] = None, whisper: Optional[bool] = None) -> None:
+        """Создать сервисы заранее (синхронно; из startup вызывается в отдельном потоке)"""
+        if names is None:
+            names = [n.strip() for n in os.getenv("SERVICES_WARMUP", DEFAULT_WARMUP).split(",") if n.strip()]
+        for name in names:
+            try:
+                getattr(self, name)
+            except AttributeError:
+                print(f"⚠️ Неизвестный сервис в SERVICES_WARMUP: {name}")
+            except Exception as e:
+                print(f"❌ Ошибка инициализации сервиса {name}: {e}")
+
+        llm_service = self._instances.get("llm_service")
+        if llm_service is not None and llm_service.openrouter_api_key:
+            # Каталог моделей для guardrail-fallback — заранее и без ожидания
+            llm_service.model_catalog.refresh_in_background()
+
+        if whisper is None:
+            whisper = os.getenv("WHISPER_WARMUP", "false").lower() == "true"
+        if whisper and self.llm_service.local_whisper is not None:
+            # Иначе модель Whisper загружается при первой транскрибации
+            try:
+                self.llm_service.local_whisper._load_model()
+            except Exception as e:
+                print(f"⚠️ Не удалось заранее загрузить Whisper: {e}")
+
+    async def startup(self, mode: Optional[str] = None) -> None:
+        """
+        Прогрев при старте (SERVICES_WARMUP_MODE):
+            blocking   — воркер начинает принимать запросы после прогрева (по умолчанию)
+            background — запросы принимаются сразу, прогрев идёт параллельно
+            off        — сервисы создаются при первом обращении
+        """
+        mode = (mode or os.getenv("SERVICES_WARMUP_MODE", "blocking")).lower()
+        if mode == "off":
+            self.warmed_up = True
+            return
+        if mode == "background":
+            self._warmup_task = asyncio.create_task(self._warmup_in_thread())
+            return
+        await self._warmup_in_thread()
+
+    async def _warmup_in_thread(self) -> None:
+        started = time.monotonic()
+        # Импорт и инициализация тяжёлых библиотек — вне event loop
+        await asyncio.to_thread(self.warmup)
+        self.warmed_up = True
+        print(f"✅ Сервисы готовы за {time.monotonic() - started:.2f} с")
+
+    async def shutdown(self) -> None:
+        from backend.app.services.chat_summary_service import chat_summarizer
+
+        if self._warmup_task is not None and not self._warmup_task.done():
+            await asyncio.gather(self._warmup_task, return_exceptions=True)
+
+        # Фоновые обновления summary не должны оборваться посреди записи
+        try:
+            await asyncio.wait_for(chat_summarizer.wait_idle(), timeout=10)
+        except asyncio.TimeoutError:
+            print("⚠️ Фоновые обновления summary не завершились за 10 с")
+
+        llm_service = self._instances.get("llm_service")
+        if llm_service is not None:
+            await llm_service.aclose()
+
+        from backend.app.services.cache_backends import close_shared_cache_backend
+        close_shared_cache_backend()
+        print("👋 Сервисы остановлены")
+
+
+# Глобальный экземпляр
+services = ServiceRegistry()
+
+
+# Зависимости FastAPI
+
+def get_llm_service() -> "LLMService":
+    return services.llm_service
+
@@ -0,0 +1,66 @@
+"""
+Single-flight: объединение одинаковых одновременных запросов к LLM.
+
+Когда публичное пространство расшарено, десятки посетителей за секунды задают
+один и тот же вопрос. Кэш заполняется только после ответа, поэтому без
+объединения каждый запрос уходит к провайдеру отдельно (и упирается в rate limit).
+Здесь первый запрос с данным ключом запускает генерацию, остальные ждут её результат.
+"""
+
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+def make_flight_key(*parts: Any) -> str:
+    """Ключ по полностью собранному запросу (модель, сообщения, параметры)"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """Не более одного выполнения корутины на ключ в каждый момент времени"""
+
+    def __init__(self):
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Выполнить factory() или присоединиться к уже идущему выполнению с тем же ключом.
+
+        Генерация идёт в отдельной задаче: если клиент-инициатор отключится
+        (отмена его запроса), остальные ожидающие всё равно получат ответ.
+        Исключение получают все ожидающие.
+        """
+        task: Optional[asyncio.Task] = self._in_flight.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(factory())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda finished, k=key: self._forget(k, finished))
+        else:
+            self.followers += 1
+            print(f"🔁 Запрос объединён с уже выполняющимся (ожидают: {self.followers} всего)")
+
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Исключение уже получили ожидающие; если их не осталось — не шумим в лог
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'in_flight': self.in_flight,
+            'leaders': self.leaders,
+            'coalesced': self.followers,
+        }
@@ -0,0 +1,189 @@
+"""
+Очистка истории чата перед отправкой в LLM.
+
+Сообщения пользователя сохраняются в том виде, в каком их прислал фронтенд:
+с разметкой вложений (uploaded-file-container, <img>, <details> с анализом
+изображения, inline-стили). В промпт это шло как есть и занимало заметную долю
+токенов. Здесь разметка превращается в короткий текст:
+
+    <img src="/assets/x.png" alt="chart.png">  →  [Изображение: chart.png]
+    <a href="/assets/report.pdf">report.pdf</a>  →  [Файл: report.pdf]
+    <details class="uploaded-file-analysis">…    →  (удаляется: анализ приходит блоком вложения)
+
+Результат кэшируется по id сообщения (содержимое сообщений не меняется после
+записи; при изменении текста меняется и ключ).
+
+Блоки вложений ([Содержимое файла …]) повторяются в каждом следующем ходе, а один
+и тот же файл бывает загружен несколько раз — целиком он остаётся только в самом
+новом месте промпта, в остальных заменяется ссылкой (attachment_key / attachment_reference).
+"""
+
+import hashlib
+import re
+from collections import OrderedDict
+from html import unescape
+from html.parser import HTMLParser
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from backend.app.utils.tokens import count_tokens
+
+# Признаки разметки, ради которых стоит запускать парсер
+_MARKUP_RE = re.compile(r"<\s*/?\s*[a-zA-Z][^>]*>")
+_BLOCK_TAGS = {"div", "p", "br", "li", "ul", "ol", "tr", "table", "h1", "h2", "h3", "h4", "h5", "h6", "details", "pre"}
+# Содержимое этих элементов в промпт не идёт
+_SKIP_TAGS = {"script", "style", "svg"}
+_SKIP_CLASSES = {"uploaded-file-analysis"}
+_VOID_TAGS = {"br", "img", "hr", "input", "meta", "link", "source"}
+
+
+class _MarkupToText(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self._skip_depth = 0
+        self._stack: List[bool] = []  # для каждого открытого тега: пропускается ли он
+        self._link: Optional[List[str]] = None
+        self._link_href = ""
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        classes = set((attrs.get("class") or "").split())
+        skip = tag in _SKIP_TAGS or bool(classes & _SKIP_CLASSES)
+        if tag not in _VOID_TAGS:
+            self._stack.append(skip)
+            if skip:
+                self._skip_depth += 1
+        if self._skip_depth:
+            return
+        if tag == "img":
+            name = attrs.get("alt") or (attrs.get("src") or "").rsplit("/", 1)[-1]
+            self.parts.append(f" [Изображение: {name}] " if name else " [Изображение] ")
+        elif tag == "a":
+            self._link = []
+            self._link_href = attrs.get("href") or ""
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in _VOID_TAGS:
+            return
+        if self._stack:
+            skipped = self._stack.pop()
+            if skipped:
+                self._skip_depth -= 1
+                return
+        if self._skip_depth:
+            return
+        if tag == "a" and self._link is not None:
+            text = " ".join("".join(self._link).split())
+            if "assets/" in self._link_href:
+                name = text or self._link_href.rsplit("/", 1)[-1]
+                self.parts.append(f"[Файл: {name}]")
+            else:
+                self.parts.append(text)
+            self._link = None
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        if self._link is not None:
+            self._link.append(data)
+        else:
+            self.parts.append(data)
+
+
+def _collapse_whitespace(text: str) -> str:
+    lines = [" ".join(line.split()) for line in text.split("\n")]
+    text = "\n".join(lines)
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+
+def sanitize_message_content(content: Optional[str]) -> str:
+    """Текст сообщения для LLM: разметка вложений → короткие ссылки, без HTML и стилей"""
+    if not content:
+        return ""
+    if not _MARKUP_RE.search(content):
+        return content
+    parser = _MarkupToText()
+    try:
+        parser.feed(content)
+        parser.close()
+    except Exception:
+        # Битая разметка — просто вырезаем теги
+        return _collapse_whitespace(unescape(_MARKUP_RE.sub(" ", content)))
+    return _collapse_whitespace("".join(parser.parts))
+
+
+def message_token_count(content: Optional[str]) -> int:
+    """Токены сообщения в том виде, в каком оно уходит в LLM (Message.token_count)"""
+    return count_tokens(sanitize_message_content(content))
+
+
+def attachment_key(attachment) -> str:
+    """Одинаковый файл, загруженный повторно, даёт тот же ключ (имя + содержимое)"""
+    raw = f"{attachment.filename}\0{attachment.context_text()}"
+    return hashlib.md5(raw.encode("utf-8")).hexdigest()
+
+
+def attachment_reference(filename: str) -> str:
+    """Замена повторного блока [Содержимое файла …]: полный текст есть ниже в промпте"""
+    return f"\n\n[Файл {filename} — содержимое приведено ниже]"
+
+
+class SanitizedHistoryCache:
+    """Очищенный текст и число токенов сообщений, LRU по id сообщения"""
+
+    def __init__(self, max_entries: int = 5000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[int, str], Tuple[str, int]]" = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+            self,
+            message_id: Optional[int],
+            content: Optional[str],
+            stored_tokens: Optional[int] = None,
+    ) -> Tuple[str, int]:
+        """
+        (очищенный текст, токены) для сообщения.
+        stored_tokens — Message.token_count (уже посчитан по очищенному тексту)
+        """
+        content = content or ""
+        if not _MARKUP_RE.search(content):
+            return content, stored_tokens if stored_tokens is not None else count_tokens(content)
+        if message_id is None:
+            text = sanitize_message_content(content)
+            return text, count_tokens(text)
+
+        # Ключ включает хэш текста: изменённое сообщение не получит старый результат
+        key = (message_id, hashlib.md5(content.encode("utf-8")).hexdigest())
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached
+        text = sanitize_message_content(content)
+        value = (text, count_tokens(text))
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def stats(self) -> Dict:
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+# Глобальный экземпляр
+sanitized_history = SanitizedHistoryCache()
@@ -0,0 +1,80 @@
+"""
+Время импорта приложения при старте воркера (python -X importtime).
+Запуск: python -m backend.app.utils.import_benchmark [--top N]
+
+Импорт backend.main не должен тянуть тяжёлые библиотеки (HEAVY_MODULES): они
+загружаются при первом обращении к сервису или при прогреве (SERVICES_WARMUP).
+Скрипт завершается с кодом 1, если тяжёлая библиотека попала в импорт или общее
+время превысило STARTUP_IMPORT_BUDGET_MS (если задан).
+"""
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Set, Tuple
+
+PROJECT_ROOT = Path(__file__).resolve().parents[3]
+
+HEAVY_MODULES = (
+    "openai", "tiktoken", "numpy", "pandas", "sklearn", "joblib",
+    "faster_whisper", "PyPDF2", "docx", "PIL",
+)
+
+
+def measure_imports(target: str = "backend.main") -> Dict[str, int]:
+    """Кумулятивное время импорта (мкс) каждого модуля в отдельном процессе"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Импорт {target} завершился ошибкой:\n{result.stderr[-2000:]}")
+
+    timings: Dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        try:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            timings[name.strip()] = int(cumulative)
+        except ValueError:
+            continue
+    return timings
+
+
+def heavy_imported(modules: Set[str]) -> List[str]:
+    return sorted(m for m in modules if m.split(".")[0] in HEAVY_MODULES)
+
+
+def top_modules(timings: Dict[str, int], top: int = 15) -> List[Tuple[str, int]]:
+    # Только модули верхнего уровня, иначе пакет и его подмодули дублируют друг друга
+    roots = {name: us for name, us in timings.items() if "." not in name}
+    return sorted(roots.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+if __name__ == "__main__":
+    top = int(sys.argv[sys.argv.index("--top") + 1]) if "--top" in sys.argv else 15
+    timings = measure_imports()
+    total_ms = timings.get("backend.main", 0) / 1000
+
+    print(f"⏱️ Импорт backend.main: {total_ms:.0f} мс")
+    for name, us in top_modules(timings, top):
+        print(f"   {us / 1000:8.1f} мс  {name}")
+
+    failed = False
+    heavy = heavy_imported(set(timings))
+    if heavy:
+        failed = True
+        print(f"❌ При старте импортируются тяжёлые модули: {', '.join(heavy)}")
+
+    budget_ms = os.getenv("STARTUP_IMPORT_BUDGET_MS")
+    if budget_ms and total_ms > float(budget_ms):
+        failed = True
+        print(f"❌ Импорт дольше бюджета STARTUP_IMPORT_BUDGET_MS={budget_ms} мс")
+
+    if failed:
+        sys.exit(1)
+    print("✅ Тяжёлые библиотеки при старте не загружаются")
@@ -0,0 +1,17 @@
+"""Форматирование событий Server-Sent Events для потоковых ответов чата."""
+
+import json
+from typing import Any
+
+# Заголовки для text/event-stream: отключаем кэширование и буферизацию nginx,
+# иначе токены приходят клиенту пачкой в конце ответа.
+SSE_RESPONSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
+
+
+def format_sse_event(event: str, data: Any) -> str:
+    """Одно SSE-событие: имя и JSON-данные (кириллица без экранирования)."""
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    return f"event: {event}\ndata: {payload}\n\n"
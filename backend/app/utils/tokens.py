@@ -0,0 +1,52 @@
+"""Подсчёт токенов (tiktoken cl100k_base) для хранимых token_count и бюджета промпта."""
+
+import re
+import threading
+from typing import Optional
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def get_encoding():
+    """Кодировка cl100k_base, одна на процесс (загружается при первом подсчёте); None без tiktoken"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        # Потоки, пришедшие во время загрузки, ждут её, а не считают по словам:
+        # такие token_count сохранились бы в messages навсегда
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding("cl100k_base")
+                except Exception as e:
+                    print(f"⚠️ tiktoken недоступен, токены считаются по словам: {e}")
+                    _encoding = None
+                _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text: Optional[str]) -> int:
+    """Число токенов в тексте (без tiktoken — число слов, как в LLMService.count_tokens)."""
+    if not text:
+        return 0
+    encoding = get_encoding()
+    if encoding is None:
+        return len(text.split())
+    return len(encoding.encode(text))
+
+
+def truncate_to_tokens(text: Optional[str], max_tokens: int) -> str:
+    """Начало текста длиной не больше max_tokens токенов."""
+    if not text or max_tokens <= 0:
+        return ""
+    encoding = get_encoding()
+    if encoding is None:
+        # Срез исходного текста по концу max_tokens-го слова (переносы строк сохраняются)
+        words = list(re.finditer(r"\S+", text))
+        return text if len(words) <= max_tokens else text[:words[max_tokens - 1].end()]
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
@@ -0,0 +1,294 @@
+"""
+Локальный OpenAI-совместимый стенд вместо LLM и Whisper (нагрузочное и латентностное тестирование).
+
+Отвечает детерминированно и без сети, поэтому нагрузку на /api/chat/send можно
+давать без расхода квоты OpenRouter, а накладные расходы самого пайплайна
+(история, бюджет промпта, кэши, очередь LLM) — измерять и сравнивать между версиями.
+
+Запуск:
+    uvicorn backend.fake_llm_server:app --port 9100
+    python -m backend.fake_llm_server --port 9100
+
+Подключение приложения (любой из вариантов):
+    USE_OLLAMA=true OLLAMA_API_URL=http://localhost:9100
+    USE_OLLAMA=false OPENROUTER_BASE_URL=http://localhost:9100/v1 OPENROUTER_API_KEY=fake
+    USE_WHISPER_CONTAINER=true WHISPER_API_URL=http://localhost:9100/v1
+    LLM_ENDPOINTS=[{"name": "fake", "base_url": "http://localhost:9100/v1", "model": "fake-large"}]
+
+Эндпоинты (с префиксом /v1 и без него):
+    POST /chat/completions      — обычный и потоковый (stream=true) ответ, vision (image_url в content)
+    POST /audio/transcriptions  — транскрибация (multipart, как в OpenAI)
+    GET  /models, /models/user  — каталог моделей (FAKE_LLM_MODELS)
+    GET  /fake/stats            — счётчики стенда
+
+Настройки (окружение):
+    FAKE_LLM_SEED=42                     — зерно генератора задержек и ошибок
+    FAKE_LLM_TTFT_MS=200                 — время до первого токена: число, uniform:MIN:MAX,
+                                           normal:MEAN:STD или lognormal:MEDIAN:SIGMA (мс)
+    FAKE_LLM_TOKENS_PER_SECOND=60        — скорость генерации
+    FAKE_LLM_COMPLETION_TOKENS=120       — длина ответа (не больше max_tokens запроса)
+    FAKE_LLM_ERROR_RATE=0                — доля ответов с ошибкой
+    FAKE_LLM_ERROR_STATUSES=503          — коды ошибок через запятую (выбираются по очереди)
+    FAKE_LLM_GUARDRAIL_MODELS=           — модели, отвечающие guardrail 404 (проверка fallback)
+    FAKE_LLM_MODELS=fake-large,fake-small,fake-vision:image
+    FAKE_WHISPER_MS_PER_KB=5             — задержка транскрибации на килобайт аудио
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, FastAPI, File, Form, Request, UploadFile
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = (
+    "бизнес клиент продажи маркетинг бюджет выручка прибыль план команда рынок "
+    "стратегия налог договор риск рост канал конверсия продукт цена спрос "
+    "анализ отчёт метрика поставщик склад сервис качество срок задача решение"
+).split()
+
+GUARDRAIL_MESSAGE = "No endpoints available matching your guardrail restrictions and data policy"
+
+
+class LatencyDistribution:
+    """Задержка в секундах по описанию из окружения: 200, uniform:100:300, normal:200:50, lognormal:200:0.5"""
+
+    def __init__(self, spec: str):
+        self.spec = spec.strip() or "0"
+        kind, _, params = self.spec.partition(":")
+        if not params:
+            kind, params = "fixed", kind
+        self.kind = kind
+        self.params = [float(p) for p in params.split(":")]
+        if self.kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Неизвестное распределение задержки: {spec}")
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            ms = self.params[0]
+        elif self.kind == "uniform":
+            ms = rng.uniform(self.params[0], self.params[1])
+        elif self.kind == "normal":
+            ms = rng.gauss(self.params[0], self.params[1])
+        else:
+            median, sigma = self.params
+            ms = median * rng.lognormvariate(0, sigma)
+        return max(0.0, ms) / 1000
+
+
+class FakeProviderConfig:
+    def __init__(self):
+        self.seed = int(os.getenv("FAKE_LLM_SEED", "42"))
+        self.ttft = LatencyDistribution(os.getenv("FAKE_LLM_TTFT_MS", "200"))
+        self.tokens_per_second = float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "60"))
+        self.completion_tokens = int(os.getenv("FAKE_LLM_COMPLETION_TOKENS", "120"))
+        self.error_rate = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+        self.error_statuses = [int(s) for s in os.getenv("FAKE_LLM_ERROR_STATUSES", "503").split(",") if s.strip()]
+        self.guardrail_models = {m.strip() for m in os.getenv("FAKE_LLM_GUARDRAIL_MODELS", "").split(",") if m.strip()}
+        self.whisper_ms_per_kb = float(os.getenv("FAKE_WHISPER_MS_PER_KB", "5"))
+        self.models: List[Dict[str, Any]] = []
+        for item in os.getenv("FAKE_LLM_MODELS", "fake-large,fake-small,fake-vision:image").split(","):
+            name, _, extra = item.strip().partition(":")
+            if not name:
+                continue
+            modalities = ["text"] + [m for m in extra.split("+") if m and m != "text"]
+            self.models.append({
+                "id": name,
+                "canonical_slug": name,
+                "architecture": {"input_modalities": modalities, "output_modalities": ["text"]},
+            })
+
+
+class FakeProvider:
+    """Детерминированные ответы, задержки и ошибки"""
+
+    def __init__(self, config: Optional[FakeProviderConfig] = None):
+        self.config = config or FakeProviderConfig()
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self._error_index = 0
+        self.stats = {"chat": 0, "stream": 0, "vision": 0, "transcriptions": 0, "errors": 0, "guardrail": 0}
+
+    def count(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] += 1
+
+    def ttft(self) -> float:
+        with self._lock:
+            return self.config.ttft.sample(self._rng)
+
+    def injected_error(self) -> Optional[int]:
+        """HTTP-код ошибки, если этот запрос должен завершиться ошибкой"""
+        if self.config.error_rate <= 0 or not self.config.error_statuses:
+            return None
+        with self._lock:
+            if self._rng.random() >= self.config.error_rate:
+                return None
+            status = self.config.error_statuses[self._error_index % len(self.config.error_statuses)]
+            self._error_index += 1
+            self.stats["errors"] += 1
+        return status
+
+    @staticmethod
+    def completion_text(seed_text: str, tokens: int) -> str:
+        """Один и тот же запрос — один и тот же ответ"""
+        digest = hashlib.sha256(seed_text.encode("utf-8")).digest()
+        words = [WORDS[(digest[i % len(digest)] + i * 7) % len(WORDS)] for i in range(max(1, tokens))]
+        words[0] = words[0].capitalize()
+        return " ".join(words) + "."
+
+    def completion_tokens(self, max_tokens: Optional[int]) -> int:
+        tokens = self.config.completion_tokens
+        return min(tokens, max_tokens) if max_tokens else tokens
+
+
+provider = FakeProvider()
+router = APIRouter()
+
+
+def _error_response(status: int, message: str) -> JSONResponse:
+    return JSONResponse(status_code=status, content={"error": {"message": message, "code": status}})
+
+
+def _prompt_parts(messages: List[Dict]) -> Tuple[str, bool, int]:
+    """(текст для детерминированного ответа, есть ли изображение, оценка токенов промпта)"""
+    texts: List[str] = []
+    has_image = False
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    texts.append(part.get("text") or "")
+                elif part.get("type") == "image_url":
+                    has_image = True
+    text = "\n".join(texts)
+    return text, has_image, len(text.split())
+
+
+def _completion_payload(completion_id: str, model: str, created: int, **fields) -> Dict[str, Any]:
+    return {"id": completion_id, "model": model, "created": created, **fields}
+
+
+@router.post("/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model") or "fake-large"
+    messages = body.get("messages") or []
+    stream = bool(body.get("stream"))
+
+    if model in provider.config.guardrail_models:
+        provider.count("guardrail")
+        return _error_response(404, GUARDRAIL_MESSAGE)
+    status = provider.injected_error()
+    if status is not None:
+        await asyncio.sleep(provider.ttft())
+        return _error_response(status, f"Injected error {status}")
+
+    prompt_text, has_image, prompt_tokens = _prompt_parts(messages)
+    tokens = provider.completion_tokens(body.get("max_tokens"))
+    if has_image:
+        provider.count("vision")
+        text = "[Описание изображения] " + provider.completion_text(prompt_text + "image", tokens - 2)
+    else:
+        text = provider.completion_text(f"{model}\n{prompt_text}", tokens)
+    words = text.split(" ")
+    usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(words), "total_tokens": prompt_tokens + len(words)}
+    completion_id = "fakecmpl-" + hashlib.md5(f"{model}{prompt_text}".encode("utf-8")).hexdigest()[:12]
+    created = int(time.time())
+    ttft = provider.ttft()
+    per_token = 1 / provider.config.tokens_per_second if provider.config.tokens_per_second > 0 else 0
+
+    if not stream:
+        provider.count("chat")
+        await asyncio.sleep(ttft + per_token * len(words))
+        return _completion_payload(
+            completion_id, model, created,
+            object="chat.completion",
+            choices=[{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            usage=usage,
+        )
+
+    provider.count("stream")
+
+    async def events():
+        await asyncio.sleep(ttft)
+        for index, word in enumerate(words):
+            if index:
+                await asyncio.sleep(per_token)
+            delta = {"content": word if index == 0 else " " + word}
+            if index == 0:
+                delta["role"] = "assistant"
+            chunk = _completion_payload(
+                completion_id, model, created,
+                object="chat.completion.chunk",
+                choices=[{"index": 0, "delta": delta, "finish_reason": None}],
+            )
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        final = _completion_payload(
+            completion_id, model, created,
+            object="chat.completion.chunk",
+            choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            usage=usage,
+        )
+        yield f"data: {json.dumps(final, ensure_ascii=False)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@router.post("/audio/transcriptions")
+async def audio_transcriptions(
+        file: UploadFile = File(...),
+        model: str = Form("whisper-1"),
+        language: Optional[str] = Form(None),
+):
+    audio = await file.read()
+    status = provider.injected_error()
+    if status is not None:
+        return _error_response(status, f"Injected error {status}")
+    provider.count("transcriptions")
+    await asyncio.sleep(len(audio) / 1024 * provider.config.whisper_ms_per_kb / 1000)
+    words = max(3, min(60, len(audio) // 2048))
+    return {"text": provider.completion_text(hashlib.md5(audio).hexdigest(), words)}
+
+
+@router.get("/models")
+@router.get("/models/user")
+async def list_models():
+    return {"data": provider.config.models}
+
+
+app = FastAPI(title="Fake LLM provider", docs_url=None, redoc_url=None)
+app.include_router(router, prefix="/v1")
+app.include_router(router)
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/fake/stats")
+async def fake_stats():
+    return provider.stats
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Локальный OpenAI-совместимый стенд LLM/Whisper")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    args = parser.parse_args()
+    print(f"🧪 Fake LLM provider: http://{args.host}:{args.port}/v1")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -1,3 +1,5 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
@@ -6,7 +8,19 @@ from dotenv import load_dotenv
 # Загружаем переменные окружения
 load_dotenv()
 
+from backend.app.services.service_registry import services
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Прогрев общих сервисов при старте воркера и закрытие клиентов при остановке"""
+    await services.startup()
+    yield
+    await services.shutdown()
+
+
 app = FastAPI(
+    lifespan=lifespan,
     title="Business Assistant API",
     description="AI помощник для бизнес-консультаций",
     version="1.0.0",
@@ -41,6 +55,7 @@ try:
     from backend.app.routes.search_routes import router as search_router
     from backend.app.routes.notification_routes import router as notification_router
     from backend.app.routes.public_routes import router as public_router
+    from backend.app.routes.metrics_routes import router as metrics_router
     
     app.include_router(chat_router, prefix="/api", tags=["chat"])
     app.include_router(auth_router, prefix="/api/auth", tags=["auth"])
@@ -51,6 +66,7 @@ try:
     app.include_router(search_router, prefix="/api/search", tags=["search"])
     app.include_router(notification_router, prefix="/api/notifications", tags=["notifications"])
     app.include_router(public_router, prefix="/api/public", tags=["public"])
+    app.include_router(metrics_router, prefix="/api/metrics", tags=["metrics"])
     
     print("✅ Роуты успешно подключены с префиксом /api")
 except Exception as e:
@@ -72,7 +88,11 @@ async def root():
 @app.get("/api/health")
 async def health_check():
     """Проверка здоровья приложения"""
-    return {"status": "healthy", "message": "Business Assistant is running"}
+    return {
+        "status": "healthy",
+        "message": "Business Assistant is running",
+        "services": "ready" if services.warmed_up else "warming_up",
+    }
 
 if __name__ == "__main__":
     import uvicorn
@@ -6,7 +6,8 @@ from typing import Dict, Any, Tuple
 
 
 class BusinessClassifierService:
-    def __init__(self, model_path: str = None):
+    def __init__(self, model_path: str = None, model_data: Dict[str, Any] = None):
+        """model_data — уже загруженная модель (чтобы не читать PKL повторно)"""
         if model_path is None:
             current_dir = os.path.dirname(os.path.abspath(__file__))
             ml_dir = os.path.dirname(current_dir)
@@ -17,19 +18,26 @@ class BusinessClassifierService:
         self.classifier = None
         self.labels = ['marketing', 'finance', 'legal', 'management', 'sales', 'general']
         self.category_keywords = {}
-        self.load_model()
+        if model_data is not None:
+            self._use_model_data(model_data)
+        else:
+            self.load_model()
+
+    def _use_model_data(self, model_data: Dict[str, Any]):
+        self.model_data = model_data
+        self.classifier = model_data.get('classifier')
+        self.labels = model_data.get('labels', self.labels)
+        self.category_keywords = model_data.get('category_keywords', {})
 
     def load_model(self):
         """Загрузка обученной модели из PKL файла"""
         try:
             if os.path.exists(self.model_path):
-                self.model_data = joblib.load(self.model_path)
+                model_data = joblib.load(self.model_path)
                 print("✅ Модель загружена успешно из PKL")
 
                 # Извлекаем компоненты модели
-                self.classifier = self.model_data.get('classifier')
-                self.labels = self.model_data.get('labels', self.labels)
-                self.category_keywords = self.model_data.get('category_keywords', {})
+                self._use_model_data(model_data)
 
                 self._print_model_info()
 
@@ -4,13 +4,21 @@
 import io
 import logging
 from pathlib import Path
-from typing import Optional, Dict, Any
-import PyPDF2
-from docx import Document
-from PIL import Image
+from typing import Optional, Dict, Any, Tuple
+
+# PyPDF2, python-docx и PIL импортируются при первом разборе файла:
+# они не нужны для старта воркера
 
 logger = logging.getLogger(__name__)
 
+# Промпт для описания изображения vision-моделью
+IMAGE_ANALYSIS_PROMPT = """Проанализируй это изображение и опиши его содержимое подробно. 
+            Если на изображении есть текст, извлеки его полностью.
+            Если это график, диаграмма или таблица, опиши данные и значения.
+            Если это документ или скриншот, опиши основное содержание.
+            Если это фото, опиши что на нем изображено.
+            Ответ должен быть информативным и структурированным."""
+
 
 class FileAnalysisService:
     """Сервис для анализа загруженных файлов"""
@@ -18,6 +26,8 @@ class FileAnalysisService:
     @staticmethod
     def extract_text_from_pdf(file_bytes: bytes) -> str:
         """Извлекает текст из PDF файла"""
+        import PyPDF2
+
         try:
             pdf_file = io.BytesIO(file_bytes)
             pdf_reader = PyPDF2.PdfReader(pdf_file)
@@ -42,6 +52,8 @@ class FileAnalysisService:
     @staticmethod
     def extract_text_from_docx(file_bytes: bytes) -> str:
         """Извлекает текст из DOCX файла"""
+        from docx import Document
+
         try:
             doc_file = io.BytesIO(file_bytes)
             doc = Document(doc_file)
@@ -74,8 +86,17 @@ class FileAnalysisService:
         raise ValueError("Старый формат DOC не поддерживается. Пожалуйста, конвертируйте файл в DOCX или PDF.")
 
     @staticmethod
-    def analyze_image(file_bytes: bytes, filename: str, llm_service, mime_type: str = "image/jpeg") -> Optional[str]:
-        """Анализирует изображение через LLM с поддержкой vision"""
+    def is_image(mime_type: str) -> bool:
+        return bool(mime_type) and mime_type.startswith('image/')
+
+    @staticmethod
+    def prepare_image(file_bytes: bytes, filename: str, mime_type: str = "image/jpeg") -> Tuple[str, str]:
+        """
+        Подготовка изображения к vision-запросу: (base64 без префикса data:, MIME тип).
+        CPU-работа (PIL), без обращения к LLM — вызывается в threadpool.
+        """
+        from PIL import Image
+
         try:
             # Проверяем, что это изображение
             image = Image.open(io.BytesIO(file_bytes))
@@ -108,38 +129,32 @@ class FileAnalysisService:
             else:
                 image.save(image_buffer, format=image_format)
             
-            image_base64 = base64.b64encode(image_buffer.getvalue()).decode('utf-8')
-            
-            # Формируем промпт для анализа изображения
-            prompt = """Проанализируй это изображение и опиши его содержимое подробно. 
-            Если на изображении есть текст, извлеки его полностью.
-            Если это график, диаграмма или таблица, опиши данные и значения.
-            Если это документ или скриншот, опиши основное содержание.
-            Если это фото, опиши что на нем изображено.
-            Ответ должен быть информативным и структурированным."""
-            
-            # Используем vision API для анализа изображения
-            try:
-                # Проверяем, поддерживает ли LLMService анализ изображений
-                if hasattr(llm_service, 'analyze_image'):
-                    analysis = llm_service.analyze_image(image_base64, prompt, actual_mime_type)
-                else:
-                    # Fallback: используем обычный chat completion с описанием
-                    logger.warning("⚠️ LLMService не поддерживает анализ изображений напрямую")
-                    analysis = "Изображение загружено. Для анализа требуется поддержка vision API."
-            except Exception as e:
-                logger.error(f"❌ Ошибка анализа изображения через LLM: {e}")
-                import traceback
-                traceback.print_exc()
-                analysis = f"Изображение загружено ({image_format}, {image.size[0]}x{image.size[1]}px). Ошибка анализа: {str(e)}"
-            
-            return analysis
+            return base64.b64encode(image_buffer.getvalue()).decode('utf-8'), actual_mime_type
         except Exception as e:
             logger.error(f"❌ Ошибка обработки изображения: {e}")
             import traceback
             traceback.print_exc()
             raise ValueError(f"Не удалось обработать изображение: {str(e)}")
 
+    @staticmethod
+    def analyze_image(file_bytes: bytes, filename: str, llm_service, mime_type: str = "image/jpeg") -> Optional[str]:
+        """Анализирует изображение через LLM с поддержкой vision"""
+        image_base64, actual_mime_type = FileAnalysisService.prepare_image(file_bytes, filename, mime_type)
+        
+        # Используем vision API для анализа изображения
+        try:
+            # Проверяем, поддерживает ли LLMService анализ изображений
+            if hasattr(llm_service, 'analyze_image'):
+                return llm_service.analyze_image(image_base64, IMAGE_ANALYSIS_PROMPT, actual_mime_type)
+            # Fallback: используем обычный chat completion с описанием
+            logger.warning("⚠️ LLMService не поддерживает анализ изображений напрямую")
+            return "Изображение загружено. Для анализа требуется поддержка vision API."
+        except Exception as e:
+            logger.error(f"❌ Ошибка анализа изображения через LLM: {e}")
+            import traceback
+            traceback.print_exc()
+            return f"Изображение загружено. Ошибка анализа: {str(e)}"
+
     @staticmethod
     def analyze_file(file_bytes: bytes, filename: str, mime_type: str, llm_service=None) -> Dict[str, Any]:
         """
@@ -173,7 +188,7 @@ class FileAnalysisService:
                 result["file_type"] = "doc"
                 result["extracted_text"] = FileAnalysisService.extract_text_from_doc(file_bytes)
                 
-            elif mime_type and mime_type.startswith('image/'):
+            elif FileAnalysisService.is_image(mime_type):
                 result["file_type"] = "image"
                 if llm_service:
                     result["analysis_result"] = FileAnalysisService.analyze_image(file_bytes, filename, llm_service, mime_type)
@@ -2,11 +2,15 @@
 Сервис для локальной транскрибации аудио через Whisper
 Использует faster-whisper для быстрой работы
 """
+import importlib.util
 import os
 import tempfile
 import threading
-from typing import Optional
-from faster_whisper import WhisperModel
+from typing import Optional, TYPE_CHECKING
+
+# faster-whisper (ctranslate2, av) импортируется при загрузке модели, а не при старте приложения
+if TYPE_CHECKING:
+    from faster_whisper import WhisperModel
 
 
 class LocalWhisperService:
@@ -26,7 +30,9 @@ class LocalWhisperService:
         self.device = device
         self.compute_type = compute_type
         self.download_root = download_root
-        self.model: Optional[WhisperModel] = None
+        if importlib.util.find_spec("faster_whisper") is None:
+            raise ImportError("No module named 'faster_whisper'")
+        self.model: Optional["WhisperModel"] = None
         self._model_loading_attempted = False
         self._model_loading_in_progress = False
         self._loading_lock = threading.Lock()
@@ -63,6 +69,7 @@ class LocalWhisperService:
                 
                 # Загружаем модель (может занять время при первом запуске)
                 # Не блокируем lock во время загрузки, чтобы не блокировать проверки
+                from faster_whisper import WhisperModel
                 loaded_model = WhisperModel(self.model_size, **model_kwargs)
                 
                 with self._loading_lock:
@@ -104,6 +111,7 @@ class LocalWhisperService:
                 if self.download_root:
                     model_kwargs["download_root"] = self.download_root
                 
+                from faster_whisper import WhisperModel
                 self.model = WhisperModel(self.model_size, **model_kwargs)
                 print(f"✅ Модель Whisper ({self.model_size}) загружена успешно")
             except Exception as e:
@@ -177,6 +185,7 @@ class LocalWhisperService:
                             
                             # Загружаем модель (блокирующая операция)
                             print("📥 Начинаем загрузку модели из HuggingFace Hub...")
+                            from faster_whisper import WhisperModel
                             self.model = WhisperModel(self.model_size, **model_kwargs)
                             
                             print("=" * 60)
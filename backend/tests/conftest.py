@@ -3,6 +3,7 @@
 """
 import os
 import sys
+import uuid
 import pytest
 from pathlib import Path
 from sqlalchemy import create_engine
@@ -174,6 +175,41 @@ def clear_cache():
     # очистить глобальные экземпляры, это можно сделать здесь.
 
 
+@pytest.fixture
+def postgres_session():
+    """
+    Сессия реального PostgreSQL со схемой из init.sql (триггеры, tsvector).
+    Нужен TEST_POSTGRES_URL, иначе тест пропускается; схема создаётся отдельная и удаляется после теста.
+    """
+    url = os.getenv("TEST_POSTGRES_URL")
+    if not url:
+        pytest.skip("нужен PostgreSQL: TEST_POSTGRES_URL")
+
+    schema = f"test_{uuid.uuid4().hex[:12]}"
+    admin_engine = create_engine(url)
+    with admin_engine.begin() as conn:
+        conn.exec_driver_sql(f"CREATE SCHEMA {schema}")
+
+    pg_engine = create_engine(url, connect_args={"options": f"-csearch_path={schema}"})
+    raw = pg_engine.raw_connection()
+    try:
+        # Скрипт целиком, как его выполняет psql (функции и DO-блоки содержат ;)
+        raw.cursor().execute((backend_dir / "app" / "database" / "init.sql").read_text(encoding="utf-8"))
+        raw.commit()
+    finally:
+        raw.close()
+
+    session = sessionmaker(bind=pg_engine)()
+    try:
+        yield session
+    finally:
+        session.close()
+        pg_engine.dispose()
+        with admin_engine.begin() as conn:
+            conn.exec_driver_sql(f"DROP SCHEMA {schema} CASCADE")
+        admin_engine.dispose()
+
+
 @pytest.fixture(scope="session", autouse=True)
 def cleanup_after_all_tests():
     """Фикстура для финальной очистки после всех тестов
@@ -1,9 +1,18 @@
 """
 Тесты для cache_service
 """
+import threading
+import time
 import pytest
 from datetime import datetime, timedelta
-from backend.app.services.cache_service import CacheService
+from unittest.mock import MagicMock
+from backend.app.services.cache_service import CacheService, build_cache_scope
+from backend.app.services.cache_backends import (
+    RedisCacheBackend,
+    SQLiteCacheBackend,
+    deserialize_cache_entry,
+    serialize_cache_entry,
+)
 
 
 class TestCacheService:
@@ -126,3 +135,256 @@ class TestCacheService:
         assert cache.get(question1) == answer1
         assert cache.get(question2) == answer2
         assert cache.get(question1) != answer2
+
+    def test_lru_eviction_by_recency(self):
+        """Тест вытеснения по давности использования, а не по порядку вставки"""
+        cache = CacheService(max_size=2)
+
+        cache.set("question 1", {"answer": "1"})
+        cache.set("question 2", {"answer": "2"})
+        # Обращение делает question 1 самым свежим
+        assert cache.get("question 1") is not None
+
+        cache.set("question 3", {"answer": "3"})
+
+        assert cache.get("question 2") is None
+        assert cache.get("question 1") is not None
+        assert cache.get("question 3") is not None
+
+    def test_byte_budget(self):
+        """Тест ограничения кэша по объёму данных"""
+        cache = CacheService(max_size=100, max_bytes=250)
+        big_answer = {"formatted_html": "x" * 100}
+
+        cache.set("question 1", big_answer)
+        cache.set("question 2", big_answer)
+        cache.set("question 3", big_answer)
+
+        assert cache.get("question 1") is None
+        assert cache.get("question 3") == big_answer
+        assert cache.current_bytes <= 250
+
+        # Запись больше бюджета не сохраняется
+        cache.set("huge", {"formatted_html": "y" * 1000})
+        assert cache.get("huge") is None
+
+    def test_overwrite_updates_size(self):
+        """Тест перезаписи ключа без утечки учтённого объёма"""
+        cache = CacheService()
+
+        cache.set("question", {"answer": "a" * 50})
+        cache.set("question", {"answer": "b"})
+
+        assert cache.get("question") == {"answer": "b"}
+        assert len(cache.cache) == 1
+        assert cache.current_bytes == cache._payload_size({"answer": "b"})
+
+    def test_stats(self):
+        """Тест счётчиков попаданий, промахов и вытеснений"""
+        cache = CacheService(max_size=1)
+
+        cache.get("question 1")
+        cache.set("question 1", {"answer": "1"})
+        cache.get("question 1")
+        cache.set("question 2", {"answer": "2"})
+
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["evictions"] == 1
+        assert stats["entries"] == 1
+        assert stats["hit_rate"] == 0.5
+
+
+class TestBuildCacheScope:
+    """Тесты области кэша (контекст чата, пространства и вложений)"""
+
+    def test_context_free_scope(self):
+        """Тест общего уровня для вопроса без контекста"""
+        # Текущий ход пользователя в истории не считается контекстом
+        history = [{"role": "user", "content": "Что такое ROI?"}]
+
+        assert build_cache_scope("finance", history) == "free:finance"
+        assert build_cache_scope("finance") == build_cache_scope("finance", [], None, [])
+
+    def test_scope_depends_on_context(self):
+        """Тест что разный контекст даёт разные области"""
+        history_a = [
+            {"role": "user", "content": "Мы продаём кофе"},
+            {"role": "assistant", "content": "Понял"},
+        ]
+        history_b = [
+            {"role": "user", "content": "Мы продаём чай"},
+            {"role": "assistant", "content": "Понял"},
+        ]
+
+        scopes = {
+            build_cache_scope("marketing", history_a),
+            build_cache_scope("marketing", history_b),
+            build_cache_scope("sales", history_a),
+            build_cache_scope("marketing", history_a, space_context="контекст пространства"),
+            build_cache_scope("marketing", history_a, attachment_ids=[7]),
+            build_cache_scope("marketing", history_a, conversation_summary="Обсуждали запуск"),
+        }
+        assert len(scopes) == 6
+        assert all(scope.startswith("ctx:") for scope in scopes)
+
+    def test_attachment_order_irrelevant(self):
+        """Тест что порядок id вложений не влияет на область"""
+        assert build_cache_scope("general", attachment_ids=[3, 1]) == build_cache_scope("general", attachment_ids=[1, 3])
+
+    def test_scoped_get_set(self):
+        """Тест что ответ из одной области не отдаётся в другой"""
+        cache = CacheService()
+        scope_a = build_cache_scope("general", [{"role": "assistant", "content": "A"}])
+        scope_b = build_cache_scope("general", [{"role": "assistant", "content": "B"}])
+
+        cache.set("Как дела с продажами?", {"raw_text": "ответ A"}, scope=scope_a)
+
+        assert cache.get("как дела с продажами?", scope=scope_a) == {"raw_text": "ответ A"}
+        assert cache.get("Как дела с продажами?", scope=scope_b) is None
+        assert cache.get("Как дела с продажами?") is None
+
+
+class TestSharedCache:
+    """Тесты второго уровня кэша (общий для процессов)"""
+
+    def test_serialization_roundtrip(self):
+        """Тест компактной сериализации записи"""
+        data = {"raw_text": "Ответ", "formatted_html": "<p>Ответ</p>" * 50}
+
+        blob = serialize_cache_entry(data, 123.5)
+
+        assert deserialize_cache_entry(blob) == (data, 123.5)
+        assert len(blob) < len(str(data))
+
+    def test_sqlite_promotion_between_processes(self, tmp_path):
+        """Тест что ответ одного процесса доступен другому через L2 и поднимается в L1"""
+        path = str(tmp_path / "cache.sqlite3")
+        worker_a = CacheService(shared_backend=SQLiteCacheBackend(path))
+        worker_b = CacheService(shared_backend=SQLiteCacheBackend(path))
+        answer = {"raw_text": "Ответ из другого воркера"}
+
+        worker_a.set("Вопрос", answer, scope="free:general")
+
+        assert worker_b.get("вопрос", scope="free:general") == answer
+        assert worker_b.stats()["shared_hits"] == 1
+        # Повторное чтение — уже из L1
+        assert worker_b.get("вопрос", scope="free:general") == answer
+        assert worker_b.stats()["shared_hits"] == 1
+
+    def test_sqlite_survives_restart(self, tmp_path):
+        """Тест что записи L2 переживают перезапуск процесса"""
+        path = str(tmp_path / "cache.sqlite3")
+        CacheService(shared_backend=SQLiteCacheBackend(path)).set("Вопрос", {"raw_text": "ok"})
+
+        restarted = CacheService(shared_backend=SQLiteCacheBackend(path))
+
+        assert restarted.get("Вопрос") == {"raw_text": "ok"}
+
+    def test_invalidation_broadcast(self, tmp_path):
+        """Тест рассылки инвалидации в L1 других процессов"""
+        path = str(tmp_path / "cache.sqlite3")
+        worker_a = CacheService(shared_backend=SQLiteCacheBackend(path))
+        worker_b = CacheService(shared_backend=SQLiteCacheBackend(path))
+        worker_a.set("Вопрос", {"raw_text": "старый"})
+        assert worker_b.get("Вопрос") is not None
+
+        worker_a.invalidate("Вопрос")
+        worker_b._next_invalidation_poll = 0.0
+
+        assert worker_b.get("Вопрос") is None
+
+        worker_a.set("Другой", {"raw_text": "x"})
+        assert worker_b.get("Другой") is not None
+        worker_a.clear()
+        worker_b._next_invalidation_poll = 0.0
+        assert worker_b.get("Другой") is None
+
+    def test_invalidation_poll_single_thread(self):
+        """Тест что события инвалидации из L2 забирает один поток, остальные не ждут и не опрашивают"""
+        started, release = threading.Event(), threading.Event()
+        backend = MagicMock()
+        backend.get.return_value = None
+
+        def poll():
+            started.set()
+            release.wait(5)
+            return []
+
+        backend.poll_invalidations.side_effect = poll
+        cache = CacheService(shared_backend=backend)
+
+        poller = threading.Thread(target=cache.get, args=("Вопрос",))
+        poller.start()
+        assert started.wait(5)
+        cache._next_invalidation_poll = 0.0
+        others = [threading.Thread(target=cache.get, args=("Вопрос",)) for _ in range(4)]
+        for thread in others:
+            thread.start()
+        for thread in others:
+            thread.join(5)
+        assert not any(thread.is_alive() for thread in others)
+        release.set()
+        poller.join(5)
+
+        assert backend.poll_invalidations.call_count == 1
+
+    def test_redis_poll_serialized(self):
+        """Тест что PubSub Redis-бэкенда не читается из нескольких потоков одновременно"""
+        active, overlaps = [], []
+
+        class PubSub:
+            def subscribe(self, channel):
+                pass
+
+            def get_message(self, timeout=0):
+                active.append(1)
+                if len(active) > 1:
+                    overlaps.append(1)
+                time.sleep(0.001)
+                active.pop()
+                return None
+
+        client = MagicMock()
+        client.pubsub.return_value = PubSub()
+        backend = RedisCacheBackend(client=client)
+
+        threads = [
+            threading.Thread(target=lambda: [backend.poll_invalidations() for _ in range(20)]) for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert overlaps == []
+
+    def test_backend_errors_do_not_break_cache(self):
+        """Тест что ошибка L2 не ломает работу L1"""
+        backend = MagicMock()
+        backend.name = "broken"
+        backend.get.side_effect = ConnectionError("down")
+        backend.set.side_effect = ConnectionError("down")
+        backend.poll_invalidations.side_effect = ConnectionError("down")
+        cache = CacheService(shared_backend=backend)
+
+        cache.set("Вопрос", {"raw_text": "ok"})
+
+        assert cache.get("Вопрос") == {"raw_text": "ok"}
+        assert cache.get("Другой") is None
+        assert cache.stats()["shared_errors"] >= 2
+
+    def test_redis_backend(self):
+        """Тест Redis-бэкенда на fakeredis"""
+        fakeredis = pytest.importorskip("fakeredis")
+        server = fakeredis.FakeServer()
+        worker_a = CacheService(shared_backend=RedisCacheBackend(client=fakeredis.FakeRedis(server=server)))
+        worker_b = CacheService(shared_backend=RedisCacheBackend(client=fakeredis.FakeRedis(server=server)))
+
+        worker_a.set("Вопрос", {"raw_text": "ok"})
+        assert worker_b.get("Вопрос") == {"raw_text": "ok"}
+
+        worker_a.clear()
+        worker_b._next_invalidation_poll = 0.0
+        assert worker_b.get("Вопрос") is None
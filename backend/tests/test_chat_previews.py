@@ -0,0 +1,125 @@
+"""
+Тесты денормализованного превью чатов (chats.last_message_preview / last_message_at / message_count)
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import event
+
+from backend.app.models.chat import Chat, CHAT_PREVIEW_LENGTH
+from backend.app.models.message import Message
+from backend.app.models.space import Space
+from backend.app.models.user import User
+
+
+@pytest.fixture
+def space(db_session, test_user):
+    space = Space(user_id=test_user.id, name="Пространство")
+    db_session.add(space)
+    db_session.commit()
+    return space
+
+
+def make_chat(db_session, space, contents, title="Чат"):
+    chat = Chat(space_id=space.id, user_id=space.user_id, title=title)
+    db_session.add(chat)
+    db_session.commit()
+    started = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    for i, content in enumerate(contents):
+        db_session.add(Message(
+            chat_id=chat.id,
+            role="user" if i % 2 == 0 else "assistant",
+            content=content,
+            created_at=started + timedelta(minutes=i),
+        ))
+        db_session.commit()
+    db_session.refresh(chat)
+    return chat
+
+
+class TestChatPreview:
+    """Тесты поддержки превью событиями Message"""
+
+    def test_insert_updates_preview_and_count(self, db_session, space):
+        """Тест что новое сообщение обновляет превью, время и счётчик"""
+        chat = make_chat(db_session, space, ["Вопрос", "ответ " * 40])
+
+        assert chat.message_count == 2
+        assert chat.last_message_preview == ("ответ " * 40)[:CHAT_PREVIEW_LENGTH] + "..."
+        assert chat.last_message_at.replace(tzinfo=None) == datetime(2025, 1, 1, 0, 1)
+
+    def test_delete_and_edit_recompute(self, db_session, space):
+        """Тест пересчёта после удаления последнего сообщения и правки текста"""
+        chat = make_chat(db_session, space, ["Первый", "Второй", "Третий"])
+        last = db_session.query(Message).filter(Message.chat_id == chat.id).order_by(Message.id.desc()).first()
+
+        db_session.delete(last)
+        db_session.commit()
+        db_session.refresh(chat)
+        assert chat.message_count == 2
+        assert chat.last_message_preview == "Второй"
+
+        second = db_session.query(Message).filter(Message.content == "Второй").first()
+        second.content = "Исправленный"
+        db_session.commit()
+        db_session.refresh(chat)
+        assert chat.message_count == 2
+        assert chat.last_message_preview == "Исправленный"
+
+    def test_chat_history_single_page_query(self, client, db_session, auth_headers, test_user_data):
+        """Тест что список чатов строится без запросов по каждому чату"""
+        user = db_session.query(User).filter(User.email == test_user_data["email"]).first()
+        space = Space(user_id=user.id, name="Работа")
+        db_session.add(space)
+        db_session.commit()
+        for i in range(5):
+            make_chat(db_session, space, [f"Вопрос {i}", f"Ответ {i}"], title=f"Чат {i}")
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = db_session.get_bind()
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            response = client.get("/api/chat/history", headers=auth_headers)
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["total"] == 5
+        assert {chat["last_message"] for chat in data["chats"]} == {f"Ответ {i}" for i in range(5)}
+        assert all(chat["space_name"] == "Работа" for chat in data["chats"])
+        # Пользователь, total и страница чатов — число запросов не зависит от числа чатов
+        assert len(statements) <= 3
+
+
+class TestChatPreviewPostgres:
+    """Превью и updated_at в PostgreSQL с триггерами из init.sql (нужен TEST_POSTGRES_URL)"""
+
+    @pytest.mark.integration
+    def test_edit_and_delete_keep_updated_at(self, postgres_session):
+        """Тест что новое сообщение поднимает чат, а правка и удаление — нет"""
+        db = postgres_session
+        user = User(email="pg@example.com", password_hash="-", name="PG", is_active=True)
+        db.add(user)
+        db.commit()
+        space = Space(user_id=user.id, name="Пространство")
+        db.add(space)
+        db.commit()
+        chat = make_chat(db, space, ["Первый", "Второй"])
+        created_at = db.query(Chat.created_at).filter(Chat.id == chat.id).scalar()
+        updated_at = chat.updated_at
+        assert updated_at > created_at
+
+        first, second = db.query(Message).filter(Message.chat_id == chat.id).order_by(Message.id).all()
+        first.content = "Исправленный"
+        db.commit()
+        db.delete(second)
+        db.commit()
+        db.refresh(chat)
+
+        assert (chat.message_count, chat.last_message_preview) == (1, "Исправленный")
+        assert chat.updated_at == updated_at
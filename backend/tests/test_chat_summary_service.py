@@ -0,0 +1,238 @@
+"""
+Тесты для ChatSummarizer (фоновое краткое содержание чата)
+"""
+import asyncio
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from backend.app.models.chat import Chat
+from backend.app.models.message import Message
+from backend.app.models.space import Space
+from backend.app.services.chat_summary_service import ChatSummarizer
+from backend.app.services.history_service import select_history_window
+
+
+class FakeLLM:
+    """summarize_conversation_async без обращения к провайдеру"""
+
+    def __init__(self, result="Краткое содержание", on_call=None):
+        self.result = result
+        self.on_call = on_call
+        self.calls = []
+
+    async def summarize_conversation_async(self, history, previous_summary=None, min_messages=5, max_messages=10):
+        self.calls.append({"history": history, "previous_summary": previous_summary})
+        if self.on_call:
+            self.on_call()
+        await asyncio.sleep(0)
+        return self.result
+
+
+@pytest.fixture
+def chat(db_session, test_user):
+    space = Space(user_id=test_user.id, name="Пространство")
+    db_session.add(space)
+    db_session.commit()
+    chat = Chat(space_id=space.id, user_id=test_user.id, title="Чат")
+    db_session.add(chat)
+    db_session.commit()
+    return chat
+
+
+@pytest.fixture
+def summarizer(db_session):
+    return ChatSummarizer(
+        session_factory=sessionmaker(bind=db_session.get_bind()),
+        enabled=True, keep_recent=2, every_messages=4, trigger_tokens=10000,
+    )
+
+
+def add_messages(db_session, chat, count, start=0):
+    started = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    messages = []
+    for i in range(start, start + count):
+        message = Message(
+            chat_id=chat.id,
+            role="user" if i % 2 == 0 else "assistant",
+            content=f"сообщение {i}",
+            created_at=started + timedelta(minutes=i),
+        )
+        db_session.add(message)
+        messages.append(message)
+    db_session.commit()
+    return messages
+
+
+class TestChatSummarizer:
+    """Тесты обновления chats.summary"""
+
+    @pytest.mark.asyncio
+    async def test_no_refresh_for_short_chat(self, db_session, chat, summarizer):
+        """Тест что короткий чат не суммаризируется"""
+        add_messages(db_session, chat, 5)
+        llm = FakeLLM()
+
+        assert await summarizer.refresh(chat.id, llm) is False
+        assert llm.calls == []
+
+    @pytest.mark.asyncio
+    async def test_refresh_covers_all_but_recent(self, db_session, chat, summarizer):
+        """Тест что summary покрывает сообщения кроме последних keep_recent и не двигает updated_at"""
+        messages = add_messages(db_session, chat, 6)
+        updated_at = chat.updated_at
+        llm = FakeLLM()
+
+        assert await summarizer.refresh(chat.id, llm) is True
+        db_session.expire_all()
+
+        assert chat.summary == "Краткое содержание"
+        assert chat.summary_message_id == messages[3].id
+        assert chat.summary_token_count > 0
+        assert chat.updated_at == updated_at
+        assert [m["content"] for m in llm.calls[0]["history"]] == [f"сообщение {i}" for i in range(4)]
+        assert llm.calls[0]["previous_summary"] is None
+
+        # В окно истории для промпта попадают только сообщения после границы summary
+        window = select_history_window(db_session, chat.id, after_message_id=chat.summary_message_id)
+        assert [m.id for m, _ in window] == [messages[4].id, messages[5].id]
+
+    @pytest.mark.asyncio
+    async def test_incremental_refresh(self, db_session, chat, summarizer):
+        """Тест что следующее обновление дополняет прежнее содержание новыми сообщениями"""
+        add_messages(db_session, chat, 6)
+        await summarizer.refresh(chat.id, FakeLLM("Первое"))
+        add_messages(db_session, chat, 4, start=6)
+        llm = FakeLLM("Второе")
+
+        assert await summarizer.refresh(chat.id, llm) is True
+        db_session.expire_all()
+
+        assert llm.calls[0]["previous_summary"] == "Первое"
+        assert [m["content"] for m in llm.calls[0]["history"]] == [f"сообщение {i}" for i in range(4, 8)]
+        assert chat.summary == "Второе"
+
+    @pytest.mark.asyncio
+    async def test_concurrent_update_discarded(self, db_session, chat, summarizer):
+        """Тест что результат отбрасывается, если summary успел обновить другой процесс"""
+        messages = add_messages(db_session, chat, 6)
+
+        def other_worker():
+            other = sessionmaker(bind=db_session.get_bind())()
+            other.query(Chat).filter(Chat.id == chat.id).update(
+                {Chat.summary: "Чужое", Chat.summary_message_id: messages[1].id}
+            )
+            other.commit()
+            other.close()
+
+        assert await summarizer.refresh(chat.id, FakeLLM(on_call=other_worker)) is False
+        db_session.expire_all()
+        assert chat.summary == "Чужое"
+
+    @pytest.mark.asyncio
+    async def test_schedule_runs_once_per_chat(self, db_session, chat, summarizer):
+        """Тест что для чата одновременно идёт не больше одного фонового обновления"""
+        add_messages(db_session, chat, 6)
+        llm = FakeLLM()
+
+        assert summarizer.schedule(chat.id, llm) is True
+        assert summarizer.schedule(chat.id, llm) is False
+        await summarizer.wait_idle()
+
+        assert len(llm.calls) == 1
+        assert summarizer.stats()["refreshed"] == 1
+        assert summarizer.schedule(chat.id, llm) is True
+        await summarizer.wait_idle()
+        assert summarizer.stats()["skipped"] == 1
+
+    @pytest.mark.asyncio
+    async def test_db_work_off_event_loop_and_sanitized(self, db_session, chat):
+        """Тест что запросы к БД идут не в потоке event loop, а в LLM уходит текст без HTML"""
+        add_messages(db_session, chat, 5)
+        db_session.add(Message(chat_id=chat.id, role="assistant", content="<p>Выручка <b>выросла</b></p>"))
+        db_session.add_all([Message(chat_id=chat.id, role="user", content="ещё") for _ in range(2)])
+        db_session.commit()
+        session_threads = []
+        factory = sessionmaker(bind=db_session.get_bind())
+
+        def session_factory():
+            session_threads.append(threading.get_ident())
+            return factory()
+
+        summarizer = ChatSummarizer(
+            session_factory=session_factory, enabled=True, keep_recent=2, every_messages=4, trigger_tokens=10000,
+        )
+        llm = FakeLLM()
+
+        assert await summarizer.refresh(chat.id, llm) is True
+
+        assert len(session_threads) == 2
+        assert threading.get_ident() not in session_threads
+        assert llm.calls[0]["history"][-1]["content"] == "Выручка выросла"
+
+
+class TestChatsUpdatedAtTrigger:
+    """Триггер update_chats_updated_at в PostgreSQL (нужен TEST_POSTGRES_URL)"""
+
+    @pytest.mark.integration
+    def test_summary_update_keeps_updated_at(self, postgres_session):
+        """Тест что запись summary не поднимает чат в списке, а переименование — поднимает"""
+        from backend.app.models.user import User
+
+        db = postgres_session
+        user = User(email="pg@example.com", password_hash="-", name="PG", is_active=True)
+        db.add(user)
+        db.flush()
+        space = Space(user_id=user.id, name="Пространство")
+        db.add(space)
+        db.flush()
+        chat = Chat(space_id=space.id, user_id=user.id, title="Чат")
+        db.add(chat)
+        db.commit()
+        chat_id = chat.id
+        updated_at = chat.updated_at
+
+        summarizer = ChatSummarizer(session_factory=sessionmaker(bind=db.get_bind()), enabled=True)
+        assert summarizer._store_summary(chat_id, None, 1, "Краткое содержание") is True
+        db.expire_all()
+        assert (chat.summary, chat.updated_at) == ("Краткое содержание", updated_at)
+
+        chat.title = "Новое название"
+        db.commit()
+        db.expire_all()
+        assert chat.updated_at > updated_at
+
+    @pytest.mark.asyncio
+    async def test_legacy_chat_summarized_in_batches(self, db_session, chat):
+        """Тест что длинный чат без summary догоняется батчами от самых старых сообщений"""
+        messages = add_messages(db_session, chat, 100)
+        summarizer = ChatSummarizer(
+            session_factory=sessionmaker(bind=db_session.get_bind()),
+            enabled=True, keep_recent=2, every_messages=4, trigger_tokens=10000, batch_messages=40,
+        )
+        llm = FakeLLM()
+
+        for _ in range(4):
+            await summarizer.refresh(chat.id, llm)
+
+        assert [len(call["history"]) for call in llm.calls] == [40, 40, 18]
+        assert llm.calls[0]["history"][0]["content"] == "сообщение 0"
+        assert llm.calls[1]["history"][0]["content"] == "сообщение 40"
+        assert llm.calls[1]["previous_summary"] == "Краткое содержание"
+        db_session.expire_all()
+        assert chat.summary_message_id == messages[97].id
+
+    @pytest.mark.asyncio
+    async def test_batch_limited_by_tokens(self, db_session, chat, summarizer):
+        """Тест что в один запрос идёт не больше batch_tokens токенов текста"""
+        messages = add_messages(db_session, chat, 12)
+        summarizer.batch_tokens = sum(m.token_count for m in messages[:3])
+        llm = FakeLLM()
+
+        assert await summarizer.refresh(chat.id, llm) is True
+
+        assert len(llm.calls[0]["history"]) == 3
+        db_session.expire_all()
+        assert chat.summary_message_id == messages[2].id
@@ -0,0 +1,100 @@
+"""
+Тесты выноса sync-запросов к БД из event loop (пул потоков)
+"""
+import asyncio
+import threading
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+
+
+class TestEventLoopOffload:
+    """Тесты что запросы к БД на горячих путях не выполняются в event loop"""
+
+    @pytest.mark.parametrize("module, name", [
+        ("backend.app.dependencies", "get_current_user"),
+        ("backend.app.routes.chat_routes", "get_chat_history"),
+        ("backend.app.routes.chat_routes", "get_chat_messages"),
+        ("backend.app.routes.search_routes", "search"),
+        ("backend.app.routes.spaces_routes", "list_spaces"),
+        ("backend.app.routes.public_routes", "get_public_chat_messages"),
+    ])
+    def test_sync_handlers_run_in_threadpool(self, module, name):
+        """Обработчики с одними запросами к БД — обычные функции (FastAPI выполняет их в пуле потоков)"""
+        import importlib
+
+        handler = getattr(importlib.import_module(module), name)
+        assert not asyncio.iscoroutinefunction(handler)
+
+    @pytest.mark.asyncio
+    async def test_pipeline_loads_context_in_thread(self):
+        """Тест что история и кэш для ответа LLM загружаются вне потока event loop"""
+        from backend.app.routes import chat_routes
+
+        loop_thread = threading.current_thread()
+        seen = {}
+
+        def load_context(db, chat, space, attachment_ids=None):
+            seen["load"] = threading.current_thread()
+            return [], None
+
+        def cached_reply(*args):
+            seen["cache"] = threading.current_thread()
+            return chat_routes.ChatSendResponse(success=True, chat_id=1, message_id=2, response={})
+
+        async def shortcut(*args):
+            return None, "prompt", "general", {"general": 0.9}
+
+        chat = SimpleNamespace(id=1, summary=None, summary_message_id=None)
+        space = SimpleNamespace(id=3)
+        user = SimpleNamespace(id=4)
+
+        with patch.object(chat_routes, "_assistant_shortcut_reply", shortcut), \
+                patch.object(chat_routes, "_load_llm_context", load_context), \
+                patch.object(chat_routes, "_cached_assistant_reply", cached_reply):
+            result = await chat_routes._assistant_reply_pipeline(
+                None, chat, space, user, "Вопрос", "Вопрос", "",
+            )
+
+        assert result.message_id == 2
+        assert seen["load"] is not loop_thread
+        assert seen["cache"] is not loop_thread
+
+    @pytest.mark.asyncio
+    async def test_shortcut_reply_runs_in_thread(self):
+        """Тест что быстрый ответ, классификатор и сохранение графика выполняются вне потока event loop"""
+        from backend.app.routes import chat_routes
+
+        loop_thread = threading.current_thread()
+        seen = {}
+
+        def quick_reply(db, chat, user_message):
+            seen["quick"] = threading.current_thread()
+            return None
+
+        def classify(*args):
+            seen["classify"] = threading.current_thread()
+            return "построй график продаж", "prompt", "graphic", {"graphic": 0.9}
+
+        async def graphic_request(*args):
+            return {"raw_text": "График"}
+
+        def save_graphic(db, chat, space, user, response_data):
+            seen["save"] = threading.current_thread()
+            return chat_routes.ChatSendResponse(success=True, chat_id=1, message_id=5, response=response_data)
+
+        chat = SimpleNamespace(id=1)
+        space = SimpleNamespace(id=3)
+        user = SimpleNamespace(id=4)
+
+        with patch.object(chat_routes, "_quick_assistant_reply", quick_reply), \
+                patch.object(chat_routes, "_classify_user_message", classify), \
+                patch.object(chat_routes, "process_graphic_request", graphic_request), \
+                patch.object(chat_routes, "_save_graphic_reply", save_graphic):
+            result, _, category, _ = await chat_routes._assistant_shortcut_reply(
+                None, chat, space, user, "построй график продаж", "построй график продаж", "",
+            )
+
+        assert (result.message_id, category) == (5, "graphic")
+        assert all(thread is not loop_thread for thread in seen.values()) and len(seen) == 3
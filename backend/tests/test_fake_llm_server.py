@@ -0,0 +1,117 @@
+"""
+Тесты локального стенда LLM/Whisper (fake_llm_server) вместе с LLMService
+"""
+import random
+from unittest.mock import patch
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from openai import AsyncOpenAI
+
+from backend import fake_llm_server
+from backend.app.services.llm_service import LLMService
+
+
+@pytest.fixture
+def fake_provider(monkeypatch):
+    """Стенд без задержек"""
+    monkeypatch.setenv("FAKE_LLM_TTFT_MS", "0")
+    monkeypatch.setenv("FAKE_LLM_TOKENS_PER_SECOND", "0")
+    monkeypatch.setenv("FAKE_LLM_COMPLETION_TOKENS", "20")
+    monkeypatch.setenv("FAKE_WHISPER_MS_PER_KB", "0")
+    monkeypatch.setenv("FAKE_LLM_GUARDRAIL_MODELS", "blocked/model")
+    provider = fake_llm_server.FakeProvider(fake_llm_server.FakeProviderConfig())
+    monkeypatch.setattr(fake_llm_server, "provider", provider)
+    return provider
+
+
+@pytest.fixture
+def llm_service(mock_env_vars, fake_provider, monkeypatch):
+    """LLMService, у которого основной endpoint — стенд (через ASGI, без сети)"""
+    monkeypatch.setenv("OPENROUTER_MODEL", "fake-large")
+    with patch('backend.app.services.llm_service.OpenAI'):
+        service = LLMService()
+    transport_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=fake_llm_server.app))
+    service.async_http_client = transport_client
+    service.async_client = AsyncOpenAI(
+        base_url="http://fake/v1", api_key="fake", http_client=transport_client, max_retries=0
+    )
+    service.openrouter_api_key = "fake"
+    service.openrouter_models_url = "http://fake/v1/models/user"
+    return service
+
+
+class TestFakeLLMServer:
+    """Тесты стенда через OpenAI SDK"""
+
+    @pytest.mark.asyncio
+    async def test_completion_deterministic(self, llm_service, fake_provider):
+        """Тест что одинаковый запрос даёт одинаковый ответ, а длина ограничена настройкой"""
+        first = await llm_service.generate_response_async("Ты помощник", "Как посчитать маржу?")
+        llm_service.single_flight = type(llm_service.single_flight)()
+        second = await llm_service.generate_response_async("Ты помощник", "Как посчитать маржу?")
+
+        assert first == second
+        assert len(first.split()) == 20
+        assert fake_provider.stats["chat"] == 2
+
+    @pytest.mark.asyncio
+    async def test_stream_matches_completion(self, llm_service):
+        """Тест что потоковый ответ собирается в тот же текст"""
+        full = await llm_service.generate_response_async("Ты помощник", "Вопрос о налогах")
+        parts = [part async for part in llm_service.stream_response_async("Ты помощник", "Вопрос о налогах")]
+
+        assert len(parts) == 20
+        assert "".join(parts) == full
+
+    @pytest.mark.asyncio
+    async def test_guardrail_fallback_uses_catalog(self, llm_service, fake_provider):
+        """Тест guardrail 404 и выбора eligible-модели из каталога стенда"""
+        completion = await llm_service._chat_completion_async(
+            preferred_model="blocked/model",
+            messages=[{"role": "user", "content": "Привет"}],
+            temperature=0.5,
+            max_tokens=50,
+        )
+
+        assert completion.model == "fake-large"
+        assert fake_provider.stats["guardrail"] == 1
+
+    @pytest.mark.asyncio
+    async def test_injected_errors(self, llm_service, fake_provider):
+        """Тест инъекции ошибок провайдера"""
+        fake_provider.config.error_rate = 1.0
+        fake_provider.config.error_statuses = [503]
+
+        with pytest.raises(ValueError, match="Ошибка LLM"):
+            await llm_service.generate_response_async("Ты помощник", "Привет?")
+
+        assert fake_provider.stats["errors"] >= 1
+
+    def test_transcription_and_models(self, fake_provider):
+        """Тест транскрибации (multipart) и каталога моделей"""
+        client = TestClient(fake_llm_server.app)
+
+        response = client.post(
+            "/v1/audio/transcriptions",
+            files={"file": ("audio.webm", b"\x00" * 8192, "audio/webm")},
+            data={"model": "whisper-1", "language": "ru"},
+        )
+        models = client.get("/v1/models/user").json()["data"]
+
+        assert response.status_code == 200
+        assert response.json()["text"]
+        assert any("image" in m["architecture"]["input_modalities"] for m in models)
+
+    @pytest.mark.parametrize("spec, low, high", [
+        ("150", 0.15, 0.15),
+        ("uniform:100:200", 0.1, 0.2),
+        ("lognormal:200:0.3", 0.0, 10.0),
+    ])
+    def test_latency_distribution(self, spec, low, high):
+        """Тест описаний распределения задержки"""
+        distribution = fake_llm_server.LatencyDistribution(spec)
+        rng = random.Random(1)
+
+        assert all(low <= distribution.sample(rng) <= high for _ in range(20))
@@ -0,0 +1,125 @@
+"""
+Тесты загрузки файлов /api/chat/upload-file
+"""
+import io
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import docx
+import pytest
+from PIL import Image
+
+from backend.main import app
+from backend.app.services import llm_scheduler as llm_scheduler_module
+from backend.app.services.llm_scheduler import LLMQueueFullError
+from backend.app.services.service_registry import get_llm_service
+
+BACKEND_DIR = Path(__file__).parent.parent
+
+
+class FakeVisionLLM:
+    """LLMService с async vision-запросом; sync analyze_image вызываться не должен"""
+
+    def __init__(self):
+        self.calls = []
+
+    async def analyze_image_async(self, image_base64, prompt, mime_type="image/jpeg"):
+        self.calls.append(mime_type)
+        return "На изображении красный квадрат"
+
+    def analyze_image(self, *args, **kwargs):
+        raise AssertionError("sync analyze_image в async-эндпоинте")
+
+
+def png_bytes():
+    buffer = io.BytesIO()
+    Image.new("RGB", (4, 4), "red").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def docx_bytes(text):
+    document = docx.Document()
+    document.add_paragraph(text)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def queue_full(monkeypatch):
+    """Очередь LLM переполнена: любой slot() сразу отказывает"""
+    @asynccontextmanager
+    async def full_slot(tenant, priority):
+        raise LLMQueueFullError()
+        yield
+
+    monkeypatch.setattr(llm_scheduler_module.llm_scheduler, "slot", full_slot)
+
+
+@pytest.fixture
+def fake_llm(client):
+    llm = FakeVisionLLM()
+    app.dependency_overrides[get_llm_service] = lambda: llm
+    return llm
+
+
+@pytest.fixture
+def uploaded_files():
+    """Удаляет сохранённые в assets файлы после теста"""
+    paths = []
+    yield paths
+    for file_url in paths:
+        (BACKEND_DIR / file_url).unlink(missing_ok=True)
+
+
+class TestFileUpload:
+    """Тесты анализа загружаемых файлов"""
+
+    def test_image_analyzed_via_async_vision(self, client, auth_headers, fake_llm, uploaded_files):
+        """Тест что изображение анализируется через analyze_image_async"""
+        response = client.post(
+            "/api/chat/upload-file",
+            files={"file": ("square.png", png_bytes(), "image/png")},
+            headers=auth_headers,
+        )
+
+        assert response.status_code == 200
+        data = response.json()
+        uploaded_files.append(data["file_url"])
+        assert data["file_type"] == "image"
+        assert data["analysis_result"] == "На изображении красный квадрат"
+        assert fake_llm.calls == ["image/jpeg"]
+
+    def test_image_rejected_when_llm_queue_full(self, client, auth_headers, fake_llm, queue_full):
+        """Тест что при переполненной очереди изображение не сохраняется без анализа, а отдаётся 429"""
+        assets = {path.name for path in (BACKEND_DIR / "assets").glob("file_*")}
+
+        response = client.post(
+            "/api/chat/upload-file",
+            files={"file": ("square.png", png_bytes(), "image/png")},
+            headers=auth_headers,
+        )
+
+        assert response.status_code == 429
+        assert "Retry-After" in response.headers
+        assert fake_llm.calls == []
+        assert {path.name for path in (BACKEND_DIR / "assets").glob("file_*")} == assets
+
+    def test_text_extraction_does_not_wait_for_llm_queue(self, client, auth_headers, fake_llm, queue_full,
+                                                          uploaded_files):
+        """Тест что извлечение текста из DOCX не занимает слот очереди LLM"""
+        response = client.post(
+            "/api/chat/upload-file",
+            files={"file": (
+                "plan.docx",
+                docx_bytes("План продаж на квартал"),
+                "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+            )},
+            headers=auth_headers,
+        )
+
+        assert response.status_code == 200
+        data = response.json()
+        uploaded_files.append(data["file_url"])
+        assert data["file_type"] == "docx"
+        assert "План продаж на квартал" in data["extracted_text"]
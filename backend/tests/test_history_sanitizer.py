@@ -0,0 +1,130 @@
+"""
+Тесты для history_sanitizer (очистка истории чата перед отправкой в LLM)
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from backend.app.models.chat import Chat
+from backend.app.models.file_attachment import FileAttachment
+from backend.app.models.message import Message
+from backend.app.models.space import Space
+from backend.app.services.history_service import load_conversation_history
+from backend.app.utils.history_sanitizer import (
+    SanitizedHistoryCache,
+    sanitize_message_content,
+)
+from backend.app.utils.tokens import count_tokens
+
+IMAGE_MESSAGE = """Что на графике?
+<div class="uploaded-file-container">
+    <div class="uploaded-file-header" style="margin-bottom: 8px; font-weight: 500;">📎 sales.png</div>
+    <div class="uploaded-file-image">
+        <img src="/assets/sales.png" alt="sales.png" style="max-width: 100%; max-height: 500px;" />
+    </div>
+    <details class="uploaded-file-analysis" style="margin-top: 12px;">
+        <summary>🔍 Показать анализ изображения</summary>
+        <div>Подробный анализ изображения, который уже есть во вложении</div>
+    </details>
+</div>"""
+
+
+class TestSanitizeMessageContent:
+    """Тесты преобразования разметки в текст"""
+
+    def test_plain_text_unchanged(self):
+        """Тест что обычный текст (в том числе со знаками < и >) не меняется"""
+        assert sanitize_message_content("Если x < 5 и y > 3, что делать?") == "Если x < 5 и y > 3, что делать?"
+
+    def test_image_block(self):
+        """Тест что блок изображения сворачивается в ссылку, анализ и стили удаляются"""
+        text = sanitize_message_content(IMAGE_MESSAGE)
+
+        assert text.startswith("Что на графике?")
+        assert "[Изображение: sales.png]" in text
+        assert "Подробный анализ" not in text
+        assert "style" not in text and "<" not in text
+        assert count_tokens(text) < count_tokens(IMAGE_MESSAGE) / 3
+
+    def test_file_link(self):
+        """Тест что ссылка на загруженный файл становится [Файл: имя], обычная — текстом"""
+        text = sanitize_message_content(
+            '<div class="uploaded-file-container">📎 <a href="/assets/report.pdf" target="_blank">report.pdf</a></div>'
+            'Сравни с <a href="https://example.com">сайтом</a> &amp; прошлым годом'
+        )
+
+        assert text == "📎 [Файл: report.pdf]\nСравни с сайтом & прошлым годом"
+
+    def test_cache_by_message_id(self):
+        """Тест что очищенный текст кэшируется по id и пересчитывается при изменении текста"""
+        cache = SanitizedHistoryCache()
+
+        first = cache.get(1, IMAGE_MESSAGE)
+        assert cache.get(1, IMAGE_MESSAGE) == first
+        assert cache.stats()["hits"] == 1
+
+        changed = cache.get(1, IMAGE_MESSAGE.replace("sales.png", "costs.png"))
+        assert "costs.png" in changed[0]
+        assert cache.get(2, "обычный текст", stored_tokens=7) == ("обычный текст", 7)
+
+
+@pytest.fixture
+def chat(db_session, test_user):
+    space = Space(user_id=test_user.id, name="Пространство")
+    db_session.add(space)
+    db_session.commit()
+    chat = Chat(space_id=space.id, user_id=test_user.id, title="Чат")
+    db_session.add(chat)
+    db_session.commit()
+    return chat
+
+
+class TestConversationHistorySanitized:
+    """Тесты истории чата для LLM"""
+
+    def _message(self, db_session, chat, role, content, minute):
+        message = Message(
+            chat_id=chat.id, role=role, content=content,
+            created_at=datetime(2025, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=minute),
+        )
+        db_session.add(message)
+        db_session.commit()
+        return message
+
+    def _attachment(self, db_session, chat, test_user, message):
+        attachment = FileAttachment(
+            message_id=message.id if message else None, chat_id=chat.id, user_id=test_user.id,
+            filename="dogovor.pdf", file_path="assets/dogovor.pdf", file_type="pdf", file_size=10,
+            extracted_text="пункт договора " * 50,
+        )
+        db_session.add(attachment)
+        db_session.commit()
+        return attachment
+
+    def test_token_count_stored_without_markup(self, db_session, chat):
+        """Тест что token_count сообщения считается по очищенному тексту"""
+        message = self._message(db_session, chat, "user", IMAGE_MESSAGE, 0)
+
+        assert message.token_count == count_tokens(sanitize_message_content(IMAGE_MESSAGE))
+
+    def test_repeated_file_collapsed(self, db_session, chat, test_user):
+        """Тест что повторно загруженный файл целиком идёт только в самом новом месте"""
+        first = self._message(db_session, chat, "user", IMAGE_MESSAGE, 0)
+        self._attachment(db_session, chat, test_user, first)
+        self._message(db_session, chat, "assistant", "Посмотрел", 1)
+        second = self._message(db_session, chat, "user", "Ещё раз тот же договор", 2)
+        self._attachment(db_session, chat, test_user, second)
+        self._message(db_session, chat, "assistant", "Тот же", 3)
+
+        history = load_conversation_history(db_session, chat.id)
+
+        assert "[Изображение: sales.png]" in history[0].content
+        assert "[Файл dogovor.pdf — содержимое приведено ниже]" in history[0].content
+        assert "пункт договора" not in history[0].content
+        assert "[Содержимое файла dogovor.pdf]" in history[2].content
+        assert history[0].token_count == count_tokens(history[0].content)
+
+        # Файл в текущем ходе — в истории остаются только ссылки
+        current = self._attachment(db_session, chat, test_user, None)
+        history = load_conversation_history(db_session, chat.id, current_attachment_ids=[current.id])
+        assert all("пункт договора" not in item.content for item in history)
@@ -0,0 +1,144 @@
+"""
+Тесты для history_service (окно истории по сохранённым token_count)
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import event
+
+from backend.app.database.backfill_token_counts import backfill_token_counts
+from backend.app.models.chat import Chat
+from backend.app.models.file_attachment import FileAttachment
+from backend.app.models.message import Message
+from backend.app.models.space import Space
+from backend.app.services.history_service import HistoryMessage, load_conversation_history, select_history_window
+from backend.app.utils.tokens import count_tokens
+
+
+@pytest.fixture
+def chat(db_session, test_user):
+    space = Space(user_id=test_user.id, name="Пространство")
+    db_session.add(space)
+    db_session.commit()
+    chat = Chat(space_id=space.id, user_id=test_user.id, title="Чат")
+    db_session.add(chat)
+    db_session.commit()
+    return chat
+
+
+def add_messages(db_session, chat, contents):
+    """Сообщения с возрастающим временем: user, assistant, user, ..."""
+    started = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    messages = []
+    for i, content in enumerate(contents):
+        message = Message(
+            chat_id=chat.id,
+            role="user" if i % 2 == 0 else "assistant",
+            content=content,
+            created_at=started + timedelta(minutes=i),
+        )
+        db_session.add(message)
+        messages.append(message)
+    db_session.commit()
+    return messages
+
+
+class TestHistoryWindow:
+    """Тесты выбора окна истории в SQL"""
+
+    def test_token_count_filled_on_insert_and_update(self, db_session, chat):
+        """Тест что token_count считается при записи и пересчитывается при изменении текста"""
+        message = add_messages(db_session, chat, ["Как рассчитать маржинальность?"])[0]
+        assert message.token_count == count_tokens("Как рассчитать маржинальность?")
+
+        message.content = "Короче"
+        db_session.commit()
+        assert message.token_count == count_tokens("Короче")
+
+    def test_window_fits_token_budget(self, db_session, chat):
+        """Тест что окно берёт последние сообщения, пока сумма токенов в бюджете"""
+        messages = add_messages(db_session, chat, ["слово " * 50, "ответ " * 50, "вопрос " * 50, "итог " * 50])
+        newest_two = messages[2].token_count + messages[3].token_count
+
+        window = select_history_window(db_session, chat.id, max_tokens=newest_two)
+
+        assert [m.id for m, _ in window] == [messages[2].id, messages[3].id]
+        assert sum(tokens for _, tokens in window) == newest_two
+
+        window = select_history_window(db_session, chat.id, max_tokens=newest_two - 1)
+        assert [m.id for m, _ in window] == [messages[3].id]
+
+    def test_window_counts_attachment_text(self, db_session, chat, test_user):
+        """Тест что текст вложений учитывается в размере сообщения"""
+        messages = add_messages(db_session, chat, ["Вот договор", "Посмотрел"])
+        attachment = FileAttachment(
+            message_id=messages[0].id, chat_id=chat.id, user_id=test_user.id,
+            filename="dogovor.pdf", file_path="assets/dogovor.pdf", file_type="pdf", file_size=10,
+            extracted_text="пункт договора " * 100,
+        )
+        db_session.add(attachment)
+        db_session.commit()
+        assert attachment.token_count == count_tokens(attachment.context_text())
+
+        window = dict((m.id, tokens) for m, tokens in select_history_window(db_session, chat.id, max_tokens=10000))
+        assert window[messages[0].id] == messages[0].token_count + attachment.token_count
+
+        window = select_history_window(db_session, chat.id, max_tokens=attachment.token_count)
+        assert [m.id for m, _ in window] == [messages[1].id]
+
+    def test_window_excludes_current_turn(self, db_session, chat):
+        """Тест что текущий вопрос пользователя (последнее сообщение) не занимает бюджет окна"""
+        messages = add_messages(db_session, chat, ["Вопрос", "Ответ", "Новый вопрос"])
+
+        window = select_history_window(db_session, chat.id, exclude_current_turn=True)
+
+        assert [m.id for m, _ in window] == [messages[0].id, messages[1].id]
+
+    def test_backfill_old_rows(self, db_session, chat):
+        """Тест досчёта token_count у строк, созданных до появления колонки"""
+        messages = add_messages(db_session, chat, ["старое сообщение", "ещё одно"])
+        db_session.query(Message).update({Message.token_count: None})
+        db_session.commit()
+
+        result = backfill_token_counts(db_session, batch_size=1)
+        db_session.expire_all()
+
+        assert result == {"messages": 2, "file_attachments": 0}
+        assert messages[0].token_count == count_tokens("старое сообщение")
+        assert backfill_token_counts(db_session) == {"messages": 0, "file_attachments": 0}
+
+
+class TestHistoryLoader:
+    """Тесты сборки истории для LLM"""
+
+    def test_attachments_loaded_in_one_query(self, db_session, chat, test_user):
+        """Тест что число запросов не растёт с числом сообщений с вложениями"""
+        messages = add_messages(db_session, chat, [f"Сообщение {i}" for i in range(12)])
+        for i, message in enumerate(messages):
+            db_session.add(FileAttachment(
+                message_id=message.id, chat_id=chat.id, user_id=test_user.id,
+                filename=f"file{i}.pdf", file_path=f"assets/file{i}.pdf", file_type="pdf", file_size=10,
+                extracted_text=f"текст файла {i}",
+            ))
+        db_session.commit()
+        chat_id = chat.id
+        db_session.expire_all()
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = db_session.get_bind()
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            history = load_conversation_history(db_session, chat_id, max_tokens=10000)
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+
+        assert len(history) == 12
+        assert len(statements) == 2
+        assert all(isinstance(item, HistoryMessage) for item in history)
+        assert history[0].role == "user"
+        assert "[Содержимое файла file0.pdf]" in history[0].content
+        assert "[Содержимое файла file11.pdf]" in history[-1].content
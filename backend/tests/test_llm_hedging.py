@@ -0,0 +1,236 @@
+"""
+Тесты для llm_hedging (хедж-запросы к LLM)
+"""
+import asyncio
+import pytest
+from unittest.mock import MagicMock, AsyncMock, patch
+
+from backend.app.services import llm_service as llm_service_module
+from backend.app.services.llm_hedging import RequestHedger
+from backend.app.services.llm_scheduler import LLMScheduler
+from backend.app.services.llm_service import LLMService
+
+
+def make_hedger(**kwargs):
+    params = dict(enabled=True, budget=1.0, min_delay=0.01, initial_delay=0.05, min_samples=5)
+    params.update(kwargs)
+    return RequestHedger(**params)
+
+
+def delayed(value, delay, calls=None, name=None):
+    async def run():
+        if calls is not None:
+            calls.append(name)
+        await asyncio.sleep(delay)
+        if isinstance(value, Exception):
+            raise value
+        return value
+    return run
+
+
+class TestRequestHedger:
+    """Тесты хеджирования медленных запросов"""
+
+    @pytest.mark.asyncio
+    async def test_disabled_runs_only_primary(self):
+        """Тест что без LLM_HEDGE_ENABLED хедж не отправляется"""
+        hedger = make_hedger(enabled=False)
+        calls = []
+
+        result = await hedger.run(delayed("основной", 0.1, calls, "primary"), delayed("хедж", 0, calls, "hedge"))
+
+        assert result == "основной"
+        assert calls == ["primary"]
+        assert hedger.stats()["requests"] == 0
+
+    @pytest.mark.asyncio
+    async def test_fast_primary_does_not_hedge(self):
+        """Тест что быстрый ответ не порождает второй запрос"""
+        hedger = make_hedger()
+        calls = []
+
+        result = await hedger.run(delayed("основной", 0, calls, "primary"), delayed("хедж", 0, calls, "hedge"))
+
+        assert result == "основной"
+        assert calls == ["primary"]
+        assert hedger.hedges_sent == 0
+
+    @pytest.mark.asyncio
+    async def test_slow_primary_loses_to_hedge(self):
+        """Тест что при медленном основном запросе берётся хедж, а основной отменяется"""
+        hedger = make_hedger()
+        primary_cancelled = asyncio.Event()
+
+        async def slow_primary():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                primary_cancelled.set()
+                raise
+
+        result = await hedger.run(slow_primary, delayed("хедж", 0))
+        await asyncio.sleep(0)
+
+        assert result == "хедж"
+        assert primary_cancelled.is_set()
+        stats = hedger.stats()
+        assert stats["hedges_sent"] == 1
+        assert stats["hedges_won"] == 1
+        assert stats["hedge_win_rate"] == 1.0
+
+    @pytest.mark.asyncio
+    async def test_failed_hedge_waits_for_primary(self):
+        """Тест что ошибка хеджа не мешает дождаться основного ответа"""
+        hedger = make_hedger()
+
+        result = await hedger.run(delayed("основной", 0.1), delayed(ValueError("хедж упал"), 0))
+
+        assert result == "основной"
+        assert hedger.hedges_won == 0
+
+    @pytest.mark.asyncio
+    async def test_both_failed_raise_primary_error(self):
+        """Тест что при отказе обоих запросов наружу уходит ошибка основного"""
+        hedger = make_hedger()
+
+        with pytest.raises(ValueError, match="основной упал"):
+            await hedger.run(delayed(ValueError("основной упал"), 0.1), delayed(ValueError("хедж упал"), 0))
+
+    @pytest.mark.asyncio
+    async def test_budget_caps_extra_requests(self):
+        """Тест бюджета: не больше budget дополнительных запросов на один основной"""
+        hedger = make_hedger(budget=0.5)
+
+        for _ in range(4):
+            await hedger.run(delayed("основной", 0.08), delayed("хедж", 0.2))
+
+        stats = hedger.stats()
+        assert stats["hedges_sent"] == 2
+        assert stats["hedges_skipped_budget"] == 2
+        assert stats["hedge_rate"] == 0.5
+
+    def test_delay_follows_latency_percentile(self):
+        """Тест задержки хеджа по перцентилю недавних латентностей"""
+        hedger = make_hedger(percentile=90, min_delay=0.5, initial_delay=7.0, min_samples=10)
+        assert hedger.current_delay() == 7.0
+
+        for latency in [1.0] * 9 + [30.0]:
+            hedger.record_primary_latency(latency)
+        assert hedger.current_delay() == 30.0
+
+        for _ in range(10):
+            hedger.record_primary_latency(1.0)
+        assert hedger.current_delay() == 1.0
+
+        hedger._latencies.clear()
+        for _ in range(10):
+            hedger.record_primary_latency(0.1)
+        assert hedger.current_delay() == 0.5
+
+    def test_censored_latency_ranks_above_observed(self):
+        """Тест что быстрые победы хеджа не занижают порог: основной запрос шёл дольше"""
+        hedger = make_hedger(percentile=40, min_delay=0.01, min_samples=6)
+        for _ in range(3):
+            hedger.record_primary_latency(3.0)
+            hedger.record_primary_latency(1.0, censored=True)
+
+        assert hedger.current_delay() == 3.0
+
+    @pytest.mark.asyncio
+    async def test_records_primary_latency_when_hedge_wins(self):
+        """Тест что при победе хеджа в выборку идёт цензурированный замер основного запроса"""
+        hedger = make_hedger()
+
+        await hedger.run(delayed("основной", 1.0), delayed("хедж", 0))
+
+        [(censored, latency)] = hedger._latencies
+        assert censored is True
+        assert latency >= 0.05
+
+
+class TestLLMServiceHedging:
+    """Тесты хеджирования в LLMService.generate_response_async"""
+
+    @pytest.mark.asyncio
+    async def test_generate_response_async_uses_hedge(self, mock_env_vars, monkeypatch):
+        """Тест что зависший ответ провайдера перекрывается хедж-запросом на другой endpoint"""
+        monkeypatch.setenv("OPENROUTER_FALLBACK_MODELS", "alt/model")
+        with patch('backend.app.services.llm_service.OpenAI'):
+            service = LLMService()
+        service.hedger = make_hedger()
+
+        completion = MagicMock()
+        completion.choices = [MagicMock()]
+        completion.choices[0].message.content = "Ответ хеджа"
+        attempts = []
+
+        async def create(**kwargs):
+            attempts.append(kwargs["model"])
+            if len(attempts) == 1:
+                await asyncio.sleep(10)
+            return completion
+
+        service.async_client = MagicMock()
+        service.async_client.chat.completions.create = AsyncMock(side_effect=create)
+
+        response = await service.generate_response_async("Ты помощник", "Вопрос")
+
+        assert response == "Ответ хеджа"
+        assert len(attempts) == 2
+        assert service.hedger.stats()["hedges_won"] == 1
+        await service.aclose()
+
+    @pytest.mark.asyncio
+    async def test_hedge_takes_scheduler_slot(self, mock_env_vars, monkeypatch):
+        """Тест что хедж-запрос занимает отдельный слот llm_scheduler"""
+        monkeypatch.setenv("OPENROUTER_FALLBACK_MODELS", "alt/model")
+        with patch('backend.app.services.llm_service.OpenAI'):
+            service = LLMService()
+        service.hedger = make_hedger()
+        scheduler = LLMScheduler(max_concurrency=5, max_per_tenant=5, max_queue=10)
+        monkeypatch.setattr(llm_service_module, "llm_scheduler", scheduler)
+
+        completion = MagicMock()
+        completion.choices = [MagicMock()]
+        completion.choices[0].message.content = "Ответ"
+        running = []
+
+        async def create(**kwargs):
+            running.append(scheduler.stats()["running"])
+            if len(running) == 1:
+                await asyncio.sleep(10)
+            return completion
+
+        service.async_client = MagicMock()
+        service.async_client.chat.completions.create = AsyncMock(side_effect=create)
+
+        await service.generate_response_async("Ты помощник", "Вопрос")
+
+        assert running == [1, 2]
+        assert scheduler.stats()["admitted"] == 2
+        await service.aclose()
+
+    @pytest.mark.asyncio
+    async def test_single_endpoint_not_hedged(self, mock_env_vars):
+        """Тест что с одним endpoint'ом хедж не отправляется (тот же запрос туда же)"""
+        with patch('backend.app.services.llm_service.OpenAI'):
+            service = LLMService()
+        service.hedger = make_hedger(initial_delay=0.01)
+
+        completion = MagicMock()
+        completion.choices = [MagicMock()]
+        completion.choices[0].message.content = "Ответ"
+        attempts = []
+
+        async def create(**kwargs):
+            attempts.append(kwargs["model"])
+            await asyncio.sleep(0.05)
+            return completion
+
+        service.async_client = MagicMock()
+        service.async_client.chat.completions.create = AsyncMock(side_effect=create)
+
+        assert await service.generate_response_async("Ты помощник", "Вопрос") == "Ответ"
+        assert len(attempts) == 1
+        assert service.hedger.stats()["hedges_sent"] == 0
+        await service.aclose()
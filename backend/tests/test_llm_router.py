@@ -0,0 +1,294 @@
+"""
+Тесты для llm_router (несколько провайдеров, здоровье, circuit breaker)
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from backend.app.services.llm_router import (
+    LLMEndpoint,
+    LLMRouter,
+    LLMUnavailableError,
+    build_llm_endpoints,
+)
+from backend.app.services.llm_service import LLMService
+
+
+class FakeLLMServer:
+    """Локальный OpenAI-совместимый сервер: /v1/chat/completions с заданным поведением"""
+
+    def __init__(self, reply: str):
+        self.reply = reply
+        self.status = 200
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                server.requests += 1
+                if server.status != 200:
+                    body = json.dumps({"error": {"message": f"fake error {server.status}"}}).encode()
+                    self.send_response(server.status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                if payload.get("stream"):
+                    self._send_stream(payload)
+                else:
+                    self._send_completion(payload)
+
+            def _send_completion(self, payload):
+                body = json.dumps({
+                    "id": "cmpl-1",
+                    "object": "chat.completion",
+                    "created": 0,
+                    "model": payload.get("model"),
+                    "choices": [{
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": server.reply},
+                    }],
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_stream(self, payload):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                for part in (server.reply[:2], server.reply[2:]):
+                    chunk = {
+                        "id": "cmpl-1",
+                        "object": "chat.completion.chunk",
+                        "created": 0,
+                        "model": payload.get("model"),
+                        "choices": [{"index": 0, "delta": {"content": part}, "finish_reason": None}],
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def fake_servers():
+    primary, backup = FakeLLMServer("Ответ основного"), FakeLLMServer("Ответ резервного")
+    yield primary, backup
+    primary.close()
+    backup.close()
+
+
+@pytest.fixture
+def routed_service(fake_servers, mock_env_vars, monkeypatch):
+    """LLMService с двумя endpoint'ами: основной Ollama и резервный OpenAI-совместимый"""
+    primary, backup = fake_servers
+    monkeypatch.setenv("USE_OLLAMA", "true")
+    monkeypatch.setenv("OLLAMA_API_URL", primary.url)
+    monkeypatch.setenv("OLLAMA_MODEL", "primary-model")
+    monkeypatch.setenv("LLM_MAX_RETRIES", "0")
+    monkeypatch.setenv("LLM_HEALTH_WINDOW_SECONDS", "0.3")
+    monkeypatch.setenv("LLM_ENDPOINTS", json.dumps([
+        {"name": "backup", "base_url": f"{backup.url}/v1", "model": "backup-model"}
+    ]))
+    return LLMService()
+
+
+class TestLLMRouter:
+    """Тесты маршрутизации между endpoint'ами"""
+
+    def test_build_endpoints_from_env(self, monkeypatch):
+        """Тест сборки списка endpoint'ов из окружения"""
+        monkeypatch.setenv("OPENROUTER_FALLBACK_MODELS", "alt/one, main/model ,alt/two")
+        monkeypatch.setenv("BACKUP_KEY", "secret")
+        monkeypatch.setenv("LLM_ENDPOINTS", json.dumps([
+            {"name": "backup", "base_url": "http://backup/v1", "model": "m", "api_key_env": "BACKUP_KEY"},
+            {"name": "broken"},
+        ]))
+
+        endpoints = build_llm_endpoints("openrouter", "main/model", "openai")
+
+        assert [ep.name for ep in endpoints] == ["openrouter", "openrouter:alt/one", "openrouter:alt/two", "backup"]
+        assert endpoints[1].base_url is None
+        assert endpoints[3].api_key == "secret"
+
+    def test_prefers_healthiest_endpoint(self):
+        """Тест выбора endpoint'а с лучшей латентностью и долей ошибок"""
+        slow, fast, fresh = LLMEndpoint("slow", "a"), LLMEndpoint("fast", "b"), LLMEndpoint("fresh", "c")
+        router = LLMRouter([slow, fast, fresh], failure_threshold=5, open_seconds=30)
+
+        router.record_success(slow, 2.0)
+        router.record_success(fast, 0.5)
+        # Endpoint без замеров пробуется первым, дальше — по латентности
+        assert router.ordered_endpoints() == [fresh, fast, slow]
+
+        router.record_failure(fresh)
+        router.record_failure(fast)
+        assert router.ordered_endpoints() == [slow, fast, fresh]
+
+    def test_old_errors_are_forgotten(self):
+        """Тест что ошибки старше окна здоровья не штрафуют endpoint"""
+        primary, backup = LLMEndpoint("primary", "a"), LLMEndpoint("backup", "b")
+        router = LLMRouter([primary, backup], failure_threshold=5, open_seconds=30, health_window_seconds=0.05)
+
+        router.record_failure(primary)
+        router.record_success(backup, 0.2)
+        assert router.ordered_endpoints()[0] is backup
+
+        time.sleep(0.06)
+        assert router.ordered_endpoints()[0] is primary
+
+    def test_circuit_opens_and_recovers(self):
+        """Тест circuit breaker: исключение после ошибок подряд и пробный запрос после паузы"""
+        endpoint = LLMEndpoint("only", "m")
+        router = LLMRouter([endpoint], failure_threshold=2, open_seconds=0.05)
+
+        router.record_failure(endpoint)
+        assert router.ordered_endpoints() == [endpoint]
+        router.record_failure(endpoint)
+        assert router.ordered_endpoints() == []
+        with pytest.raises(LLMUnavailableError):
+            router.call(lambda ep: "не должен вызываться")
+
+        time.sleep(0.06)
+        assert router.ordered_endpoints() == [endpoint]
+        assert router.acquire(endpoint)
+        # Пока идёт пробный запрос, другие в half-open endpoint не пускаются
+        assert not router.acquire(endpoint)
+        router.record_success(endpoint, 0.1)
+
+        assert router.stats()["endpoints"][0]["state"] == "closed"
+        assert router.stats()["endpoints"][0]["circuit_opens"] == 1
+
+    def test_request_error_does_not_fail_over(self):
+        """Тест что ошибка самого запроса (400) не переключает endpoint и не портит здоровье"""
+        class BadRequest(Exception):
+            status_code = 400
+
+        first, second = LLMEndpoint("first", "a"), LLMEndpoint("second", "b")
+        router = LLMRouter([first, second], failure_threshold=1, open_seconds=30)
+        called = []
+
+        def request(endpoint):
+            called.append(endpoint.name)
+            raise BadRequest("context too long")
+
+        with pytest.raises(BadRequest):
+            router.call(request)
+
+        assert called == ["first"]
+        assert router.stats()["endpoints"][0]["failures"] == 0
+
+    @pytest.mark.asyncio
+    async def test_service_fails_over_to_backup(self, routed_service, fake_servers):
+        """Тест переключения LLMService на резервный провайдер при 5xx основного"""
+        primary, backup = fake_servers
+        primary.status = 500
+
+        try:
+            first = await routed_service.generate_response_async("Ты помощник", "Вопрос 1")
+            # Основной со свежей ошибкой уступает резервному — запрос сразу идёт туда
+            second = await routed_service.generate_response_async("Ты помощник", "Вопрос 2")
+        finally:
+            await routed_service.aclose()
+
+        assert first == second == "Ответ резервного"
+        assert primary.requests == 1
+        assert backup.requests == 2
+        stats = routed_service.llm_router.stats()
+        assert stats["endpoints"][0]["error_rate"] == 1.0
+        assert stats["failovers"] == 1
+
+    @pytest.mark.asyncio
+    async def test_service_returns_to_recovered_primary(self, routed_service, fake_servers):
+        """Тест возврата на основной провайдер, когда его ошибки вышли из окна здоровья"""
+        primary, backup = fake_servers
+        primary.status = 500
+
+        try:
+            await routed_service.generate_response_async("Ты помощник", "Вопрос 1")
+            primary.status = 200
+            time.sleep(0.35)
+            response = await routed_service.generate_response_async("Ты помощник", "Вопрос 3")
+        finally:
+            await routed_service.aclose()
+
+        assert response == "Ответ основного"
+
+    @pytest.mark.asyncio
+    async def test_stream_fails_over_before_first_token(self, routed_service, fake_servers):
+        """Тест потоковой генерации: переключение на резервный до первого фрагмента"""
+        primary, _ = fake_servers
+        primary.status = 503
+
+        try:
+            parts = [part async for part in routed_service.stream_response_async("Ты помощник", "Вопрос")]
+        finally:
+            await routed_service.aclose()
+
+        assert "".join(parts) == "Ответ резервного"
+        assert primary.requests == 1
+
+    @pytest.mark.asyncio
+    async def test_stream_break_recorded_without_failover(self, routed_service, fake_servers, monkeypatch):
+        """Тест что обрыв потока после первого фрагмента учитывается в здоровье endpoint'а, но без переключения"""
+        from types import SimpleNamespace
+
+        calls = []
+
+        async def broken_stream():
+            yield SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content="Нача"))])
+            raise ConnectionError("connection reset")
+
+        async def completion(endpoint, messages, temperature, max_tokens, stream=False):
+            calls.append(endpoint.name)
+            return broken_stream()
+
+        monkeypatch.setattr(routed_service, "_endpoint_completion_async", completion)
+        parts = []
+        try:
+            with pytest.raises(ValueError):
+                async for part in routed_service.stream_response_async("Ты помощник", "Вопрос"):
+                    parts.append(part)
+        finally:
+            await routed_service.aclose()
+
+        assert parts == ["Нача"]
+        assert len(calls) == 1
+        primary_stats = routed_service.llm_router.stats()["endpoints"][0]
+        assert primary_stats["failures"] == 1
+
+    def test_sync_generate_reports_last_error(self, routed_service, fake_servers):
+        """Тест что при отказе всех endpoint'ов наружу уходит понятная ошибка"""
+        primary, backup = fake_servers
+        primary.status = 500
+        backup.status = 429
+
+        with pytest.raises(ValueError, match="Превышен лимит запросов"):
+            routed_service.generate_response("Ты помощник", "Вопрос")
+
+        assert primary.requests == 1
+        assert backup.requests == 1
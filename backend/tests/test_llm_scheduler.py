@@ -0,0 +1,155 @@
+"""
+Тесты для llm_scheduler
+"""
+import asyncio
+
+import pytest
+
+from backend.app.services.llm_scheduler import (
+    LLMScheduler,
+    LLMQueueFullError,
+    PRIORITY_INTERACTIVE,
+    PRIORITY_PUBLIC,
+    PRIORITY_BACKGROUND,
+)
+
+
+async def _hold(scheduler, tenant, priority, started, release, order=None):
+    """Занимает слот до release; порядок получения слотов пишет в order"""
+    async with scheduler.slot(tenant, priority):
+        if order is not None:
+            order.append(tenant)
+        started.set()
+        await release.wait()
+
+
+class TestLLMScheduler:
+    """Тесты планировщика запросов к LLM"""
+
+    @pytest.mark.asyncio
+    async def test_global_concurrency_limit(self):
+        """Тест что одновременно выполняется не больше max_concurrency вызовов"""
+        scheduler = LLMScheduler(max_concurrency=2, max_per_tenant=5, max_queue=10)
+        release = asyncio.Event()
+        tasks = [
+            asyncio.ensure_future(_hold(scheduler, f"user:{i}", PRIORITY_INTERACTIVE, asyncio.Event(), release))
+            for i in range(4)
+        ]
+        await asyncio.sleep(0.01)
+
+        assert scheduler.stats()["running"] == 2
+        assert scheduler.stats()["waiting"] == 2
+
+        release.set()
+        await asyncio.gather(*tasks)
+        assert scheduler.stats()["running"] == 0
+        assert scheduler.stats()["admitted"] == 4
+
+    @pytest.mark.asyncio
+    async def test_per_tenant_limit(self):
+        """Тест что один арендатор не занимает все слоты"""
+        scheduler = LLMScheduler(max_concurrency=4, max_per_tenant=1, max_queue=10)
+        release = asyncio.Event()
+        order = []
+        tasks = [
+            asyncio.ensure_future(_hold(scheduler, "public:abc", PRIORITY_PUBLIC, asyncio.Event(), release, order))
+            for _ in range(3)
+        ]
+        tasks.append(asyncio.ensure_future(
+            _hold(scheduler, "user:1", PRIORITY_INTERACTIVE, asyncio.Event(), release, order)
+        ))
+        await asyncio.sleep(0.01)
+
+        assert order == ["public:abc", "user:1"]
+        assert scheduler.stats()["running"] == 2
+
+        release.set()
+        await asyncio.gather(*tasks)
+
+    @pytest.mark.asyncio
+    async def test_priority_order(self):
+        """Тест что чат владельцев обслуживается раньше публичного трафика и фонового анализа"""
+        scheduler = LLMScheduler(max_concurrency=1, max_per_tenant=5, max_queue=10)
+        release_first = asyncio.Event()
+        first = asyncio.ensure_future(
+            _hold(scheduler, "user:0", PRIORITY_INTERACTIVE, asyncio.Event(), release_first)
+        )
+        await asyncio.sleep(0)
+
+        order = []
+        release_rest = asyncio.Event()
+        release_rest.set()
+        rest = [
+            asyncio.ensure_future(_hold(scheduler, "user:9", PRIORITY_BACKGROUND, asyncio.Event(), release_rest, order)),
+            asyncio.ensure_future(_hold(scheduler, "public:x", PRIORITY_PUBLIC, asyncio.Event(), release_rest, order)),
+            asyncio.ensure_future(_hold(scheduler, "user:1", PRIORITY_INTERACTIVE, asyncio.Event(), release_rest, order)),
+        ]
+        await asyncio.sleep(0.01)
+        release_first.set()
+        await asyncio.gather(first, *rest)
+
+        assert order == ["user:1", "public:x", "user:9"]
+
+    @pytest.mark.asyncio
+    async def test_round_robin_between_tenants(self):
+        """Тест чередования арендаторов одного класса приоритета"""
+        scheduler = LLMScheduler(max_concurrency=1, max_per_tenant=5, max_queue=10)
+        release_first = asyncio.Event()
+        first = asyncio.ensure_future(
+            _hold(scheduler, "public:a", PRIORITY_PUBLIC, asyncio.Event(), release_first)
+        )
+        await asyncio.sleep(0)
+
+        order = []
+        done = asyncio.Event()
+        done.set()
+        rest = [
+            asyncio.ensure_future(_hold(scheduler, tenant, PRIORITY_PUBLIC, asyncio.Event(), done, order))
+            for tenant in ["public:a", "public:a", "public:b"]
+        ]
+        await asyncio.sleep(0.01)
+        release_first.set()
+        await asyncio.gather(first, *rest)
+
+        assert order == ["public:a", "public:b", "public:a"]
+
+    @pytest.mark.asyncio
+    async def test_queue_full_rejects_fast(self):
+        """Тест быстрого отказа при переполненной очереди"""
+        scheduler = LLMScheduler(max_concurrency=1, max_per_tenant=1, max_queue=1)
+        release = asyncio.Event()
+        running = asyncio.ensure_future(_hold(scheduler, "user:1", PRIORITY_INTERACTIVE, asyncio.Event(), release))
+        queued = asyncio.ensure_future(_hold(scheduler, "user:2", PRIORITY_INTERACTIVE, asyncio.Event(), release))
+        await asyncio.sleep(0.01)
+
+        with pytest.raises(LLMQueueFullError):
+            async with scheduler.slot("user:3", PRIORITY_INTERACTIVE):
+                pass
+        assert scheduler.stats()["rejected"] == 1
+
+        release.set()
+        await asyncio.gather(running, queued)
+
+    @pytest.mark.asyncio
+    async def test_queue_timeout_and_cancellation_release_state(self):
+        """Тест что таймаут и отмена ожидания не оставляют занятых слотов"""
+        scheduler = LLMScheduler(max_concurrency=1, max_per_tenant=1, max_queue=10, queue_timeout=0.05)
+        release = asyncio.Event()
+        running = asyncio.ensure_future(_hold(scheduler, "user:1", PRIORITY_INTERACTIVE, asyncio.Event(), release))
+        await asyncio.sleep(0)
+
+        with pytest.raises(LLMQueueFullError):
+            async with scheduler.slot("user:2", PRIORITY_INTERACTIVE):
+                pass
+
+        cancelled = asyncio.ensure_future(_hold(scheduler, "user:3", PRIORITY_INTERACTIVE, asyncio.Event(), release))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+
+        release.set()
+        await running
+        stats = scheduler.stats()
+        assert stats["running"] == 0
+        assert stats["waiting"] == 0
+        assert stats["timeouts"] == 1
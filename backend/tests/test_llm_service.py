@@ -1,8 +1,9 @@
 """
 Тесты для llm_service
 """
+import asyncio
 import pytest
-from unittest.mock import Mock, patch, MagicMock
+from unittest.mock import Mock, patch, MagicMock, AsyncMock
 from backend.app.services.llm_service import LLMService
 
 
@@ -119,7 +120,48 @@ class TestLLMService:
         )
         assert [m["role"] for m in messages] == ["system", "user"]
         assert messages[-1]["content"] == "вопрос"
-    
+
+    def test_prepare_uses_stored_token_counts(self, llm_service):
+        """История с token_count из БД не токенизируется повторно"""
+        history = [
+            {"role": "user", "content": "старый вопрос", "token_count": 1000},
+            {"role": "assistant", "content": "старый ответ", "token_count": 1000},
+            {"role": "user", "content": "вопрос", "token_count": 5},
+            {"role": "assistant", "content": "ответ", "token_count": 5},
+        ]
+        with patch.object(llm_service, 'count_tokens', wraps=llm_service.count_tokens) as counter:
+            messages = llm_service.prepare_conversation_messages(
+                "sys", "новый вопрос", conversation_history=history, max_tokens=1500
+            )
+
+        # Считаются только system prompt и текущий вопрос — по одному разу
+        assert counter.call_count == 2
+        assert [m["content"] for m in messages] == ["sys", "вопрос", "ответ", "новый вопрос"]
+
+    def test_generation_messages_truncate_large_file(self, llm_service):
+        """Большой файл обрезается по квоте бюджета промпта, вопрос сохраняется целиком"""
+        file_context = "\n\n[Содержимое файла отчет.pdf]:\n" + "строка отчёта " * 5000
+        messages = llm_service._prepare_generation_messages(
+            "Ты помощник", "Что в отчёте?", file_context=file_context
+        )
+
+        user_content = messages[-1]["content"]
+        assert user_content.startswith("Что в отчёте?\n\n[Содержимое файла отчет.pdf]")
+        assert llm_service.count_tokens(user_content) <= llm_service.prompt_files_max_tokens + 20
+        assert len(user_content) < len(file_context)
+
+    def test_generation_messages_include_summary(self, llm_service):
+        """Краткое содержание беседы добавляется к system prompt перед историей"""
+        messages = llm_service._prepare_generation_messages(
+            "Ты помощник", "Что дальше?",
+            conversation_history=[{"role": "user", "content": "вопрос"}, {"role": "assistant", "content": "ответ"}],
+            conversation_summary="Обсуждали тарифы.",
+        )
+
+        assert messages[0]["role"] == "system"
+        assert "Краткое содержание предыдущей части беседы:\nОбсуждали тарифы." in messages[0]["content"]
+        assert [m["content"] for m in messages[1:]] == ["вопрос", "ответ", "Что дальше?"]
+
     def test_prepare_conversation_messages_max_tokens(self, llm_service):
         """Тест ограничения истории по токенам"""
         system_prompt = "Ты помощник"
@@ -183,6 +225,150 @@ class TestLLMService:
                 user_question="Привет"
             )
     
+    @pytest.mark.asyncio
+    async def test_generate_response_async_success(self, llm_service):
+        """Тест async-генерации ответа через AsyncOpenAI"""
+        mock_completion = MagicMock()
+        mock_completion.choices = [MagicMock()]
+        mock_completion.choices[0].message.content = "Async ответ"
+        mock_async_client = MagicMock()
+        mock_async_client.chat.completions.create = AsyncMock(return_value=mock_completion)
+        llm_service.async_client = mock_async_client
+
+        response = await llm_service.generate_response_async(
+            system_prompt="Ты помощник",
+            user_question="Привет"
+        )
+
+        assert response == "Async ответ"
+        mock_async_client.chat.completions.create.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_generate_response_async_coalesces_identical_requests(self, llm_service):
+        """Тест объединения одинаковых одновременных запросов в один вызов провайдера"""
+        release = asyncio.Event()
+        mock_completion = MagicMock()
+        mock_completion.choices = [MagicMock()]
+        mock_completion.choices[0].message.content = "Общий ответ"
+
+        async def slow_create(**kwargs):
+            await release.wait()
+            return mock_completion
+
+        mock_async_client = MagicMock()
+        mock_async_client.chat.completions.create = AsyncMock(side_effect=slow_create)
+        llm_service.async_client = mock_async_client
+
+        requests = [
+            asyncio.ensure_future(llm_service.generate_response_async(
+                system_prompt="Ты помощник",
+                user_question="Как привлечь клиентов?"
+            ))
+            for _ in range(5)
+        ]
+        other = asyncio.ensure_future(llm_service.generate_response_async(
+            system_prompt="Ты помощник",
+            user_question="Другой вопрос"
+        ))
+        await asyncio.sleep(0)
+        release.set()
+
+        results = await asyncio.gather(*requests, other)
+
+        assert results == ["Общий ответ"] * 6
+        assert mock_async_client.chat.completions.create.await_count == 2
+        assert llm_service.single_flight.stats()["coalesced"] == 4
+        assert llm_service.single_flight.in_flight == 0
+
+    @pytest.mark.asyncio
+    async def test_single_flight_survives_leader_cancellation(self, llm_service):
+        """Тест что отмена первого запроса не ломает ожидающих"""
+        release = asyncio.Event()
+        mock_completion = MagicMock()
+        mock_completion.choices = [MagicMock()]
+        mock_completion.choices[0].message.content = "Ответ"
+
+        async def slow_create(**kwargs):
+            await release.wait()
+            return mock_completion
+
+        mock_async_client = MagicMock()
+        mock_async_client.chat.completions.create = AsyncMock(side_effect=slow_create)
+        llm_service.async_client = mock_async_client
+
+        leader = asyncio.ensure_future(llm_service.generate_response_async("Ты помощник", "Вопрос"))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(llm_service.generate_response_async("Ты помощник", "Вопрос"))
+        await asyncio.sleep(0)
+        leader.cancel()
+        release.set()
+
+        assert await follower == "Ответ"
+        assert mock_async_client.chat.completions.create.await_count == 1
+
+    @pytest.mark.asyncio
+    async def test_stream_response_async(self, llm_service):
+        """Тест потоковой генерации: фрагменты отдаются по мере получения"""
+        def make_chunk(text):
+            chunk = MagicMock()
+            chunk.choices = [MagicMock()]
+            chunk.choices[0].delta.content = text
+            return chunk
+
+        async def fake_stream():
+            for text in ["При", None, "вет"]:
+                yield make_chunk(text)
+
+        mock_async_client = MagicMock()
+        mock_async_client.chat.completions.create = AsyncMock(return_value=fake_stream())
+        llm_service.async_client = mock_async_client
+
+        parts = [part async for part in llm_service.stream_response_async(
+            system_prompt="Ты помощник",
+            user_question="Привет"
+        )]
+
+        assert parts == ["При", "вет"]
+        assert mock_async_client.chat.completions.create.call_args.kwargs["stream"] is True
+
+    @pytest.mark.asyncio
+    async def test_generate_response_async_guardrail_fallback(self, llm_service):
+        """Тест async fallback на eligible модель при guardrail 404 OpenRouter"""
+        mock_completion = MagicMock()
+        mock_completion.choices = [MagicMock()]
+        mock_completion.choices[0].message.content = "Ответ другой модели"
+        guardrail_error = Exception(
+            "Error code: 404 - No endpoints available matching your guardrail restrictions and data policy"
+        )
+        mock_async_client = MagicMock()
+        mock_async_client.chat.completions.create = AsyncMock(side_effect=[guardrail_error, mock_completion])
+        llm_service.async_client = mock_async_client
+        llm_service._get_openrouter_eligible_models_async = AsyncMock(
+            return_value=[{"id": "alt/model", "architecture": {"input_modalities": ["text"]}}]
+        )
+
+        response = await llm_service.generate_response_async(
+            system_prompt="Ты помощник",
+            user_question="Привет"
+        )
+
+        assert response == "Ответ другой модели"
+        second_call = mock_async_client.chat.completions.create.await_args_list[1]
+        assert second_call.kwargs["model"] == "alt/model"
+
+    @pytest.mark.asyncio
+    async def test_generate_response_async_rate_limit(self, llm_service):
+        """Тест преобразования 429 в понятную ошибку в async-версии"""
+        mock_async_client = MagicMock()
+        mock_async_client.chat.completions.create = AsyncMock(side_effect=Exception("Error code: 429"))
+        llm_service.async_client = mock_async_client
+
+        with pytest.raises(ValueError, match="Превышен лимит запросов"):
+            await llm_service.generate_response_async(
+                system_prompt="Ты помощник",
+                user_question="Привет"
+            )
+
     def test_get_conversation_stats(self, llm_service):
         """Тест получения статистики беседы"""
         history = [
@@ -226,6 +412,24 @@ class TestLLMService:
         summary = llm_service.summarize_conversation([])
         
         assert summary == ""
+
+    def test_summary_uses_client_provider(self, monkeypatch):
+        """Тест что суммаризация идёт в модель того провайдера, на который настроен клиент"""
+        history = [{"role": "user", "content": f"Сообщение {i}"} for i in range(6)]
+
+        monkeypatch.delenv("USE_OLLAMA", raising=False)
+        monkeypatch.setenv("OLLAMA_MODEL", "local-model")
+        with patch('backend.app.services.llm_service.OpenAI'):
+            service = LLMService()
+        use_ollama, model, _ = service._summary_request(history, None, 4, None)
+        assert (use_ollama, model) == (True, "local-model")
+
+        monkeypatch.setenv("USE_OLLAMA", "false")
+        monkeypatch.setenv("OPENROUTER_MODEL", "remote/model")
+        with patch('backend.app.services.llm_service.OpenAI'):
+            service = LLMService()
+        use_ollama, model, _ = service._summary_request(history, None, 4, None)
+        assert (use_ollama, model) == (False, "remote/model")
     
     @patch('backend.app.services.llm_service.OpenAI')
     def test_transcribe_audio_with_whisper_client(self, mock_openai, mock_env_vars):
@@ -0,0 +1,183 @@
+"""
+Тесты телеметрии вызовов LLM и экспорта метрик
+"""
+import asyncio
+import contextvars
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from backend.app.services.llm_service import LLMService
+from backend.app.services.llm_telemetry import (
+    LLMTelemetry,
+    bind_context,
+    classify_error,
+    llm_telemetry,
+    render_stats_gauges,
+)
+
+
+def make_completion(text, prompt_tokens=None, completion_tokens=None):
+    completion = MagicMock()
+    completion.choices = [MagicMock()]
+    completion.choices[0].message.content = text
+    if prompt_tokens is None:
+        completion.usage = None
+    else:
+        completion.usage.prompt_tokens = prompt_tokens
+        completion.usage.completion_tokens = completion_tokens
+    return completion
+
+
+class TestLLMTelemetry:
+    """Тесты записи вызовов"""
+
+    def test_track_records_usage_and_latency(self):
+        """Тест что токены берутся из usage, а длительность попадает в гистограмму"""
+        telemetry = LLMTelemetry(log_enabled=False)
+
+        with telemetry.track("chat", "big/model") as call:
+            call.set_usage(make_completion("Ответ", prompt_tokens=120, completion_tokens=30))
+
+        assert telemetry.requests.value("chat", "big/model", "ok") == 1
+        assert telemetry.duration.count("chat", "big/model") == 1
+        assert telemetry.tokens.value("chat", "big/model", "prompt") == 120
+        assert telemetry.tokens.value("chat", "big/model", "completion") == 30
+
+    def test_usage_estimated_without_usage_field(self):
+        """Тест оценки токенов по тексту, если провайдер не вернул usage"""
+        telemetry = LLMTelemetry(log_enabled=False)
+
+        with telemetry.track("summary", "m", messages=[{"role": "user", "content": "раз два три"}]) as call:
+            call.set_usage(make_completion("четыре пять"))
+
+        assert telemetry.tokens.value("summary", "m", "prompt") > 0
+        assert telemetry.tokens.value("summary", "m", "completion") > 0
+
+    def test_error_recorded_with_class(self):
+        """Тест что ошибка считается по классу и пробрасывается дальше"""
+        telemetry = LLMTelemetry(log_enabled=False)
+
+        with pytest.raises(RuntimeError):
+            with telemetry.track("chat", "m"):
+                raise RuntimeError("Error code: 429 - rate limit")
+
+        assert telemetry.requests.value("chat", "m", "error") == 1
+        assert telemetry.errors.value("chat", "m", "rate_limit") == 1
+
+    @pytest.mark.parametrize("error, expected", [
+        (TimeoutError("timed out"), "timeout"),
+        (Exception("Error code: 404 - No endpoints available matching your guardrail restrictions and data policy"), "guardrail"),
+        (ValueError("LLM вернул пустое содержимое"), "empty_response"),
+        (type("APIStatusError", (Exception,), {"status_code": 503})("upstream"), "server"),
+        (asyncio.CancelledError(), "cancelled"),
+    ])
+    def test_classify_error(self, error, expected):
+        """Тест таксономии ошибок"""
+        assert classify_error(error) == expected
+
+    def test_space_tokens_from_context(self):
+        """Тест что токены относятся к пространству из контекста запроса"""
+        telemetry = LLMTelemetry(log_enabled=False, max_spaces=1)
+
+        def run():
+            bind_context(space_id=7, chat_id=3)
+            with telemetry.track("chat", "m") as call:
+                call.set_usage(make_completion("x", prompt_tokens=10, completion_tokens=5))
+            bind_context(space_id=8)
+            with telemetry.track("chat", "m") as call:
+                call.set_usage(make_completion("x", prompt_tokens=1, completion_tokens=1))
+
+        # Контекст не должен протечь в другие тесты
+        contextvars.copy_context().run(run)
+
+        assert telemetry.space_tokens.value("7", "prompt") == 10
+        assert telemetry.space_tokens.value("other", "prompt") == 1
+
+    def test_render_prometheus_text(self):
+        """Тест формата экспорта: HELP/TYPE, корзины гистограммы, +Inf"""
+        telemetry = LLMTelemetry(log_enabled=False)
+        with telemetry.track("chat", "m"):
+            pass
+
+        text = telemetry.render()
+
+        assert "# TYPE llm_request_duration_seconds histogram" in text
+        assert 'llm_request_duration_seconds_bucket{operation="chat",model="m",le="+Inf"} 1' in text
+        assert 'llm_requests_total{operation="chat",model="m",outcome="ok"} 1' in text
+
+    def test_stats_gauges_grouped_by_family(self):
+        """Тест что у серий с разными метками одна строка TYPE"""
+        lines = render_stats_gauges("app_llm_tier", [
+            ({"tier": "default"}, {"requests": 3, "latency_ms": None, "models": ["a"]}),
+            ({"tier": "fast"}, {"requests": 5, "latency_ms": 12.5, "models": ["b"]}),
+        ])
+
+        assert lines.count("# TYPE app_llm_tier_requests gauge") == 1
+        assert 'app_llm_tier_requests{tier="fast"} 5' in lines
+        assert 'app_llm_tier_latency_ms{tier="fast"} 12.5' in lines
+
+
+class TestLLMServiceTelemetry:
+    """Тесты инструментирования LLMService"""
+
+    @pytest.fixture
+    def llm_service(self, mock_env_vars):
+        with patch('backend.app.services.llm_service.OpenAI'):
+            return LLMService()
+
+    @pytest.mark.asyncio
+    async def test_stream_records_ttft(self, llm_service):
+        """Тест что потоковая генерация записывает время до первого фрагмента"""
+        def make_chunk(text):
+            chunk = MagicMock()
+            chunk.usage = None
+            chunk.choices = [MagicMock()]
+            chunk.choices[0].delta.content = text
+            return chunk
+
+        async def fake_stream():
+            for text in ["При", "вет"]:
+                yield make_chunk(text)
+
+        mock_async_client = MagicMock()
+        mock_async_client.chat.completions.create = AsyncMock(return_value=fake_stream())
+        llm_service.async_client = mock_async_client
+        model = llm_service.llm_router.endpoints[0].model
+        before = llm_telemetry.ttft.count("chat_stream", model)
+
+        parts = [part async for part in llm_service.stream_response_async("Ты помощник", "Привет")]
+
+        assert parts == ["При", "вет"]
+        assert llm_telemetry.ttft.count("chat_stream", model) == before + 1
+
+    def test_summary_tracked(self, llm_service):
+        """Тест что суммаризация учитывается отдельной операцией"""
+        llm_service.client = MagicMock()
+        llm_service.client.chat.completions.create.return_value = make_completion("Итог", 50, 10)
+        model = llm_service.llm_router.endpoints[0].model
+        before = llm_telemetry.tokens.value("summary", model, "completion")
+
+        llm_service.summarize_conversation([{"role": "user", "content": "вопрос"}], min_messages=1)
+
+        assert llm_telemetry.tokens.value("summary", model, "completion") == before + 10
+
+
+class TestMetricsEndpoint:
+    """Тесты /api/metrics"""
+
+    def test_metrics_endpoint(self, client):
+        """Тест экспорта метрик в формате Prometheus"""
+        response = client.get("/api/metrics")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert "llm_requests_total" in response.text
+        assert "app_llm_scheduler_running" in response.text
+
+    def test_metrics_token(self, client, monkeypatch):
+        """Тест что при METRICS_TOKEN без заголовка доступ закрыт"""
+        monkeypatch.setenv("METRICS_TOKEN", "secret")
+
+        assert client.get("/api/metrics").status_code == 401
+        assert client.get("/api/metrics", headers={"Authorization": "Bearer secret"}).status_code == 200
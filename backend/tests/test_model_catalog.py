@@ -0,0 +1,91 @@
+"""
+Тесты для ModelCatalog (кэш eligible-моделей OpenRouter)
+"""
+import time
+
+import pytest
+
+from backend.app.services.model_catalog import ModelCatalog
+
+MODELS = [
+    {"id": "text/model", "canonical_slug": "text/model-2025", "architecture": {"input_modalities": ["text"]}},
+    {"id": "vision/model", "architecture": {"input_modalities": ["text", "image"]}},
+]
+
+
+class TestModelCatalog:
+    """Тесты кэширования и выбора модели"""
+
+    def test_fetches_once_within_ttl(self):
+        """Тест что в пределах TTL каталог не загружается повторно"""
+        calls = []
+        catalog = ModelCatalog(fetch=lambda: calls.append(1) or MODELS, ttl=60)
+
+        assert catalog.pick("missing/model", "image") == "vision/model"
+        assert catalog.pick("missing/model", "text") == "text/model"
+
+        assert len(calls) == 1
+
+    def test_select_preferred_by_slug(self):
+        """Тест что eligible-модель находится и по canonical_slug"""
+        catalog = ModelCatalog(fetch=lambda: MODELS)
+
+        assert catalog.pick("text/model-2025") == "text/model"
+
+    def test_fallback_remembered_and_forgotten(self):
+        """Тест что замена запоминается и сбрасывается после неудачного запроса"""
+        catalog = ModelCatalog(fetch=lambda: MODELS, ttl=60)
+        catalog.pick("missing/model", "image")
+
+        assert catalog.select("missing/model", "image") == "vision/model"
+        assert catalog.fallback_hits == 1
+
+        catalog.forget_fallback("missing/model", "image")
+        assert catalog.stats()["fallbacks"] == {}
+
+    def test_fallback_dropped_when_model_leaves_catalog(self):
+        """Тест что замена на пропавшую из каталога модель забывается при обновлении"""
+        responses = [MODELS, MODELS[:1]]
+        catalog = ModelCatalog(fetch=lambda: responses.pop(0), ttl=60)
+        catalog.pick("missing/model", "image")
+
+        catalog.refresh()
+
+        assert catalog.select("missing/model", "image") == "text/model"
+
+    def test_failure_keeps_previous_list_and_waits(self):
+        """Тест что ошибка загрузки не стирает список и повтор ждёт retry_after"""
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            if len(calls) > 1:
+                raise RuntimeError("provider down")
+            return MODELS
+
+        catalog = ModelCatalog(fetch=fetch, ttl=0, retry_after=60)
+        catalog.get_models()
+        assert catalog.refresh() is False
+
+        catalog._next_attempt_at = time.monotonic() + 60
+        assert catalog.refresh_in_background() is False
+        assert len(catalog.get_models()) == 2
+        assert catalog.stats()["failures"] == 1
+
+    @pytest.mark.asyncio
+    async def test_stale_list_served_while_refreshing(self):
+        """Тест что устаревший список отдаётся сразу, а обновление идёт в фоне"""
+        fetched = []
+
+        async def fetch_async():
+            fetched.append(1)
+            return MODELS if len(fetched) == 1 else MODELS[:1]
+
+        catalog = ModelCatalog(fetch=lambda: [], fetch_async=fetch_async, ttl=0)
+
+        first = await catalog.get_models_async()
+        stale = await catalog.get_models_async()
+        assert len(first) == len(stale) == 2
+
+        await catalog._refresh_task
+        assert len(await catalog.get_models_async()) == 1
@@ -0,0 +1,171 @@
+"""
+Тесты выбора уровня модели (model_tiering)
+"""
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from backend.app.services.llm_service import LLMService
+from backend.app.services.model_tiering import RoutingSignals, TieringPolicy, TIER_DEFAULT, TIER_FAST
+
+
+def make_completion(text):
+    completion = MagicMock()
+    completion.choices = [MagicMock()]
+    completion.choices[0].message.content = text
+    return completion
+
+
+class TestTieringPolicy:
+    """Тесты правил выбора уровня"""
+
+    @pytest.fixture
+    def policy(self):
+        return TieringPolicy(
+            max_question_tokens=20, max_prompt_tokens=500, max_history_messages=4,
+            min_confidence=0.5, complex_categories=["legal"],
+        )
+
+    def test_simple_question_goes_fast(self, policy):
+        """Тест что короткий уверенно классифицированный вопрос идёт в быструю модель"""
+        signals = RoutingSignals(category="general", confidence=0.9, question_tokens=5, prompt_tokens=120)
+
+        assert policy.choose(signals)[0] == TIER_FAST
+
+    @pytest.mark.parametrize("signals", [
+        RoutingSignals(category="general", confidence=0.9, question_tokens=5, has_files=True),
+        RoutingSignals(category="legal", confidence=0.9, question_tokens=5),
+        RoutingSignals(category="general", confidence=0.2, question_tokens=5),
+        RoutingSignals(category="general", confidence=0.9, question_tokens=50),
+        RoutingSignals(category="general", confidence=0.9, question_tokens=5, prompt_tokens=900),
+        RoutingSignals(category="general", confidence=0.9, question_tokens=5, history_messages=10),
+        RoutingSignals(category="general", confidence=0.9, question_tokens=5, has_summary=True),
+    ])
+    def test_complex_requests_go_default(self, policy, signals):
+        """Тест что файлы, сложные категории, неуверенность и длинный контекст — в основную модель"""
+        assert policy.choose(signals)[0] == TIER_DEFAULT
+
+
+class TestLLMServiceTiering:
+    """Тесты маршрутизации запросов LLMService по уровням"""
+
+    @pytest.fixture
+    def llm_service(self, mock_env_vars, monkeypatch):
+        monkeypatch.setenv("OPENROUTER_MODEL", "big/model")
+        monkeypatch.setenv("LLM_FAST_MODEL", "small/model")
+        monkeypatch.setenv("LLM_FAST_MAX_TOKENS", "300")
+        with patch('backend.app.services.llm_service.OpenAI'):
+            return LLMService()
+
+    def test_no_fast_model_single_tier(self, mock_env_vars):
+        """Тест что без LLM_FAST_MODEL всё идёт в основной уровень"""
+        with patch('backend.app.services.llm_service.OpenAI'):
+            service = LLMService()
+
+        assert list(service.llm_tiers) == [TIER_DEFAULT]
+
+    @pytest.mark.asyncio
+    async def test_simple_question_uses_fast_model(self, llm_service):
+        """Тест что простой вопрос уходит в быструю модель со своим max_tokens и учитывается в статистике"""
+        mock_async_client = MagicMock()
+        mock_async_client.chat.completions.create = AsyncMock(return_value=make_completion("Коротко"))
+        llm_service.async_client = mock_async_client
+
+        response = await llm_service.generate_response_async(
+            system_prompt="Ты помощник", user_question="Что такое ИП?",
+            category="general", confidence=0.9,
+        )
+
+        assert response == "Коротко"
+        call = mock_async_client.chat.completions.create.await_args
+        assert call.kwargs["model"] == "small/model"
+        assert call.kwargs["max_tokens"] == 300
+        stats = llm_service.llm_tiers[TIER_FAST].stats()
+        assert stats["requests"] == 1
+        assert stats["completion_tokens"] > 0
+
+    @pytest.mark.asyncio
+    async def test_complex_question_uses_default_model(self, llm_service):
+        """Тест что вопрос со сложной категорией идёт в основную модель"""
+        mock_async_client = MagicMock()
+        mock_async_client.chat.completions.create = AsyncMock(return_value=make_completion("Подробно"))
+        llm_service.async_client = mock_async_client
+
+        await llm_service.generate_response_async(
+            system_prompt="Ты помощник", user_question="Как составить договор?",
+            category="legal", confidence=0.9,
+        )
+
+        call = mock_async_client.chat.completions.create.await_args
+        assert call.kwargs["model"] == "big/model"
+        assert call.kwargs["max_tokens"] == 1000
+
+    @pytest.mark.asyncio
+    async def test_fast_failure_falls_back_to_default(self, llm_service):
+        """Тест что при ошибке быстрой модели запрос повторяется в основной"""
+        mock_async_client = MagicMock()
+        mock_async_client.chat.completions.create = AsyncMock(
+            side_effect=[Exception("Error code: 503"), make_completion("Ответ основной модели")]
+        )
+        llm_service.async_client = mock_async_client
+
+        response = await llm_service.generate_response_async(
+            system_prompt="Ты помощник", user_question="Привет, как дела?",
+            category="general", confidence=0.9,
+        )
+
+        assert response == "Ответ основной модели"
+        models = [c.kwargs["model"] for c in mock_async_client.chat.completions.create.await_args_list]
+        assert models == ["small/model", "big/model"]
+        assert llm_service.llm_tiers[TIER_FAST].stats()["fallbacks"] == 1
+        assert llm_service.llm_tiers[TIER_DEFAULT].stats()["requests"] == 1
+
+    def test_sync_generate_uses_fast_model(self, llm_service):
+        """Тест выбора уровня в синхронной генерации"""
+        llm_service.client = MagicMock()
+        llm_service.client.chat.completions.create.return_value = make_completion("Ок")
+
+        llm_service.generate_response("Ты помощник", "Что такое НДС?", category="general", confidence=0.8)
+
+        assert llm_service.client.chat.completions.create.call_args.kwargs["model"] == "small/model"
+
+    @pytest.mark.asyncio
+    async def test_prompt_tokenized_once(self, llm_service, monkeypatch):
+        """Тест что уровень и статистика берут размер промпта из бюджета, а не токенизируют его заново"""
+        mock_async_client = MagicMock()
+        mock_async_client.chat.completions.create = AsyncMock(return_value=make_completion("Коротко"))
+        llm_service.async_client = mock_async_client
+        counted = []
+        count_tokens = llm_service.count_tokens
+        monkeypatch.setattr(llm_service, "count_tokens", lambda text: counted.append(text) or count_tokens(text))
+        history = [
+            {"role": "user", "content": "Привет", "token_count": 2},
+            {"role": "assistant", "content": "Здравствуйте", "token_count": 3},
+        ]
+
+        await llm_service.generate_response_async(
+            system_prompt="Ты помощник", user_question="Что такое ИП?", conversation_history=history,
+            category="general", confidence=0.9,
+        )
+
+        # system prompt, вопрос и ответ — по одному разу; история — по token_count из БД
+        assert counted == ["Ты помощник", "Что такое ИП?", "Коротко"]
+        stats = llm_service.llm_tiers[TIER_FAST].stats()
+        assert stats["prompt_tokens"] == count_tokens("Ты помощник") + 5 + count_tokens("Что такое ИП?")
+
+    def test_single_tier_skips_completion_tokens(self, mock_env_vars, monkeypatch):
+        """Тест что без LLM_FAST_MODEL ответ для статистики уровней не токенизируется"""
+        with patch('backend.app.services.llm_service.OpenAI'):
+            service = LLMService()
+        service.client = MagicMock()
+        service.client.chat.completions.create.return_value = make_completion("Ответ")
+        counted = []
+        count_tokens = service.count_tokens
+        monkeypatch.setattr(service, "count_tokens", lambda text: counted.append(text) or count_tokens(text))
+
+        service.generate_response("Ты помощник", "Что такое НДС?")
+
+        assert counted == ["Ты помощник", "Что такое НДС?"]
+        stats = service.llm_tiers[TIER_DEFAULT].stats()
+        assert (stats["requests"], stats["completion_tokens"]) == (1, 0)
+        assert stats["prompt_tokens"] == count_tokens("Ты помощник") + count_tokens("Что такое НДС?")
@@ -0,0 +1,144 @@
+"""
+Тесты для PromptBudget (распределение токенов между секциями промпта)
+"""
+from backend.app.services.prompt_budget import (
+    PromptBudget,
+    PromptSection,
+    PRIORITY_FILES,
+    PRIORITY_HISTORY,
+    PRIORITY_SPACE_CONTEXT,
+    KEEP_EXTERNAL,
+    KEEP_TAIL_LINES,
+    TRUNCATED_MARKER,
+)
+from backend.app.utils.tokens import count_tokens
+
+
+class TestPromptBudget:
+    """Тесты распределения бюджета промпта"""
+
+    def test_everything_fits(self):
+        """Тест что при достаточном бюджете секции не меняются"""
+        sections = [
+            PromptSection("system", "Ты помощник"),
+            PromptSection("question", "Вопрос"),
+            PromptSection("files", "текст файла", PRIORITY_FILES, max_tokens=100),
+        ]
+        PromptBudget(max_prompt_tokens=1000).allocate(sections)
+
+        assert [s.action for s in sections] == ["kept", "kept", "kept"]
+        assert sections[2].text == "текст файла"
+        assert sum(s.allocated for s in sections) == sum(s.tokens for s in sections)
+
+    def test_required_sections_always_granted(self):
+        """Тест что system prompt и вопрос не режутся даже сверх бюджета"""
+        system = PromptSection("system", "инструкция " * 50)
+        question = PromptSection("question", "вопрос " * 50)
+        files = PromptSection("files", "файл " * 50, PRIORITY_FILES, min_tokens=10)
+        PromptBudget(max_prompt_tokens=10).allocate([system, question, files])
+
+        assert system.allocated == system.tokens
+        assert question.allocated == question.tokens
+        assert files.action == "dropped"
+        assert files.text == ""
+
+    def test_file_truncated_by_quota(self):
+        """Тест что большой файл обрезается до своей квоты, начало текста сохраняется"""
+        text = "начало документа " + "пункт договора " * 500
+        files = PromptSection("files", text, PRIORITY_FILES, max_tokens=100, min_tokens=20)
+        PromptBudget(max_prompt_tokens=6000).allocate([files])
+
+        assert files.action == "truncated"
+        assert files.text.startswith("начало документа")
+        assert files.text.endswith(TRUNCATED_MARKER)
+        assert files.allocated == count_tokens(files.text) <= 100
+
+    def test_low_priority_dropped_first(self):
+        """Тест что при нехватке бюджета страдает секция с более низким приоритетом"""
+        question = PromptSection("question", "вопрос")
+        files = PromptSection("files", "файл " * 100, PRIORITY_FILES, min_tokens=10)
+        space = PromptSection("space", "контекст " * 100, PRIORITY_SPACE_CONTEXT, min_tokens=10)
+        budget = question.tokens + files.tokens + 5
+        PromptBudget(max_prompt_tokens=budget).allocate([question, space, files])
+
+        assert files.action == "kept"
+        assert space.action == "dropped"
+        assert space.allocated == 0
+
+    def test_external_section_only_gets_budget(self):
+        """Тест что история (KEEP_EXTERNAL) получает бюджет, но текст не трогается"""
+        history = PromptSection("history", priority=PRIORITY_HISTORY, max_tokens=300, keep=KEEP_EXTERNAL, tokens=1000)
+        PromptBudget(max_prompt_tokens=6000).allocate([history])
+
+        assert history.allocated == 300
+        assert history.action == "truncated"
+
+    def test_unused_budget_returned_to_pool(self):
+        """Тест что недобранные после обрезки токены достаются следующим секциям"""
+        files = PromptSection("files", "слово " * 300, PRIORITY_FILES, max_tokens=50)
+        history = PromptSection("history", priority=PRIORITY_HISTORY, keep=KEEP_EXTERNAL, tokens=1000)
+        PromptBudget(max_prompt_tokens=200).allocate([files, history])
+
+        assert files.allocated <= 50
+        assert history.allocated == 200 - files.allocated
+
+    def test_tail_lines_keeps_header_and_newest(self):
+        """Тест что контекст пространства сохраняет заголовок и последние пункты"""
+        lines = [f"• Сообщение номер {i} " + "текст " * 10 for i in range(30)]
+        text = "Контекст пространства:\n" + "\n".join(lines)
+        space = PromptSection("space", text, PRIORITY_SPACE_CONTEXT, max_tokens=120, keep=KEEP_TAIL_LINES)
+        PromptBudget(max_prompt_tokens=6000).allocate([space])
+
+        assert space.action == "truncated"
+        assert space.text.startswith("Контекст пространства:\n")
+        assert "Сообщение номер 29" in space.text
+        assert "Сообщение номер 0 " not in space.text
+        assert space.allocated <= 120
+
+    def test_report(self):
+        """Тест отчёта о раскладке токенов"""
+        sections = [
+            PromptSection("question", "вопрос"),
+            PromptSection("files", "файл " * 100, PRIORITY_FILES, max_tokens=20),
+        ]
+        PromptBudget(max_prompt_tokens=6000).allocate(sections)
+
+        report = PromptBudget.report(sections)
+        assert report["files"]["action"] == "truncated"
+        assert report["files"]["requested"] == sections[1].tokens
+        assert "files=" in PromptBudget.format_report(sections)
+
+
+class TestEncodingLoad:
+    """Тесты загрузки кодировки tiktoken"""
+
+    def test_concurrent_first_load(self, monkeypatch):
+        """Тест что потоки, пришедшие во время загрузки, получают кодировку, а не подсчёт по словам"""
+        import sys
+        import threading
+        import time
+        from types import SimpleNamespace
+
+        from backend.app.utils import tokens
+
+        encoding = object()
+        loads = []
+
+        def load(name):
+            loads.append(name)
+            time.sleep(0.05)
+            return encoding
+
+        monkeypatch.setitem(sys.modules, "tiktoken", SimpleNamespace(get_encoding=load))
+        monkeypatch.setattr(tokens, "_encoding", None)
+        monkeypatch.setattr(tokens, "_encoding_loaded", False)
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(tokens.get_encoding())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert loads == ["cl100k_base"]
+        assert results == [encoding] * 8
@@ -0,0 +1,121 @@
+"""
+Тесты поиска /api/search и построения полнотекстового запроса
+"""
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Query
+
+from backend.app.models.chat import Chat
+from backend.app.models.message import Message
+from backend.app.models.note import Note
+from backend.app.models.space import Space
+from backend.app.models.user import User
+from backend.app.services import search_service
+from backend.app.services.search_service import prefix_tsquery_text
+
+
+def fill_search_data(db_session, user, name="Маркетинг"):
+    """Пространство с чатом, заметкой и сообщениями, где встречается «бюджет»"""
+    space = Space(user_id=user.id, name=name)
+    db_session.add(space)
+    db_session.flush()
+    chat = Chat(space_id=space.id, user_id=user.id, title="Квартальный бюджет")
+    db_session.add(chat)
+    db_session.flush()
+    db_session.add_all([
+        Message(chat_id=chat.id, role="user", content=f"Какой бюджет у кампании {i}?") for i in range(5)
+    ])
+    db_session.add(Message(chat_id=chat.id, role="assistant", content="Про налоги"))
+    db_session.add(Note(space_id=space.id, user_id=user.id, title="План", content="Итоговый бюджет согласован"))
+    db_session.commit()
+    return space, chat
+
+
+class TestSearch:
+    """Тесты эндпоинта поиска (SQLite — поиск по подстроке)"""
+
+    def test_search_joined_results_fixed_queries(self, client, db_session, auth_headers, test_user_data):
+        """Тест что названия чата и пространства приходят без запросов на каждую строку"""
+        user = db_session.query(User).filter(User.email == test_user_data["email"]).first()
+        space, chat = fill_search_data(db_session, user)
+        space_id, chat_id = space.id, chat.id
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = db_session.get_bind()
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            response = client.get("/api/search", params={"q": "бюджет"}, headers=auth_headers)
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["results"] == {"chats_count": 1, "notes_count": 1, "messages_count": 5}
+        assert data["chats"][0]["space_name"] == "Маркетинг"
+        assert data["notes"][0]["snippet"] == "Итоговый <mark>бюджет</mark> согласован"
+        for message in data["messages"]:
+            assert (message["chat_id"], message["chat_title"]) == (chat_id, "Квартальный бюджет")
+            assert (message["space_id"], message["space_name"]) == (space_id, "Маркетинг")
+            assert "<mark>бюджет</mark>" in message["snippet"]
+        # Пользователь и по одному запросу на чаты, заметки и сообщения
+        assert len(statements) <= 4
+
+    def test_search_scoped_to_user_and_space(self, client, db_session, auth_headers, test_user_data):
+        """Тест что чужие данные и другие пространства не попадают в результаты"""
+        user = db_session.query(User).filter(User.email == test_user_data["email"]).first()
+        other = User(email="other@example.com", password_hash="-", name="Other", is_active=True)
+        db_session.add(other)
+        db_session.commit()
+        fill_search_data(db_session, other, name="Чужое")
+        own_space, _ = fill_search_data(db_session, user)
+        fill_search_data(db_session, user, name="Продажи")
+
+        response = client.get(
+            "/api/search",
+            params={"q": "бюджет", "space_id": own_space.id, "type": "messages", "limit": 3},
+            headers=auth_headers,
+        )
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["chats"] == [] and data["notes"] == []
+        assert len(data["messages"]) == 3
+        assert {m["space_name"] for m in data["messages"]} == {"Маркетинг"}
+
+        foreign = db_session.query(Space).filter(Space.user_id == other.id).first()
+        response = client.get("/api/search", params={"q": "бюджет", "space_id": foreign.id}, headers=auth_headers)
+        assert response.status_code == 404
+
+
+class TestFullTextQuery:
+    """Тесты полнотекстового запроса PostgreSQL (без подключения к БД)"""
+
+    def test_prefix_tsquery_text(self):
+        """Тест что из ввода остаются только слова, каждое как префикс"""
+        assert prefix_tsquery_text("Бюджет  отч") == "бюджет:* & отч:*"
+        assert prefix_tsquery_text("a & b | !c:*") == "a:* & b:* & c:*"
+        assert prefix_tsquery_text("?!") is None
+
+    def test_postgres_query_uses_index_rank_and_headline(self, db_session, monkeypatch):
+        """Тест SQL полнотекстового поиска сообщений: @@ по search_vector, ts_rank, ts_headline, JOIN"""
+        captured = {}
+
+        def capture_sql(query):
+            captured["sql"] = str(query.statement.compile(dialect=postgresql.dialect()))
+            return []
+
+        monkeypatch.setattr(search_service, "full_text_enabled", lambda db: True)
+        monkeypatch.setattr(Query, "all", capture_sql)
+
+        assert search_service.search_messages(db_session, 1, "бюджет", None, 10) == []
+
+        sql = captured["sql"]
+        assert "messages.search_vector @@ (to_tsquery(" in sql
+        assert "ts_rank(messages.search_vector" in sql
+        assert "ts_headline(" in sql
+        assert "JOIN chats ON chats.id = messages.chat_id JOIN spaces ON spaces.id = chats.space_id" in sql
+        assert " IN (" not in sql
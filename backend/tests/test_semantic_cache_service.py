@@ -0,0 +1,117 @@
+"""
+Тесты для semantic_cache_service
+"""
+import time
+
+import numpy as np
+
+from backend.app.services.cache_service import CacheService
+from backend.app.services.semantic_cache_service import SemanticCacheService
+
+
+class TestSemanticCacheService:
+    """Тесты семантического кэша"""
+
+    def test_vectorize_normalized(self):
+        """Тест нормировки векторов и нулевого вектора для пустого текста"""
+        semantic = SemanticCacheService(enabled=True)
+
+        vector = semantic.vectorize("Как продвигать бизнес в соцсетях?")
+
+        assert vector.shape == (semantic.dim,)
+        assert np.isclose(np.linalg.norm(vector), 1.0)
+        assert not semantic.vectorize("как что?").any()
+
+    def test_paraphrase_matches(self):
+        """Тест что перефразированный вопрос находит закэшированный"""
+        semantic = SemanticCacheService(enabled=True, threshold=0.9)
+        semantic.add("как продвигать бизнес в соцсетях", "free:marketing", "marketing")
+
+        match = semantic.find("продвижение бизнеса в соцсетях", "free:marketing", "marketing")
+
+        assert match == "как продвигать бизнес в соцсетях"
+
+    def test_different_question_not_matched(self):
+        """Тест что вопрос с другим смыслом не совпадает"""
+        semantic = SemanticCacheService(enabled=True, threshold=0.9)
+        semantic.add("как нанять сотрудника", "free:management", "management")
+        semantic.add("как продвигать бизнес в соцсетях", "free:management", "management")
+
+        assert semantic.find("как уволить сотрудника", "free:management", "management") is None
+        assert semantic.find("как снизить налоги для ИП", "free:management", "management") is None
+
+    def test_scope_isolation(self):
+        """Тест что поиск идёт только внутри своей области (категории и контекста)"""
+        semantic = SemanticCacheService(enabled=True, threshold=0.9)
+        semantic.add("как продвигать бизнес в соцсетях", "free:marketing", "marketing")
+
+        assert semantic.find("продвижение бизнеса в соцсетях", "free:sales", "sales") is None
+
+    def test_get_cached_response_counts_saved_calls(self):
+        """Тест получения ответа по похожему вопросу и счётчика сэкономленных вызовов"""
+        cache = CacheService()
+        semantic = SemanticCacheService(enabled=True, threshold=0.9)
+        answer = {"raw_text": "Ведите контент-план"}
+        cache.set("как продвигать бизнес в соцсетях", answer, scope="free:marketing")
+        semantic.add("как продвигать бизнес в соцсетях", "free:marketing", "marketing")
+
+        result = semantic.get_cached_response(cache, "Продвижение бизнеса в соцсетях", "free:marketing", "marketing")
+
+        assert result == answer
+        assert semantic.stats()["saved_llm_calls"] == 1
+
+    def test_evicted_answer_forgotten(self):
+        """Тест что вопрос, ответ на который вытеснен из кэша, удаляется из индекса"""
+        cache = CacheService()
+        semantic = SemanticCacheService(enabled=True, threshold=0.9)
+        semantic.add("как продвигать бизнес в соцсетях", "free:marketing", "marketing")
+
+        assert semantic.get_cached_response(cache, "продвижение бизнеса в соцсетях", "free:marketing", "marketing") is None
+        assert semantic.stats()["entries"] == 0
+
+    def test_strict_category_threshold(self):
+        """Тест отключения семантического поиска для графиков"""
+        semantic = SemanticCacheService(enabled=True)
+        semantic.add("построй график продаж", "free:graphic", "graphic")
+
+        assert semantic.find("построй график продаж", "free:graphic", "graphic") is None
+
+    def test_ring_buffer_capacity(self):
+        """Тест ограничения числа векторов в области"""
+        semantic = SemanticCacheService(enabled=True, max_entries_per_scope=3)
+        for i in range(5):
+            semantic.add(f"вопрос про товар номер {i}", "free:general", "general")
+
+        assert semantic.stats()["entries"] == 3
+
+    def test_scope_count_bounded(self):
+        """Тест что число областей ограничено и вытесняется самая давно использованная"""
+        semantic = SemanticCacheService(enabled=True, max_scopes=5)
+        semantic.add("как снизить налоги", "ctx:keep", "general")
+        for i in range(20):
+            semantic.add("как снизить налоги", f"ctx:{i}", "general")
+            # Используемая область не вытесняется
+            semantic.find("как снизить налоги", "ctx:keep", "general")
+
+        stats = semantic.stats()
+        assert stats["scopes"] == 5
+        assert stats["evicted_scopes"] == 16
+        assert semantic.find("как снизить налоги", "ctx:keep", "general") == "как снизить налоги"
+        assert semantic.find("как снизить налоги", "ctx:0", "general") is None
+
+    def test_lookup_speed(self):
+        """Тест скорости поиска по десяткам тысяч векторов"""
+        semantic = SemanticCacheService(enabled=True)
+        index_vectors = np.random.randn(20000, semantic.dim).astype(np.float32)
+        for i in range(0, 20000, 1000):
+            semantic.add(f"вопрос {i}", "free:general", "general")
+        index = semantic._indexes["free:general"]
+        index.vectors = index_vectors
+        index.questions = [f"вопрос {i}" for i in range(20000)]
+
+        started = time.perf_counter()
+        for _ in range(50):
+            semantic.find("как вести учёт расходов", "free:general", "general")
+        elapsed_ms = (time.perf_counter() - started) / 50 * 1000
+
+        assert elapsed_ms < 20
@@ -0,0 +1,99 @@
+"""
+Тесты для ServiceRegistry (общие сервисы процесса)
+"""
+import threading
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from backend.app.services.service_registry import ServiceRegistry
+
+
+class TestServiceRegistry:
+    """Тесты ленивого создания и жизненного цикла сервисов"""
+
+    def test_created_lazily_once(self):
+        """Тест что сервис создаётся при первом обращении и дальше переиспользуется"""
+        registry = ServiceRegistry()
+        assert not registry.is_initialized("formatting_service")
+
+        first = registry.formatting_service
+
+        assert registry.is_initialized("formatting_service")
+        assert registry.formatting_service is first
+
+    def test_concurrent_access_creates_one_instance(self):
+        """Тест что при одновременном первом обращении из потоков создаётся один экземпляр"""
+        registry = ServiceRegistry()
+        created = []
+
+        def factory():
+            created.append(1)
+            return object()
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(registry._get("svc", factory))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(created) == 1
+        assert all(result is results[0] for result in results)
+
+    def test_public_classifier_shares_model(self):
+        """Тест что классификатор публичных чатов использует уже загруженную модель"""
+        registry = ServiceRegistry()
+
+        with patch("joblib.load", wraps=__import__("joblib").load) as load:
+            classifier = registry.classifier
+            public = registry.public_classifier
+
+        assert load.call_count == 1
+        assert public.classifier is classifier.classifier
+        assert public.is_ready()
+
+    def test_warmup_skips_unknown_and_failing(self):
+        """Тест что ошибка одного сервиса при прогреве не мешает остальным"""
+        registry = ServiceRegistry()
+        registry.override("llm_service", MagicMock(local_whisper=None))
+
+        registry.warmup(["no_such_service", "formatting_service"], whisper=True)
+
+        assert registry.is_initialized("formatting_service")
+
+    @pytest.mark.asyncio
+    async def test_shutdown_closes_llm_clients(self):
+        """Тест что при остановке закрываются HTTP-клиенты LLMService"""
+        registry = ServiceRegistry()
+        llm_service = MagicMock()
+        llm_service.aclose = AsyncMock()
+        registry.override("llm_service", llm_service)
+
+        await registry.shutdown()
+
+        llm_service.aclose.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_shutdown_without_created_services(self):
+        """Тест что остановка не создаёт сервисы, к которым не обращались"""
+        registry = ServiceRegistry()
+
+        await registry.shutdown()
+
+        assert not registry.is_initialized("llm_service")
+
+    @pytest.mark.asyncio
+    async def test_shutdown_closes_shared_cache_backend(self, monkeypatch):
+        """Тест что при остановке закрывается общий L2-кэш, а следующий запрос создаёт новый"""
+        from backend.app.services import cache_backends
+
+        backend = MagicMock()
+        monkeypatch.setattr(cache_backends, "_shared_backend", backend)
+        monkeypatch.setattr(cache_backends, "_shared_backend_initialized", True)
+        monkeypatch.setattr(cache_backends, "create_shared_cache_backend", lambda: "new")
+
+        await ServiceRegistry().shutdown()
+
+        backend.close.assert_called_once()
+        assert cache_backends.get_shared_cache_backend() == "new"
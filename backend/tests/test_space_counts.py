@@ -0,0 +1,85 @@
+"""
+Тесты счётчиков чатов, заметок и тегов в ответах /api/spaces
+"""
+from sqlalchemy import event
+
+from backend.app.models.chat import Chat
+from backend.app.models.note import Note
+from backend.app.models.space import Space
+from backend.app.models.tag import Tag
+from backend.app.models.user import User
+
+
+def fill_spaces(db_session, user, count):
+    """Пространства с i чатами, 2*i заметками и одним тегом"""
+    spaces = []
+    for i in range(count):
+        space = Space(user_id=user.id, name=f"Пространство {i}")
+        db_session.add(space)
+        db_session.flush()
+        db_session.add_all([Chat(space_id=space.id, user_id=user.id, title=f"Чат {j}") for j in range(i)])
+        db_session.add_all([Note(space_id=space.id, user_id=user.id, title=f"Заметка {j}") for j in range(2 * i)])
+        db_session.add(Tag(space_id=space.id, name="важное"))
+        spaces.append(space)
+    db_session.commit()
+    return spaces
+
+
+class TestSpaceCounts:
+    """Тесты агрегированных счётчиков пространств"""
+
+    def test_list_spaces_counts_in_one_query(self, client, db_session, auth_headers, test_user_data):
+        """Тест что список пространств со счётчиками — фиксированное число запросов"""
+        user = db_session.query(User).filter(User.email == test_user_data["email"]).first()
+        fill_spaces(db_session, user, 6)
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = db_session.get_bind()
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            response = client.get("/api/spaces", headers=auth_headers)
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+
+        assert response.status_code == 200
+        by_name = {space["name"]: space for space in response.json()["spaces"]}
+        for i in range(6):
+            space = by_name[f"Пространство {i}"]
+            assert (space["chats_count"], space["notes_count"], space["tags_count"]) == (i, 2 * i, 1)
+        # Пользователь, total и страница пространств
+        assert len(statements) <= 3
+
+    def test_detail_endpoints_counts(self, client, db_session, auth_headers, test_user_data):
+        """Тест счётчиков в get / update / archive / unarchive"""
+        user = db_session.query(User).filter(User.email == test_user_data["email"]).first()
+        space_id = fill_spaces(db_session, user, 3)[2].id
+
+        responses = [
+            client.get(f"/api/spaces/{space_id}", headers=auth_headers),
+            client.put(f"/api/spaces/{space_id}", json={"name": "Новое имя"}, headers=auth_headers),
+            client.post(f"/api/spaces/{space_id}/archive", headers=auth_headers),
+            client.post(f"/api/spaces/{space_id}/unarchive", headers=auth_headers),
+        ]
+
+        for response in responses:
+            assert response.status_code == 200
+            data = response.json()
+            assert (data["chats_count"], data["notes_count"], data["tags_count"]) == (2, 4, 1)
+        assert responses[1].json()["name"] == "Новое имя"
+        assert responses[2].json()["is_archived"] is True
+        assert responses[3].json()["is_archived"] is False
+
+    def test_foreign_space_not_found(self, client, db_session, auth_headers):
+        """Тест что чужое пространство не отдаётся"""
+        other = User(email="other@example.com", password_hash="-", name="Other", is_active=True)
+        db_session.add(other)
+        db_session.commit()
+        foreign = fill_spaces(db_session, other, 1)[0]
+
+        response = client.get(f"/api/spaces/{foreign.id}", headers=auth_headers)
+
+        assert response.status_code == 404
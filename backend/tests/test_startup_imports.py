@@ -0,0 +1,50 @@
+"""
+Тесты импорта приложения при старте воркера
+"""
+import asyncio
+
+from backend.app.services.service_registry import ServiceRegistry
+from backend.app.utils.import_benchmark import heavy_imported, measure_imports
+
+
+class TestStartupImports:
+    """Тесты того, что тяжёлые библиотеки не загружаются при импорте backend.main"""
+
+    def test_main_does_not_import_heavy_modules(self):
+        """Тест что openai, numpy, pandas/sklearn, whisper и библиотеки документов импортируются лениво"""
+        timings = measure_imports("backend.main")
+
+        assert "backend.main" in timings
+        assert heavy_imported(set(timings)) == []
+
+    def test_heavy_imported_matches_submodules(self):
+        """Тест что подмодули тяжёлых пакетов тоже считаются"""
+        assert heavy_imported({"fastapi", "sklearn.linear_model", "PIL"}) == ["PIL", "sklearn.linear_model"]
+
+
+class TestWarmupMode:
+    """Тесты режимов прогрева при старте"""
+
+    def test_off_skips_warmup(self):
+        """Тест что в режиме off сервисы не создаются при старте"""
+        registry = ServiceRegistry()
+
+        asyncio.run(registry.startup(mode="off"))
+
+        assert registry.warmed_up
+        assert not registry.is_initialized("formatting_service")
+
+    def test_background_does_not_block_startup(self, monkeypatch):
+        """Тест что в режиме background startup возвращается до окончания прогрева"""
+        monkeypatch.setenv("SERVICES_WARMUP", "formatting_service")
+        registry = ServiceRegistry()
+
+        async def run():
+            await registry.startup(mode="background")
+            assert not registry.warmed_up
+            await registry._warmup_task
+
+        asyncio.run(run())
+
+        assert registry.warmed_up
+        assert registry.is_initialized("formatting_service")